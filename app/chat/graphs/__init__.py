@@ -2,7 +2,7 @@
 
 from .conversational_rag import build_rag_graph, ConversationState, ConversationalRAG
 from .agentic_rag import build_agentic_graph, AgentState, AgenticRAG
-from .stacking_rag import build_stacking_graph, StackingState, StackingRAG
+from .stacking_rag import build_stacking_graph, get_stacking_graph, StackingState, StackingRAG
 
 __all__ = [
     "build_rag_graph",
@@ -12,6 +12,7 @@ __all__ = [
     "AgentState",
     "AgenticRAG",
     "build_stacking_graph",
+    "get_stacking_graph",
     "StackingState",
     "StackingRAG",
 ]
@@ -15,6 +15,7 @@ The graph follows this pattern:
 """
 
 import json
+import time
 from typing import TypedDict, List, Optional, Annotated, Sequence, Literal
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage, ToolMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
@@ -25,7 +26,9 @@ from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
 
 # Import from new modules
+from app.chat.logging_utils import timed_node
 from app.chat.tools import TRADE_TOOLS
+from app.services.metrics import observe_tool
 from app.chat.prompts import PLANNER_PROMPT, PLANNING_PROMPT
 from app.chat.output_schemas import AgentPlan, PlanStep
 
@@ -93,6 +96,7 @@ def _format_chat_history(messages: Sequence[BaseMessage], max_messages: int = 10
     return "\n".join(formatted)
 
 
+@timed_node("plan", graph="agentic", log=False)
 def plan_node(state: AgentState) -> dict:
     """
     Generate an explicit step-by-step plan before executing tools.
@@ -138,6 +142,7 @@ def plan_node(state: AgentState) -> dict:
     }
 
 
+@timed_node("agent", graph="agentic", log=False)
 def agent_node(state: AgentState) -> dict:
     """
     Main agent node that decides actions using tool-calling.
@@ -205,6 +210,7 @@ Execute the current step, then we'll move to the next."""
     }
 
 
+@timed_node("tools", graph="agentic", log=False)
 def tool_executor_node(state: AgentState) -> dict:
     """
     Execute tools called by the agent.
@@ -232,14 +238,17 @@ def tool_executor_node(state: AgentState) -> dict:
         tool_args = tool_call["args"]
 
         if tool_name in tool_map:
+            start = time.perf_counter()
             try:
                 result = tool_map[tool_name].invoke(tool_args)
+                observe_tool("agentic", tool_name, time.perf_counter() - start)
                 tool_outputs.append(f"[{tool_name}]: {result}")
                 tool_messages.append(ToolMessage(
                     content=result,
                     tool_call_id=tool_call["id"]
                 ))
             except Exception as e:
+                observe_tool("agentic", tool_name, time.perf_counter() - start, error=True)
                 error_msg = f"Error calling {tool_name}: {str(e)}"
                 tool_outputs.append(error_msg)
                 tool_messages.append(ToolMessage(
@@ -279,6 +288,7 @@ def should_continue(state: AgentState) -> Literal["tools", "generate"]:
     return "generate"
 
 
+@timed_node("generate", graph="agentic", log=False)
 def generate_answer_node(state: AgentState) -> dict:
     """
     Generate the final answer based on gathered information.
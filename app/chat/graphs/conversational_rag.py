@@ -31,6 +31,7 @@ from pinecone import Pinecone as PineconeClient
 from langchain_pinecone import PineconeVectorStore
 
 # Import from new modules
+from app.chat.logging_utils import timed_node
 from app.chat.output_schemas import (
     SourceCitation,
     StructuredAnswer,
@@ -142,6 +143,7 @@ def _format_context_with_citations(documents: List[Document]) -> tuple[str, List
 # Graph Nodes
 # ============================================================================
 
+@timed_node("condense", graph="conversational", log=False)
 def condense_question_node(state: ConversationState) -> dict:
     """
     Condense the user's question using chat history.
@@ -181,6 +183,7 @@ def condense_question_node(state: ConversationState) -> dict:
     return {"condensed_question": condensed}
 
 
+@timed_node("retrieve", graph="conversational", log=False)
 def retrieve_documents_node(state: ConversationState) -> dict:
     """
     Retrieve relevant documents from Pinecone.
@@ -204,6 +207,7 @@ def retrieve_documents_node(state: ConversationState) -> dict:
     return {"documents": documents}
 
 
+@timed_node("generate", graph="conversational", log=False)
 def generate_answer_node(state: ConversationState) -> dict:
     """
     Generate answer from retrieved context.
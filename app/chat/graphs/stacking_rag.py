@@ -14,7 +14,7 @@ The graph follows this pattern:
 4. Generate: Create human-readable output with audit trail
 """
 
-import json
+import threading
 from typing import TypedDict, List, Optional, Annotated, Sequence, Literal, Dict, Any
 from datetime import date
 
@@ -26,7 +26,30 @@ from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
 
-from app.chat.tools.stacking_tools import STACKING_TOOLS, get_mfn_base_rate
+from app.chat.tools.stacking_tools import (
+    get_mfn_base_rate,
+    # v22.0: Dict-native tool APIs (no JSON round trip between nodes)
+    get_applicable_programs_data,
+    ensure_materials_data,
+    check_program_inclusion_data,
+    check_program_exclusion_data,
+    check_material_composition_data,
+    resolve_program_dependencies_data,
+    get_program_output_data,
+    plan_entry_slices_data,
+    check_annex_ii_exclusion_data,
+    resolve_reciprocal_variant_data,
+    calculate_duties_data,
+    calculation_context,
+)
+from app.chat.logging_utils import timed_node
+from app.services.calculation_profile import profile_calculation, profiled_node
+from app.services.result_cache import (
+    get_result_cache,
+    get_tariff_data_version,
+    result_cache_enabled,
+    result_cache_key,
+)
 
 
 # ============================================================================
@@ -96,17 +119,12 @@ class StackingState(TypedDict):
     quantity_uom: Optional[str]
 
 
-# ============================================================================
-# Tool Map
-# ============================================================================
-
-TOOL_MAP = {t.name: t for t in STACKING_TOOLS}
-
-
 # ============================================================================
 # Graph Nodes
 # ============================================================================
 
+@timed_node("initialize", graph="stacking", log=False)
+@profiled_node("initialize")
 def initialize_node(state: StackingState) -> dict:
     """
     Initialize stacking by getting applicable programs.
@@ -119,13 +137,7 @@ def initialize_node(state: StackingState) -> dict:
     import_date = state.get("import_date") or date.today().isoformat()
 
     # Call get_applicable_programs tool
-    result = TOOL_MAP["get_applicable_programs"].invoke({
-        "country": country,
-        "hts_code": hts_code,
-        "import_date": import_date
-    })
-
-    data = json.loads(result)
+    data = get_applicable_programs_data(country, hts_code, import_date)
     programs = data.get("programs", [])
 
     # Log the decision
@@ -145,6 +157,8 @@ def initialize_node(state: StackingState) -> dict:
     }
 
 
+@timed_node("check_materials", graph="stacking", log=False)
+@profiled_node("check_materials")
 def check_materials_node(state: StackingState) -> dict:
     """
     Check if material composition is needed and collect if possible.
@@ -158,13 +172,7 @@ def check_materials_node(state: StackingState) -> dict:
 
     # Call ensure_materials tool
     # FIX: Check for None explicitly, not truthiness - empty dict {} is a valid "no metals" answer
-    result = TOOL_MAP["ensure_materials"].invoke({
-        "hts_code": hts_code,
-        "product_description": product_description,
-        "known_materials": json.dumps(materials) if materials is not None else None
-    })
-
-    data = json.loads(result)
+    data = ensure_materials_data(hts_code, product_description, materials)
 
     if data.get("materials_needed"):
         return {
@@ -197,6 +205,8 @@ def check_materials_node(state: StackingState) -> dict:
         }
 
 
+@timed_node("process_program", graph="stacking", log=False)
+@profiled_node("process_program")
 def process_program_node(state: StackingState) -> dict:
     """
     Process a single program - check inclusion, exclusion, conditions.
@@ -227,11 +237,7 @@ def process_program_node(state: StackingState) -> dict:
 
     # Step 1: Check inclusion (unless check_type is "always")
     if check_type == "hts_lookup":
-        inclusion_result = TOOL_MAP["check_program_inclusion"].invoke({
-            "program_id": program_id,
-            "hts_code": hts_code
-        })
-        inclusion_data = json.loads(inclusion_result)
+        inclusion_data = check_program_inclusion_data(program_id, hts_code)
 
         decisions.append({
             "step": "check_inclusion",
@@ -265,13 +271,7 @@ def process_program_node(state: StackingState) -> dict:
 
     # Step 2: Check exclusion (if applicable)
     if program.get("exclusion_table"):
-        exclusion_result = TOOL_MAP["check_program_exclusion"].invoke({
-            "program_id": program_id,
-            "hts_code": hts_code,
-            "product_description": product_description,
-            "import_date": import_date
-        })
-        exclusion_data = json.loads(exclusion_result)
+        exclusion_data = check_program_exclusion_data(program_id, hts_code, product_description, import_date)
 
         decisions.append({
             "step": "check_exclusion",
@@ -295,12 +295,7 @@ def process_program_node(state: StackingState) -> dict:
         # Section 232 - check material composition
         # Phase 6: Pass product_value for content-value-based duties
         product_value = state.get("product_value", 0)
-        material_result = TOOL_MAP["check_material_composition"].invoke({
-            "hts_code": hts_code,
-            "materials": json.dumps(materials),
-            "product_value": product_value
-        })
-        material_data = json.loads(material_result)
+        material_data = check_material_composition_data(hts_code, materials, float(product_value))
 
         # Find the specific material for this program
         material_name = program.get("condition_param")
@@ -376,11 +371,7 @@ def process_program_node(state: StackingState) -> dict:
 
     elif condition_handler == "handle_dependency":
         # IEEPA Reciprocal - depends on Section 232 results
-        dependency_result = TOOL_MAP["resolve_program_dependencies"].invoke({
-            "program_id": program_id,
-            "previous_results": json.dumps(program_results)
-        })
-        dependency_data = json.loads(dependency_result)
+        dependency_data = resolve_program_dependencies_data(program_id, program_results)
 
         result_data["action"] = dependency_data.get("action")
         result_data["chapter_99_code"] = dependency_data.get("chapter_99_code")
@@ -411,11 +402,7 @@ def process_program_node(state: StackingState) -> dict:
     else:
         # No special condition handler (e.g., Section 301, IEEPA Fentanyl)
         # Get the output code
-        output_result = TOOL_MAP["get_program_output"].invoke({
-            "program_id": program_id,
-            "action": "apply"
-        })
-        output_data = json.loads(output_result)
+        output_data = get_program_output_data(program_id, "apply")
 
         if output_data.get("found"):
             result_data["action"] = "apply"
@@ -452,6 +439,8 @@ def process_program_node(state: StackingState) -> dict:
     }
 
 
+@timed_node("plan_slices", graph="stacking", log=False)
+@profiled_node("plan_slices")
 def plan_slices_node(state: StackingState) -> dict:
     """
     v4.0: Plan entry slices based on materials.
@@ -470,14 +459,8 @@ def plan_slices_node(state: StackingState) -> dict:
     applicable_programs = [p.get("program_id") for p in programs]
 
     # Call plan_entry_slices tool
-    result = TOOL_MAP["plan_entry_slices"].invoke({
-        "hts_code": hts_code,
-        "product_value": product_value,
-        "materials": json.dumps(materials),
-        "applicable_programs": json.dumps(applicable_programs)
-    })
-
-    slice_data = json.loads(result)
+    # float() matches the coercion the @tool schema applied to product_value
+    slice_data = plan_entry_slices_data(hts_code, float(product_value), materials, applicable_programs)
     slices = slice_data.get("slices", [])
 
     decisions.append({
@@ -495,6 +478,8 @@ def plan_slices_node(state: StackingState) -> dict:
     }
 
 
+@timed_node("check_annex_ii", graph="stacking", log=False)
+@profiled_node("check_annex_ii")
 def check_annex_ii_node(state: StackingState) -> dict:
     """
     v4.0: Check if HTS is in Annex II (exempt from IEEPA Reciprocal).
@@ -503,11 +488,7 @@ def check_annex_ii_node(state: StackingState) -> dict:
     decisions = state.get("decisions", [])
 
     # Call check_annex_ii_exclusion tool
-    result = TOOL_MAP["check_annex_ii_exclusion"].invoke({
-        "hts_code": hts_code
-    })
-
-    annex_data = json.loads(result)
+    annex_data = check_annex_ii_exclusion_data(hts_code)
     is_exempt = annex_data.get("excluded", False)
 
     decisions.append({
@@ -524,6 +505,8 @@ def check_annex_ii_node(state: StackingState) -> dict:
     }
 
 
+@timed_node("build_entry_stacks", graph="stacking", log=False)
+@profiled_node("build_entry_stacks")
 def build_entry_stacks_node(state: StackingState) -> dict:
     """
     v4.0: Build Chapter 99 stacks for all entry slices.
@@ -605,11 +588,7 @@ def build_entry_stacks_node(state: StackingState) -> dict:
                 # v11.0: Use import_date for temporal lookup (exclusion precedence)
                 # v19.0: NO FALLBACK - if HTS not in section_301_rates, 301 does not apply
                 import_date = state.get("import_date")
-                inclusion_result = json.loads(TOOL_MAP["check_program_inclusion"].invoke({
-                    "program_id": program_id,
-                    "hts_code": hts_code,
-                    "as_of_date": import_date
-                }))
+                inclusion_result = check_program_inclusion_data(program_id, hts_code, as_of_date=import_date)
                 if inclusion_result.get("included"):
                     # HTS is on Section 301 list - apply the tariff
                     action = "apply"
@@ -629,11 +608,7 @@ def build_entry_stacks_node(state: StackingState) -> dict:
             elif program_id == "ieepa_fentanyl":
                 # IEEPA Fentanyl applies to all slices
                 action = "apply"
-                output = json.loads(TOOL_MAP["get_program_output"].invoke({
-                    "program_id": program_id,
-                    "action": "apply",
-                    "slice_type": "all"
-                }))
+                output = get_program_output_data(program_id, "apply", slice_type="all")
                 if output.get("found"):
                     chapter_99_code = output.get("chapter_99_code")
                     duty_rate = output.get("duty_rate", 0.10)
@@ -652,23 +627,21 @@ def build_entry_stacks_node(state: StackingState) -> dict:
                 # Phase 11: Get article_type for Note 16 full-value exemption
                 article_type = None
                 hts_8digit = hts_code.replace(".", "")[:8]
-                from app.web.db.models.tariff_tables import Section232Material
-                from app.chat.tools.stacking_tools import get_flask_app
-                app = get_flask_app()
-                with app.app_context():
-                    mat_232 = Section232Material.query.filter_by(hts_8digit=hts_8digit).first()
+                from app.chat.tools.stacking_tools import get_first_section_232_material, tool_app_context
+                with tool_app_context():
+                    mat_232 = get_first_section_232_material(hts_8digit)
                     if mat_232:
                         article_type = getattr(mat_232, 'article_type', 'content') or 'content'
 
-                variant_result = json.loads(TOOL_MAP["resolve_reciprocal_variant"].invoke({
-                    "hts_code": hts_code,
-                    "slice_type": slice_type,
-                    "us_content_pct": None,
-                    "import_date": import_date,
-                    "article_type": article_type,
-                    "country_code": country_iso2,
-                    "entered_value": float(product_value) if product_value else None,
-                }))
+                variant_result = resolve_reciprocal_variant_data(
+                    hts_code=hts_code,
+                    slice_type=slice_type,
+                    us_content_pct=None,
+                    import_date=import_date,
+                    article_type=article_type,
+                    country_code=country_iso2,
+                    entered_value=float(product_value) if product_value else None,
+                )
                 variant = variant_result.get("variant", "taxable")
                 action = variant_result.get("action", "paid")
 
@@ -680,20 +653,10 @@ def build_entry_stacks_node(state: StackingState) -> dict:
                 # Fallback to get_program_output lookup if variant_result didn't provide code
                 if not chapter_99_code:
                     lookup_slice = slice_type if variant == "metal_exempt" else slice_type
-                    output = json.loads(TOOL_MAP["get_program_output"].invoke({
-                        "program_id": program_id,
-                        "action": action,
-                        "variant": variant,
-                        "slice_type": lookup_slice
-                    }))
+                    output = get_program_output_data(program_id, action, variant, lookup_slice)
                     # Fallback to "all" if not found
                     if not output.get("found") and lookup_slice != "all":
-                        output = json.loads(TOOL_MAP["get_program_output"].invoke({
-                            "program_id": program_id,
-                            "action": action,
-                            "variant": variant,
-                            "slice_type": "all"
-                        }))
+                        output = get_program_output_data(program_id, action, variant, "all")
                     if output.get("found"):
                         chapter_99_code = output.get("chapter_99_code")
                         duty_rate = output.get("duty_rate", 0)
@@ -703,10 +666,7 @@ def build_entry_stacks_node(state: StackingState) -> dict:
                 material = program_id.replace("section_232_", "")
 
                 # Check if HTS is on the 232 list for this metal
-                inclusion_result = json.loads(TOOL_MAP["check_program_inclusion"].invoke({
-                    "program_id": program_id,
-                    "hts_code": hts_code
-                }))
+                inclusion_result = check_program_inclusion_data(program_id, hts_code)
 
                 if not inclusion_result.get("included"):
                     # HTS not on 232 list for this metal - skip entirely
@@ -796,6 +756,8 @@ def build_entry_stacks_node(state: StackingState) -> dict:
     }
 
 
+@timed_node("calculate", graph="stacking", log=False)
+@profiled_node("calculate")
 def calculate_duties_node(state: StackingState) -> dict:
     """
     Calculate total duties at PRODUCT level (not per-slice).
@@ -874,18 +836,16 @@ def calculate_duties_node(state: StackingState) -> dict:
                         "line_value": product_value  # Full product value
                     })
 
-    # Call calculate_duties tool with product-level lines
+    # Call calculate_duties with product-level lines
     # v5.0: Pass country and hts_code for dynamic rate lookups
-    result = TOOL_MAP["calculate_duties"].invoke({
-        "filing_lines": json.dumps(product_level_lines),
-        "product_value": product_value,
-        "materials": json.dumps(materials),
-        "country": country,  # v5.0: For country-specific rates
-        "hts_code": hts_code,  # v5.0: For MFN base rate lookup
-        "import_date": import_date  # v5.0: For time-bounded rate lookups
-    })
-
-    duty_data = json.loads(result)
+    duty_data = calculate_duties_data(
+        filing_lines=product_level_lines,
+        product_value=float(product_value),
+        materials=materials,
+        country=country,  # v5.0: For country-specific rates
+        hts_code=hts_code,  # v5.0: For MFN base rate lookup
+        import_date=import_date  # v5.0: For time-bounded rate lookups
+    )
 
     # Add unstacking to duty data (override with graph-calculated values)
     duty_data["unstacking"] = unstacking
@@ -902,6 +862,8 @@ def calculate_duties_node(state: StackingState) -> dict:
     }
 
 
+@timed_node("generate", graph="stacking", log=False)
+@profiled_node("generate")
 def generate_output_node(state: StackingState) -> dict:
     """
     Generate human-readable output with explanation and audit trail.
@@ -1034,7 +996,7 @@ def should_use_v4_flow(state: StackingState) -> Literal["v4_flow", "legacy_flow"
     return "v4_flow"
 
 
-def build_stacking_graph(checkpointer=None):
+def build_stacking_graph(checkpointer=None, checkpoint: bool = True):
     """
     Build the stacking graph.
 
@@ -1046,6 +1008,8 @@ def build_stacking_graph(checkpointer=None):
 
     Args:
         checkpointer: LangGraph checkpointer for memory persistence
+        checkpoint: v22.0 - False compiles without a checkpointer (one-shot
+                    runs that never resume with materials)
 
     Returns:
         Compiled LangGraph graph
@@ -1106,6 +1070,10 @@ def build_stacking_graph(checkpointer=None):
     workflow.add_edge("calculate", "generate")
     workflow.add_edge("generate", END)
 
+    # v22.0: One-shot graphs skip checkpoint serialization entirely
+    if not checkpoint:
+        return workflow.compile()
+
     # Use provided checkpointer or default to MemorySaver
     if checkpointer is None:
         checkpointer = MemorySaver()
@@ -1113,10 +1081,140 @@ def build_stacking_graph(checkpointer=None):
     return workflow.compile(checkpointer=checkpointer)
 
 
+# ============================================================================
+# v22.0: Process-Wide Compiled Graphs
+# ============================================================================
+# Building and compiling the StateGraph costs far more than a calculation's
+# state merging, so StackingRAG reuses one compiled graph per mode. Requests
+# are isolated only by thread_id in the run config.
+
+_compiled_graphs: Dict[bool, Any] = {}
+_compiled_graphs_lock = threading.Lock()
+
+
+def get_stacking_graph(checkpoint: bool = True):
+    """
+    Get the process-wide compiled stacking graph.
+
+    Args:
+        checkpoint: True for the graph backed by a shared MemorySaver (needed
+                    to resume with materials), False for the one-shot graph
+                    compiled without a checkpointer
+    """
+    graph = _compiled_graphs.get(checkpoint)
+    if graph is None:
+        with _compiled_graphs_lock:
+            graph = _compiled_graphs.get(checkpoint)
+            if graph is None:
+                graph = build_stacking_graph(checkpoint=checkpoint)
+                _compiled_graphs[checkpoint] = graph
+    return graph
+
+
+# ============================================================================
+# v22.0: Direct Execution (no LangGraph)
+# ============================================================================
+# The stacking flow is deterministic, so the same node functions can run as
+# plain Python calls. run_stacking_direct() mirrors build_stacking_graph()'s
+# v4.0 edges and LangGraph's state merging (overwrite per key, add_messages
+# for messages). Keep it in sync with the graph edges above.
+
+def _apply_node_update(state: dict, update: dict) -> None:
+    """Merge a node's partial update into state like the StateGraph channels."""
+    for key, value in update.items():
+        if key == "messages":
+            state[key] = add_messages(state.get(key, []), value)
+        else:
+            state[key] = value
+
+
+def run_stacking_direct(state: dict) -> dict:
+    """
+    Run the stacking nodes in graph order without LangGraph.
+
+    Flow (same as the compiled graph):
+    initialize -> (check_materials?) -> plan_slices -> check_annex_ii ->
+    build_entry_stacks -> calculate -> generate
+
+    Args:
+        state: Full StackingState input (as passed to graph.invoke)
+
+    Returns:
+        Final state dict, equivalent to graph.invoke(state)
+    """
+    state = dict(state)
+    state["messages"] = add_messages([], state.get("messages") or [])
+
+    def run(node):
+        _apply_node_update(state, node(state))
+
+    run(initialize_node)
+
+    if should_check_materials(state) == "check_materials":
+        run(check_materials_node)
+        route = should_continue_processing(state)
+        if route == "await_input":
+            return state
+        if route == "calculate":
+            run(calculate_duties_node)
+            run(generate_output_node)
+            return state
+
+    run(plan_slices_node)
+    run(check_annex_ii_node)
+    run(build_entry_stacks_node)
+    run(calculate_duties_node)
+    run(generate_output_node)
+    return state
+
+
 # ============================================================================
 # High-Level Wrapper
 # ============================================================================
 
+# v22.0: Inputs that fully define a calculation awaiting materials
+PENDING_STATE_KEYS = (
+    "hts_code", "country", "product_description", "product_value",
+    "import_date", "quantity", "quantity_uom",
+)
+
+
+def _initial_state(hts_code: str, country: str, product_description: str, product_value: float,
+                   import_date: Optional[str] = None, materials: Optional[Dict[str, float]] = None,
+                   quantity: Optional[int] = None, quantity_uom: Optional[str] = "PCS") -> dict:
+    """Graph input state for a new calculation."""
+    return {
+        "messages": [],
+        "hts_code": hts_code,
+        "country": country,
+        "product_description": product_description,
+        "product_value": product_value,
+        "import_date": import_date,
+        "materials": materials,
+        "materials_needed": False,
+        "applicable_materials": None,  # Populated by check_materials_node
+        "programs": [],
+        "program_results": {},
+        "filing_lines": [],
+        "decisions": [],
+        "total_duty": None,
+        "current_program_idx": 0,
+        "iteration": 0,
+        "final_output": None,
+        "awaiting_user_input": False,
+        "user_question": None,
+        # v4.0: Entry Slices
+        "entries": [],
+        "unstacking": None,
+        "slices": [],
+        "current_slice_idx": 0,
+        "annex_ii_exempt": False,
+        # v7.1: Quantity handling
+        "quantity": quantity,
+        "quantity_uom": quantity_uom
+    }
+
+
 class StackingRAG:
     """
     High-level wrapper for the stacking RAG graph.
@@ -1124,18 +1222,67 @@ class StackingRAG:
     Provides tariff stacking calculation with data-driven logic.
     """
 
-    def __init__(self, conversation_id: str, checkpointer=None):
+    ENGINES = ("graph", "direct")
+
+    def __init__(self, conversation_id: str, checkpointer=None, checkpoint: bool = True,
+                 engine: str = "graph"):
         """
         Initialize the stacking RAG.
 
+        v22.0: Uses the process-wide compiled graph unless a custom
+        checkpointer is given; conversation_id is the checkpoint thread_id.
+
         Args:
             conversation_id: Unique ID for this conversation
-            checkpointer: Optional custom checkpointer
+            checkpointer: Optional custom checkpointer (builds a dedicated graph)
+            checkpoint: False for one-shot runs without checkpointing; such
+                        runs cannot continue_with_materials()
+            engine: "graph" (LangGraph) or "direct" (run_stacking_direct, same
+                    nodes and output without LangGraph overhead)
         """
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown stacking engine '{engine}', expected one of {self.ENGINES}")
         self.conversation_id = conversation_id
-        self.graph = build_stacking_graph(checkpointer=checkpointer)
+        self.checkpoint = checkpoint
+        self.engine = engine
+        self._pending_state = None  # Direct engine: state awaiting materials
+        self._shared_graph = checkpointer is None
+        if self._shared_graph:
+            self.graph = get_stacking_graph(checkpoint=checkpoint)
+        else:
+            self.graph = build_stacking_graph(checkpointer=checkpointer, checkpoint=checkpoint)
         self.config = {"configurable": {"thread_id": conversation_id}}
 
+    def _invoke(self, state: dict, config: dict) -> dict:
+        """Run the selected engine and release finished checkpoint threads."""
+        # v22.0: One app context, session and lookup memo for the whole run;
+        # SQL and time are attributed per node and tool (calculation_profile)
+        if self.engine == "direct":
+            with profile_calculation(), calculation_context():
+                result = run_stacking_direct(state)
+            self._pending_state = result if result.get("awaiting_user_input") else None
+            return result
+
+        result = None
+        try:
+            with profile_calculation(), calculation_context():
+                result = self.graph.invoke(state, config=config)
+        finally:
+            # Also when the graph raised: a failed thread is never resumed
+            if result is None or not result.get("awaiting_user_input"):
+                self._release_thread(config)
+        return result
+
+    def _release_thread(self, config: dict) -> None:
+        """
+        Drop a finished thread from the shared checkpointer.
+
+        Threads awaiting materials are kept so continue_with_materials() can
+        resume them; custom checkpointers keep their history.
+        """
+        if self._shared_graph and self.checkpoint:
+            self.graph.checkpointer.delete_thread(config["configurable"]["thread_id"])
+
     def calculate_stacking(
         self,
         hts_code: str,
@@ -1145,7 +1292,8 @@ class StackingRAG:
         materials: Optional[Dict[str, float]] = None,
         import_date: Optional[str] = None,
         quantity: Optional[int] = None,
-        quantity_uom: Optional[str] = "PCS"
+        quantity_uom: Optional[str] = "PCS",
+        thread_id: Optional[str] = None
     ) -> dict:
         """
         Calculate tariff stacking for a product.
@@ -1160,6 +1308,8 @@ class StackingRAG:
             import_date: Date of import (YYYY-MM-DD), defaults to today
             quantity: Piece count for the line item (v7.1, duplicated across all slices)
             quantity_uom: Unit of measure (e.g., "PCS", "KG"), defaults to "PCS"
+            thread_id: Checkpoint thread for this run (v22.0), defaults to the
+                       conversation_id. Lets one StackingRAG serve many lines.
 
         Returns:
             Dict with stacking results including:
@@ -1181,43 +1331,41 @@ class StackingRAG:
                     f"Material values (${material_sum:.2f}) exceed product value (${product_value:.2f}). "
                     f"Sum of material allocations cannot exceed total product value."
                 )
-        result = self.graph.invoke(
-            {
-                "messages": [],
-                "hts_code": hts_code,
-                "country": country,
-                "product_description": product_description,
-                "product_value": product_value,
-                "import_date": import_date,
-                "materials": materials,
-                "materials_needed": False,
-                "applicable_materials": None,  # Populated by check_materials_node
-                "programs": [],
-                "program_results": {},
-                "filing_lines": [],
-                "decisions": [],
-                "total_duty": None,
-                "current_program_idx": 0,
-                "iteration": 0,
-                "final_output": None,
-                "awaiting_user_input": False,
-                "user_question": None,
-                # v4.0: Entry Slices
-                "entries": [],
-                "unstacking": None,
-                "slices": [],
-                "current_slice_idx": 0,
-                "annex_ii_exempt": False,
-                # v7.1: Quantity handling
-                "quantity": quantity,
-                "quantity_uom": quantity_uom
-            },
-            config=self.config
+
+        # v22.0: Identical calculations on unchanged tariff data are served
+        # from the result cache (USE_RESULT_CACHE)
+        cache_key = None
+        if result_cache_enabled():
+            from app.chat.tools.stacking_tools import get_flask_app
+            with get_flask_app().app_context():
+                data_version = get_tariff_data_version()
+            cache_key = result_cache_key(
+                hts_code, country, import_date or date.today().isoformat(),
+                product_value, product_description, materials,
+                quantity=quantity, quantity_uom=quantity_uom, data_version=data_version,
+            )
+            cached = get_result_cache().get(cache_key)
+            if cached is not None:
+                return cached
+
+        config = {"configurable": {"thread_id": thread_id}} if thread_id else self.config
+        result = self._invoke(
+            _initial_state(
+                hts_code=hts_code,
+                country=country,
+                product_description=product_description,
+                product_value=product_value,
+                import_date=import_date,
+                materials=materials,
+                quantity=quantity,
+                quantity_uom=quantity_uom,
+            ),
+            config
         )
 
         total_duty = result.get("total_duty") or {}
 
-        return {
+        response = {
             "output": result.get("final_output", ""),
             # v4.0: ACE Entry Slices
             "entries": result.get("entries", []),
@@ -1234,22 +1382,70 @@ class StackingRAG:
             "applicable_materials": result.get("applicable_materials", [])
         }
 
-    def continue_with_materials(self, materials: Dict[str, float]) -> dict:
+        if cache_key is not None:
+            get_result_cache().put(cache_key, response)
+        return response
+
+    def detach_pending_state(self) -> Optional[dict]:
+        """
+        v22.0: Compact state of the calculation awaiting materials.
+
+        Only the calculation inputs (PENDING_STATE_KEYS) are kept, as plain
+        JSON: continuing re-runs the nodes from initialize with the materials,
+        so nothing else is needed. Any StackingRAG in any process can resume
+        it with continue_with_materials(materials, pending_state=...).
+
+        Releases the checkpoint thread. Returns None if nothing is awaiting
+        materials.
+        """
+        if self.engine == "direct":
+            values = self._pending_state
+            self._pending_state = None
+        elif self.checkpoint:
+            values = self.graph.get_state(self.config).values
+            self._release_thread(self.config)
+        else:
+            values = None
+
+        if not values or not values.get("awaiting_user_input"):
+            return None
+        return {key: values.get(key) for key in PENDING_STATE_KEYS}
+
+    def continue_with_materials(self, materials: Dict[str, float],
+                                pending_state: Optional[dict] = None) -> dict:
         """
         Continue calculation after user provides material composition.
 
         Args:
             materials: Material composition dict (e.g., {"copper": 3000, "steel": 1000})
+            pending_state: v22.0: State from detach_pending_state(), possibly
+                           of another StackingRAG or process. Defaults to this
+                           RAG's own pending calculation.
 
         Returns:
             Updated stacking results with v4.0 entry slices
 
         Raises:
-            ValueError: If sum of material values exceeds product_value
+            ValueError: If sum of material values exceeds product_value, or
+                        the RAG was created with checkpoint=False and no
+                        pending_state is given
         """
+        if pending_state is None and self.engine == "graph" and not self.checkpoint:
+            raise ValueError(
+                "continue_with_materials() requires checkpoint mode; "
+                "resubmit calculate_stacking() with materials instead."
+            )
+
         # Get current state and continue
-        current_state = self.graph.get_state(self.config)
-        product_value = current_state.values.get("product_value", 0)
+        if pending_state is not None:
+            current_values = _initial_state(**{key: pending_state.get(key) for key in PENDING_STATE_KEYS})
+        elif self.engine == "direct":
+            if self._pending_state is None:
+                raise ValueError("No calculation is awaiting materials.")
+            current_values = self._pending_state
+        else:
+            current_values = self.graph.get_state(self.config).values
+        product_value = current_values.get("product_value", 0)
 
         # v7.1: Validate material allocation
         if materials:
@@ -1261,14 +1457,14 @@ class StackingRAG:
                 )
 
         # Update with materials and resume
-        result = self.graph.invoke(
+        result = self._invoke(
             {
-                **current_state.values,
+                **current_values,
                 "materials": materials,
                 "materials_needed": False,
                 "awaiting_user_input": False
             },
-            config=self.config
+            self.config
         )
 
         total_duty = result.get("total_duty") or {}
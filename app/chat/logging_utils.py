@@ -213,8 +213,12 @@ class GraphLogger:
             "num_citations": len(citations) if citations else 0
         })
 
-    def log_tool(self, tool_name: str, inputs: Dict, output: Any, duration_ms: float) -> None:
-        """Log a tool call."""
+    def log_tool(self, tool_name: str, inputs: Dict, output: Any, duration_ms: float,
+                 graph: str = "chat", error: bool = False) -> None:
+        """Log a tool call (v22.0: and record it in the tool latency metrics)."""
+        from app.services.metrics import observe_tool
+        observe_tool(graph, tool_name, (duration_ms or 0) / 1000, error=error)
+
         event = {
             "tool": tool_name,
             "inputs": inputs,
@@ -235,41 +239,52 @@ class GraphLogger:
 # Decorator for Node Timing
 # ============================================================================
 
-def timed_node(node_name: str):
+def timed_node(node_name: str, graph: str = "chat", log: bool = True):
     """
     Decorator to time and log node execution.
 
+    v22.0: Also records the node's latency and errors in the in-process
+    metrics (graph_node_duration_seconds / graph_node_errors_total on
+    /admin/metrics). Works for nodes with or without a config parameter.
+
+    Args:
+        node_name: Node name as registered in the graph
+        graph: Graph label for the metrics (e.g. "stacking", "conversational")
+        log: Write a node_execution JSON log line per run (off for hot paths)
+
     Usage:
-        @timed_node("retrieve")
+        @timed_node("retrieve", graph="conversational")
         def retrieve_documents_node(state, config):
             ...
     """
+    from app.services.metrics import observe_node
+
     def decorator(func):
         @wraps(func)
         def wrapper(state, config=None, *args, **kwargs):
-            start = time.time()
+            start = time.perf_counter()
             error = None
 
-            # Extract run info from config
-            run_meta = (config or {}).get("configurable", {})
-            run_id = run_meta.get("run_id", "unknown")
-            conversation_id = run_meta.get("conversation_id", "unknown")
-
             try:
-                result = func(state, config, *args, **kwargs)
-                return result
+                if config is None:
+                    return func(state, *args, **kwargs)
+                return func(state, config, *args, **kwargs)
             except Exception as e:
                 error = str(e)
                 raise
             finally:
-                duration_ms = (time.time() - start) * 1000
-                log_node_execution(
-                    node_name=node_name,
-                    run_id=run_id,
-                    conversation_id=conversation_id,
-                    duration_ms=round(duration_ms, 2),
-                    error=error
-                )
+                duration = time.perf_counter() - start
+                observe_node(graph, node_name, duration, error=error is not None)
+                if log:
+                    # Extract run info from config
+                    run_meta = (config or {}).get("configurable", {})
+                    log_node_execution(
+                        node_name=node_name,
+                        run_id=run_meta.get("run_id", "unknown"),
+                        conversation_id=run_meta.get("conversation_id", "unknown"),
+                        duration_ms=round(duration * 1000, 2),
+                        error=error
+                    )
 
         return wrapper
     return decorator
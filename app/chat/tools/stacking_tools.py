@@ -32,16 +32,21 @@ v12.0 Update (Jan 2026) - IEEPA Code Corrections:
 """
 
 import os
+import copy
 import csv
 import json
 import hashlib
-import uuid
+import threading
+from contextlib import contextmanager, nullcontext
 from datetime import date, datetime
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
+from flask import current_app, has_app_context
 from langchain_core.tools import tool
 
+from app.services.calculation_profile import profiled_tool
+
 
 # ============================================================================
 # v12.0: IEEPA Code Constants (per CSMS #66749380)
@@ -86,6 +91,7 @@ IEEPA_CODES = {
 # v13.0: Temporal IEEPA Rate Lookup with Fallback
 # ============================================================================
 
+@profiled_tool("get_ieepa_rate_temporal")
 def get_ieepa_rate_temporal(program_type: str, country_code: str, as_of_date=None, variant: str = None):
     """
     Get IEEPA rate from temporal table with fallback to hardcoded constants.
@@ -112,24 +118,28 @@ def get_ieepa_rate_temporal(program_type: str, country_code: str, as_of_date=Non
 
     # Try temporal table first
     try:
-        app = get_flask_app()
-        with app.app_context():
+        with tool_app_context():
             models = get_models()
             IeepaRate = models.get("IeepaRate")
-            if IeepaRate:
+            snapshot = get_active_rule_snapshot()
+            if snapshot is not None:
+                rate = snapshot.ieepa_rate_as_of(program_type, country_code, lookup_date, variant)
+            elif IeepaRate:
                 rate = IeepaRate.get_rate_as_of(
                     program_type=program_type,
                     country_code=country_code,
                     as_of_date=lookup_date,
                     variant=variant
                 )
-                if rate:
-                    return {
-                        'code': rate.chapter_99_code,
-                        'rate': float(rate.duty_rate),
-                        'source': 'temporal',
-                        'effective_start': rate.effective_start.isoformat() if rate.effective_start else None,
-                    }
+            else:
+                rate = None
+            if rate:
+                return {
+                    'code': rate.chapter_99_code,
+                    'rate': float(rate.duty_rate),
+                    'source': 'temporal',
+                    'effective_start': rate.effective_start.isoformat() if rate.effective_start else None,
+                }
     except Exception:
         pass  # Fall through to hardcoded
 
@@ -271,10 +281,8 @@ def _is_annex_ii_energy_exempt_from_db(hts_code: str, import_date: Optional[str]
     Returns:
         dict with 'exempt' flag and exemption details if found
     """
-    # Call the existing check_annex_ii_exclusion tool
-    # Note: check_annex_ii_exclusion is decorated with @tool, so we use .invoke()
-    result_json = check_annex_ii_exclusion.invoke({"hts_code": hts_code, "import_date": import_date})
-    result = json.loads(result_json)
+    # v22.0: Call the dict API directly instead of the @tool wrapper
+    result = check_annex_ii_exclusion_data(hts_code, import_date)
 
     if result.get("excluded") and result.get("category") == "energy":
         return {
@@ -294,6 +302,7 @@ import logging
 _energy_check_logger = logging.getLogger(__name__)
 
 
+@profiled_tool("is_annex_ii_energy_exempt")
 def is_annex_ii_energy_exempt(hts_code: str, import_date: Optional[str] = None) -> dict:
     """
     v21.0: Feature flag wrapper for Annex II energy exemption check.
@@ -347,7 +356,20 @@ def get_db():
 
 
 def get_models():
-    """Get tariff table models (lazy import to avoid circular imports)."""
+    """
+    Get tariff table models (lazy import to avoid circular imports).
+
+    v22.0: Inside calculation_context() the models resolved when the
+    calculation started are reused.
+    """
+    calculation = getattr(_batch_lookups, "calculation", None)
+    if calculation is not None:
+        return calculation.models
+    return _load_models()
+
+
+def _load_models() -> dict:
+    """Import the tariff table models and return them by name."""
     from app.web.db.models.tariff_tables import (
         TariffProgram,
         Section301Inclusion,
@@ -403,6 +425,209 @@ def get_models():
     }
 
 
+def get_active_rule_snapshot():
+    """
+    v22.0: Get the in-memory tariff rule snapshot, or None when disabled.
+
+    Controlled by USE_RULE_SNAPSHOT (default false), or per block with
+    shared_lookups(rule_snapshot=True). When enabled, rule-table lookups on
+    the stacking hot path are served from an immutable snapshot
+    (app.services.rule_snapshot) instead of issuing SQL per lookup.
+
+    Inside shared_lookups() / calculation_context() the snapshot is resolved
+    once (one tariff data version check) and reused for the whole block.
+    """
+    if (os.getenv("USE_RULE_SNAPSHOT", "false").lower() != "true"
+            and not getattr(_batch_lookups, "rule_snapshot", False)):
+        return None
+    from app.services.rule_snapshot import get_rule_snapshot
+    return shared_lookup("rule_snapshot", None, lambda: get_rule_snapshot(get_flask_app()))
+
+
+def get_active_applicability_matrix():
+    """
+    v22.0: Get the program applicability matrix, or None when disabled.
+
+    Controlled by USE_APPLICABILITY_MATRIX (default false). When enabled,
+    program lists, inclusion outcomes and country scope outcomes are served
+    from app.services.applicability_matrix and computed by the live logic
+    only on a miss. Must be called inside an app context.
+    """
+    if os.getenv("USE_APPLICABILITY_MATRIX", "false").lower() != "true":
+        return None
+    from app.services.applicability_matrix import get_applicability_matrix
+    return get_applicability_matrix()
+
+
+def get_active_country_resolver():
+    """
+    v22.0: Get the preloaded country resolver, or None when disabled.
+
+    Controlled by USE_COUNTRY_RESOLVER (default false). When enabled, country
+    normalization (with fuzzy matching of misspelled names) and country group
+    membership are served from app.services.country_resolver instead of
+    CountryAlias / CountryGroupMember queries. Must be called inside an app context.
+    """
+    if os.getenv("USE_COUNTRY_RESOLVER", "false").lower() != "true":
+        return None
+    from app.services.country_resolver import get_country_resolver
+    return get_country_resolver()
+
+
+def get_active_program_rate_resolver():
+    """
+    v22.0: Get the compiled program rate resolver, or None when disabled.
+
+    Controlled by USE_RATE_RESOLVER (default false). When enabled, ProgramRate
+    lookups and formula rates are served from app.services.rate_formula
+    instead of the rule snapshot / program_rates queries. Resolved once per
+    shared_lookups() block. Must be called inside an app context.
+    """
+    if os.getenv("USE_RATE_RESOLVER", "false").lower() != "true":
+        return None
+    from app.services.rate_formula import get_program_rate_resolver
+    return shared_lookup("program_rate_resolver", None, get_program_rate_resolver)
+
+
+def get_first_section_232_material(hts_8digit: str):
+    """
+    v22.0: First Section232Material row for an HTS8 (any material), or None.
+
+    Used to read article_type for Note 16 handling. Must be called inside an
+    app context when the rule snapshot is disabled.
+    """
+    snapshot = get_active_rule_snapshot()
+    if snapshot is not None:
+        materials = snapshot.section_232_materials(hts_8digit)
+        return materials[0] if materials else None
+    Section232Material = get_models()["Section232Material"]
+    return Section232Material.query.filter_by(hts_8digit=hts_8digit).first()
+
+
+# ============================================================================
+# v22.0: Batch-Scoped Shared Lookups
+# ============================================================================
+# Lines of one customs entry share a country and import date, so country
+# normalization, the program list and duty rules are identical across lines.
+# Likewise one HTS evaluated for many origins shares its inclusion, Section
+# 232 material, Annex II and MFN base rate results. Inside a
+# shared_lookups() block those lookups are resolved once and reused.
+
+_batch_lookups = threading.local()
+
+
+@contextmanager
+def shared_lookups(rule_snapshot: bool = False):
+    """
+    v22.0: Memoize entry-invariant lookups for the duration of the block.
+
+    Nested blocks reuse the outer memo. Memoized rows are frozen copies
+    (see app.services.rule_snapshot.freeze_rows), so they stay valid after
+    the app context that loaded them is torn down.
+
+    Args:
+        rule_snapshot: Also serve rule-table lookups from the rule snapshot
+                       inside the block, regardless of USE_RULE_SNAPSHOT
+    """
+    outer = getattr(_batch_lookups, "memo", None)
+    outer_snapshot = getattr(_batch_lookups, "rule_snapshot", False)
+    if outer is None:
+        _batch_lookups.memo = {}
+    _batch_lookups.rule_snapshot = outer_snapshot or rule_snapshot
+    try:
+        yield _batch_lookups.memo
+    finally:
+        _batch_lookups.rule_snapshot = outer_snapshot
+        if outer is None:
+            _batch_lookups.memo = None
+
+
+def shared_lookup(kind: str, key, loader):
+    """
+    v22.0: Return loader() memoized under (kind, key) inside shared_lookups().
+
+    Outside a shared_lookups() block the loader is called every time.
+    """
+    memo = getattr(_batch_lookups, "memo", None)
+    if memo is None:
+        return loader()
+    cache_key = (kind, key)
+    if cache_key not in memo:
+        memo[cache_key] = loader()
+    return memo[cache_key]
+
+
+def _freeze_first(model, instance):
+    """Frozen copy of a single ORM row (or None) for shared_lookup memoization."""
+    if instance is None:
+        return None
+    from app.services.rule_snapshot import freeze_rows
+    return freeze_rows(model, [instance])[0]
+
+
+# ============================================================================
+# v22.0: Calculation Context
+# ============================================================================
+# A calculation runs many tool lookups, and each one used to push its own app
+# context (with its own SQLAlchemy session) and re-import the models. Inside
+# calculation_context() they share one app context, session, model dict and
+# shared_lookups() memo, so e.g. check_program_inclusion for the same
+# (program, HTS, date) is computed once across all slices.
+
+
+class CalculationContext:
+    """State shared by every tool lookup of one calculation."""
+
+    def __init__(self, app, session, models: dict, memo: dict):
+        self.app = app
+        self.session = session
+        self.models = models
+        self.memo = memo
+
+
+@contextmanager
+def calculation_context(rule_snapshot: bool = False):
+    """
+    v22.0: Run a calculation's tool lookups in one app context and memo.
+
+    Nested blocks reuse the outer context. Also enters shared_lookups()
+    (reusing an enclosing batch memo).
+
+    Args:
+        rule_snapshot: Passed to shared_lookups()
+
+    Yields:
+        CalculationContext
+    """
+    outer = getattr(_batch_lookups, "calculation", None)
+    if outer is not None:
+        yield outer
+        return
+
+    app = get_flask_app()
+    with app.app_context(), shared_lookups(rule_snapshot=rule_snapshot) as memo:
+        from app.web.db import db
+        calculation = CalculationContext(app, db.session(), _load_models(), memo)
+        _batch_lookups.calculation = calculation
+        try:
+            yield calculation
+        finally:
+            _batch_lookups.calculation = None
+
+
+def tool_app_context():
+    """
+    v22.0: App context for a tool lookup.
+
+    Inside calculation_context() the calculation's app context is already
+    active and is reused; otherwise a new one is pushed for the lookup.
+    """
+    calculation = getattr(_batch_lookups, "calculation", None)
+    if calculation is not None and has_app_context() and current_app._get_current_object() is calculation.app:
+        return nullcontext()
+    return get_flask_app().app_context()
+
+
 # ============================================================================
 # v6.0: Country Normalization and Data-Driven Country Scope
 # ============================================================================
@@ -446,6 +671,7 @@ COUNTRY_FALLBACK_MAP = {
 }
 
 
+@profiled_tool("normalize_country")
 def normalize_country(country_input: str) -> dict:
     """
     v6.0: Normalize country input to standardized ISO code.
@@ -478,8 +704,17 @@ def normalize_country(country_input: str) -> dict:
             "normalized": False
         }
 
-    app = get_flask_app()
-    with app.app_context():
+    return dict(shared_lookup("normalize_country", country_input,
+                              lambda: _normalize_country_uncached(country_input)))
+
+
+def _normalize_country_uncached(country_input: str) -> dict:
+    """normalize_country() lookup without batch memoization."""
+    with tool_app_context():
+        resolver = get_active_country_resolver()
+        if resolver is not None:
+            return resolver.normalize(country_input)
+
         models = get_models()
         CountryAlias = models["CountryAlias"]
 
@@ -487,9 +722,13 @@ def normalize_country(country_input: str) -> dict:
         alias_norm = country_input.lower().strip()
 
         # Query country_aliases table
-        alias = CountryAlias.query.filter(
-            CountryAlias.alias_norm == alias_norm
-        ).first()
+        snapshot = get_active_rule_snapshot()
+        if snapshot is not None:
+            alias = snapshot.country_alias(alias_norm)
+        else:
+            alias = CountryAlias.query.filter(
+                CountryAlias.alias_norm == alias_norm
+            ).first()
 
         if alias:
             return {
@@ -522,6 +761,7 @@ def normalize_country(country_input: str) -> dict:
         }
 
 
+@profiled_tool("check_program_country_scope")
 def check_program_country_scope(
     program_id: str,
     country_iso2: str,
@@ -559,13 +799,55 @@ def check_program_country_scope(
             "group_id": None
         }
 
-    app = get_flask_app()
-    with app.app_context():
+    with tool_app_context():
+        matrix = get_active_applicability_matrix()
+        if matrix is not None:
+            check_date = import_date or date.today()
+            return matrix.materialize(
+                "scope", (program_id, country_iso2.upper()), check_date,
+                lambda: _check_program_country_scope_live(program_id, country_iso2, check_date),
+            )
+    return _check_program_country_scope_live(program_id, country_iso2, import_date)
+
+
+def _check_program_country_scope_live(program_id: str, country_iso2: str, import_date: date = None) -> dict:
+    """check_program_country_scope() lookup without the applicability matrix."""
+    with tool_app_context():
         models = get_models()
         ProgramCountryScope = models["ProgramCountryScope"]
         CountryGroupMember = models["CountryGroupMember"]
 
         check_date = import_date or date.today()
+        snapshot = get_active_rule_snapshot()
+        resolver = get_active_country_resolver()
+
+        if snapshot is not None:
+            # v22.0: Same precedence as the SQL path, served from memory
+            for scope in snapshot.country_scopes(program_id, check_date):
+                if scope.iso_alpha2:
+                    if scope.iso_alpha2.upper() == country_iso2.upper():
+                        return {
+                            "in_scope": scope.scope_type == 'include',
+                            "scope_type": scope.scope_type,
+                            "matched_by": "country",
+                            "group_id": None
+                        }
+                elif scope.country_group_id:
+                    group_id = snapshot.group_id_for(scope.country_group_id)
+                    members = resolver if resolver is not None else snapshot
+                    if group_id and members.is_group_member(group_id, country_iso2, check_date):
+                        return {
+                            "in_scope": scope.scope_type == 'include',
+                            "scope_type": scope.scope_type,
+                            "matched_by": "group",
+                            "group_id": group_id
+                        }
+            return {
+                "in_scope": False,
+                "scope_type": "default",
+                "matched_by": "none",
+                "group_id": None
+            }
 
         # Query program_country_scope for this program
         scopes = ProgramCountryScope.query.filter(
@@ -589,13 +871,16 @@ def check_program_country_scope(
             # Check group scope
             elif scope.country_group_id:
                 # Check if country is a member of this group
-                member = CountryGroupMember.query.filter(
-                    CountryGroupMember.group_id == scope.country_group.group_id,
-                    CountryGroupMember.country_code.ilike(country_iso2),
-                    CountryGroupMember.effective_date <= check_date,
-                    (CountryGroupMember.expiration_date.is_(None)) |
-                    (CountryGroupMember.expiration_date > check_date)
-                ).first()
+                if resolver is not None:
+                    member = resolver.is_group_member(scope.country_group.group_id, country_iso2, check_date)
+                else:
+                    member = CountryGroupMember.query.filter(
+                        CountryGroupMember.group_id == scope.country_group.group_id,
+                        CountryGroupMember.country_code.ilike(country_iso2),
+                        CountryGroupMember.effective_date <= check_date,
+                        (CountryGroupMember.expiration_date.is_(None)) |
+                        (CountryGroupMember.expiration_date > check_date)
+                    ).first()
 
                 if member:
                     return {
@@ -628,13 +913,16 @@ def get_disclaim_behavior(program_id: str) -> str:
         'omit' - Steel/Aluminum: Omit entirely when not claimed (no disclaim line)
         'none' - Non-232 programs: No disclaim concept
     """
-    app = get_flask_app()
-    with app.app_context():
+    with tool_app_context():
         models = get_models()
         TariffProgram = models["TariffProgram"]
 
         # Query by program_id (get any entry since disclaim_behavior is same for all countries)
-        program = TariffProgram.query.filter_by(program_id=program_id).first()
+        snapshot = get_active_rule_snapshot()
+        if snapshot is not None:
+            program = snapshot.program(program_id)
+        else:
+            program = TariffProgram.query.filter_by(program_id=program_id).first()
         if program and hasattr(program, 'disclaim_behavior') and program.disclaim_behavior:
             return program.disclaim_behavior
         return 'none'
@@ -644,6 +932,7 @@ def get_disclaim_behavior(program_id: str) -> str:
 # v11.0: Semiconductor Predicate Evaluation
 # ============================================================================
 
+@profiled_tool("evaluate_semiconductor_predicates")
 def evaluate_semiconductor_predicates(hts_8digit: str, technical_attributes: dict,
                                        as_of_date=None) -> dict:
     """
@@ -669,8 +958,7 @@ def evaluate_semiconductor_predicates(hts_8digit: str, technical_attributes: dic
             details: list of per-predicate results
     """
     from datetime import date as date_type
-    app = get_flask_app()
-    with app.app_context():
+    with tool_app_context():
         models = get_models()
         Section232Predicate = models.get("Section232Predicate")
         if not Section232Predicate:
@@ -678,90 +966,19 @@ def evaluate_semiconductor_predicates(hts_8digit: str, technical_attributes: dic
 
         check_date = as_of_date or date_type.today()
 
-        # Get all active predicates for semiconductor program
-        from sqlalchemy import or_
-        predicates = Section232Predicate.query.filter(
-            Section232Predicate.program_id == 'section_232_semiconductor',
-            Section232Predicate.effective_start <= check_date,
-            or_(
-                Section232Predicate.effective_end.is_(None),
-                Section232Predicate.effective_end > check_date
-            )
-        ).all()
-
-        if not predicates:
-            return {"predicate_evaluated": False, "reason": "No active predicates found"}
-
-        # Filter to predicates matching this HTS code
-        matching = [p for p in predicates if p.matches_hts(hts_8digit)]
-        if not matching:
-            return {"predicate_evaluated": False, "reason": f"No predicates match HTS {hts_8digit}"}
-
-        # Group predicates by predicate_group
-        groups = {}
-        for p in matching:
-            groups.setdefault(p.predicate_group, []).append(p)
-
-        # Evaluate each group: ALL predicates in a group must pass (AND)
-        # If ANY group passes, the overall result is True (OR between groups)
-        details = []
-        for group_name, group_preds in groups.items():
-            group_passed = True
-            for pred in group_preds:
-                attr_value = technical_attributes.get(pred.attribute_name)
-                if attr_value is None:
-                    # Missing attribute -> group fails
-                    group_passed = False
-                    details.append({
-                        "group": group_name,
-                        "attribute": pred.attribute_name,
-                        "supplied_value": None,
-                        "threshold_min": float(pred.threshold_min) if pred.threshold_min else None,
-                        "threshold_max": float(pred.threshold_max) if pred.threshold_max else None,
-                        "passed": False,
-                        "reason": "attribute not supplied"
-                    })
-                else:
-                    passed = pred.evaluate(float(attr_value))
-                    if not passed:
-                        group_passed = False
-                    details.append({
-                        "group": group_name,
-                        "attribute": pred.attribute_name,
-                        "supplied_value": float(attr_value),
-                        "threshold_min": float(pred.threshold_min) if pred.threshold_min else None,
-                        "threshold_max": float(pred.threshold_max) if pred.threshold_max else None,
-                        "passed": passed,
-                    })
-
-            if group_passed:
-                # This group passed — return claim heading at 25%
-                first_pred = group_preds[0]
-                return {
-                    "predicate_evaluated": True,
-                    "predicate_passed": True,
-                    "claim_heading": first_pred.claim_heading_if_true,
-                    "duty_rate": float(first_pred.rate_if_true),
-                    "matched_group": group_name,
-                    "details": details,
-                }
-
-        # No group passed — return alternative heading at 0%
-        first_pred = matching[0]
-        return {
-            "predicate_evaluated": True,
-            "predicate_passed": False,
-            "claim_heading": first_pred.heading_if_false,
-            "duty_rate": float(first_pred.rate_if_false),
-            "matched_group": None,
-            "details": details,
-        }
+        # v22.0: Predicates compiled once per validity window and indexed by
+        # HTS prefix (app.services.semiconductor_predicates)
+        from app.services.semiconductor_predicates import get_semiconductor_predicate_engine
+        return get_semiconductor_predicate_engine().evaluate(
+            hts_8digit, technical_attributes, check_date
+        )
 
 
 # ============================================================================
 # v5.0: Country-Specific Rate Lookup Functions
 # ============================================================================
 
+@profiled_tool("get_country_group")
 def get_country_group(country: str, import_date: date = None) -> str:
     """
     v5.0: Map country to its group for rate lookups.
@@ -779,20 +996,27 @@ def get_country_group(country: str, import_date: date = None) -> str:
     Returns:
         Group ID: 'EU', 'UK', 'CN', 'USMCA', or 'default'
     """
-    app = get_flask_app()
-    with app.app_context():
+    with tool_app_context():
         models = get_models()
         CountryGroupMember = models["CountryGroupMember"]
 
         check_date = import_date or date.today()
 
+        resolver = get_active_country_resolver()
+        if resolver is not None:
+            return resolver.country_group(country, check_date)
+
         # Query country_group_members for this country
-        member = CountryGroupMember.query.filter(
-            CountryGroupMember.country_code == country,
-            CountryGroupMember.effective_date <= check_date,
-            (CountryGroupMember.expiration_date.is_(None)) |
-            (CountryGroupMember.expiration_date > check_date)
-        ).first()
+        snapshot = get_active_rule_snapshot()
+        if snapshot is not None:
+            member = snapshot.country_group_member(country, check_date)
+        else:
+            member = CountryGroupMember.query.filter(
+                CountryGroupMember.country_code == country,
+                CountryGroupMember.effective_date <= check_date,
+                (CountryGroupMember.expiration_date.is_(None)) |
+                (CountryGroupMember.expiration_date > check_date)
+            ).first()
 
         if member:
             return member.group_id
@@ -801,6 +1025,7 @@ def get_country_group(country: str, import_date: date = None) -> str:
         return "default"
 
 
+@profiled_tool("get_mfn_base_rate")
 def get_mfn_base_rate(hts_code: str, import_date: date = None) -> float:
     """
     v5.0: Look up MFN Column 1 base rate for an HTS code.
@@ -821,13 +1046,23 @@ def get_mfn_base_rate(hts_code: str, import_date: date = None) -> float:
     Returns:
         MFN rate as decimal (0.026 = 2.6%). Returns 0.0 if not found.
     """
-    app = get_flask_app()
-    with app.app_context():
+    return shared_lookup("mfn_base_rate", (hts_code, import_date),
+                         lambda: _get_mfn_base_rate_uncached(hts_code, import_date))
+
+
+def _get_mfn_base_rate_uncached(hts_code: str, import_date: date = None) -> float:
+    """get_mfn_base_rate() lookup without batch memoization."""
+    with tool_app_context():
         models = get_models()
         HtsBaseRate = models["HtsBaseRate"]
 
         check_date = import_date or date.today()
         hts_clean = hts_code.replace(".", "")
+        snapshot = get_active_rule_snapshot()
+        if snapshot is not None:
+            # v22.0: One prefix-trie walk covers every length and both forms
+            rate = snapshot.mfn_base_rate(hts_clean, check_date)
+            return float(rate.column1_rate) if rate else 0.0
 
         # Try progressively shorter prefixes (longest match wins)
         # 10 digits, 8 digits, 6 digits, 4 digits
@@ -869,6 +1104,7 @@ def get_mfn_base_rate(hts_code: str, import_date: date = None) -> float:
         return 0.0
 
 
+@profiled_tool("get_rate_for_program")
 def get_rate_for_program(
     program_id: str,
     country: str,
@@ -884,6 +1120,8 @@ def get_rate_for_program(
 
     Formulas supported:
     - '15pct_minus_mfn': 15% minus MFN base rate (EU ceiling rule)
+    - v22.0: with USE_RATE_RESOLVER, expressions over mfn such as
+      'max(0, 15% - mfn)' (see app.services.rate_formula)
 
     Args:
         program_id: Program ID (e.g., 'section_232_steel', 'ieepa_reciprocal')
@@ -896,8 +1134,7 @@ def get_rate_for_program(
         - rate: Duty rate as decimal (0.50 = 50%)
         - rate_source: Description of where rate came from
     """
-    app = get_flask_app()
-    with app.app_context():
+    with tool_app_context():
         models = get_models()
         ProgramRate = models["ProgramRate"]
 
@@ -906,9 +1143,27 @@ def get_rate_for_program(
         # Get country group
         group_id = get_country_group(country, check_date)
 
-        # Try specific group first, then 'default'
+        # v22.0: Compiled formulas (tries the group, then 'default', then the
+        # legacy ProgramCode rate); get_rates_for_program() primes the memo
+        resolver = get_active_program_rate_resolver()
+        if resolver is not None:
+            return shared_lookup(
+                "program_rate", (program_id, group_id, hts_code, check_date),
+                lambda: resolver.evaluate(
+                    program_id, group_id, hts_code, check_date,
+                    mfn_lookup=lambda code: get_mfn_base_rate(code, check_date),
+                ),
+            )
+
+        # Look up rate for this program/group
+        snapshot = get_active_rule_snapshot()
         rate_record = None
         for try_group in [group_id, 'default']:
+            if snapshot is not None:
+                rate_record = snapshot.program_rate(program_id, try_group, check_date)
+                if rate_record:
+                    break
+                continue
             rate_record = ProgramRate.query.filter(
                 ProgramRate.program_id == program_id,
                 ProgramRate.group_id == try_group,
@@ -916,17 +1171,23 @@ def get_rate_for_program(
                 (ProgramRate.expiration_date.is_(None)) |
                 (ProgramRate.expiration_date > check_date)
             ).order_by(ProgramRate.effective_date.desc()).first()
-
             if rate_record:
                 break
 
         if not rate_record:
-            # Fallback to old behavior - look up from ProgramCode
-            models = get_models()
+            # Fallback to program_codes table (legacy)
             ProgramCode = models["ProgramCode"]
-            code = ProgramCode.query.filter_by(program_id=program_id, action="apply").first()
-            if code:
-                code = ProgramCode.query.filter_by(program_id=program_id).first()
+            if snapshot is not None:
+                code = snapshot.program_code(program_id, action="apply", match_variant=False)
+                if code:
+                    code = snapshot.program_code(program_id, match_variant=False)
+            else:
+                code = ProgramCode.query.filter_by(
+                    program_id=program_id,
+                    action="apply"
+                ).first()
+                if code:
+                    code = ProgramCode.query.filter_by(program_id=program_id).first()
             if code and code.duty_rate:
                 return (float(code.duty_rate), "legacy_program_code")
             return (0.0, "no_rate_found")
@@ -934,22 +1195,82 @@ def get_rate_for_program(
         # Handle formula-based rates
         if rate_record.rate_type == 'formula':
             if rate_record.rate_formula == '15pct_minus_mfn':
-                # EU 15% ceiling rule
+                # EU 15% ceiling rule: rate = max(0, 15% - MFN base rate)
                 base_mfn = get_mfn_base_rate(hts_code, check_date)
                 rate = max(0.0, 0.15 - base_mfn)
                 return (rate, f"EU 15% ceiling: 15% - {base_mfn*100:.1f}% MFN = {rate*100:.1f}%")
             else:
-                # Unknown formula - return 0 with warning
+                # Unknown formula - return 0 and flag
                 return (0.0, f"unknown_formula:{rate_record.rate_formula}")
 
         # Fixed rate
         if rate_record.rate is not None:
-            used_group = rate_record.group_id
-            return (float(rate_record.rate), f"fixed_rate_{used_group}")
+            return (float(rate_record.rate), f"fixed_rate_{rate_record.group_id}")
         else:
             return (0.0, "rate_is_null")
 
 
+@profiled_tool("get_rates_for_program")
+def get_rates_for_program(
+    program_id: str,
+    country: str,
+    hts_codes: List[str],
+    import_date: date = None
+) -> tuple:
+    """
+    v22.0: get_rate_for_program() for many HTS codes of one country.
+
+    With USE_RATE_RESOLVER the country group is resolved once, each distinct
+    HTS code's MFN base rate is looked up once, a formula is evaluated over
+    the whole array, and inside shared_lookups() the results prime the
+    memo that get_rate_for_program() reads. Otherwise each code is looked up
+    with get_rate_for_program().
+
+    Returns:
+        Tuple of (rates: numpy array aligned with hts_codes, rate_sources: list)
+    """
+    import numpy as np
+
+    with tool_app_context():
+        check_date = import_date or date.today()
+        resolver = get_active_program_rate_resolver()
+        if resolver is None:
+            results = [get_rate_for_program(program_id, country, code, check_date) for code in hts_codes]
+            return np.array([rate for rate, _ in results], dtype=float), [source for _, source in results]
+
+        group_id = get_country_group(country, check_date)
+        rates, sources = resolver.evaluate_many(
+            program_id, group_id, hts_codes, check_date,
+            mfn_lookup=lambda code: get_mfn_base_rate(code, check_date),
+        )
+        memo = getattr(_batch_lookups, "memo", None)
+        if memo is not None:
+            for code, rate, source in zip(hts_codes, rates.tolist(), sources):
+                memo.setdefault(("program_rate", (program_id, group_id, code, check_date)), (rate, source))
+        return rates, sources
+
+
+def prefetch_program_rates(country: str, hts_codes: List[str], import_date: Optional[str] = None) -> None:
+    """
+    v22.0: Rate every program with program_rates rows for many HTS codes of
+    one country, one get_rates_for_program() call per program.
+
+    Only useful inside shared_lookups(), where the rates are memoized for
+    the calculations that follow. A no-op unless USE_RATE_RESOLVER is set.
+
+    Args:
+        import_date: Import date (YYYY-MM-DD) the calculations will use
+    """
+    with tool_app_context():
+        resolver = get_active_program_rate_resolver()
+        if resolver is None or not hts_codes:
+            return
+        check_date = date.fromisoformat(import_date) if import_date else date.today()
+        codes = list(dict.fromkeys(hts_codes))
+        for program_id in resolver.program_ids():
+            get_rates_for_program(program_id, country, codes, check_date)
+
+
 # ============================================================================
 # Tool 0: Ensure Materials
 # ============================================================================
@@ -959,29 +1280,15 @@ def get_rate_for_program(
 MATERIALS_REQUIRING_USER_INPUT = {"copper", "steel", "aluminum"}
 
 
-@tool
-def ensure_materials(hts_code: str, product_description: str, known_materials: Optional[str] = None) -> str:
+@profiled_tool("ensure_materials")
+def ensure_materials_data(hts_code: str, product_description: str, known_materials: Optional[dict] = None) -> dict:
     """
-    Determine if material composition is needed for this HTS code.
-
-    Call this early in the stacking process to identify what material
-    information we need from the user (if any).
-
-    IMPORTANT: Only metals (copper, steel, aluminum) require user input for
-    material percentage. Other Section 232 materials like semiconductors and
-    auto parts apply to the FULL product value automatically.
-
-    Args:
-        hts_code: The 10-digit HTS code
-        product_description: Description of the product
-        known_materials: JSON string of known materials {"copper": 0.05, "steel": 0.20}
-                        or None if unknown
+    v22.0: Dict-native ensure_materials for the stacking graph.
 
-    Returns:
-        JSON with materials_needed flag and suggested questions
+    known_materials is the parsed composition dict; None means unknown and
+    {} means the user has no Section 232 metals to claim.
     """
-    app = get_flask_app()
-    with app.app_context():
+    with tool_app_context():
         models = get_models()
         Section232Material = models["Section232Material"]
         ProductHistory = models["ProductHistory"]
@@ -989,14 +1296,18 @@ def ensure_materials(hts_code: str, product_description: str, known_materials: O
         hts_8digit = hts_code.replace(".", "")[:8]
 
         # Check if any Section 232 materials apply to this HTS
-        materials = Section232Material.query.filter_by(hts_8digit=hts_8digit).all()
+        snapshot = get_active_rule_snapshot()
+        if snapshot is not None:
+            materials = list(snapshot.section_232_materials(hts_8digit))
+        else:
+            materials = Section232Material.query.filter_by(hts_8digit=hts_8digit).all()
 
         if not materials:
-            return json.dumps({
+            return {
                 "materials_needed": False,
                 "reason": f"No Section 232 materials apply to HTS {hts_8digit}",
                 "materials": known_materials or {}
-            })
+            }
 
         # All materials that apply to this HTS
         all_applicable = [m.material for m in materials]
@@ -1007,45 +1318,42 @@ def ensure_materials(hts_code: str, product_description: str, known_materials: O
 
         # If no metals apply, no user input needed
         if not applicable_materials:
-            return json.dumps({
+            return {
                 "materials_needed": False,
                 "reason": f"Section 232 materials ({', '.join(all_applicable)}) apply to full product - no user input needed",
                 "materials": {},
                 "full_product_materials": all_applicable
-            })
+            }
 
-        if known_materials:
-            try:
-                parsed = json.loads(known_materials) if isinstance(known_materials, str) else known_materials
-
-                # FIX: If user explicitly passed empty dict {}, they're saying "no 232 metals to claim"
-                # This is a valid answer - proceed without 232 claims as a full product
-                if isinstance(parsed, dict) and len(parsed) == 0:
-                    return json.dumps({
-                        "materials_needed": False,
-                        "reason": "User indicated no Section 232 materials to claim",
-                        "materials": {},
-                        "explicit_no_claim": True
-                    })
-
-                # Check if we have info for all applicable materials
-                missing = [m for m in applicable_materials if m not in parsed]
-                if not missing:
-                    return json.dumps({
-                        "materials_needed": False,
-                        "reason": "All material composition known",
-                        "materials": parsed
-                    })
-                return json.dumps({
-                    "materials_needed": True,
-                    "reason": f"Missing composition for: {', '.join(missing)}",
-                    "applicable_materials": applicable_materials,
-                    "known_materials": parsed,
-                    "missing_materials": missing,
-                    "suggested_question": f"What percentage of this product is {', '.join(missing)}?"
-                })
-            except json.JSONDecodeError:
-                pass
+        if known_materials is not None:
+            parsed = known_materials
+
+            # FIX: If user explicitly passed empty dict {}, they're saying "no 232 metals to claim"
+            # This is a valid answer - proceed without 232 claims as a full product
+            if isinstance(parsed, dict) and len(parsed) == 0:
+                return {
+                    "materials_needed": False,
+                    "reason": "User indicated no Section 232 materials to claim",
+                    "materials": {},
+                    "explicit_no_claim": True
+                }
+
+            # Check if we have info for all applicable materials
+            missing = [m for m in applicable_materials if m not in parsed]
+            if not missing:
+                return {
+                    "materials_needed": False,
+                    "reason": "All material composition known",
+                    "materials": parsed
+                }
+            return {
+                "materials_needed": True,
+                "reason": f"Missing composition for: {', '.join(missing)}",
+                "applicable_materials": applicable_materials,
+                "known_materials": parsed,
+                "missing_materials": missing,
+                "suggested_question": f"What percentage of this product is {', '.join(missing)}?"
+            }
 
         # Check product history for similar products
         history = ProductHistory.query.filter_by(hts_code=hts_code).order_by(
@@ -1053,46 +1361,59 @@ def ensure_materials(hts_code: str, product_description: str, known_materials: O
         ).first()
 
         if history and history.components and history.user_confirmed:
-            return json.dumps({
+            return {
                 "materials_needed": False,
                 "reason": "Found composition in product history",
                 "materials": history.components,
                 "from_history": True
-            })
+            }
 
-        return json.dumps({
+        return {
             "materials_needed": True,
             "applicable_materials": applicable_materials,
             "suggested_question": f"What is the material composition of this product? Specifically: {', '.join(applicable_materials)} (as percentages)",
             "from_history": False
-        })
-
+        }
 
-# ============================================================================
-# Tool 1: Get Applicable Programs
-# ============================================================================
 
 @tool
-def get_applicable_programs(country: str, hts_code: str, import_date: Optional[str] = None) -> str:
+def ensure_materials(hts_code: str, product_description: str, known_materials: Optional[str] = None) -> str:
     """
-    Query tariff_programs table to find what programs might apply.
+    Determine if material composition is needed for this HTS code.
 
-    This is the ENTRY POINT for tariff stacking - call this first to get
-    the list of programs to check, ordered by filing_sequence.
+    Call this early in the stacking process to identify what material
+    information we need from the user (if any).
+
+    IMPORTANT: Only metals (copper, steel, aluminum) require user input for
+    material percentage. Other Section 232 materials like semiconductors and
+    auto parts apply to the FULL product value automatically.
 
     Args:
-        country: Country of origin (e.g., "China", "Mexico")
-        hts_code: The 10-digit HTS code (e.g., "8544.42.9090")
-        import_date: Date of import in YYYY-MM-DD format (defaults to today)
+        hts_code: The 10-digit HTS code
+        product_description: Description of the product
+        known_materials: JSON string of known materials {"copper": 0.05, "steel": 0.20}
+                        or None if unknown
 
     Returns:
-        JSON list of applicable programs with check_type, condition_handler, etc.
+        JSON with materials_needed flag and suggested questions
     """
-    app = get_flask_app()
-    with app.app_context():
-        models = get_models()
-        TariffProgram = models["TariffProgram"]
+    parsed = None
+    if known_materials:
+        try:
+            parsed = json.loads(known_materials) if isinstance(known_materials, str) else known_materials
+        except json.JSONDecodeError:
+            pass  # Unparseable input is treated as unknown composition
+    return json.dumps(ensure_materials_data(hts_code, product_description, parsed))
+
+
+# ============================================================================
+# Tool 1: Get Applicable Programs
+# ============================================================================
 
+@profiled_tool("get_applicable_programs")
+def get_applicable_programs_data(country: str, hts_code: str, import_date: Optional[str] = None) -> dict:
+    """v22.0: Programs that may apply to country/HTS, ordered by filing_sequence."""
+    with tool_app_context():
         check_date = date.fromisoformat(import_date) if import_date else date.today()
 
         # v14.0: Normalize country to ISO code for proper tariff_programs lookup
@@ -1100,70 +1421,143 @@ def get_applicable_programs(country: str, hts_code: str, import_date: Optional[s
         normalized = normalize_country(country)
         country_iso = normalized.get("iso_alpha2") or country
 
-        # Query programs that apply to this country or ALL countries
-        programs = TariffProgram.query.filter(
-            (TariffProgram.country == country_iso) | (TariffProgram.country == "ALL"),
-            TariffProgram.effective_date <= check_date,
-            (TariffProgram.expiration_date.is_(None)) | (TariffProgram.expiration_date > check_date)
-        ).order_by(TariffProgram.filing_sequence).all()
+        # v22.0: Served from the applicability matrix when enabled
+        matrix = get_active_applicability_matrix()
+        if matrix is not None:
+            result = matrix.materialize("programs", country_iso, check_date,
+                                        lambda: _applicable_program_rows(country_iso, check_date))
+        else:
+            result = _applicable_program_rows(country_iso, check_date)
 
-        if not programs:
-            return json.dumps({
+        if not result:
+            return {
                 "programs": [],
                 "message": f"No tariff programs found for {country}"
-            })
-
-        result = []
-        for p in programs:
-            result.append({
-                "program_id": p.program_id,
-                "program_name": p.program_name,
-                "country": p.country,
-                "check_type": p.check_type,
-                "condition_handler": p.condition_handler,
-                "condition_param": p.condition_param,
-                "inclusion_table": p.inclusion_table,
-                "exclusion_table": p.exclusion_table,
-                "filing_sequence": p.filing_sequence,
-                # v4.0: Include calculation_sequence for duty math order
-                "calculation_sequence": p.calculation_sequence or p.filing_sequence,
-                "source_document": p.source_document
-            })
+            }
 
-        return json.dumps({
+        return {
             "programs": result,
             "total": len(result),
             "country": country,
             "hts_code": hts_code,
             "import_date": check_date.isoformat()
-        })
+        }
 
 
-# ============================================================================
-# Tool 2: Check Program Inclusion
-# ============================================================================
+def _applicable_program_rows(country_iso: str, check_date: date) -> list:
+    """Program dicts for a country (or ALL) active on check_date. Must be called inside an app context."""
+    TariffProgram = get_models()["TariffProgram"]
+
+    # Query programs that apply to this country or ALL countries
+    snapshot = get_active_rule_snapshot()
+    if snapshot is not None:
+        programs = snapshot.programs_for_country(country_iso, check_date)
+    else:
+        from app.services.rule_snapshot import freeze_rows
+        programs = shared_lookup("programs", (country_iso, check_date), lambda: freeze_rows(
+            TariffProgram,
+            TariffProgram.query.filter(
+                (TariffProgram.country == country_iso) | (TariffProgram.country == "ALL"),
+                TariffProgram.effective_date <= check_date,
+                (TariffProgram.expiration_date.is_(None)) | (TariffProgram.expiration_date > check_date)
+            ).order_by(TariffProgram.filing_sequence).all()
+        ))
+
+    result = []
+    for p in programs:
+        result.append({
+            "program_id": p.program_id,
+            "program_name": p.program_name,
+            "country": p.country,
+            "check_type": p.check_type,
+            "condition_handler": p.condition_handler,
+            "condition_param": p.condition_param,
+            "inclusion_table": p.inclusion_table,
+            "exclusion_table": p.exclusion_table,
+            "filing_sequence": p.filing_sequence,
+            # v4.0: Include calculation_sequence for duty math order
+            "calculation_sequence": p.calculation_sequence or p.filing_sequence,
+            "source_document": p.source_document
+        })
+    return result
+
 
 @tool
-def check_program_inclusion(program_id: str, hts_code: str, as_of_date: str = None, technical_attributes: str = None) -> str:
+def get_applicable_programs(country: str, hts_code: str, import_date: Optional[str] = None) -> str:
     """
-    Check if an HTS code is included in a specific tariff program.
+    Query tariff_programs table to find what programs might apply.
 
-    This is a generic checker that works for ANY program by looking up
-    the appropriate inclusion table.
+    This is the ENTRY POINT for tariff stacking - call this first to get
+    the list of programs to check, ordered by filing_sequence.
 
     Args:
-        program_id: The program to check (e.g., "section_301", "section_232_copper")
-        hts_code: The 10-digit HTS code
-        as_of_date: Optional date string (YYYY-MM-DD) for temporal lookup. Defaults to today.
-        technical_attributes: Optional JSON string with semiconductor technical attributes
-            (e.g., '{"transistor_processing_power": 15000, "dram_bandwidth": 4700}')
-            Used only for section_232_semiconductor predicate evaluation per CSMS #67400472.
+        country: Country of origin (e.g., "China", "Mexico")
+        hts_code: The 10-digit HTS code (e.g., "8544.42.9090")
+        import_date: Date of import in YYYY-MM-DD format (defaults to today)
 
     Returns:
-        JSON with inclusion result, Chapter 99 code, duty rate, and source info
+        JSON list of applicable programs with check_type, condition_handler, etc.
     """
-    app = get_flask_app()
-    with app.app_context():
+    return json.dumps(get_applicable_programs_data(country, hts_code, import_date))
+
+
+# ============================================================================
+# Tool 2: Check Program Inclusion
+# ============================================================================
+
+@profiled_tool("check_program_inclusion")
+def check_program_inclusion_data(program_id: str, hts_code: str, as_of_date: str = None,
+                                 technical_attributes: Optional[dict] = None) -> dict:
+    """
+    v22.0: Inclusion result for one program as a dict.
+
+    technical_attributes may also be the raw JSON string from the tool; a
+    malformed value is reported in predicate_evaluation.
+
+    Inclusion does not depend on the country, so inside shared_lookups() it
+    is resolved once per (program, HTS, date, attributes).
+    """
+    if isinstance(technical_attributes, dict):
+        attributes_key = json.dumps(technical_attributes, sort_keys=True, default=str)
+    else:
+        attributes_key = technical_attributes
+    return copy.deepcopy(shared_lookup(
+        "program_inclusion", (program_id, hts_code, as_of_date, attributes_key),
+        lambda: _check_program_inclusion_uncached(program_id, hts_code, as_of_date, technical_attributes),
+    ))
+
+
+def _check_program_inclusion_uncached(program_id: str, hts_code: str, as_of_date: str = None,
+                                      technical_attributes: Optional[dict] = None) -> dict:
+    """check_program_inclusion_data() lookup without batch memoization."""
+    # v22.0: Served from the applicability matrix when enabled. Semiconductor
+    # predicate results depend on the attributes and are always computed live.
+    if not technical_attributes:
+        with tool_app_context():
+            matrix = get_active_applicability_matrix()
+            lookup_date = _inclusion_lookup_date(as_of_date)
+            if matrix is not None and lookup_date is not None:
+                return matrix.materialize(
+                    "inclusion", (hts_code.replace(".", "").strip(), program_id), lookup_date,
+                    lambda: _check_program_inclusion_live(program_id, hts_code, as_of_date, technical_attributes),
+                )
+    return _check_program_inclusion_live(program_id, hts_code, as_of_date, technical_attributes)
+
+
+def _inclusion_lookup_date(as_of_date: Optional[str]) -> Optional[date]:
+    """Date the inclusion lookup resolves as_of_date to; None if it is malformed."""
+    if not as_of_date:
+        return date.today()
+    try:
+        return datetime.strptime(as_of_date, "%Y-%m-%d").date()
+    except (ValueError, TypeError):
+        return None
+
+
+def _check_program_inclusion_live(program_id: str, hts_code: str, as_of_date: str = None,
+                                  technical_attributes: Optional[dict] = None) -> dict:
+    """check_program_inclusion_data() lookup without the applicability matrix."""
+    with tool_app_context():
         models = get_models()
         TariffProgram = models["TariffProgram"]
         Section301Inclusion = models["Section301Inclusion"]
@@ -1171,14 +1565,18 @@ def check_program_inclusion(program_id: str, hts_code: str, as_of_date: str = No
         Section232Material = models["Section232Material"]
 
         hts_8digit = hts_code.replace(".", "")[:8]
+        snapshot = get_active_rule_snapshot()
 
         # Get program info
-        program = TariffProgram.query.filter_by(program_id=program_id).first()
+        if snapshot is not None:
+            program = snapshot.program(program_id)
+        else:
+            program = TariffProgram.query.filter_by(program_id=program_id).first()
         if not program:
-            return json.dumps({
+            return {
                 "included": False,
                 "error": f"Unknown program: {program_id}"
-            })
+            }
 
         # Programs with check_type="always" still need rate lookup from ieepa_rates
         if program.check_type == "always":
@@ -1198,14 +1596,17 @@ def check_program_inclusion(program_id: str, hts_code: str, as_of_date: str = No
                     program_type = "fentanyl" if program_id == "ieepa_fentanyl" else "reciprocal"
 
                     # Query ieepa_rates for this program type (active rate as of lookup_date)
-                    rate = IeepaRate.query.filter(
-                        IeepaRate.program_type == program_type,
-                        IeepaRate.effective_start <= lookup_date,
-                        (IeepaRate.effective_end.is_(None) | (IeepaRate.effective_end > lookup_date))
-                    ).order_by(IeepaRate.effective_start.desc()).first()
+                    if snapshot is not None:
+                        rate = snapshot.latest_ieepa_rate(program_type, lookup_date)
+                    else:
+                        rate = IeepaRate.query.filter(
+                            IeepaRate.program_type == program_type,
+                            IeepaRate.effective_start <= lookup_date,
+                            (IeepaRate.effective_end.is_(None) | (IeepaRate.effective_end > lookup_date))
+                        ).order_by(IeepaRate.effective_start.desc()).first()
 
                     if rate:
-                        return json.dumps({
+                        return {
                             "included": True,
                             "program_id": program_id,
                             "chapter_99_code": rate.chapter_99_code,
@@ -1213,15 +1614,15 @@ def check_program_inclusion(program_id: str, hts_code: str, as_of_date: str = No
                             "check_type": "always",
                             "variant": rate.variant,
                             "effective_start": rate.effective_start.isoformat() if rate.effective_start else None
-                        })
+                        }
 
             # Fallback for other "always" programs or if no rate found
-            return json.dumps({
+            return {
                 "included": True,
                 "program_id": program_id,
                 "check_type": "always",
                 "reason": f"{program.program_name} applies to all qualifying imports"
-            })
+            }
 
         # Look up in the appropriate inclusion table
         if program.inclusion_table == "section_301_inclusions":
@@ -1240,10 +1641,13 @@ def check_program_inclusion(program_id: str, hts_code: str, as_of_date: str = No
 
             # Get the rate for this HTS code as of the lookup date
             # Uses role-based precedence: exclusions take priority over impose codes
-            rate = Section301Rate.get_rate_as_of(hts_8digit, lookup_date)
+            if snapshot is not None:
+                rate = snapshot.section_301_rate_as_of(hts_8digit, lookup_date)
+            else:
+                rate = Section301Rate.get_rate_as_of(hts_8digit, lookup_date)
 
             if rate:
-                return json.dumps({
+                return {
                     "included": True,
                     "program_id": program_id,
                     "hts_8digit": hts_8digit,
@@ -1254,7 +1658,7 @@ def check_program_inclusion(program_id: str, hts_code: str, as_of_date: str = No
                     "product_group": rate.product_group,
                     "sector": rate.sector,
                     "effective_start": rate.effective_start.isoformat() if rate.effective_start else None,
-                })
+                }
 
             # v17.0: No fallback - temporal table is single source of truth
             # If HTS not found in Section301Rate, it's not subject to Section 301
@@ -1275,12 +1679,15 @@ def check_program_inclusion(program_id: str, hts_code: str, as_of_date: str = No
                         lookup_date = date_type.today()
 
                     # Try temporal lookup
-                    rate = Section232Rate.get_rate_as_of(
-                        hts_8digit=hts_8digit,
-                        material=material,
-                        country_code=None,  # Use global rate
-                        as_of_date=lookup_date
-                    )
+                    if snapshot is not None:
+                        rate = snapshot.section_232_rate_as_of(hts_8digit, material, None, lookup_date)
+                    else:
+                        rate = Section232Rate.get_rate_as_of(
+                            hts_8digit=hts_8digit,
+                            material=material,
+                            country_code=None,  # Use global rate
+                            as_of_date=lookup_date
+                        )
                     if rate:
                         result_data = {
                             "included": True,
@@ -1317,17 +1724,20 @@ def check_program_inclusion(program_id: str, hts_code: str, as_of_date: str = No
                                     "reason": "Invalid technical_attributes format"
                                 }
 
-                        return json.dumps(result_data)
+                        return result_data
                 except Exception:
                     pass  # Fall through to static lookup
 
             # Fallback to static section_232_materials table
-            inclusion = Section232Material.query.filter_by(
-                hts_8digit=hts_8digit,
-                material=material
-            ).first()
+            if snapshot is not None:
+                inclusion = snapshot.section_232_material(hts_8digit, material)
+            else:
+                inclusion = Section232Material.query.filter_by(
+                    hts_8digit=hts_8digit,
+                    material=material
+                ).first()
             if inclusion:
-                return json.dumps({
+                return {
                     "included": True,
                     "program_id": program_id,
                     "hts_8digit": hts_8digit,
@@ -1338,39 +1748,46 @@ def check_program_inclusion(program_id: str, hts_code: str, as_of_date: str = No
                     "article_type": getattr(inclusion, 'article_type', 'content'),
                     "source_doc": inclusion.source_doc,
                     "temporal_lookup": False,  # v13.0: Static lookup
-                })
+                }
 
-        return json.dumps({
+        return {
             "included": False,
             "program_id": program_id,
             "hts_8digit": hts_8digit,
             "reason": f"HTS {hts_8digit} not found in {program.inclusion_table}"
-        })
-
+        }
 
-# ============================================================================
-# Tool 3: Check Program Exclusion
-# ============================================================================
 
 @tool
-def check_program_exclusion(program_id: str, hts_code: str, product_description: str, import_date: Optional[str] = None) -> str:
+def check_program_inclusion(program_id: str, hts_code: str, as_of_date: str = None, technical_attributes: str = None) -> str:
     """
-    Check if a product qualifies for an exclusion from a tariff program.
+    Check if an HTS code is included in a specific tariff program.
 
-    Uses semantic matching to compare product description against
-    exclusion descriptions in the database.
+    This is a generic checker that works for ANY program by looking up
+    the appropriate inclusion table.
 
     Args:
-        program_id: The program to check exclusions for
+        program_id: The program to check (e.g., "section_301", "section_232_copper")
         hts_code: The 10-digit HTS code
-        product_description: Description of the product for semantic matching
-        import_date: Date of import (to check if exclusion is still valid)
+        as_of_date: Optional date string (YYYY-MM-DD) for temporal lookup. Defaults to today.
+        technical_attributes: Optional JSON string with semiconductor technical attributes
+            (e.g., '{"transistor_processing_power": 15000, "dram_bandwidth": 4700}')
+            Used only for section_232_semiconductor predicate evaluation per CSMS #67400472.
 
     Returns:
-        JSON with exclusion result, match confidence, and source info
+        JSON with inclusion result, Chapter 99 code, duty rate, and source info
     """
-    app = get_flask_app()
-    with app.app_context():
+    return json.dumps(check_program_inclusion_data(program_id, hts_code, as_of_date, technical_attributes))
+
+
+# ============================================================================
+# Tool 3: Check Program Exclusion
+# ============================================================================
+
+@profiled_tool("check_program_exclusion")
+def check_program_exclusion_data(program_id: str, hts_code: str, product_description: str, import_date: Optional[str] = None) -> dict:
+    """v22.0: Best-matching active exclusion for the product, as a dict."""
+    with tool_app_context():
         models = get_models()
         TariffProgram = models["TariffProgram"]
         Section301Exclusion = models["Section301Exclusion"]
@@ -1379,12 +1796,16 @@ def check_program_exclusion(program_id: str, hts_code: str, product_description:
         check_date = date.fromisoformat(import_date) if import_date else date.today()
 
         # Get program info
-        program = TariffProgram.query.filter_by(program_id=program_id).first()
+        snapshot = get_active_rule_snapshot()
+        if snapshot is not None:
+            program = snapshot.program(program_id)
+        else:
+            program = TariffProgram.query.filter_by(program_id=program_id).first()
         if not program or not program.exclusion_table:
-            return json.dumps({
+            return {
                 "excluded": False,
                 "reason": f"No exclusion table for program {program_id}"
-            })
+            }
 
         # Look up potential exclusions
         if program.exclusion_table == "section_301_exclusions":
@@ -1396,13 +1817,13 @@ def check_program_exclusion(program_id: str, hts_code: str, product_description:
             )
 
             if not active_exclusions:
-                return json.dumps({
+                return {
                     "excluded": False,
                     "program_id": program_id,
                     "hts_8digit": hts_8digit,
                     "reason": "No active exclusions for this HTS code",
                     "expired_exclusions": 0
-                })
+                }
 
             # Check each exclusion for semantic match
             # For MVP, we do simple substring matching
@@ -1423,7 +1844,7 @@ def check_program_exclusion(program_id: str, hts_code: str, product_description:
                     best_match = exc
 
             if best_match and best_confidence > 0.3:  # Threshold for match
-                return json.dumps({
+                return {
                     "excluded": True,
                     "program_id": program_id,
                     "hts_8digit": hts_8digit,
@@ -1434,21 +1855,41 @@ def check_program_exclusion(program_id: str, hts_code: str, product_description:
                     "source_doc": f"Chapter 99 Note {best_match.note_bucket}",
                     "claim_heading": best_match.claim_ch99_heading,
                     "note": "Product description matches exclusion criteria"
-                })
+                }
 
-            return json.dumps({
+            return {
                 "excluded": False,
                 "program_id": program_id,
                 "hts_8digit": hts_8digit,
                 "reason": "Product does not match any active exclusion descriptions",
                 "active_exclusions_checked": len(active_exclusions),
                 "best_confidence": round(best_confidence, 2) if best_confidence > 0 else None
-            })
+            }
 
-        return json.dumps({
+        return {
             "excluded": False,
             "reason": f"Unknown exclusion table: {program.exclusion_table}"
-        })
+        }
+
+
+@tool
+def check_program_exclusion(program_id: str, hts_code: str, product_description: str, import_date: Optional[str] = None) -> str:
+    """
+    Check if a product qualifies for an exclusion from a tariff program.
+
+    Uses semantic matching to compare product description against
+    exclusion descriptions in the database.
+
+    Args:
+        program_id: The program to check exclusions for
+        hts_code: The 10-digit HTS code
+        product_description: Description of the product for semantic matching
+        import_date: Date of import (to check if exclusion is still valid)
+
+    Returns:
+        JSON with exclusion result, match confidence, and source info
+    """
+    return json.dumps(check_program_exclusion_data(program_id, hts_code, product_description, import_date))
 
 
 # ============================================================================
@@ -1493,50 +1934,38 @@ def should_split_lines(total_value: float, content_value: float,
 # Tool 4: Check Material Composition (Phase 6 Updated)
 # ============================================================================
 
-@tool
-def check_material_composition(hts_code: str, materials: str, product_value: float = None) -> str:
-    """
-    Check Section 232 material requirements for an HTS code.
-
-    Phase 6 Update (Dec 2025):
-    - Now accepts material VALUES in addition to percentages
-    - Generates line splitting info for content-value-based duties
-    - Returns content_value, non_content_value for split filing lines
+@profiled_tool("check_material_composition")
+def check_material_composition_data(hts_code: str, materials: dict, product_value: float = None) -> dict:
+    """v22.0: Claim/disclaim and line split info per 232 material, from a composition dict."""
+    materials_key = json.dumps(materials, sort_keys=True, default=str)
+    return copy.deepcopy(shared_lookup(
+        "material_composition", (hts_code, materials_key, product_value),
+        lambda: _check_material_composition_uncached(hts_code, materials, product_value),
+    ))
 
-    Args:
-        hts_code: The 10-digit HTS code
-        materials: JSON string of material composition. Supports two formats:
-            - Simple: {"copper": 0.05, "steel": 0.20, "aluminum": 0.72}
-            - With values: {"copper": {"percentage": 0.05, "value": 500.00}, ...}
-        product_value: Total product value in USD (required for content-value calculations)
 
-    Returns:
-        JSON with claim/disclaim decision, line split info, and content values
-    """
-    app = get_flask_app()
-    with app.app_context():
+def _check_material_composition_uncached(hts_code: str, materials: dict, product_value: float = None) -> dict:
+    """check_material_composition_data() lookup without batch memoization."""
+    with tool_app_context():
         models = get_models()
         Section232Material = models["Section232Material"]
 
         hts_8digit = hts_code.replace(".", "")[:8]
-
-        try:
-            composition = json.loads(materials) if isinstance(materials, str) else materials
-        except json.JSONDecodeError:
-            return json.dumps({
-                "error": "Invalid materials JSON format",
-                "expected": '{"copper": 0.05, "steel": 0.20, "aluminum": 0.72} or {"copper": {"percentage": 0.05, "value": 500.00}}'
-            })
+        composition = materials
 
         # Get all 232 materials that apply to this HTS
-        applicable = Section232Material.query.filter_by(hts_8digit=hts_8digit).all()
+        snapshot = get_active_rule_snapshot()
+        if snapshot is not None:
+            applicable = list(snapshot.section_232_materials(hts_8digit))
+        else:
+            applicable = Section232Material.query.filter_by(hts_8digit=hts_8digit).all()
 
         if not applicable:
-            return json.dumps({
+            return {
                 "has_232_materials": False,
                 "hts_8digit": hts_8digit,
                 "reason": "No Section 232 materials apply to this HTS code"
-            })
+            }
 
         results = []
         any_claims = False
@@ -1630,64 +2059,75 @@ def check_material_composition(hts_code: str, materials: str, product_value: flo
                 "article_type": article_type,
             })
 
-        return json.dumps({
+        return {
             "has_232_materials": True,
             "hts_8digit": hts_8digit,
             "composition": composition,
             "materials": results,
             "any_claims": any_claims,
             "product_value": product_value
-        })
+        }
 
 
-# ============================================================================
-# Tool 5: Resolve Program Dependencies
-# ============================================================================
-
 @tool
-def resolve_program_dependencies(program_id: str, previous_results: str) -> str:
+def check_material_composition(hts_code: str, materials: str, product_value: float = None) -> str:
     """
-    Resolve conditional program logic based on other program results.
-
-    For programs with condition_handler='handle_dependency', this determines
-    the appropriate action based on results from dependent programs.
+    Check Section 232 material requirements for an HTS code.
 
-    Example: IEEPA Reciprocal depends on Section 232 claims.
-    - If any 232 claims exist -> action = "paid"
-    - Else -> action = "disclaim"
+    Phase 6 Update (Dec 2025):
+    - Now accepts material VALUES in addition to percentages
+    - Generates line splitting info for content-value-based duties
+    - Returns content_value, non_content_value for split filing lines
 
     Args:
-        program_id: The program to resolve (e.g., "ieepa_reciprocal")
-        previous_results: JSON string with results from previous programs
+        hts_code: The 10-digit HTS code
+        materials: JSON string of material composition. Supports two formats:
+            - Simple: {"copper": 0.05, "steel": 0.20, "aluminum": 0.72}
+            - With values: {"copper": {"percentage": 0.05, "value": 500.00}, ...}
+        product_value: Total product value in USD (required for content-value calculations)
 
     Returns:
-        JSON with resolved action and Chapter 99 code
+        JSON with claim/disclaim decision, line split info, and content values
     """
-    app = get_flask_app()
-    with app.app_context():
+    try:
+        composition = json.loads(materials) if isinstance(materials, str) else materials
+    except json.JSONDecodeError:
+        return json.dumps({
+            "error": "Invalid materials JSON format",
+            "expected": '{"copper": 0.05, "steel": 0.20, "aluminum": 0.72} or {"copper": {"percentage": 0.05, "value": 500.00}}'
+        })
+    return json.dumps(check_material_composition_data(hts_code, composition, product_value))
+
+
+# ============================================================================
+# Tool 5: Resolve Program Dependencies
+# ============================================================================
+
+@profiled_tool("resolve_program_dependencies")
+def resolve_program_dependencies_data(program_id: str, previous_results: dict) -> dict:
+    """v22.0: Dependency-resolved action for a program, given {program_id: result} dicts."""
+    with tool_app_context():
         models = get_models()
         TariffProgram = models["TariffProgram"]
         ProgramCode = models["ProgramCode"]
 
-        program = TariffProgram.query.filter_by(program_id=program_id).first()
+        snapshot = get_active_rule_snapshot()
+        if snapshot is not None:
+            program = snapshot.program(program_id)
+        else:
+            program = TariffProgram.query.filter_by(program_id=program_id).first()
         if not program:
-            return json.dumps({
+            return {
                 "error": f"Unknown program: {program_id}"
-            })
+            }
 
         if program.condition_handler != "handle_dependency":
-            return json.dumps({
+            return {
                 "error": f"Program {program_id} does not use dependency handling",
                 "condition_handler": program.condition_handler
-            })
-
-        try:
-            results = json.loads(previous_results) if isinstance(previous_results, str) else previous_results
-        except json.JSONDecodeError:
-            return json.dumps({
-                "error": "Invalid previous_results JSON format"
-            })
+            }
 
+        results = previous_results
         dependency = program.condition_param  # e.g., "section_232"
 
         # Check if any 232 programs had claims
@@ -1709,14 +2149,17 @@ def resolve_program_dependencies(program_id: str, previous_results: str) -> str:
             reason = "No Section 232 claims, disclaim IEEPA reciprocal"
 
         # Get the output code for this action
-        code = ProgramCode.query.filter_by(program_id=program_id, action=action).first()
+        if snapshot is not None:
+            code = snapshot.program_code(program_id, action=action, match_variant=False)
+        else:
+            code = ProgramCode.query.filter_by(program_id=program_id, action=action).first()
 
         if not code:
-            return json.dumps({
+            return {
                 "error": f"No output code found for {program_id}/{action}"
-            })
+            }
 
-        return json.dumps({
+        return {
             "program_id": program_id,
             "dependency": dependency,
             "dependency_met": has_232_claims,
@@ -1725,40 +2168,56 @@ def resolve_program_dependencies(program_id: str, previous_results: str) -> str:
             "duty_rate": float(code.duty_rate) if code.duty_rate else 0,
             "reason": reason,
             "source_doc": code.source_doc
-        })
-
+        }
 
-# ============================================================================
-# Tool 6: Get Program Output (v4.0 Updated)
-# ============================================================================
 
 @tool
-def get_program_output(program_id: str, action: str, variant: Optional[str] = None, slice_type: str = "all") -> str:
+def resolve_program_dependencies(program_id: str, previous_results: str) -> str:
     """
-    Look up the output codes for a program decision.
+    Resolve conditional program logic based on other program results.
 
-    After determining what action to take (apply/claim/disclaim/paid/exempt),
-    use this to get the specific Chapter 99 code and duty rate.
+    For programs with condition_handler='handle_dependency', this determines
+    the appropriate action based on results from dependent programs.
 
-    v4.0 Update: Added variant and slice_type for precise code lookup.
-    - variant: 'taxable', 'annex_ii_exempt', 'metal_exempt', 'us_content_exempt'
-    - slice_type: 'all', 'non_metal', 'copper_slice', 'steel_slice', 'aluminum_slice'
+    Example: IEEPA Reciprocal depends on Section 232 claims.
+    - If any 232 claims exist -> action = "paid"
+    - Else -> action = "disclaim"
 
     Args:
-        program_id: The program (e.g., "section_301", "section_232_copper")
-        action: The action determined (e.g., "apply", "claim", "disclaim", "paid", "exempt")
-        variant: Optional variant for programs with multiple outcomes (e.g., IEEPA Reciprocal)
-        slice_type: Slice type for per-slice lookups (default "all")
+        program_id: The program to resolve (e.g., "ieepa_reciprocal")
+        previous_results: JSON string with results from previous programs
 
     Returns:
-        JSON with chapter_99_code, duty_rate, applies_to, variant, slice_type, and source info
+        JSON with resolved action and Chapter 99 code
     """
-    app = get_flask_app()
-    with app.app_context():
+    try:
+        results = json.loads(previous_results) if isinstance(previous_results, str) else previous_results
+    except json.JSONDecodeError:
+        return json.dumps({
+            "error": "Invalid previous_results JSON format"
+        })
+    return json.dumps(resolve_program_dependencies_data(program_id, results))
+
+
+# ============================================================================
+# Tool 6: Get Program Output (v4.0 Updated)
+# ============================================================================
+
+@profiled_tool("get_program_output")
+def get_program_output_data(program_id: str, action: str, variant: Optional[str] = None, slice_type: str = "all") -> dict:
+    """v22.0: Chapter 99 code and duty rate for a program decision, as a dict."""
+    with tool_app_context():
         models = get_models()
         ProgramCode = models["ProgramCode"]
 
         # v4.0: Query with variant and slice_type
+        snapshot = get_active_rule_snapshot()
+        if snapshot is not None:
+            code = snapshot.program_code(program_id, action, variant or None, slice_type)
+            if not code and slice_type != "all":
+                code = snapshot.program_code(program_id, action, variant or None, "all")
+            return _program_output_response(program_id, action, variant, slice_type, code)
+
         query = ProgramCode.query.filter_by(program_id=program_id, action=action)
 
         # Add variant filter if provided
@@ -1782,27 +2241,56 @@ def get_program_output(program_id: str, action: str, variant: Optional[str] = No
             query = query.filter_by(slice_type="all")
             code = query.first()
 
-        if not code:
-            return json.dumps({
-                "found": False,
-                "program_id": program_id,
-                "action": action,
-                "variant": variant,
-                "slice_type": slice_type,
-                "error": f"No output code found for {program_id}/{action}/{variant}/{slice_type}"
-            })
+        return _program_output_response(program_id, action, variant, slice_type, code)
 
-        return json.dumps({
-            "found": True,
+
+@tool
+def get_program_output(program_id: str, action: str, variant: Optional[str] = None, slice_type: str = "all") -> str:
+    """
+    Look up the output codes for a program decision.
+
+    After determining what action to take (apply/claim/disclaim/paid/exempt),
+    use this to get the specific Chapter 99 code and duty rate.
+
+    v4.0 Update: Added variant and slice_type for precise code lookup.
+    - variant: 'taxable', 'annex_ii_exempt', 'metal_exempt', 'us_content_exempt'
+    - slice_type: 'all', 'non_metal', 'copper_slice', 'steel_slice', 'aluminum_slice'
+
+    Args:
+        program_id: The program (e.g., "section_301", "section_232_copper")
+        action: The action determined (e.g., "apply", "claim", "disclaim", "paid", "exempt")
+        variant: Optional variant for programs with multiple outcomes (e.g., IEEPA Reciprocal)
+        slice_type: Slice type for per-slice lookups (default "all")
+
+    Returns:
+        JSON with chapter_99_code, duty_rate, applies_to, variant, slice_type, and source info
+    """
+    return json.dumps(get_program_output_data(program_id, action, variant, slice_type))
+
+
+def _program_output_response(program_id, action, variant, slice_type, code) -> dict:
+    """Build the get_program_output result for a ProgramCode lookup."""
+    if not code:
+        return {
+            "found": False,
             "program_id": program_id,
             "action": action,
-            "variant": code.variant,
-            "slice_type": code.slice_type,
-            "chapter_99_code": code.chapter_99_code,
-            "duty_rate": float(code.duty_rate) if code.duty_rate else 0,
-            "applies_to": code.applies_to,
-            "source_doc": code.source_doc
-        })
+            "variant": variant,
+            "slice_type": slice_type,
+            "error": f"No output code found for {program_id}/{action}/{variant}/{slice_type}"
+        }
+
+    return {
+        "found": True,
+        "program_id": program_id,
+        "action": action,
+        "variant": code.variant,
+        "slice_type": code.slice_type,
+        "chapter_99_code": code.chapter_99_code,
+        "duty_rate": float(code.duty_rate) if code.duty_rate else 0,
+        "applies_to": code.applies_to,
+        "source_doc": code.source_doc
+    }
 
 
 # ============================================================================
@@ -1828,67 +2316,33 @@ def compute_replay_key(hts_code, country, as_of_date, materials=None,
 
 # ============================================================================
 # Tool 7: Calculate Duties (Phase 6.5 Updated - IEEPA Unstacking)
-# ============================================================================
-
-@tool
-def calculate_duties(
-    filing_lines: str,
+# ============================================================================
+
+@profiled_tool("calculate_duties")
+def calculate_duties_data(
+    filing_lines: List[dict],
     product_value: float,
-    materials: Optional[str] = None,
+    materials: Optional[dict] = None,
     country: Optional[str] = None,
     hts_code: Optional[str] = None,
     import_date: Optional[str] = None
-) -> str:
+) -> dict:
     """
-    Calculate total duties based on all applicable programs.
-
-    Phase 6 Update (Dec 2025):
-    - Supports content-value-based duties (base_on='content_value')
-    - Calculates duty on material $ value instead of percentage
-    - Applies fallback to full_value if content value unknown
-    - Generates split filing lines for 232 materials
-
-    Phase 6.5 Update (Dec 2025) - IEEPA Unstacking:
-    - Tracks remaining_value after 232 content deductions
-    - 232 programs with base_effect='subtract_from_remaining' reduce the IEEPA base
-    - IEEPA Reciprocal with base_on='remaining_value' uses the reduced base
-    - This implements CBP rule: "Content subject to 232 is NOT subject to Reciprocal IEEPA"
-
-    v5.0 Update (Dec 2025) - Country-Specific Rates:
-    - Uses get_rate_for_program() to get country-specific rates
-    - Supports EU 15% ceiling rule (formula: 15% - MFN base rate)
-    - Supports UK 232 exception (25% instead of 50% for steel/aluminum)
-    - If country/hts_code not provided, falls back to rate from filing_lines
-
-    Args:
-        filing_lines: JSON string with list of filing lines from program decisions
-        product_value: The declared value of the product in USD
-        materials: JSON string of material composition. Supports:
-            - Simple: {"copper": 0.05, "steel": 0.20}
-            - With values: {"copper": {"percentage": 0.05, "value": 500.00}, ...}
-        country: v5.0 - Country of origin for rate lookup (optional)
-        hts_code: v5.0 - HTS code for MFN lookup in formulas (optional)
-        import_date: v5.0 - Import date (YYYY-MM-DD) for time-bounded lookups
+    v22.0: Duty calculation over filing line dicts.
 
-    Returns:
-        JSON with total duty calculation breakdown, including base_value, value_source,
-        rate_source (v5.0), and remaining_value tracking for IEEPA unstacking
+    Same breakdown as the calculate_duties tool, without the JSON round trip
+    per call. materials is the composition dict (None if unknown).
     """
-    app = get_flask_app()
-    with app.app_context():
+    with tool_app_context():
         models = get_models()
         DutyRule = models["DutyRule"]
 
-        try:
-            lines = json.loads(filing_lines) if isinstance(filing_lines, str) else filing_lines
-            composition = json.loads(materials) if materials and isinstance(materials, str) else (materials or {})
-        except json.JSONDecodeError as e:
-            return json.dumps({
-                "error": f"Invalid JSON: {str(e)}"
-            })
+        lines = filing_lines
+        composition = materials or {}
 
         # v5.0: Parse import_date for rate lookups
         check_date = date.fromisoformat(import_date) if import_date else date.today()
+        snapshot = get_active_rule_snapshot()
 
         # v5.0: Get country group for audit trail
         country_group = get_country_group(country, check_date) if country else None
@@ -1931,7 +2385,12 @@ def calculate_duties(
                     rate_sources[program_id] = rate_source
 
             # Get duty rule for calculation type
-            rule = DutyRule.query.filter_by(program_id=program_id).first()
+            if snapshot is not None:
+                rule = snapshot.duty_rule(program_id)
+            else:
+                rule = shared_lookup("duty_rule", program_id, lambda: _freeze_first(
+                    DutyRule, DutyRule.query.filter_by(program_id=program_id).first()
+                ))
             if not rule:
                 calculation_type = "additive"
                 base_on = "product_value"
@@ -2136,25 +2595,20 @@ def calculate_duties(
 
         # v11.0: Audit trail — compute replay_key and persist calculation log
         try:
-            # Collect source_docs from breakdown items
-            source_docs_list = list({
+            # Collect source_docs from breakdown items (sorted: set order
+            # varies with the per-process string hash seed)
+            source_docs_list = sorted({
                 item.get("rate_source", "")
                 for item in breakdown
                 if item.get("rate_source")
             })
             # Collect program names applied
-            programs_list = list({
+            programs_list = sorted({
                 item.get("program", "")
                 for item in breakdown
                 if item.get("action") not in ("disclaim", "skip") and item.get("program")
             })
-            # Parse materials if provided
-            materials_obj = None
-            if materials:
-                try:
-                    materials_obj = json.loads(materials) if isinstance(materials, str) else materials
-                except (json.JSONDecodeError, TypeError):
-                    pass
+            materials_obj = materials
 
             replay_key = compute_replay_key(
                 hts_code=hts_code or "",
@@ -2169,60 +2623,92 @@ def calculate_duties(
             result["source_docs_used"] = source_docs_list
 
             # Fire-and-forget: persist to tariff_calculation_log
+            # v22.0: Batched upsert; repeats of a replay_key bump hit_count
             try:
-                app = get_flask_app()
-                with app.app_context():
-                    from app.web.db import db as flask_db
-                    models = get_models()
-                    TariffCalculationLog = models["TariffCalculationLog"]
-
-                    log_entry = TariffCalculationLog(
-                        id=str(uuid.uuid4()),
-                        hts_code=hts_code or "",
-                        country_of_origin=country or "",
-                        as_of_date=check_date,
-                        product_value=product_value,
-                        materials_json=materials_obj,
-                        replay_key=replay_key,
-                        calculation_result=result,
-                        programs_applied=programs_list,
-                        total_duty_rate=result.get("total_duty_percent"),
-                        source_docs_used=source_docs_list,
-                        engine_version="v11.0",
-                    )
-                    flask_db.session.add(log_entry)
-                    flask_db.session.commit()
+                from app.services.calculation_log_writer import get_calculation_log_writer
+                get_calculation_log_writer().submit({
+                    "hts_code": hts_code or "",
+                    "country_of_origin": country or "",
+                    "as_of_date": check_date,
+                    "product_value": product_value,
+                    "materials_json": materials_obj,
+                    "replay_key": replay_key,
+                    "calculation_result": result,
+                    "programs_applied": programs_list,
+                    "total_duty_rate": result.get("total_duty_percent"),
+                    "source_docs_used": source_docs_list,
+                    "engine_version": "v11.0",
+                })
             except Exception:
                 pass  # Fire-and-forget — never block calculation on logging failure
         except Exception:
             pass  # Replay key computation failed — don't block result
 
-        return json.dumps(result)
+        return result
 
 
-# ============================================================================
-# Tool 8: Lookup Product History
-# ============================================================================
-
 @tool
-def lookup_product_history(hts_code: str, product_description: str) -> str:
+def calculate_duties(
+    filing_lines: str,
+    product_value: float,
+    materials: Optional[str] = None,
+    country: Optional[str] = None,
+    hts_code: Optional[str] = None,
+    import_date: Optional[str] = None
+) -> str:
     """
-    Check if we've handled similar products before.
+    Calculate total duties based on all applicable programs.
 
-    Looks up previous classifications to:
-    1. Suggest material composition if we've seen this product
-    2. Provide historical decisions as reference
-    3. Reduce user questions by using confirmed data
+    Phase 6 Update (Dec 2025):
+    - Supports content-value-based duties (base_on='content_value')
+    - Calculates duty on material $ value instead of percentage
+    - Applies fallback to full_value if content value unknown
+    - Generates split filing lines for 232 materials
+
+    Phase 6.5 Update (Dec 2025) - IEEPA Unstacking:
+    - Tracks remaining_value after 232 content deductions
+    - 232 programs with base_effect='subtract_from_remaining' reduce the IEEPA base
+    - IEEPA Reciprocal with base_on='remaining_value' uses the reduced base
+    - This implements CBP rule: "Content subject to 232 is NOT subject to Reciprocal IEEPA"
+
+    v5.0 Update (Dec 2025) - Country-Specific Rates:
+    - Uses get_rate_for_program() to get country-specific rates
+    - Supports EU 15% ceiling rule (formula: 15% - MFN base rate)
+    - Supports UK 232 exception (25% instead of 50% for steel/aluminum)
+    - If country/hts_code not provided, falls back to rate from filing_lines
 
     Args:
-        hts_code: The 10-digit HTS code
-        product_description: Description of the product
+        filing_lines: JSON string with list of filing lines from program decisions
+        product_value: The declared value of the product in USD
+        materials: JSON string of material composition. Supports:
+            - Simple: {"copper": 0.05, "steel": 0.20}
+            - With values: {"copper": {"percentage": 0.05, "value": 500.00}, ...}
+        country: v5.0 - Country of origin for rate lookup (optional)
+        hts_code: v5.0 - HTS code for MFN lookup in formulas (optional)
+        import_date: v5.0 - Import date (YYYY-MM-DD) for time-bounded lookups
 
     Returns:
-        JSON with historical data and suggestions
+        JSON with total duty calculation breakdown, including base_value, value_source,
+        rate_source (v5.0), and remaining_value tracking for IEEPA unstacking
     """
-    app = get_flask_app()
-    with app.app_context():
+    try:
+        lines = json.loads(filing_lines) if isinstance(filing_lines, str) else filing_lines
+        composition = json.loads(materials) if materials and isinstance(materials, str) else (materials or None)
+    except json.JSONDecodeError as e:
+        return json.dumps({
+            "error": f"Invalid JSON: {str(e)}"
+        })
+    return json.dumps(calculate_duties_data(lines, product_value, composition, country, hts_code, import_date))
+
+
+# ============================================================================
+# Tool 8: Lookup Product History
+# ============================================================================
+
+@profiled_tool("lookup_product_history")
+def lookup_product_history_data(hts_code: str, product_description: str) -> dict:
+    """v22.0: Previous classifications for this HTS code, as a dict."""
+    with tool_app_context():
         models = get_models()
         ProductHistory = models["ProductHistory"]
 
@@ -2232,12 +2718,12 @@ def lookup_product_history(hts_code: str, product_description: str) -> str:
         ).limit(5).all()
 
         if not history:
-            return json.dumps({
+            return {
                 "found": False,
                 "hts_code": hts_code,
                 "message": "No history found for this HTS code",
                 "suggestion": "Will need to ask user for material composition if 232 applies"
-            })
+            }
 
         # Find best match by product description (simple substring for MVP)
         best_match = None
@@ -2254,7 +2740,7 @@ def lookup_product_history(hts_code: str, product_description: str) -> str:
                     best_match = h
 
         if best_match and best_match.user_confirmed:
-            return json.dumps({
+            return {
                 "found": True,
                 "hts_code": hts_code,
                 "match_type": "exact_hts_with_description_match",
@@ -2264,11 +2750,11 @@ def lookup_product_history(hts_code: str, product_description: str) -> str:
                 "user_confirmed": best_match.user_confirmed,
                 "timestamp": best_match.timestamp.isoformat() if best_match.timestamp else None,
                 "suggestion": "Can use historical composition, verify with user if different product"
-            })
+            }
 
         # Return most recent entry
         recent = history[0]
-        return json.dumps({
+        return {
             "found": True,
             "hts_code": hts_code,
             "match_type": "exact_hts_only",
@@ -2277,53 +2763,50 @@ def lookup_product_history(hts_code: str, product_description: str) -> str:
             "user_confirmed": recent.user_confirmed,
             "timestamp": recent.timestamp.isoformat() if recent.timestamp else None,
             "suggestion": "Historical data available but should verify with user"
-        })
-
+        }
 
-# ============================================================================
-# Tool 9: Save Product Decision (for learning)
-# ============================================================================
 
 @tool
-def save_product_decision(
-    hts_code: str,
-    country: str,
-    product_description: str,
-    materials: str,
-    filing_lines: str,
-    user_confirmed: bool = False
-) -> str:
+def lookup_product_history(hts_code: str, product_description: str) -> str:
     """
-    Save a product stacking decision to history for future reference.
+    Check if we've handled similar products before.
 
-    Call this after completing a stacking calculation to build up
-    the knowledge base for similar products.
+    Looks up previous classifications to:
+    1. Suggest material composition if we've seen this product
+    2. Provide historical decisions as reference
+    3. Reduce user questions by using confirmed data
 
     Args:
         hts_code: The 10-digit HTS code
-        country: Country of origin
         product_description: Description of the product
-        materials: JSON string of material composition
-        filing_lines: JSON string of final filing lines
-        user_confirmed: Whether user verified the composition
 
     Returns:
-        JSON confirming save
+        JSON with historical data and suggestions
     """
-    app = get_flask_app()
-    with app.app_context():
+    return json.dumps(lookup_product_history_data(hts_code, product_description))
+
+
+# ============================================================================
+# Tool 9: Save Product Decision (for learning)
+# ============================================================================
+
+@profiled_tool("save_product_decision")
+def save_product_decision_data(
+    hts_code: str,
+    country: str,
+    product_description: str,
+    materials: dict,
+    filing_lines: List[dict],
+    user_confirmed: bool = False
+) -> dict:
+    """v22.0: Persist a stacking decision to product history; returns the save result."""
+    with tool_app_context():
         models = get_models()
         ProductHistory = models["ProductHistory"]
         db = get_db()
 
-        try:
-            composition = json.loads(materials) if isinstance(materials, str) else materials
-            decisions = json.loads(filing_lines) if isinstance(filing_lines, str) else filing_lines
-        except json.JSONDecodeError as e:
-            return json.dumps({
-                "saved": False,
-                "error": f"Invalid JSON: {str(e)}"
-            })
+        composition = materials
+        decisions = filing_lines
 
         history = ProductHistory(
             hts_code=hts_code,
@@ -2336,46 +2819,67 @@ def save_product_decision(
         db.session.add(history)
         db.session.commit()
 
-        return json.dumps({
+        return {
             "saved": True,
             "id": history.id,
             "hts_code": hts_code,
             "user_confirmed": user_confirmed
-        })
-
+        }
 
-# ============================================================================
-# v4.0 Tools: Entry Slices and Variant Resolution
-# ============================================================================
 
 @tool
-def plan_entry_slices(hts_code: str, product_value: float, materials: str, applicable_programs: str) -> str:
+def save_product_decision(
+    hts_code: str,
+    country: str,
+    product_description: str,
+    materials: str,
+    filing_lines: str,
+    user_confirmed: bool = False
+) -> str:
     """
-    v4.0: Determine how many ACE entries (slices) to create for one product.
-
-    When a product has 232 metal content, it must be split into multiple
-    ACE entries:
-    - 1 non_metal slice (value - all 232 metal values)
-    - 1 slice per 232 metal with value > 0
+    Save a product stacking decision to history for future reference.
 
-    If no 232 materials apply, returns a single "full_product" slice.
+    Call this after completing a stacking calculation to build up
+    the knowledge base for similar products.
 
     Args:
         hts_code: The 10-digit HTS code
-        product_value: Total product value in USD
-        materials: JSON string of material values {"copper": 3000, "steel": 1000, "aluminum": 1000}
-        applicable_programs: JSON string of applicable programs from get_applicable_programs()
+        country: Country of origin
+        product_description: Description of the product
+        materials: JSON string of material composition
+        filing_lines: JSON string of final filing lines
+        user_confirmed: Whether user verified the composition
 
     Returns:
-        JSON with list of entry slices, each with entry_id, slice_type, value, materials
+        JSON confirming save
     """
     try:
         composition = json.loads(materials) if isinstance(materials, str) else materials
-        programs_data = json.loads(applicable_programs) if isinstance(applicable_programs, str) else applicable_programs
+        decisions = json.loads(filing_lines) if isinstance(filing_lines, str) else filing_lines
     except json.JSONDecodeError as e:
         return json.dumps({
+            "saved": False,
             "error": f"Invalid JSON: {str(e)}"
         })
+    return json.dumps(save_product_decision_data(
+        hts_code, country, product_description, composition, decisions, user_confirmed
+    ))
+
+
+# ============================================================================
+# v4.0 Tools: Entry Slices and Variant Resolution
+# ============================================================================
+
+@profiled_tool("plan_entry_slices")
+def plan_entry_slices_data(hts_code: str, product_value: float, materials: dict, applicable_programs) -> dict:
+    """
+    v22.0: Entry slices for a product from its composition dict.
+
+    applicable_programs is a list of program IDs or program dicts, or the
+    get_applicable_programs result ({"programs": [...]}).
+    """
+    composition = materials
+    programs_data = applicable_programs
 
     programs = programs_data.get("programs", []) if isinstance(programs_data, dict) else programs_data
 
@@ -2397,8 +2901,7 @@ def plan_entry_slices(hts_code: str, product_value: float, materials: str, appli
     # Mixed products (e.g., copper primary + aluminum content) should slice normally
     hts_8digit = hts_code.replace(".", "")[:8]
 
-    app = get_flask_app()
-    with app.app_context():
+    with tool_app_context():
         models = get_models()
         Section232Material = models["Section232Material"]
 
@@ -2407,8 +2910,12 @@ def plan_entry_slices(hts_code: str, product_value: float, materials: str, appli
         all_primary_or_derivative = True
         single_metal_type = None
 
+        snapshot = get_active_rule_snapshot()
         for metal in materials_in_composition:
-            mat_232 = Section232Material.query.filter_by(hts_8digit=hts_8digit, material=metal).first()
+            if snapshot is not None:
+                mat_232 = snapshot.section_232_material(hts_8digit, metal)
+            else:
+                mat_232 = Section232Material.query.filter_by(hts_8digit=hts_8digit, material=metal).first()
             if mat_232:
                 article_type = getattr(mat_232, 'article_type', 'content') or 'content'
                 if article_type not in ('primary', 'derivative'):
@@ -2426,7 +2933,7 @@ def plan_entry_slices(hts_code: str, product_value: float, materials: str, appli
         # Single material that is primary/derivative - full value, no slicing
         first_metal = materials_in_composition[0]
 
-        return json.dumps({
+        return {
             "slice_count": 1,
             "slices": [{
                 "entry_id": f"{first_metal}_full" if first_metal else "full_product",
@@ -2439,7 +2946,7 @@ def plan_entry_slices(hts_code: str, product_value: float, materials: str, appli
             }],
             "reason": f"Article type '{single_metal_type}' - Note 16 requires full value assessment, no slicing",
             "article_type": single_metal_type
-        })
+        }
 
     # Get materials that have 232 programs AND have value > 0
     # v6.0: Support both percentage format (0.05 = 5%) and dollar value format (500.0 = $500)
@@ -2470,7 +2977,7 @@ def plan_entry_slices(hts_code: str, product_value: float, materials: str, appli
 
     # If no 232 materials, return single full_product slice
     if not materials_with_232:
-        return json.dumps({
+        return {
             "slice_count": 1,
             "slices": [{
                 "entry_id": "full_product",
@@ -2479,7 +2986,7 @@ def plan_entry_slices(hts_code: str, product_value: float, materials: str, appli
                 "value": product_value,
                 "materials": composition
             }]
-        })
+        }
 
     # Calculate slices (for 'content' type articles only)
     slices = []
@@ -2497,23 +3004,104 @@ def plan_entry_slices(hts_code: str, product_value: float, materials: str, appli
             "materials": non_metal_materials
         })
 
-    # One slice per 232 metal
-    for metal, value in materials_with_232.items():
-        slices.append({
-            "entry_id": f"{metal}_slice",
-            "slice_type": f"{metal}_slice",
-            "base_hts": hts_code,
-            "value": value,
-            "materials": {metal: composition.get(metal, value)}
-        })
+    # One slice per 232 metal
+    for metal, value in materials_with_232.items():
+        slices.append({
+            "entry_id": f"{metal}_slice",
+            "slice_type": f"{metal}_slice",
+            "base_hts": hts_code,
+            "value": value,
+            "materials": {metal: composition.get(metal, value)}
+        })
+
+    return {
+        "slice_count": len(slices),
+        "metal_total": metal_total,
+        "non_metal_value": non_metal_value,
+        "slices": slices,
+        "article_type": article_type or "content"
+    }
+
+
+@tool
+def plan_entry_slices(hts_code: str, product_value: float, materials: str, applicable_programs: str) -> str:
+    """
+    v4.0: Determine how many ACE entries (slices) to create for one product.
+
+    When a product has 232 metal content, it must be split into multiple
+    ACE entries:
+    - 1 non_metal slice (value - all 232 metal values)
+    - 1 slice per 232 metal with value > 0
+
+    If no 232 materials apply, returns a single "full_product" slice.
+
+    Args:
+        hts_code: The 10-digit HTS code
+        product_value: Total product value in USD
+        materials: JSON string of material values {"copper": 3000, "steel": 1000, "aluminum": 1000}
+        applicable_programs: JSON string of applicable programs from get_applicable_programs()
+
+    Returns:
+        JSON with list of entry slices, each with entry_id, slice_type, value, materials
+    """
+    try:
+        composition = json.loads(materials) if isinstance(materials, str) else materials
+        programs_data = json.loads(applicable_programs) if isinstance(applicable_programs, str) else applicable_programs
+    except json.JSONDecodeError as e:
+        return json.dumps({
+            "error": f"Invalid JSON: {str(e)}"
+        })
+    return json.dumps(plan_entry_slices_data(hts_code, product_value, composition, programs_data))
+
 
-    return json.dumps({
-        "slice_count": len(slices),
-        "metal_total": metal_total,
-        "non_metal_value": non_metal_value,
-        "slices": slices,
-        "article_type": article_type or "content"
-    })
+@profiled_tool("check_annex_ii_exclusion")
+def check_annex_ii_exclusion_data(hts_code: str, import_date: Optional[str] = None) -> dict:
+    """v22.0: Longest-prefix Annex II exclusion match for the HTS code, as a dict."""
+    return dict(shared_lookup("annex_ii", (hts_code, import_date),
+                              lambda: _check_annex_ii_exclusion_uncached(hts_code, import_date)))
+
+
+def _check_annex_ii_exclusion_uncached(hts_code: str, import_date: Optional[str] = None) -> dict:
+    """check_annex_ii_exclusion_data() lookup without batch memoization."""
+    with tool_app_context():
+        models = get_models()
+        IeepaAnnexIIExclusion = models["IeepaAnnexIIExclusion"]
+
+        hts_clean = hts_code.replace(".", "")
+        check_date = date.fromisoformat(import_date) if import_date else date.today()
+
+        snapshot = get_active_rule_snapshot()
+        if snapshot is not None:
+            # v22.0: One prefix-trie walk instead of a lookup per length
+            prefix, match = snapshot.annex_ii_longest_match(hts_clean, check_date) or (None, None)
+        else:
+            # Try progressively shorter prefixes (longest match wins)
+            prefix, match = None, None
+            for length in [10, 8, 6, 4]:
+                candidate = IeepaAnnexIIExclusion.query.filter_by(hts_code=hts_clean[:length]).first()
+                if candidate and candidate.is_active(check_date):
+                    prefix, match = hts_clean[:length], candidate
+                    break
+
+        if match:
+            return {
+                "excluded": True,
+                "hts_code": hts_code,
+                "matched_prefix": prefix,
+                "category": match.category,
+                "description": match.description,
+                "source_doc": match.source_doc,
+                "effective_date": match.effective_date.isoformat() if match.effective_date else None,
+                "expiration_date": match.expiration_date.isoformat() if match.expiration_date else None,
+                "variant": "annex_ii_exempt",
+                "chapter_99_code": "9903.01.32"
+            }
+
+        return {
+            "excluded": False,
+            "hts_code": hts_code,
+            "reason": "HTS code not in Annex II exclusion list"
+        }
 
 
 @tool
@@ -2537,44 +3125,14 @@ def check_annex_ii_exclusion(hts_code: str, import_date: Optional[str] = None) -
     Returns:
         JSON with excluded flag, category, and matched prefix
     """
-    app = get_flask_app()
-    with app.app_context():
-        models = get_models()
-        IeepaAnnexIIExclusion = models["IeepaAnnexIIExclusion"]
-
-        hts_clean = hts_code.replace(".", "")
-        check_date = date.fromisoformat(import_date) if import_date else date.today()
-
-        # Try progressively shorter prefixes (longest match wins)
-        for length in [10, 8, 6, 4]:
-            prefix = hts_clean[:length]
-            match = IeepaAnnexIIExclusion.query.filter_by(hts_code=prefix).first()
-
-            if match and match.is_active(check_date):
-                return json.dumps({
-                    "excluded": True,
-                    "hts_code": hts_code,
-                    "matched_prefix": prefix,
-                    "category": match.category,
-                    "description": match.description,
-                    "source_doc": match.source_doc,
-                    "effective_date": match.effective_date.isoformat() if match.effective_date else None,
-                    "expiration_date": match.expiration_date.isoformat() if match.expiration_date else None,
-                    "variant": "annex_ii_exempt",
-                    "chapter_99_code": "9903.01.32"
-                })
-
-        return json.dumps({
-            "excluded": False,
-            "hts_code": hts_code,
-            "reason": "HTS code not in Annex II exclusion list"
-        })
+    return json.dumps(check_annex_ii_exclusion_data(hts_code, import_date))
 
 
 # =============================================================================
 # v21.0: IEEPA Reciprocal V2 Resolver (6-Phase Algorithm)
 # =============================================================================
 
+@profiled_tool("resolve_ieepa_reciprocal_v2")
 def resolve_ieepa_reciprocal_v2(
     hts_digits: str,
     country_code: Optional[str],  # Minor fix #1: Optional for baseline lookup
@@ -2618,8 +3176,7 @@ def resolve_ieepa_reciprocal_v2(
     Returns:
         dict with variant, action, chapter_99_code, duty_rate, duty_amount, etc.
     """
-    app = get_flask_app()
-    with app.app_context():
+    with tool_app_context():
         models = get_models()
 
         # Import V2 models
@@ -2633,10 +3190,21 @@ def resolve_ieepa_reciprocal_v2(
         # Clean HTS digits
         hts_clean = hts_digits.replace('.', '')
 
+        # v22.0: Serve V2 table lookups from the rule snapshot when enabled
+        snapshot = get_active_rule_snapshot()
+        if snapshot is not None:
+            get_active_rules = snapshot.exception_rules_ordered
+            find_product_exclusion = snapshot.reciprocal_product_exclusion
+            find_deal_override = snapshot.deal_override
+        else:
+            get_active_rules = IeepaReciprocalExceptionRules.get_active_rules_ordered
+            find_product_exclusion = IeepaReciprocalProductExclusions.find_longest_match
+            find_deal_override = IeepaReciprocalDealOverrides.find_deal_override
+
         # =================================================================
         # Phase 1: Exception Rules (priority order)
         # =================================================================
-        exception_rules = IeepaReciprocalExceptionRules.get_active_rules_ordered(entry_date)
+        exception_rules = get_active_rules(entry_date)
 
         for rule in exception_rules:
             matched = False
@@ -2662,7 +3230,7 @@ def resolve_ieepa_reciprocal_v2(
                     matched = is_info_material
                 elif rule.requires_flag == 'is_annex_ii_exempt':
                     # Check via Phase 2 product exclusions
-                    excl = IeepaReciprocalProductExclusions.find_longest_match(hts_clean, entry_date)
+                    excl = find_product_exclusion(hts_clean, entry_date)
                     matched = excl is not None
                 elif rule.requires_flag == 'country_would_exceed_baseline':
                     # Bug B fix: Check if country's rate exceeds baseline
@@ -2758,7 +3326,7 @@ def resolve_ieepa_reciprocal_v2(
         # =================================================================
         # Phase 2: Product Exclusions (LPM lookup)
         # =================================================================
-        product_exclusion = IeepaReciprocalProductExclusions.find_longest_match(hts_clean, entry_date)
+        product_exclusion = find_product_exclusion(hts_clean, entry_date)
         if product_exclusion:
             return {
                 'variant': 'annex_ii_exempt',
@@ -2776,7 +3344,7 @@ def resolve_ieepa_reciprocal_v2(
         # =================================================================
         # Phase 3: Deal Overrides (LPM lookup)
         # =================================================================
-        deal_override = IeepaReciprocalDealOverrides.find_deal_override(country_code, hts_clean, entry_date)
+        deal_override = find_deal_override(country_code, hts_clean, entry_date)
         if deal_override:
             rate_pct = float(deal_override.override_rate) if deal_override.override_rate else 0.0
             duty_amount = entered_value * rate_pct / 100
@@ -2920,6 +3488,10 @@ def _get_country_schedule(country_code, entry_date, model_class):
     When multiple rows match (e.g. v21.0 + v21.1 overlap), prefer the
     latest dataset_tag (lexicographic DESC) and then latest id as tiebreaker.
     """
+    snapshot = get_active_rule_snapshot()
+    if snapshot is not None:
+        return snapshot.rate_schedule(country_code, entry_date)
+
     query = model_class.query.filter(
         model_class.country_code == country_code,
         model_class.effective_start <= entry_date,
@@ -2945,6 +3517,10 @@ def _check_section_232_subject(hts_digits: str, entry_date: date, models) -> boo
     # Normalize to 8 digits for lookup
     hts_8 = hts_digits[:8] if len(hts_digits) >= 8 else hts_digits
 
+    snapshot = get_active_rule_snapshot()
+    if snapshot is not None:
+        return bool(snapshot.section_232_materials(hts_8))
+
     # Check for exact match on hts_8digit
     match = Section232Material.query.filter(
         Section232Material.hts_8digit == hts_8
@@ -2953,8 +3529,8 @@ def _check_section_232_subject(hts_digits: str, entry_date: date, models) -> boo
     return match is not None
 
 
-@tool
-def resolve_reciprocal_variant(
+@profiled_tool("resolve_reciprocal_variant")
+def resolve_reciprocal_variant_data(
     hts_code: str,
     slice_type: str,
     us_content_pct: Optional[float] = None,
@@ -2970,44 +3546,8 @@ def resolve_reciprocal_variant(
     cbp_transshipment: bool = False,
     is_donation: bool = False,
     is_info_material: bool = False
-) -> str:
-    """
-    v4.0: Determine IEEPA Reciprocal variant for a given slice.
-    v11.0: Added article_type for Note 16 full-value exemption.
-    v12.0: Added Annex II energy product exemption check.
-    v13.0: Added country_code for temporal rate lookups.
-    v21.0: Added feature flag wrapper for V2 engine.
-
-    Priority order (V1 legacy):
-    1. annex_ii_energy_exempt - If HTS is an Annex II energy product (propane, LPG, etc.)
-    2. annex_ii_exempt - If HTS is in Annex II exclusion list (DB lookup)
-    3. us_content_exempt - If US content >= 20%
-    4. note16_full_exempt - If article_type is 'primary' or 'derivative' (entire article subject to 232)
-    5. metal_exempt - If slice is a 232 metal slice (copper_slice, steel_slice, aluminum_slice)
-    6. taxable - Default, pay 10% reciprocal tariff
-
-    V2 engine (USE_IEEPA_V2_ENGINE=true):
-    Uses 6-phase data-driven algorithm with full temporal versioning.
-
-    Args:
-        hts_code: The 10-digit HTS code
-        slice_type: Slice type: 'full', 'non_metal', 'copper_slice', 'steel_slice', 'aluminum_slice'
-        us_content_pct: US content percentage (0.0-1.0 for V1, 0-100 for V2)
-        import_date: Date of import (YYYY-MM-DD)
-        article_type: Phase 11 - 'primary', 'derivative', or 'content' per U.S. Note 16
-        country_code: v13.0 - ISO 2-letter country code for temporal rate lookup
-        entered_value: V2 - Entry value in USD
-        base_mfn_ad_val: V2 - Base MFN ad valorem rate (percentage)
-        load_date: V2 - Date goods were loaded (for in-transit)
-        vessel_final_mode: V2 - Final mode vessel flag
-        chapter98_claim: V2 - Chapter 98 claim type
-        cbp_transshipment: V2 - CBP transshipment determination
-        is_donation: V2 - Donation flag
-        is_info_material: V2 - Information material flag
-
-    Returns:
-        JSON with variant, action, chapter_99_code, and duty_rate
-    """
+) -> dict:
+    """v22.0: IEEPA Reciprocal variant, action, code and rate for one slice, as a dict."""
     # v21.0: Feature flag for V2 engine
     if os.getenv('USE_IEEPA_V2_ENGINE', 'false').lower() == 'true':
         # Convert V1 inputs to V2 format
@@ -3042,13 +3582,13 @@ def resolve_reciprocal_variant(
 
         # Bug D verified: Convert V2 output to V1 format
         # V2 uses percentage (10.0 = 10%), V1 uses decimal (0.10 = 10%)
-        return json.dumps({
+        return {
             "variant": result['variant'],
             "action": result['action'],
             "chapter_99_code": result['chapter_99_code'],
             "duty_rate": result['duty_rate'] / 100,  # Convert percentage to decimal
             "reason": result.get('reason', '')
-        })
+        }
 
     # V1 legacy logic below
     # v13.0: Use temporal lookups for all reciprocal variants
@@ -3062,107 +3602,144 @@ def resolve_reciprocal_variant(
     # v21.0: Now uses feature flag (USE_DB_ENERGY_CHECK) to switch between CSV/DB
     energy_exempt = is_annex_ii_energy_exempt(hts_code, import_date)
     if energy_exempt.get('exempt'):
-        return json.dumps({
+        return {
             "variant": "annex_ii_exempt",
             "action": "exempt",
             "chapter_99_code": annex_ii_rate['code'],  # 9903.01.32
             "duty_rate": 0.0,
             "reason": f"HTS {hts_code} is Annex II energy product: {energy_exempt.get('description')}"
-        })
+        }
 
     # Priority 2: Check Annex II exclusion (DB lookup for non-energy products)
-    annex_ii_result = check_annex_ii_exclusion.invoke({"hts_code": hts_code, "import_date": import_date})
-    annex_ii_data = json.loads(annex_ii_result)
+    annex_ii_data = check_annex_ii_exclusion_data(hts_code, import_date)
 
     if annex_ii_data.get("excluded"):
-        return json.dumps({
+        return {
             "variant": "annex_ii_exempt",
             "action": "exempt",
             "chapter_99_code": annex_ii_rate['code'],  # 9903.01.32
             "duty_rate": 0.0,
             "reason": f"HTS {hts_code} is in Annex II exclusion list ({annex_ii_data.get('category')})"
-        })
+        }
 
     # Priority 3: US content exemption
     if us_content_pct is not None and us_content_pct >= 0.20:
-        return json.dumps({
+        return {
             "variant": "us_content_exempt",
             "action": "exempt",
             "chapter_99_code": us_content_rate['code'],  # 9903.01.34
             "duty_rate": 0.0,
             "reason": f"US content ({us_content_pct*100:.1f}%) >= 20% threshold"
-        })
+        }
 
     # Priority 4: Phase 11 - Note 16 full-value exemption
     # For primary/derivative articles, the ENTIRE article is subject to 232,
     # so the ENTIRE value is exempt from IEEPA Reciprocal
     if article_type in ('primary', 'derivative'):
-        return json.dumps({
+        return {
             "variant": "note16_full_exempt",
             "action": "exempt",
             "chapter_99_code": sec232_rate['code'],  # 9903.01.33
             "duty_rate": 0.0,
             "reason": f"Article type '{article_type}' - entire article subject to 232, 100% exempt from Reciprocal per Note 16"
-        })
+        }
 
     # Priority 5: 232 metal slice exemption (for 'content' type articles)
     metal_slices = ["copper_slice", "steel_slice", "aluminum_slice"]
     if slice_type in metal_slices:
-        return json.dumps({
+        return {
             "variant": "metal_exempt",
             "action": "exempt",
             "chapter_99_code": sec232_rate['code'],  # 9903.01.33
             "duty_rate": 0.0,
             "reason": f"Slice type '{slice_type}' is 232 metal content, exempt from Reciprocal"
-        })
+        }
 
     # Priority 6: Taxable (no exemption applies)
-    return json.dumps({
+    return {
         "variant": "taxable",
         "action": "paid",
         "chapter_99_code": standard_rate['code'],  # 9903.01.25
         "duty_rate": standard_rate['rate'],  # 0.10
         "reason": "No exemption applies, subject to 10% IEEPA Reciprocal tariff"
-    })
+    }
 
 
 @tool
-def build_entry_stack(
+def resolve_reciprocal_variant(
     hts_code: str,
-    country: str,
     slice_type: str,
-    applicable_programs: str,
-    materials: Optional[str] = None,
     us_content_pct: Optional[float] = None,
-    import_date: Optional[str] = None
+    import_date: Optional[str] = None,
+    article_type: Optional[str] = None,
+    country_code: Optional[str] = None,
+    # V2 optional inputs (passed through from Tool 5 per Gap #2)
+    entered_value: Optional[float] = None,
+    base_mfn_ad_val: Optional[float] = None,
+    load_date: Optional[str] = None,
+    vessel_final_mode: Optional[bool] = None,
+    chapter98_claim: Optional[str] = None,
+    cbp_transshipment: bool = False,
+    is_donation: bool = False,
+    is_info_material: bool = False
 ) -> str:
     """
-    v4.0: Build the Chapter 99 code stack for a single ACE entry slice.
+    v4.0: Determine IEEPA Reciprocal variant for a given slice.
+    v11.0: Added article_type for Note 16 full-value exemption.
+    v12.0: Added Annex II energy product exemption check.
+    v13.0: Added country_code for temporal rate lookups.
+    v21.0: Added feature flag wrapper for V2 engine.
 
-    For each applicable program, determines:
-    - Action (apply, claim, disclaim, paid, exempt)
-    - Variant (for IEEPA Reciprocal)
-    - Chapter 99 code and duty rate
+    Priority order (V1 legacy):
+    1. annex_ii_energy_exempt - If HTS is an Annex II energy product (propane, LPG, etc.)
+    2. annex_ii_exempt - If HTS is in Annex II exclusion list (DB lookup)
+    3. us_content_exempt - If US content >= 20%
+    4. note16_full_exempt - If article_type is 'primary' or 'derivative' (entire article subject to 232)
+    5. metal_exempt - If slice is a 232 metal slice (copper_slice, steel_slice, aluminum_slice)
+    6. taxable - Default, pay 10% reciprocal tariff
 
-    Programs are ordered by filing_sequence per CBP CSMS #64018403.
+    V2 engine (USE_IEEPA_V2_ENGINE=true):
+    Uses 6-phase data-driven algorithm with full temporal versioning.
 
     Args:
         hts_code: The 10-digit HTS code
-        country: Country of origin
-        slice_type: Slice type: 'full', 'non_metal', 'copper_slice', etc.
-        applicable_programs: JSON string of applicable programs
-        materials: JSON string of material composition (optional)
-        us_content_pct: US content percentage (optional)
-        import_date: Import date (optional)
+        slice_type: Slice type: 'full', 'non_metal', 'copper_slice', 'steel_slice', 'aluminum_slice'
+        us_content_pct: US content percentage (0.0-1.0 for V1, 0-100 for V2)
+        import_date: Date of import (YYYY-MM-DD)
+        article_type: Phase 11 - 'primary', 'derivative', or 'content' per U.S. Note 16
+        country_code: v13.0 - ISO 2-letter country code for temporal rate lookup
+        entered_value: V2 - Entry value in USD
+        base_mfn_ad_val: V2 - Base MFN ad valorem rate (percentage)
+        load_date: V2 - Date goods were loaded (for in-transit)
+        vessel_final_mode: V2 - Final mode vessel flag
+        chapter98_claim: V2 - Chapter 98 claim type
+        cbp_transshipment: V2 - CBP transshipment determination
+        is_donation: V2 - Donation flag
+        is_info_material: V2 - Information material flag
 
     Returns:
-        JSON with list of FilingLine objects for this slice's stack
+        JSON with variant, action, chapter_99_code, and duty_rate
     """
-    try:
-        programs_data = json.loads(applicable_programs) if isinstance(applicable_programs, str) else applicable_programs
-        composition = json.loads(materials) if materials and isinstance(materials, str) else (materials or {})
-    except json.JSONDecodeError as e:
-        return json.dumps({"error": f"Invalid JSON: {str(e)}"})
+    return json.dumps(resolve_reciprocal_variant_data(
+        hts_code, slice_type, us_content_pct, import_date, article_type, country_code,
+        entered_value, base_mfn_ad_val, load_date, vessel_final_mode, chapter98_claim,
+        cbp_transshipment, is_donation, is_info_material
+    ))
+
+
+@profiled_tool("build_entry_stack")
+def build_entry_stack_data(
+    hts_code: str,
+    country: str,
+    slice_type: str,
+    applicable_programs,
+    materials: Optional[dict] = None,
+    us_content_pct: Optional[float] = None,
+    import_date: Optional[str] = None
+) -> dict:
+    """v22.0: Chapter 99 stack for one slice; applicable_programs is a list or {"programs": [...]}."""
+    programs_data = applicable_programs
+    composition = materials or {}
 
     programs = programs_data.get("programs", []) if isinstance(programs_data, dict) else programs_data
 
@@ -3189,11 +3766,7 @@ def build_entry_stack(
             variant = None
 
             # Get the correct chapter 99 code for this specific HTS
-            inclusion_result = check_program_inclusion.invoke({
-                "program_id": "section_301",
-                "hts_code": hts_code
-            })
-            inclusion_data = json.loads(inclusion_result)
+            inclusion_data = check_program_inclusion_data("section_301", hts_code)
             if inclusion_data.get("included"):
                 chapter_99_code = inclusion_data.get("chapter_99_code")
                 duty_rate = inclusion_data.get("duty_rate")
@@ -3249,23 +3822,19 @@ def build_entry_stack(
             country_iso2 = normalized.get("iso_alpha2") or country
 
             # Look up article_type from section_232_materials (if any 232 materials apply)
-            app = get_flask_app()
-            with app.app_context():
-                models = get_models()
-                Section232Material = models["Section232Material"]
-                mat_232 = Section232Material.query.filter_by(hts_8digit=hts_8digit).first()
+            with tool_app_context():
+                mat_232 = get_first_section_232_material(hts_8digit)
                 if mat_232:
                     article_type = getattr(mat_232, 'article_type', 'content') or 'content'
 
-            variant_result = resolve_reciprocal_variant.invoke({
-                "hts_code": hts_code,
-                "slice_type": slice_type,
-                "us_content_pct": us_content_pct,
-                "import_date": import_date,
-                "article_type": article_type,
-                "country_code": country_iso2  # v13.0: Pass for temporal rate lookups
-            })
-            variant_data = json.loads(variant_result)
+            variant_data = resolve_reciprocal_variant_data(
+                hts_code=hts_code,
+                slice_type=slice_type,
+                us_content_pct=us_content_pct,
+                import_date=import_date,
+                article_type=article_type,
+                country_code=country_iso2  # v13.0: Pass for temporal rate lookups
+            )
             variant = variant_data.get("variant")
             action = variant_data.get("action")
             duty_rate = variant_data.get("duty_rate")
@@ -3276,11 +3845,7 @@ def build_entry_stack(
             metal = program_id.replace("section_232_", "")
 
             # Check inclusion list - only show 232 if HTS is actually covered
-            inclusion_result = check_program_inclusion.invoke({
-                "program_id": program_id,
-                "hts_code": hts_code
-            })
-            inclusion_data = json.loads(inclusion_result)
+            inclusion_data = check_program_inclusion_data(program_id, hts_code)
 
             if not inclusion_data.get("included"):
                 # HTS is NOT on the 232 list for this metal - skip entirely
@@ -3320,25 +3885,13 @@ def build_entry_stack(
 
         # Look up code if not already set
         if chapter_99_code is None:
-            code_result = get_program_output.invoke({
-                "program_id": program_id,
-                "action": action,
-                "variant": variant,
-                "slice_type": slice_type
-            })
-            code_data = json.loads(code_result)
+            code_data = get_program_output_data(program_id, action, variant, slice_type)
             if code_data.get("found"):
                 chapter_99_code = code_data.get("chapter_99_code")
                 duty_rate = code_data.get("duty_rate", 0)
             else:
                 # Fallback: try with slice_type='all'
-                code_result = get_program_output.invoke({
-                    "program_id": program_id,
-                    "action": action,
-                    "variant": variant,
-                    "slice_type": "all"
-                })
-                code_data = json.loads(code_result)
+                code_data = get_program_output_data(program_id, action, variant, "all")
                 if code_data.get("found"):
                     chapter_99_code = code_data.get("chapter_99_code")
                     duty_rate = code_data.get("duty_rate", 0)
@@ -3357,11 +3910,53 @@ def build_entry_stack(
                 "material": program_id.replace("section_232_", "") if program_id.startswith("section_232_") else None
             })
 
-    return json.dumps({
+    return {
         "slice_type": slice_type,
         "stack_count": len(stack),
         "stack": stack
-    })
+    }
+
+
+@tool
+def build_entry_stack(
+    hts_code: str,
+    country: str,
+    slice_type: str,
+    applicable_programs: str,
+    materials: Optional[str] = None,
+    us_content_pct: Optional[float] = None,
+    import_date: Optional[str] = None
+) -> str:
+    """
+    v4.0: Build the Chapter 99 code stack for a single ACE entry slice.
+
+    For each applicable program, determines:
+    - Action (apply, claim, disclaim, paid, exempt)
+    - Variant (for IEEPA Reciprocal)
+    - Chapter 99 code and duty rate
+
+    Programs are ordered by filing_sequence per CBP CSMS #64018403.
+
+    Args:
+        hts_code: The 10-digit HTS code
+        country: Country of origin
+        slice_type: Slice type: 'full', 'non_metal', 'copper_slice', etc.
+        applicable_programs: JSON string of applicable programs
+        materials: JSON string of material composition (optional)
+        us_content_pct: US content percentage (optional)
+        import_date: Import date (optional)
+
+    Returns:
+        JSON with list of FilingLine objects for this slice's stack
+    """
+    try:
+        programs_data = json.loads(applicable_programs) if isinstance(applicable_programs, str) else applicable_programs
+        composition = json.loads(materials) if materials and isinstance(materials, str) else (materials or {})
+    except json.JSONDecodeError as e:
+        return json.dumps({"error": f"Invalid JSON: {str(e)}"})
+    return json.dumps(build_entry_stack_data(
+        hts_code, country, slice_type, programs_data, composition, us_content_pct, import_date
+    ))
 
 
 # ============================================================================
@@ -629,43 +629,15 @@ class ExclusionClaim(BaseModel):
 
         NOTE: These are CANDIDATES only. Verification always required.
         """
-        hts_normalized = hts_code.replace(".", "").strip()
-        hts8 = hts_normalized[:8]
-
-        # Get all active exclusions
-        active_exclusions = cls.query.filter(
-            cls.effective_start <= entry_date,
-            or_(
-                cls.effective_end.is_(None),
-                cls.effective_end > entry_date
-            )
-        ).all()
-
-        # Split into exact HTS10 matches vs HTS8 fallback
-        exact_hts10 = []
-        hts8_fallback = []
-
-        for exc in active_exclusions:
-            if not exc.hts_constraints:
-                continue
-            constraints = exc.hts_constraints
-
-            # Check exact HTS10 match
-            if "hts10_exact" in constraints:
-                if hts_normalized in constraints["hts10_exact"]:
-                    exact_hts10.append(exc)
-                    continue
-
-            # Check HTS8 prefix match (fallback only)
-            if "hts8_prefix" in constraints:
-                prefixes = constraints["hts8_prefix"]
-                if isinstance(prefixes, str):
-                    prefixes = [prefixes]
-                if hts8 in prefixes or any(hts8.startswith(p) for p in prefixes):
-                    hts8_fallback.append(exc)
-
-        # Exact HTS10 wins; HTS8 only when no exact match
-        return exact_hts10 if exact_hts10 else hts8_fallback
+        # v22.0: Precomputed HTS10/HTS8 index instead of scanning every
+        # active claim's hts_constraints; rows are fetched by primary key
+        from app.services.exclusion_matcher import get_exclusion_matcher
+
+        claim_ids = get_exclusion_matcher().match_ids(hts_code, entry_date)
+        if not claim_ids:
+            return []
+        rows = {c.id: c for c in cls.query.filter(cls.id.in_(claim_ids)).all()}
+        return [rows[claim_id] for claim_id in claim_ids if claim_id in rows]
 
 
 # =============================================================================
@@ -8,6 +8,8 @@ Use explicit imports from submodules when needed:
     from app.services.freshness import get_freshness_service
     from app.services.confidence_service import get_confidence_service
     from app.services.section301_engine import evaluate_section_301
+    from app.services.rule_snapshot import get_rule_snapshot
+    from app.services.result_cache import bump_tariff_data_version
 """
 
 
@@ -58,4 +60,106 @@ def __getattr__(name):
         }
         return mapping[name]
 
+    # v22.0: In-memory tariff rule snapshot
+    if name in ('TariffRuleSnapshot', 'get_rule_snapshot', 'invalidate_rule_snapshot'):
+        from app.services.rule_snapshot import (
+            TariffRuleSnapshot, get_rule_snapshot, invalidate_rule_snapshot
+        )
+        mapping = {
+            'TariffRuleSnapshot': TariffRuleSnapshot,
+            'get_rule_snapshot': get_rule_snapshot,
+            'invalidate_rule_snapshot': invalidate_rule_snapshot,
+        }
+        return mapping[name]
+
+    # v22.0: Stacking result cache and tariff data version
+    if name in ('StackingResultCache', 'get_result_cache',
+                'get_tariff_data_version', 'bump_tariff_data_version'):
+        from app.services.result_cache import (
+            StackingResultCache, get_result_cache,
+            get_tariff_data_version, bump_tariff_data_version
+        )
+        mapping = {
+            'StackingResultCache': StackingResultCache,
+            'get_result_cache': get_result_cache,
+            'get_tariff_data_version': get_tariff_data_version,
+            'bump_tariff_data_version': bump_tariff_data_version,
+        }
+        return mapping[name]
+
+    # v22.0: Shared store for calculations awaiting materials
+    if name in ('PendingSessionStore', 'get_pending_session_store'):
+        from app.services.session_store import PendingSessionStore, get_pending_session_store
+        return PendingSessionStore if name == 'PendingSessionStore' else get_pending_session_store
+
+    # v22.0: Batched calculation log writer
+    if name in ('CalculationLogWriter', 'get_calculation_log_writer'):
+        from app.services.calculation_log_writer import CalculationLogWriter, get_calculation_log_writer
+        return CalculationLogWriter if name == 'CalculationLogWriter' else get_calculation_log_writer
+
+    # v22.0: Longest-prefix trie for HTS prefix tables
+    if name == 'HtsPrefixTrie':
+        from app.services.prefix_trie import HtsPrefixTrie
+        return HtsPrefixTrie
+
+    # v22.0: As-of interval index for temporal rate tables
+    if name == 'TemporalIntervalIndex':
+        from app.services.interval_index import TemporalIntervalIndex
+        return TemporalIntervalIndex
+
+    # v22.0: Vectorized portfolio duty exposure
+    if name in ('PortfolioCatalog', 'PortfolioExposureEngine'):
+        from app.services.portfolio_exposure import PortfolioCatalog, PortfolioExposureEngine
+        return PortfolioCatalog if name == 'PortfolioCatalog' else PortfolioExposureEngine
+
+    # v22.0: Materialized program applicability
+    if name in ('ApplicabilityMatrix', 'get_applicability_matrix'):
+        from app.services.applicability_matrix import ApplicabilityMatrix, get_applicability_matrix
+        return ApplicabilityMatrix if name == 'ApplicabilityMatrix' else get_applicability_matrix
+
+    # v22.0: Compiled ProgramRate formulas
+    if name in ('compile_formula', 'ProgramRateResolver', 'get_program_rate_resolver'):
+        from app.services.rate_formula import (
+            compile_formula, ProgramRateResolver, get_program_rate_resolver
+        )
+        mapping = {
+            'compile_formula': compile_formula,
+            'ProgramRateResolver': ProgramRateResolver,
+            'get_program_rate_resolver': get_program_rate_resolver,
+        }
+        return mapping[name]
+
+    # v22.0: Process-pool batch calculation
+    if name in ('ParallelBatchExecutor', 'get_parallel_executor'):
+        from app.services.parallel_batch import ParallelBatchExecutor, get_parallel_executor
+        return ParallelBatchExecutor if name == 'ParallelBatchExecutor' else get_parallel_executor
+
+    # v22.0: In-process metrics and per-calculation SQL attribution
+    if name in ('MetricsRegistry', 'get_metrics_registry'):
+        from app.services.metrics import MetricsRegistry, get_metrics_registry
+        return MetricsRegistry if name == 'MetricsRegistry' else get_metrics_registry
+
+    if name in ('CalculationProfile', 'profile_calculation'):
+        from app.services.calculation_profile import CalculationProfile, profile_calculation
+        return CalculationProfile if name == 'CalculationProfile' else profile_calculation
+
+    # v22.0: Preloaded country normalization and group membership
+    if name in ('CountryResolver', 'get_country_resolver'):
+        from app.services.country_resolver import CountryResolver, get_country_resolver
+        return CountryResolver if name == 'CountryResolver' else get_country_resolver
+
+    # v22.0: Compiled Section 232 semiconductor predicates
+    if name in ('SemiconductorPredicateEngine', 'get_semiconductor_predicate_engine'):
+        from app.services.semiconductor_predicates import (
+            SemiconductorPredicateEngine, get_semiconductor_predicate_engine
+        )
+        if name == 'SemiconductorPredicateEngine':
+            return SemiconductorPredicateEngine
+        return get_semiconductor_predicate_engine
+
+    # v22.0: Shared commit hooks and versioned singletons for rule caches
+    if name in ('VersionedSingleton', 'register_model_invalidation'):
+        from app.services.model_invalidation import VersionedSingleton, register_model_invalidation
+        return VersionedSingleton if name == 'VersionedSingleton' else register_model_invalidation
+
     raise AttributeError(f"module 'app.services' has no attribute '{name}'")
@@ -0,0 +1,400 @@
+"""
+Program Applicability Matrix
+
+v22.0: Materialized program applicability, keyed by HTS10, country and
+validity interval.
+
+get_applicable_programs, check_program_inclusion and
+check_program_country_scope re-derive their answers on every calculation,
+although the answers only change when rule rows change. The matrix keeps
+each answer together with the date interval over which it holds:
+- programs:  country ISO -> programs for that country (or ALL)
+- inclusion: (HTS10, program_id) -> inclusion outcome
+- scope:     (program_id, country ISO) -> country / country group scope outcome
+applicability() joins them into one row for (HTS10, country, date).
+
+Validity intervals: an answer can only change on a date where one of the
+rows it is derived from starts or ends. On a miss the stacking tools compute
+the answer with their live logic for the requested date, and the matrix
+stores it for the interval between the surrounding boundary dates of those
+rows, so any later lookup in the same interval is a hit.
+
+Incremental rebuild: ORM commits that change rule rows drop only the
+entries they can affect, which the next lookup re-materializes:
+- Section 301 / 232 rates and Section 232 materials: inclusion entries
+  under the row's HTS8
+- IEEPA rates: inclusion entries of the IEEPA programs
+- Program country scopes, country groups and members: scope entries
+- Tariff programs: everything
+Tariff data version bumps made by this process after such a commit keep the
+matrix (see result_cache.bumped_locally); a bump by another process, whose
+changes are unknown here, clears it.
+
+Enabled for the stacking tools with USE_APPLICABILITY_MATRIX=true.
+
+Usage:
+    from app.services.applicability_matrix import get_applicability_matrix
+
+    matrix = get_applicability_matrix()
+    outcome = matrix.materialize("inclusion", ("8544429090", "section_301"),
+                                 date(2026, 1, 15), loader)
+"""
+
+import copy
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func, inspect as sa_inspect
+
+from app.services.model_invalidation import VersionedSingleton, register_model_invalidation
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("programs", "inclusion", "scope")
+
+IEEPA_PROGRAMS = ("ieepa_fentanyl", "ieepa_reciprocal")
+
+# (valid_from, valid_to or None, value)
+_Segment = Tuple[date, Optional[date], Any]
+
+_MISS = object()
+
+
+def validity_interval(boundaries: Iterable[Optional[date]], as_of_date: date) -> Tuple[date, Optional[date]]:
+    """[valid_from, valid_to) around as_of_date with no boundary date inside it."""
+    valid_from, valid_to = date.min, None
+    for boundary in boundaries:
+        if boundary is None:
+            continue
+        if boundary <= as_of_date:
+            valid_from = max(valid_from, boundary)
+        elif valid_to is None or boundary < valid_to:
+            valid_to = boundary
+    return valid_from, valid_to
+
+
+def _date_boundaries(model, start_column, end_column, *criteria) -> List[date]:
+    rows = model.query.with_entities(start_column, end_column).filter(*criteria).all()
+    return [d for row in rows for d in row if d is not None]
+
+
+class ApplicabilityMatrix:
+    """Interval-stamped program, inclusion and scope answers."""
+
+    def __init__(self, data_version: int = 0, engine_id: Optional[int] = None,
+                 max_entries: int = 200000):
+        """
+        Args:
+            data_version: Tariff data version the matrix is valid for
+            engine_id: id() of the database engine answers are loaded from
+            max_entries: Keys kept per kind (least recently used dropped)
+        """
+        self.data_version = data_version
+        self.engine_id = engine_id
+        self.max_entries = max_entries
+        self._entries: Dict[str, "OrderedDict[Hashable, List[_Segment]]"] = {
+            kind: OrderedDict() for kind in KINDS
+        }
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    # ------------------------------------------------------------------
+    # Lookup
+    # ------------------------------------------------------------------
+
+    def get(self, kind: str, key: Hashable, as_of_date: date, default=None):
+        """Stored answer for key covering as_of_date, or default."""
+        with self._lock:
+            segments = self._entries[kind].get(key)
+            if segments:
+                for valid_from, valid_to, value in segments:
+                    if valid_from <= as_of_date and (valid_to is None or as_of_date < valid_to):
+                        self._entries[kind].move_to_end(key)
+                        return value
+        return default
+
+    def materialize(self, kind: str, key: Hashable, as_of_date: date, loader: Callable[[], Any]):
+        """
+        Answer for key on as_of_date, computing it with loader() on a miss.
+
+        Must be called inside an app context (boundary dates are read on a
+        miss). Returns a copy the caller may mutate.
+        """
+        value = self.get(kind, key, as_of_date, _MISS)
+        if value is not _MISS:
+            self.hits += 1
+            return copy.deepcopy(value)
+
+        self.misses += 1
+        generation = self._generation
+        value = loader()
+        valid_from, valid_to = validity_interval(self.boundaries(kind, key), as_of_date)
+        self.put(kind, key, valid_from, valid_to, value, generation=generation)
+        return copy.deepcopy(value)
+
+    def put(self, kind: str, key: Hashable, valid_from: date, valid_to: Optional[date],
+            value: Any, generation: Optional[int] = None) -> None:
+        """
+        Store an answer for [valid_from, valid_to).
+
+        Skipped when entries were dropped since generation was read, since
+        the answer may predate the change that dropped them.
+        """
+        stored = copy.deepcopy(value)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            entries = self._entries[kind]
+            entries.setdefault(key, []).append((valid_from, valid_to, stored))
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def applicability(self, hts10: str, country_iso: str, as_of_date: date) -> Optional[dict]:
+        """
+        Materialized row for (HTS10, country, date), or None if the program
+        list for the country is not materialized.
+
+        Programs without a stored inclusion or scope outcome are omitted from
+        "inclusions" / "scopes". valid_from / valid_to is the intersection of
+        the joined answers' intervals.
+        """
+        with self._lock:
+            programs = self._segment("programs", country_iso, as_of_date)
+            if programs is None:
+                return None
+            inclusions, scopes = {}, {}
+            for program in programs[2]:
+                program_id = program["program_id"]
+                inclusion = self._segment("inclusion", (hts10, program_id), as_of_date)
+                if inclusion is not None:
+                    inclusions[program_id] = inclusion
+                scope = self._segment("scope", (program_id, country_iso.upper()), as_of_date)
+                if scope is not None:
+                    scopes[program_id] = scope
+            parts = [programs, *inclusions.values(), *scopes.values()]
+
+        ends = [segment[1] for segment in parts if segment[1] is not None]
+        return copy.deepcopy({
+            "hts10": hts10,
+            "country": country_iso,
+            "valid_from": max(segment[0] for segment in parts),
+            "valid_to": min(ends) if ends else None,
+            "programs": programs[2],
+            "inclusions": {program_id: segment[2] for program_id, segment in inclusions.items()},
+            "scopes": {program_id: segment[2] for program_id, segment in scopes.items()},
+        })
+
+    def _segment(self, kind: str, key: Hashable, as_of_date: date) -> Optional[_Segment]:
+        for segment in self._entries[kind].get(key, ()):
+            if segment[0] <= as_of_date and (segment[1] is None or as_of_date < segment[1]):
+                return segment
+        return None
+
+    # ------------------------------------------------------------------
+    # Validity boundaries
+    # ------------------------------------------------------------------
+
+    def boundaries(self, kind: str, key: Hashable) -> List[date]:
+        """
+        Start/end dates of every row the answer for key is derived from.
+
+        A superset is safe (it only shortens intervals). Must be called
+        inside an app context.
+        """
+        from app.web.db.models import tariff_tables as t
+
+        if kind == "programs":
+            return _date_boundaries(
+                t.TariffProgram, t.TariffProgram.effective_date, t.TariffProgram.expiration_date,
+                t.TariffProgram.country.in_((key, "ALL")),
+            )
+
+        if kind == "inclusion":
+            hts10, program_id = key
+            hts_8digit = hts10[:8]
+            program = t.TariffProgram.query.filter_by(program_id=program_id).first()
+            if program is None:
+                return []
+            if program.check_type == "always":
+                if program_id not in IEEPA_PROGRAMS:
+                    return []
+                program_type = "fentanyl" if program_id == "ieepa_fentanyl" else "reciprocal"
+                return _date_boundaries(
+                    t.IeepaRate, t.IeepaRate.effective_start, t.IeepaRate.effective_end,
+                    t.IeepaRate.program_type == program_type,
+                )
+            if program.inclusion_table == "section_301_inclusions":
+                return _date_boundaries(
+                    t.Section301Rate, t.Section301Rate.effective_start, t.Section301Rate.effective_end,
+                    t.Section301Rate.hts_8digit == hts_8digit,
+                )
+            if program.inclusion_table == "section_232_materials":
+                return _date_boundaries(
+                    t.Section232Rate, t.Section232Rate.effective_start, t.Section232Rate.effective_end,
+                    t.Section232Rate.hts_8digit == hts_8digit,
+                    t.Section232Rate.material_type == program.condition_param,
+                )
+            return []
+
+        if kind == "scope":
+            program_id, country_iso = key
+            return _date_boundaries(
+                t.ProgramCountryScope, t.ProgramCountryScope.effective_date,
+                t.ProgramCountryScope.expiration_date,
+                t.ProgramCountryScope.program_id == program_id,
+            ) + _date_boundaries(
+                t.CountryGroupMember, t.CountryGroupMember.effective_date,
+                t.CountryGroupMember.expiration_date,
+                func.upper(t.CountryGroupMember.country_code) == country_iso,
+            )
+
+        raise ValueError(f"Unknown applicability kind: {kind}")
+
+    # ------------------------------------------------------------------
+    # Invalidation
+    # ------------------------------------------------------------------
+
+    def drop(self, changes: dict) -> int:
+        """
+        Drop the entries a committed rule change can affect.
+
+        Args:
+            changes: {"all": bool, "scopes": bool, "ieepa": bool,
+                      "hts_prefixes": set of HTS8 prefixes ("" = every HTS)}
+
+        Returns:
+            Number of keys dropped
+        """
+        with self._lock:
+            self._generation += 1
+            if changes.get("all"):
+                dropped = sum(len(entries) for entries in self._entries.values())
+                for entries in self._entries.values():
+                    entries.clear()
+                return dropped
+
+            dropped = 0
+            if changes.get("scopes"):
+                dropped += len(self._entries["scope"])
+                self._entries["scope"].clear()
+
+            prefixes = tuple(changes.get("hts_prefixes") or ())
+            ieepa = changes.get("ieepa", False)
+            if prefixes or ieepa:
+                inclusions = self._entries["inclusion"]
+                stale = [
+                    (hts10, program_id) for hts10, program_id in inclusions
+                    if (ieepa and program_id in IEEPA_PROGRAMS) or hts10.startswith(prefixes)
+                ]
+                for key in stale:
+                    del inclusions[key]
+                dropped += len(stale)
+            return dropped
+
+    def stats(self) -> dict:
+        """Summary for admin/debug endpoints."""
+        with self._lock:
+            entries = {kind: len(self._entries[kind]) for kind in KINDS}
+        return {
+            "data_version": self.data_version,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# ============================================================================
+# Singleton access
+# ============================================================================
+
+def _new_matrix(data_version: int, engine_id: int) -> ApplicabilityMatrix:
+    if _matrix.current is not None:
+        logger.info(f"Applicability matrix reset at data v{data_version}")
+    return ApplicabilityMatrix(
+        data_version=data_version,
+        engine_id=engine_id,
+        max_entries=int(os.getenv("APPLICABILITY_MATRIX_MAX_ENTRIES", "200000")),
+    )
+
+
+def _keep_after_local_bumps(matrix: ApplicabilityMatrix, data_version: int) -> bool:
+    """Keep the matrix across versions bumped only by this process (its commits were applied)."""
+    from app.services.result_cache import bumped_locally
+
+    if data_version > matrix.data_version and bumped_locally(matrix.data_version, data_version):
+        matrix.data_version = data_version
+        return True
+    return False
+
+
+_matrix = VersionedSingleton(_new_matrix, keep=_keep_after_local_bumps)
+
+
+def get_applicability_matrix() -> ApplicabilityMatrix:
+    """
+    Current applicability matrix; a new empty one after another process
+    changed the tariff data or when the database engine changed.
+
+    Must be called inside an app context.
+    """
+    return _matrix.get()
+
+
+def invalidate_applicability_matrix() -> None:
+    """Drop the matrix; the next lookup starts an empty one."""
+    _matrix.invalidate()
+
+
+# ============================================================================
+# Incremental invalidation on committed rule changes
+# ============================================================================
+
+# Model name -> what a change to one of its rows affects
+_HTS_MODELS = ("Section301Rate", "Section232Rate", "Section232Material")
+_SCOPE_MODELS = ("ProgramCountryScope", "CountryGroup", "CountryGroupMember")
+
+
+def _rule_models():
+    from app.web.db.models import tariff_tables
+    return tuple(getattr(tariff_tables, name)
+                 for name in _HTS_MODELS + _SCOPE_MODELS + ("TariffProgram", "IeepaRate"))
+
+
+def _hts_8digits(obj) -> Set[str]:
+    """Current and previous hts_8digit of a flushed row."""
+    history = sa_inspect(obj).attrs.hts_8digit.history
+    return {code for code in (*history.added, *history.unchanged, *history.deleted) if code}
+
+
+def _record_change(changes, model, obj, change) -> dict:
+    changes = changes or {"all": False, "scopes": False, "ieepa": False, "hts_prefixes": set()}
+    model_name = model.__name__
+    if model_name == "TariffProgram":
+        changes["all"] = True
+    elif model_name == "IeepaRate":
+        changes["ieepa"] = True
+    elif model_name in _SCOPE_MODELS:
+        changes["scopes"] = True
+    elif model_name in _HTS_MODELS:
+        if obj is None:
+            changes["hts_prefixes"].add("")
+        else:
+            changes["hts_prefixes"].update(_hts_8digits(obj) or {""})
+    return changes
+
+
+def _apply_on_commit(changes: dict) -> None:
+    matrix = _matrix.current
+    if matrix is not None:
+        dropped = matrix.drop(changes)
+        logger.debug(f"Applicability matrix: dropped {dropped} entries after commit")
+
+
+register_model_invalidation(_rule_models, _apply_on_commit, record=_record_change)
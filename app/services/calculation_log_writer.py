@@ -0,0 +1,261 @@
+"""
+Calculation Log Writer
+
+v22.0: Batched writer for the v11.0 TariffCalculationLog audit trail.
+
+Every calculate_duties() call appends a log row carrying the full
+calculation_result JSON. Writing it inside the request put an INSERT and a
+COMMIT on every calculation's latency. The writer instead:
+- Collapses repeats of the same replay_key (identical inputs and source
+  documents) into an upsert that increments hit_count on the first row
+- Writes many records per statement (multi-row INSERT ... ON CONFLICT)
+- With ASYNC_CALCULATION_LOG=true, buffers records in a bounded queue
+  (CALCULATION_LOG_QUEUE_SIZE, default 10000) drained by a background
+  thread every CALCULATION_LOG_FLUSH_SECONDS (default 1.0) or
+  CALCULATION_LOG_BATCH_SIZE (default 200) records
+
+Durability: the queue is flushed at interpreter exit (atexit) and by
+close(). When the queue is full the submitting request writes its record
+itself, so records are never dropped. Without ASYNC_CALCULATION_LOG the
+record is upserted synchronously, as before.
+
+Usage:
+    from app.services.calculation_log_writer import get_calculation_log_writer
+
+    get_calculation_log_writer().submit(record)   # dict of TariffCalculationLog columns
+"""
+
+import atexit
+import copy
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def collapse_records(records: List[dict]) -> List[dict]:
+    """
+    One row per replay_key: the first record, with hit_count summed and
+    last_calculated_at set to the latest repeat.
+    """
+    rows: Dict[str, dict] = {}
+    for record in records:
+        key = record["replay_key"]
+        row = rows.get(key)
+        if row is None:
+            rows[key] = {
+                **record,
+                "hit_count": record.get("hit_count", 1),
+                "last_calculated_at": record.get("last_calculated_at") or record["calculated_at"],
+            }
+        else:
+            row["hit_count"] += record.get("hit_count", 1)
+            row["last_calculated_at"] = max(
+                row["last_calculated_at"], record.get("last_calculated_at") or record["calculated_at"]
+            )
+    return list(rows.values())
+
+
+class CalculationLogWriter:
+    """
+    Upserts TariffCalculationLog records, optionally from a background thread.
+
+    One instance per process (see get_calculation_log_writer()).
+    """
+
+    def __init__(self, app=None, asynchronous: bool = False, max_queue: int = 10000,
+                 batch_size: int = 200, flush_seconds: float = 1.0):
+        """
+        Args:
+            app: Flask app for the writer's app context, defaults to
+                 stacking_tools.get_flask_app()
+            asynchronous: Buffer records and write from a background thread
+            max_queue: Queue bound in records
+            batch_size: Records per write
+            flush_seconds: Longest a queued record waits to be written
+        """
+        self._app = app
+        self.asynchronous = asynchronous
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=max_queue)
+        self._write_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self.records_written = 0
+        self.rows_written = 0
+
+    @property
+    def app(self):
+        if self._app is None:
+            from app.chat.tools.stacking_tools import get_flask_app
+            self._app = get_flask_app()
+        return self._app
+
+    def submit(self, record: dict) -> None:
+        """
+        Log one calculation. Never raises.
+
+        record holds TariffCalculationLog columns (replay_key and
+        calculation_result required). Asynchronous mode snapshots the
+        record, so the caller may keep mutating its result.
+        """
+        record = {
+            "id": str(uuid.uuid4()),
+            "calculated_at": datetime.utcnow(),
+            **record,
+        }
+        if not self.asynchronous:
+            self._write_safely([record])
+            return
+
+        self._ensure_thread()
+        record = copy.deepcopy(record)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Back-pressure instead of dropping audit records
+            self._write_safely([record])
+
+    def flush(self) -> None:
+        """Write every queued record now."""
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                return
+            self._write_safely(batch)
+
+    def close(self) -> None:
+        """Stop the background thread and flush what is queued."""
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout=max(5.0, self.flush_seconds * 5))
+        self.flush()
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _drain(self, limit: int) -> List[dict]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._write_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="calculation-log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                continue
+            # Let a burst accumulate into one statement
+            deadline = time.monotonic() + min(self.flush_seconds, 0.05)
+            batch = [first]
+            while len(batch) < self.batch_size and time.monotonic() < deadline:
+                batch.extend(self._drain(self.batch_size - len(batch)))
+                if len(batch) < self.batch_size:
+                    time.sleep(0.005)
+            self._write_safely(batch)
+
+    def _write_safely(self, records: List[dict]) -> None:
+        try:
+            self.write(records)
+        except Exception as e:
+            logger.warning(f"Could not write {len(records)} calculation log record(s): {e}")
+
+    def write(self, records: List[dict]) -> int:
+        """
+        Upsert records in one statement. Returns the number of rows sent.
+
+        Uses INSERT ... ON CONFLICT (replay_key) DO UPDATE on SQLite and
+        PostgreSQL; other dialects fall back to a read-then-write per row.
+        """
+        rows = collapse_records(records)
+        if not rows:
+            return 0
+
+        from app.web.db import db
+        from app.web.db.models.tariff_tables import TariffCalculationLog
+
+        with self._write_lock, self.app.app_context():
+            table = TariffCalculationLog.__table__
+            dialect = db.engine.dialect.name
+            try:
+                if dialect in ("sqlite", "postgresql"):
+                    if dialect == "sqlite":
+                        from sqlalchemy.dialects.sqlite import insert
+                    else:
+                        from sqlalchemy.dialects.postgresql import insert
+                    stmt = insert(table).values(rows)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[table.c.replay_key],
+                        set_={
+                            "hit_count": table.c.hit_count + stmt.excluded.hit_count,
+                            "last_calculated_at": stmt.excluded.last_calculated_at,
+                        },
+                    )
+                    db.session.execute(stmt)
+                else:
+                    for row in rows:
+                        existing = TariffCalculationLog.query.filter_by(replay_key=row["replay_key"]).first()
+                        if existing is None:
+                            db.session.add(TariffCalculationLog(**row))
+                        else:
+                            existing.hit_count = (existing.hit_count or 1) + row["hit_count"]
+                            existing.last_calculated_at = row["last_calculated_at"]
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+        self.records_written += len(records)
+        self.rows_written += len(rows)
+        return len(rows)
+
+    def stats(self) -> dict:
+        """Summary for admin/debug endpoints."""
+        return {
+            "asynchronous": self.asynchronous,
+            "pending": self.pending(),
+            "records_written": self.records_written,
+            "rows_written": self.rows_written,
+        }
+
+
+_writer: Optional[CalculationLogWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_calculation_log_writer() -> CalculationLogWriter:
+    """Get the process-wide calculation log writer (created on first use)."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = CalculationLogWriter(
+                    asynchronous=os.getenv("ASYNC_CALCULATION_LOG", "false").lower() == "true",
+                    max_queue=int(os.getenv("CALCULATION_LOG_QUEUE_SIZE", "10000")),
+                    batch_size=int(os.getenv("CALCULATION_LOG_BATCH_SIZE", "200")),
+                    flush_seconds=float(os.getenv("CALCULATION_LOG_FLUSH_SECONDS", "1.0")),
+                )
+                # Guarantee queued audit records reach the database on shutdown
+                atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,266 @@
+"""
+Calculation Profile
+
+v22.0: Attribute SQL statements and time to the stacking graph node and
+tool that issued them.
+
+A slow calculation used to be opaque: the stacking tools share one
+session, so a query log cannot tell which tool or node ran a statement.
+Inside profile_calculation():
+- Graph nodes (@profiled_node) and stacking tools (@profiled_tool) push
+  themselves onto a per-thread scope stack while they run
+- SQLAlchemy cursor events (installed once on the Engine class) charge
+  each statement's count and time to the innermost active node and tool
+- On exit, per-calculation totals are observed into histograms on the
+  in-process metrics registry (app.services.metrics), e.g.
+  stacking_tool_sql_statements{tool="check_program_inclusion"}, so N+1
+  patterns such as per-slice inclusion checks show up on /admin/metrics
+
+Outside a profile the SQL hooks only do a thread-local lookup; tool calls
+are still timed into graph_tool_duration_seconds (see app.chat.logging_utils
+timed_node for node latency). Nested profile_calculation() blocks reuse the outer profile.
+
+Usage:
+    from app.services.calculation_profile import profile_calculation
+
+    with profile_calculation() as profile:
+        result = rag.calculate_stacking(...)
+    debug = profile.as_dict()
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Optional
+
+from app.services.metrics import COUNT_BUCKETS, LATENCY_BUCKETS, get_metrics_registry, observe_tool
+
+_state = threading.local()
+
+# Charged when a statement runs outside any node or tool scope
+UNSCOPED = "(none)"
+
+
+class ScopeStats:
+    """Calls, wall time and SQL attributed to one node or tool."""
+
+    __slots__ = ("calls", "seconds", "sql_count", "sql_seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "ms": round(self.seconds * 1000, 3),
+            "sql_statements": self.sql_count,
+            "sql_ms": round(self.sql_seconds * 1000, 3),
+        }
+
+
+class CalculationProfile:
+    """
+    Per-calculation breakdown by node and by tool.
+
+    Tool times are inclusive (a tool calling another tool includes its
+    time); SQL is charged only to the innermost tool, so SQL totals add up.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.nodes: Dict[str, ScopeStats] = {}
+        self.tools: Dict[str, ScopeStats] = {}
+        self._node_stack: List[str] = []
+        self._tool_stack: List[str] = []
+
+    def _stats(self, kind: str, name: str) -> ScopeStats:
+        table = self.nodes if kind == "node" else self.tools
+        stats = table.get(name)
+        if stats is None:
+            stats = table[name] = ScopeStats()
+        return stats
+
+    @contextmanager
+    def scope(self, kind: str, name: str):
+        stack = self._node_stack if kind == "node" else self._tool_stack
+        stats = self._stats(kind, name)
+        stats.calls += 1
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats.seconds += time.perf_counter() - start
+            stack.pop()
+
+    def record_sql(self, seconds: float) -> None:
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        for kind, stack in (("node", self._node_stack), ("tool", self._tool_stack)):
+            stats = self._stats(kind, stack[-1] if stack else UNSCOPED)
+            stats.sql_count += 1
+            stats.sql_seconds += seconds
+
+    def as_dict(self) -> dict:
+        """The debug block returned by /tariff/calculate."""
+        def table(entries):
+            ordered = sorted(entries.items(), key=lambda item: (-item[1].sql_count, -item[1].seconds))
+            return {name: stats.as_dict() for name, stats in ordered}
+
+        return {
+            "ms": round(self.seconds * 1000, 3),
+            "sql_statements": self.sql_count,
+            "sql_ms": round(self.sql_seconds * 1000, 3),
+            "nodes": table(self.nodes),
+            "tools": table(self.tools),
+        }
+
+    def observe(self) -> None:
+        """Add this calculation to the /admin/metrics histograms."""
+        registry = get_metrics_registry()
+        registry.histogram(
+            "stacking_calculation_sql_statements", "SQL statements per stacking calculation", COUNT_BUCKETS
+        ).observe(self.sql_count)
+        registry.histogram(
+            "stacking_calculation_sql_seconds", "SQL time per stacking calculation", LATENCY_BUCKETS
+        ).observe(self.sql_seconds)
+
+        tool_sql = registry.histogram(
+            "stacking_tool_sql_statements", "SQL statements per calculation by stacking tool", COUNT_BUCKETS
+        )
+        tool_sql_seconds = registry.histogram(
+            "stacking_tool_sql_seconds", "SQL time per calculation by stacking tool", LATENCY_BUCKETS
+        )
+        tool_calls = registry.histogram(
+            "stacking_tool_calls", "Calls per calculation by stacking tool", COUNT_BUCKETS
+        )
+        for name, stats in self.tools.items():
+            tool_sql.observe(stats.sql_count, tool=name)
+            tool_sql_seconds.observe(stats.sql_seconds, tool=name)
+            if name != UNSCOPED:
+                tool_calls.observe(stats.calls, tool=name)
+
+        node_sql = registry.histogram(
+            "stacking_node_sql_statements", "SQL statements per calculation by stacking graph node", COUNT_BUCKETS
+        )
+        for name, stats in self.nodes.items():
+            node_sql.observe(stats.sql_count, node=name)
+
+
+def active_profile() -> Optional[CalculationProfile]:
+    return getattr(_state, "profile", None)
+
+
+@contextmanager
+def profile_calculation():
+    """
+    Profile the calculation run inside the block.
+
+    Yields:
+        CalculationProfile (the enclosing one when nested)
+    """
+    outer = active_profile()
+    if outer is not None:
+        yield outer
+        return
+
+    install_sql_hooks()
+    profile = CalculationProfile()
+    _state.profile = profile
+    try:
+        yield profile
+    finally:
+        _state.profile = None
+        profile.seconds = time.perf_counter() - profile.started
+        profile.observe()
+
+
+def profiled_node(name: str):
+    """Decorator: charge SQL issued by a graph node to `name`."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = active_profile()
+            if profile is None:
+                return func(*args, **kwargs)
+            with profile.scope("node", name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profiled_tool(name: str):
+    """
+    Decorator: charge SQL issued by a stacking tool to `name`.
+
+    Every call is also recorded in the tool latency metrics
+    (graph_tool_duration_seconds{graph="stacking"}), profiled or not.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = active_profile()
+            start = time.perf_counter()
+            error = True
+            try:
+                if profile is None:
+                    result = func(*args, **kwargs)
+                else:
+                    with profile.scope("tool", name):
+                        result = func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                observe_tool("stacking", name, time.perf_counter() - start, error=error)
+        return wrapper
+    return decorator
+
+
+# ============================================================================
+# SQLAlchemy hooks
+# ============================================================================
+
+_hooks_installed = False
+_hooks_lock = threading.Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if active_profile() is not None:
+        conn.info.setdefault("_profile_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = active_profile()
+    starts = conn.info.get("_profile_start")
+    if profile is not None and starts:
+        profile.record_sql(time.perf_counter() - starts.pop())
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    conn = exception_context.connection
+    starts = conn.info.get("_profile_start") if conn is not None else None
+    if starts:
+        starts.pop()
+
+
+def install_sql_hooks() -> None:
+    """Listen to cursor events on every Engine (idempotent)."""
+    global _hooks_installed
+    if _hooks_installed:
+        return
+    with _hooks_lock:
+        if not _hooks_installed:
+            from sqlalchemy import event
+            from sqlalchemy.engine import Engine
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            event.listen(Engine, "handle_error", _handle_error)
+            _hooks_installed = True
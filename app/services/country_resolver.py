@@ -0,0 +1,347 @@
+"""
+Country Resolver
+
+v22.0: Preloaded country normalization and group membership.
+
+normalize_country() queried CountryAlias on every call before falling back
+to COUNTRY_FALLBACK_MAP, and get_country_group() / the country-scope check
+then queried CountryGroupMember separately. The resolver loads, once per
+tariff data version:
+- CountryAlias rows (alias_norm -> ISO alpha-2/alpha-3, canonical name)
+- COUNTRY_FALLBACK_MAP
+- data/census_to_iso_mapping.csv country names and ISO codes
+- CountryGroupMember rows, indexed both by their raw country_code and by
+  the ISO alpha-2 code that country_code resolves to
+
+so one in-memory lookup returns the ISO code and the group memberships
+active on a date. Names that match nothing exactly are tried against all
+known names with a bounded fuzzy match (difflib); a fuzzy match is only
+accepted when it is close and unambiguous, and is reported as such.
+
+Rebuilt when countries change, like the program rate resolver:
+- Commits that change CountryAlias or CountryGroupMember rows through the ORM
+- Tariff data version bumps from other processes
+- A different database engine (e.g. a test app)
+
+Enabled for the stacking tools with USE_COUNTRY_RESOLVER=true.
+
+Usage:
+    from app.services.country_resolver import get_country_resolver
+
+    resolver = get_country_resolver()           # inside an app context
+    resolution = resolver.resolve("Germnay")    # -> DE, matched_by="fuzzy"
+    resolver.country_group("Germany", date(2025, 6, 1))   # -> "EU"
+"""
+
+import csv
+import difflib
+import logging
+import re
+import threading
+from collections import defaultdict
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app.services.model_invalidation import VersionedSingleton, register_model_invalidation
+
+logger = logging.getLogger(__name__)
+
+CENSUS_ISO_MAPPING_PATH = Path(__file__).parent.parent.parent / "data" / "census_to_iso_mapping.csv"
+
+# Fuzzy matching: minimum similarity, and how far ahead of the runner-up
+# (mapping to a different country) the best candidate must be
+FUZZY_CUTOFF = 0.85
+FUZZY_MARGIN = 0.05
+# Inputs shorter than this are codes, never fuzzy-matched
+FUZZY_MIN_LENGTH = 4
+_FUZZY_CACHE_SIZE = 4096
+
+
+class Membership(NamedTuple):
+    group_id: str
+    country_code: str
+    effective_date: date
+    expiration_date: Optional[date]
+
+    def is_active(self, as_of_date: date) -> bool:
+        if self.effective_date and self.effective_date > as_of_date:
+            return False
+        return self.expiration_date is None or as_of_date < self.expiration_date
+
+
+class CountryResolution(NamedTuple):
+    """One resolved country input."""
+    iso_alpha2: str
+    iso_alpha3: Optional[str]
+    canonical_name: str
+    matched_by: str          # 'alias' | 'fallback' | 'census' | 'iso' | 'fuzzy'
+    memberships: Tuple[Membership, ...]
+
+    def groups(self, as_of_date: date) -> List[str]:
+        """Group ids this country belongs to on a date."""
+        return [m.group_id for m in self.memberships if m.is_active(as_of_date)]
+
+
+class _Entry(NamedTuple):
+    iso_alpha2: str
+    iso_alpha3: Optional[str]
+    canonical_name: Optional[str]   # None: echo the caller's input (fallback map)
+    matched_by: str
+
+
+def normalize_key(text: str) -> str:
+    """Lowercase, trimmed, inner whitespace collapsed (CountryAlias.alias_norm form)."""
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+def _loose_key(key: str) -> str:
+    """Punctuation-insensitive form: "people's rep. of china" -> "peoples rep of china"."""
+    return re.sub(r"[^a-z0-9 ]", "", key).strip()
+
+
+def load_census_countries(path: Path = CENSUS_ISO_MAPPING_PATH) -> List[Tuple[str, str]]:
+    """(iso_alpha2, country_name) rows of the census mapping, skipped rows excluded."""
+    rows = []
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                iso2 = (row.get("iso_alpha2") or "").strip().upper()
+                if iso2 and not (row.get("skip") or "").strip():
+                    rows.append((iso2, (row.get("country_name") or "").strip()))
+    except OSError as e:
+        logger.warning(f"Census country mapping not loaded ({path}): {e}")
+    return rows
+
+
+class CountryResolver:
+    """
+    Immutable country lookup tables.
+
+    Precedence for an exact name: CountryAlias, then COUNTRY_FALLBACK_MAP,
+    then census country names, then bare ISO alpha-2 codes known to any of
+    those sources.
+    """
+
+    def __init__(
+        self,
+        aliases: Iterable = (),
+        fallback_map: Optional[Dict[str, str]] = None,
+        census_countries: Iterable[Tuple[str, str]] = (),
+        members: Iterable = (),
+        data_version: Optional[int] = None,
+        engine_id: Optional[int] = None,
+    ):
+        self.data_version = data_version
+        self.engine_id = engine_id
+
+        index: Dict[str, _Entry] = {}
+        iso_names: Dict[str, Tuple[Optional[str], str]] = {}
+
+        for alias in aliases:
+            key = normalize_key(alias.alias_norm)
+            index.setdefault(key, _Entry(alias.iso_alpha2, alias.iso_alpha3, alias.canonical_name, "alias"))
+            iso_names.setdefault(alias.iso_alpha2.upper(), (alias.iso_alpha3, alias.canonical_name))
+
+        for key, iso2 in (fallback_map or {}).items():
+            index.setdefault(normalize_key(key), _Entry(iso2, None, None, "fallback"))
+
+        for iso2, name in census_countries:
+            if name:
+                index.setdefault(normalize_key(name), _Entry(iso2, None, name, "census"))
+            iso_names.setdefault(iso2, (None, name or iso2))
+
+        for iso2 in (fallback_map or {}).values():
+            iso_names.setdefault(iso2.upper(), (None, iso2.upper()))
+
+        for iso2, (iso3, name) in iso_names.items():
+            index.setdefault(iso2.lower(), _Entry(iso2, iso3, name, "iso"))
+
+        self._index = index
+        self._loose_index = {}
+        for key, entry in index.items():
+            self._loose_index.setdefault(_loose_key(key), entry)
+
+        # Fuzzy candidates: full names only, bucketed by length
+        self._fuzzy_buckets: Dict[int, List[str]] = defaultdict(list)
+        for key in self._loose_index:
+            if len(key) >= FUZZY_MIN_LENGTH:
+                self._fuzzy_buckets[len(key)].append(key)
+        self._fuzzy_cache: Dict[str, Optional[str]] = {}
+        self._fuzzy_lock = threading.Lock()
+
+        # Group memberships by raw country_code and by resolved ISO code
+        self._members_by_code: Dict[str, List[Membership]] = defaultdict(list)
+        self._members_by_iso: Dict[str, List[Membership]] = defaultdict(list)
+        for row in members:
+            membership = Membership(row.group_id, row.country_code, row.effective_date, row.expiration_date)
+            self._members_by_code[row.country_code].append(membership)
+            entry = self._exact(row.country_code)
+            if entry is not None:
+                self._members_by_iso[entry.iso_alpha2.upper()].append(membership)
+
+    # ------------------------------------------------------------------
+    # Resolution
+    # ------------------------------------------------------------------
+
+    def _exact(self, text: str) -> Optional[_Entry]:
+        key = normalize_key(text)
+        entry = self._index.get(key)
+        if entry is None:
+            entry = self._loose_index.get(_loose_key(key))
+        return entry
+
+    def fuzzy_match(self, text: str) -> Optional[str]:
+        """Known name closest to text, or None when none is close and unambiguous."""
+        key = _loose_key(normalize_key(text))
+        if len(key) < FUZZY_MIN_LENGTH:
+            return None
+        if key in self._fuzzy_cache:
+            return self._fuzzy_cache[key]
+
+        candidates = [
+            name
+            for length in range(len(key) - 2, len(key) + 3)
+            for name in self._fuzzy_buckets.get(length, ())
+        ]
+        matcher = difflib.SequenceMatcher(b=key, autojunk=False)
+        scored = []
+        for name in candidates:
+            matcher.set_seq1(name)
+            if matcher.real_quick_ratio() < FUZZY_CUTOFF or matcher.quick_ratio() < FUZZY_CUTOFF:
+                continue
+            score = matcher.ratio()
+            if score >= FUZZY_CUTOFF:
+                scored.append((score, name))
+        scored.sort(reverse=True)
+
+        match = None
+        if scored:
+            best_score, best = scored[0]
+            best_iso = self._loose_index[best].iso_alpha2
+            rivals = [s for s, name in scored[1:] if self._loose_index[name].iso_alpha2 != best_iso]
+            if not rivals or best_score - rivals[0] >= FUZZY_MARGIN:
+                match = best
+
+        with self._fuzzy_lock:
+            if len(self._fuzzy_cache) >= _FUZZY_CACHE_SIZE:
+                self._fuzzy_cache.clear()
+            self._fuzzy_cache[key] = match
+        return match
+
+    def resolve(self, country_input: str, fuzzy: bool = True) -> Optional[CountryResolution]:
+        """Resolve a country name or code; None when it matches nothing."""
+        if not country_input:
+            return None
+        entry = self._exact(country_input)
+        matched_by = entry.matched_by if entry else None
+        if entry is None and fuzzy:
+            name = self.fuzzy_match(country_input)
+            if name is not None:
+                entry, matched_by = self._loose_index[name], "fuzzy"
+        if entry is None:
+            return None
+
+        iso2 = entry.iso_alpha2.upper()
+        return CountryResolution(
+            iso_alpha2=entry.iso_alpha2,
+            iso_alpha3=entry.iso_alpha3,
+            canonical_name=entry.canonical_name or country_input,
+            matched_by=matched_by,
+            memberships=tuple(self._members_by_iso.get(iso2, ())),
+        )
+
+    def normalize(self, country_input: str) -> dict:
+        """Same result shape as stacking_tools.normalize_country(), plus matched_by."""
+        resolution = self.resolve(country_input)
+        if resolution is None:
+            return {
+                "iso_alpha2": country_input.upper()[:2] if len(country_input) == 2 else None,
+                "iso_alpha3": None,
+                "canonical_name": country_input,
+                "original_input": country_input,
+                "normalized": False,
+                "matched_by": None,
+            }
+        return {
+            "iso_alpha2": resolution.iso_alpha2,
+            "iso_alpha3": resolution.iso_alpha3,
+            "canonical_name": resolution.canonical_name,
+            "original_input": country_input,
+            "normalized": True,
+            "matched_by": resolution.matched_by,
+        }
+
+    # ------------------------------------------------------------------
+    # Group membership
+    # ------------------------------------------------------------------
+
+    def country_group(self, country: str, as_of_date: date) -> str:
+        """
+        Group for rate lookups (get_country_group semantics).
+
+        A CountryGroupMember whose country_code equals the input wins, as
+        before; otherwise any member row for the same ISO code (so "DE",
+        "Germany" and "Deutschland" resolve alike). 'default' if none.
+        """
+        for membership in self._members_by_code.get(country, ()):
+            if membership.is_active(as_of_date):
+                return membership.group_id
+        resolution = self.resolve(country, fuzzy=False)
+        if resolution is not None:
+            groups = resolution.groups(as_of_date)
+            if groups:
+                return groups[0]
+        return "default"
+
+    def is_group_member(self, group_id: str, country_iso2: str, as_of_date: date) -> bool:
+        """Whether the country (ISO alpha-2) is in the group on a date."""
+        target = country_iso2.upper()
+        memberships = self._members_by_iso.get(target) or self._members_by_code.get(country_iso2, ())
+        return any(m.group_id == group_id and m.is_active(as_of_date) for m in memberships)
+
+    @classmethod
+    def load(cls, data_version: Optional[int] = None, engine_id: Optional[int] = None,
+             census_path: Path = CENSUS_ISO_MAPPING_PATH) -> "CountryResolver":
+        """Build from the database and census mapping. Must be called inside an app context."""
+        from app.chat.tools.stacking_tools import COUNTRY_FALLBACK_MAP
+        from app.web.db.models.tariff_tables import CountryAlias, CountryGroupMember
+
+        return cls(
+            aliases=CountryAlias.query.order_by(CountryAlias.id).all(),
+            fallback_map=COUNTRY_FALLBACK_MAP,
+            census_countries=load_census_countries(census_path),
+            members=CountryGroupMember.query.order_by(CountryGroupMember.id).all(),
+            data_version=data_version,
+            engine_id=engine_id,
+        )
+
+
+def _build_resolver(data_version: int, engine_id: int) -> CountryResolver:
+    resolver = CountryResolver.load(data_version=data_version, engine_id=engine_id)
+    logger.info(f"Built country resolver (data v{data_version})")
+    return resolver
+
+
+def _country_models():
+    from app.web.db.models.tariff_tables import CountryAlias, CountryGroupMember
+    return CountryAlias, CountryGroupMember
+
+
+_resolver = VersionedSingleton(_build_resolver)
+register_model_invalidation(_country_models, lambda changes: invalidate_country_resolver())
+
+
+def get_country_resolver() -> CountryResolver:
+    """
+    Current country resolver, rebuilt when countries or the tariff data
+    version changed.
+
+    Must be called inside an app context.
+    """
+    return _resolver.get()
+
+
+def invalidate_country_resolver() -> None:
+    """Drop the resolver; the next lookup rebuilds it."""
+    _resolver.invalidate()
@@ -0,0 +1,401 @@
+"""
+Entry Batch Calculator
+
+v22.0: Calculate tariff stacking for every line of a multi-line customs entry.
+
+Brokers file entries with hundreds of lines that share an import date (and
+usually a country of origin). Calling POST /tariff/calculate per line builds
+a new StackingRAG and repeats every lookup for each line. The batch
+calculator instead:
+- Runs every line on the direct (no LangGraph, no checkpoint) stacking engine
+- Resolves entry-invariant lookups once via stacking_tools.shared_lookups()
+  (country normalization, applicable programs, DutyRule rows)
+- Serves rule-table lookups from the in-memory rule snapshot
+  (app.services.rule_snapshot) instead of per-line SQL
+- Fetches data freshness once per entry
+- Fetches Section 301 exclusion candidates once per distinct HTS code
+- With USE_RATE_RESOLVER, rates every program for all lines of a country
+  in one vectorized call (stacking_tools.prefetch_program_rates)
+
+stream_entry_batch() is the streaming form: it yields each line's result as
+soon as it is calculated and ends with a summary record (totals, errors,
+data version), for NDJSON responses on large batches.
+
+Usage:
+    from app.services.entry_batch import calculate_entry_batch
+
+    result = calculate_entry_batch(
+        lines=[{"hts_code": "8544.42.9090", "product_value": 10000}],
+        country="China",
+        import_date="2025-06-01",
+    )
+"""
+
+import json
+import logging
+import uuid
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BatchLineError(ValueError):
+    """Raised when a batch line is missing required fields."""
+
+
+def _parse_line(raw: dict, index: int, default_country: Optional[str]) -> dict:
+    """Validate one batch line and apply entry-level defaults."""
+    if not isinstance(raw, dict):
+        raise BatchLineError(f"Line {index} must be an object")
+
+    hts_code = (raw.get("hts_code") or "").strip()
+    country = (raw.get("country") or default_country or "").strip()
+    if not hts_code or not country:
+        raise BatchLineError(f"Line {index}: HTS code and country are required")
+
+    try:
+        product_value = float(raw.get("product_value") or 10000)
+    except (TypeError, ValueError):
+        raise BatchLineError(f"Line {index}: product_value must be a number")
+
+    return {
+        "line_id": raw.get("line_id", index),
+        "hts_code": hts_code,
+        "country": country,
+        "product_value": product_value,
+        "product_description": (raw.get("product_description") or "").strip() or f"Product ({hts_code})",
+        "materials": raw.get("materials"),
+        "quantity": raw.get("quantity"),
+        "quantity_uom": raw.get("quantity_uom") or "PCS",
+    }
+
+
+def _has_301(entries: List[dict]) -> bool:
+    """Same check as calculate_tariff: any applied Section 301 stack line."""
+    return any(
+        line.get("program", "").startswith("Section 301")
+        for entry in entries
+        for line in entry.get("stack", [])
+        if line.get("action") == "apply"
+    )
+
+
+class EntryBatchCalculator:
+    """
+    Runs the stacking graph for all lines of one entry.
+
+    One instance per entry: exclusion candidates and freshness info are
+    shared by every line.
+    """
+
+    def __init__(self, import_date: Optional[str] = None, batch_id: Optional[str] = None):
+        from app.chat.graphs.stacking_rag import StackingRAG
+
+        self.import_date = import_date or date.today().isoformat()
+        self.batch_id = batch_id or str(uuid.uuid4())
+        self.rag = StackingRAG(conversation_id=self.batch_id, checkpoint=False, engine="direct")
+        self._exclusions: Dict[str, List[dict]] = {}
+        self._freshness = None
+
+    def calculate_line(self, index: int, raw: dict, default_country: Optional[str] = None) -> dict:
+        """
+        Calculate one line. Errors are reported on the line, never raised.
+
+        Lines that need material values are returned with needs_materials=True
+        and no entries; the caller resubmits them with materials.
+        """
+        try:
+            line = _parse_line(raw, index, default_country)
+        except BatchLineError as e:
+            line_id = raw.get("line_id", index) if isinstance(raw, dict) else index
+            return {"line": index, "line_id": line_id, "success": False, "error": str(e)}
+
+        base = {
+            "line": index,
+            "line_id": line["line_id"],
+            "hts_code": line["hts_code"],
+            "country": line["country"],
+            "product_description": line["product_description"],
+            "product_value": line["product_value"],
+            "materials": line["materials"] or {},
+        }
+
+        try:
+            result = self.rag.calculate_stacking(
+                hts_code=line["hts_code"],
+                country=line["country"],
+                product_description=line["product_description"],
+                product_value=line["product_value"],
+                materials=line["materials"],
+                import_date=self.import_date,
+                quantity=line["quantity"],
+                quantity_uom=line["quantity_uom"],
+                thread_id=f"{self.batch_id}:{index}",
+            )
+        except Exception as e:
+            return {**base, "success": False, "error": str(e)}
+
+        if result.get("awaiting_user_input"):
+            return {
+                **base,
+                "success": True,
+                "needs_materials": True,
+                "applicable_materials": result.get("applicable_materials", []),
+                "entries": [],
+                "total_duty": None,
+            }
+
+        entries = result.get("entries", [])
+        total_duty = result.get("total_duty") or {}
+        return {
+            **base,
+            "success": True,
+            "needs_materials": False,
+            "entries": entries,
+            "total_duty": total_duty,
+            "effective_rate": total_duty.get("effective_rate", 0),
+            "potential_exclusions": self.exclusion_candidates(line["hts_code"]) if _has_301(entries) else [],
+        }
+
+    def prefetch_rates(self, lines: List[dict], default_country: Optional[str] = None) -> None:
+        """
+        Rate every program for all lines at once, one call per country
+        (see stacking_tools.prefetch_program_rates). Call inside shared_lookups().
+        """
+        from app.chat.tools.stacking_tools import prefetch_program_rates
+
+        hts_by_country: Dict[str, List[str]] = {}
+        for index, raw in enumerate(lines):
+            try:
+                line = _parse_line(raw, index, default_country)
+            except BatchLineError:
+                continue
+            hts_by_country.setdefault(line["country"], []).append(line["hts_code"])
+        for country, hts_codes in hts_by_country.items():
+            try:
+                prefetch_program_rates(country, hts_codes, self.import_date)
+            except Exception as e:
+                logger.warning(f"Rate prefetch for {country} failed: {e}")
+
+    def exclusion_candidates(self, hts_code: str) -> List[dict]:
+        """Section 301 exclusion candidates, looked up once per HTS code."""
+        if hts_code not in self._exclusions:
+            try:
+                from app.models.section301 import ExclusionClaim
+                candidates = ExclusionClaim.find_exclusion_candidates(
+                    hts_code, date.fromisoformat(self.import_date)
+                )
+                self._exclusions[hts_code] = [c.as_dict() for c in candidates]
+            except Exception:
+                self._exclusions[hts_code] = []  # Don't break calculation if exclusion query fails
+        return self._exclusions[hts_code]
+
+    def freshness(self) -> dict:
+        """Data freshness, fetched once per entry."""
+        if self._freshness is None:
+            try:
+                from app.services.freshness import get_freshness_service
+                self._freshness = get_freshness_service().get_all_freshness()
+            except Exception:
+                self._freshness = {}
+        return self._freshness
+
+
+class EntryTotals:
+    """
+    v22.0: Running entry-level totals, fed one line result at a time.
+
+    Only successfully calculated lines contribute to value and duty.
+    """
+
+    def __init__(self):
+        self.line_count = 0
+        self.calculated_lines = 0
+        self.needs_materials_lines = 0
+        self.error_lines = 0
+        self.total_value = 0.0
+        self.total_duty_amount = 0.0
+        self.by_program: Dict[str, float] = {}
+
+    def add(self, line: dict) -> None:
+        self.line_count += 1
+        if line.get("needs_materials"):
+            self.needs_materials_lines += 1
+        if not line.get("success"):
+            self.error_lines += 1
+        if not line.get("success") or line.get("needs_materials"):
+            return
+
+        self.calculated_lines += 1
+        total_duty = line.get("total_duty") or {}
+        self.total_value += line["product_value"]
+        self.total_duty_amount += total_duty.get("total_duty_amount", 0)
+        for item in total_duty.get("breakdown", []):
+            if item.get("action") in ("disclaim", "skip"):
+                continue
+            program_id = item.get("program_id")
+            self.by_program[program_id] = self.by_program.get(program_id, 0) + item.get("duty_amount", 0)
+
+    def as_dict(self) -> dict:
+        return {
+            "line_count": self.line_count,
+            "calculated_lines": self.calculated_lines,
+            "needs_materials_lines": self.needs_materials_lines,
+            "error_lines": self.error_lines,
+            "total_value": round(self.total_value, 2),
+            "total_duty_amount": round(self.total_duty_amount, 2),
+            "effective_rate": (
+                round(self.total_duty_amount / self.total_value, 4) if self.total_value > 0 else 0
+            ),
+            "by_program": {k: round(v, 2) for k, v in self.by_program.items()},
+        }
+
+
+def summarize_lines(lines: List[dict]) -> dict:
+    """
+    Entry-level totals over per-line results.
+
+    Only successfully calculated lines contribute to value and duty.
+    """
+    totals = EntryTotals()
+    for line in lines:
+        totals.add(line)
+    return totals.as_dict()
+
+
+def calculate_entry_batch(
+    lines: List[dict],
+    country: Optional[str] = None,
+    import_date: Optional[str] = None,
+) -> dict:
+    """
+    Calculate all lines of a customs entry.
+
+    Args:
+        lines: Line dicts with hts_code, product_value and optional country,
+               product_description, materials, quantity, quantity_uom, line_id
+        country: Default country of origin for lines that omit it
+        import_date: Shared import date (YYYY-MM-DD), defaults to today
+
+    Returns:
+        Dict with per-line results, entry totals and data freshness
+    """
+    from app.chat.tools.stacking_tools import shared_lookups
+
+    calculator = EntryBatchCalculator(import_date=import_date)
+    with shared_lookups(rule_snapshot=True):
+        calculator.prefetch_rates(lines, default_country=country)
+        results = [
+            calculator.calculate_line(index, raw, default_country=country)
+            for index, raw in enumerate(lines)
+        ]
+
+    logger.info(f"Calculated entry batch {calculator.batch_id}: {len(results)} lines")
+
+    return {
+        "batch_id": calculator.batch_id,
+        "import_date": calculator.import_date,
+        "lines": results,
+        "entry_total": summarize_lines(results),
+        "data_freshness": calculator.freshness(),
+    }
+
+
+# ============================================================================
+# v22.0: Streaming (NDJSON) batches
+# ============================================================================
+
+# Line errors repeated in the summary record; the rest are only counted
+MAX_SUMMARY_ERRORS = 100
+
+
+def read_ndjson_lines(stream: Iterable) -> Iterator:
+    """
+    Decode one JSON value per non-blank line of an NDJSON byte/str stream.
+
+    Lines are read lazily. A line that is not valid JSON is yielded as a
+    BatchLineError so it is reported on its own result record.
+    """
+    for number, raw in enumerate(stream, 1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            yield json.loads(raw)
+        except ValueError as e:
+            yield BatchLineError(f"Request line {number} is not valid JSON: {e}")
+
+
+def _data_version() -> Optional[int]:
+    try:
+        from app.chat.tools.stacking_tools import tool_app_context
+        from app.services.result_cache import get_tariff_data_version
+        with tool_app_context():
+            return get_tariff_data_version()
+    except Exception:
+        return None
+
+
+def stream_entry_batch(
+    lines: Iterable,
+    country: Optional[str] = None,
+    import_date: Optional[str] = None,
+) -> Iterator[dict]:
+    """
+    Calculate a batch lazily, one result record per line, then a summary.
+
+    Each line is calculated only when the consumer asks for the next record,
+    so a slow client paces the calculation and finished records are not
+    kept: memory is independent of the number of lines (beyond the
+    per-distinct-HTS lookup memo). lines may itself be lazy (see
+    read_ndjson_lines).
+
+    Yields:
+        {"type": "line", ...calculate_line() result} per line, then
+        {"type": "summary", "batch_id", "import_date", "entry_total",
+         "errors", "data_version", "data_freshness"}
+    """
+    from app.chat.tools.stacking_tools import shared_lookups
+
+    calculator = EntryBatchCalculator(import_date=import_date)
+    totals = EntryTotals()
+    errors: List[dict] = []
+    data_version = _data_version()
+    failure = None
+
+    with shared_lookups(rule_snapshot=True):
+        try:
+            for index, raw in enumerate(lines):
+                if isinstance(raw, BatchLineError):
+                    result = {"line": index, "line_id": index, "success": False, "error": str(raw)}
+                else:
+                    result = calculator.calculate_line(index, raw, default_country=country)
+                totals.add(result)
+                if not result.get("success") and len(errors) < MAX_SUMMARY_ERRORS:
+                    errors.append({k: result.get(k) for k in ("line", "line_id", "error")})
+                yield {"type": "line", **result}
+        except Exception as e:
+            # e.g. the request body stream broke; still close with a summary
+            logger.warning(f"Streaming entry batch {calculator.batch_id} aborted: {e}")
+            failure = str(e)
+
+    logger.info(f"Streamed entry batch {calculator.batch_id}: {totals.line_count} lines")
+
+    summary = {
+        "type": "summary",
+        "success": failure is None,
+        "batch_id": calculator.batch_id,
+        "import_date": calculator.import_date,
+        "entry_total": totals.as_dict(),
+        "errors": errors,
+        "data_version": data_version,
+        "data_freshness": calculator.freshness(),
+    }
+    if failure is not None:
+        summary["error"] = failure
+    end_version = _data_version()
+    if end_version != data_version:
+        # Tariff data changed mid-batch: earlier and later lines may differ
+        summary["data_version_end"] = end_version
+    yield summary
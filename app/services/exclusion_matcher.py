@@ -0,0 +1,150 @@
+"""
+Exclusion Claim Matcher
+
+v22.0: Precomputed HTS index over Section 301 exclusion claims.
+
+ExclusionClaim.find_exclusion_candidates() used to load every active claim
+and walk each row's hts_constraints JSON in Python, on every
+/tariff/calculate where Section 301 applies (and again in
+Section301Engine._check_exclusions). The matcher instead maps:
+- HTS10 exact codes -> claim entries
+- HTS8 prefixes (any length, as stored) -> claim entries
+where an entry is (load order, claim id, effective_start, effective_end).
+
+A lookup is one dict probe for the HTS10 plus one per prefix length of the
+HTS8 (at most 9), independent of the number of claims. HTS10 matches still
+win over HTS8 prefix matches.
+
+Rebuilt when claims change:
+- Commits that insert, update or delete ExclusionClaim rows through the ORM
+  (including bulk query.delete()/update()) drop the matcher in this process
+- Writers in other processes bump the tariff data version
+  (populate_exclusion_claims.py does); the matcher is stamped with the
+  version it was built at
+- A different database engine (e.g. a test app) also triggers a rebuild
+
+Usage:
+    from app.services.exclusion_matcher import get_exclusion_matcher
+
+    claim_ids = get_exclusion_matcher().match_ids("8536.90.4000", date(2026, 1, 15))
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from app.services.model_invalidation import VersionedSingleton, register_model_invalidation
+
+logger = logging.getLogger(__name__)
+
+# (load order, claim id, effective_start, effective_end)
+_Entry = Tuple[int, str, date, Optional[date]]
+
+
+def _as_list(codes) -> List[str]:
+    if not codes:
+        return []
+    if isinstance(codes, str):
+        return [codes]
+    return list(codes)
+
+
+class ExclusionClaimMatcher:
+    """HTS10-exact and HTS8-prefix index of exclusion claims."""
+
+    def __init__(self, claims, data_version: int = 0, engine_id: Optional[int] = None):
+        """
+        Args:
+            claims: Iterable of (id, hts_constraints, effective_start,
+                    effective_end) in query order
+            data_version: Tariff data version the claims were loaded at
+            engine_id: id() of the database engine they were loaded from
+        """
+        self.data_version = data_version
+        self.engine_id = engine_id
+        self._hts10: Dict[str, List[_Entry]] = defaultdict(list)
+        self._prefixes: Dict[str, List[_Entry]] = defaultdict(list)
+        self.claim_count = 0
+
+        for order, (claim_id, constraints, start, end) in enumerate(claims):
+            self.claim_count += 1
+            if not constraints:
+                continue
+            entry = (order, claim_id, start, end)
+            for code in set(_as_list(constraints.get("hts10_exact"))):
+                self._hts10[code].append(entry)
+            for prefix in set(_as_list(constraints.get("hts8_prefix"))):
+                self._prefixes[prefix].append(entry)
+
+        self._hts10 = dict(self._hts10)
+        self._prefixes = dict(self._prefixes)
+
+    @classmethod
+    def load(cls, data_version: int = 0) -> "ExclusionClaimMatcher":
+        """Build from the exclusion claims table. Must be called inside an app context."""
+        from app.models.section301 import ExclusionClaim
+        from app.web.db import db
+
+        claims = ExclusionClaim.query.with_entities(
+            ExclusionClaim.id,
+            ExclusionClaim.hts_constraints,
+            ExclusionClaim.effective_start,
+            ExclusionClaim.effective_end,
+        ).all()
+        return cls(claims, data_version=data_version, engine_id=id(db.engine))
+
+    @staticmethod
+    def _active(entries: List[_Entry], entry_date: date) -> List[_Entry]:
+        return [
+            entry for entry in entries
+            if entry[2] <= entry_date and (entry[3] is None or entry_date < entry[3])
+        ]
+
+    def match_ids(self, hts_code: str, entry_date: date) -> List[str]:
+        """
+        Claim IDs matching the HTS code on entry_date, in load order.
+
+        Exact HTS10 matches only if any; otherwise claims with an HTS8 prefix
+        the code's first 8 digits start with.
+        """
+        hts_normalized = hts_code.replace(".", "").strip()
+        exact = self._active(self._hts10.get(hts_normalized, []), entry_date)
+        if exact:
+            return [entry[1] for entry in sorted(exact)]
+
+        hts8 = hts_normalized[:8]
+        matched: Dict[str, _Entry] = {}
+        for length in range(len(hts8) + 1):
+            for entry in self._active(self._prefixes.get(hts8[:length], []), entry_date):
+                matched[entry[1]] = entry
+        return [entry[1] for entry in sorted(matched.values())]
+
+
+def _build_matcher(data_version: int, engine_id: int) -> ExclusionClaimMatcher:
+    matcher = ExclusionClaimMatcher.load(data_version=data_version)
+    logger.info(f"Built exclusion claim matcher ({matcher.claim_count} claims, data v{data_version})")
+    return matcher
+
+
+def _claim_models():
+    from app.models.section301 import ExclusionClaim
+    return (ExclusionClaim,)
+
+
+_matcher = VersionedSingleton(_build_matcher)
+register_model_invalidation(_claim_models, lambda changes: invalidate_exclusion_matcher())
+
+
+def get_exclusion_matcher() -> ExclusionClaimMatcher:
+    """
+    Current exclusion matcher, rebuilt if claims changed since it was built.
+
+    Must be called inside an app context.
+    """
+    return _matcher.get()
+
+
+def invalidate_exclusion_matcher() -> None:
+    """Drop the matcher; the next lookup rebuilds it."""
+    _matcher.invalidate()
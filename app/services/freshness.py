@@ -3,13 +3,30 @@ Data Freshness Service
 
 Provides freshness information for tariff data sources.
 Used by UI to show when data was last updated and watcher status.
+
+v22.0: Served from an in-memory snapshot instead of running
+MAX(updated_at)/COUNT(*) over every source table (and the watcher queries)
+on each request:
+- The snapshot holds raw facts (last update, record count, watcher status);
+  relative times and statuses are derived when served
+- Commits through the ORM that add, change or delete rows of a source table
+  update the snapshot incrementally (bulk statements mark it for refresh)
+- A snapshot older than FRESHNESS_REFRESH_SECONDS (default 300) is still
+  served while a background thread reloads it, so table scans never run on
+  the request path after the first load. 0 reloads on every call (the
+  pre-v22 behaviour).
 """
 
 from datetime import datetime, date, timedelta
 from typing import Dict, Optional
 import logging
+import os
+import threading
+import time
 
+from flask import current_app, has_app_context
 from sqlalchemy import func, text
+from app.services.model_invalidation import register_model_invalidation
 from app.web.db import db
 
 logger = logging.getLogger(__name__)
@@ -68,6 +85,25 @@ class FreshnessService:
         },
     }
 
+    def __init__(self, refresh_seconds: Optional[float] = None):
+        """
+        Args:
+            refresh_seconds: Snapshot age that triggers a background reload,
+                             defaults to FRESHNESS_REFRESH_SECONDS (300)
+        """
+        if refresh_seconds is None:
+            refresh_seconds = float(os.getenv("FRESHNESS_REFRESH_SECONDS", "300"))
+        self.refresh_seconds = refresh_seconds
+        self._snapshot: Optional[dict] = None
+        self._loaded_at = 0.0       # time.monotonic() of the last full load
+        self._stale = False         # Set by bulk writes: reload on next read
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    @property
+    def tables(self) -> set:
+        return {config["table"] for config in self.DATA_SOURCES.values()}
+
     def get_all_freshness(self) -> Dict[str, dict]:
         """
         Get freshness info for all data sources.
@@ -75,11 +111,101 @@ class FreshnessService:
         Returns:
             Dict mapping program_id to freshness info
         """
+        snapshot = self._get_snapshot()
         result = {}
         for program_id in self.DATA_SOURCES:
-            result[program_id] = self.get_program_freshness(program_id)
+            result[program_id] = self._program_freshness(program_id, snapshot)
         return result
 
+    # ------------------------------------------------------------------
+    # v22.0: Snapshot maintenance
+    # ------------------------------------------------------------------
+
+    def load_snapshot(self) -> dict:
+        """
+        Read every source table and watcher now and replace the snapshot.
+
+        Must be called inside an app context.
+        """
+        loaded_at = time.monotonic()
+        snapshot = {
+            "engine_id": id(db.engine),
+            "tables": {
+                table: {
+                    "last_updated": self._get_last_update(table),
+                    "record_count": self._get_record_count(table),
+                }
+                for table in self.tables
+            },
+            "watchers": {
+                config["watcher"]: self._get_watcher_status(config["watcher"])
+                for config in self.DATA_SOURCES.values()
+            },
+        }
+        with self._lock:
+            self._snapshot = snapshot
+            self._loaded_at = loaded_at
+            self._stale = False
+        return snapshot
+
+    def invalidate(self) -> None:
+        """Reload the snapshot (in the background) on the next read."""
+        with self._lock:
+            self._stale = True
+
+    def record_changes(self, changes: Dict[str, dict]) -> None:
+        """
+        Apply committed row changes to the snapshot.
+
+        Args:
+            changes: table -> {"added": int, "deleted": int,
+                     "last_updated": datetime or None}
+        """
+        with self._lock:
+            if self._snapshot is None:
+                return
+            tables = dict(self._snapshot["tables"])
+            for table, change in changes.items():
+                if table not in tables:
+                    continue
+                entry = dict(tables[table])
+                entry["record_count"] = max(0, entry["record_count"] + change["added"] - change["deleted"])
+                if change["last_updated"] and (
+                        entry["last_updated"] is None or change["last_updated"] > entry["last_updated"]):
+                    entry["last_updated"] = change["last_updated"]
+                tables[table] = entry
+            self._snapshot = {**self._snapshot, "tables": tables}
+
+    def _get_snapshot(self) -> dict:
+        """Current snapshot; loads on first use, reloads in the background when old."""
+        snapshot = self._snapshot
+        if snapshot is None or self.refresh_seconds <= 0 or snapshot["engine_id"] != id(db.engine):
+            return self.load_snapshot()
+        if self._stale or time.monotonic() - self._loaded_at >= self.refresh_seconds:
+            self._refresh_in_background()
+        return snapshot
+
+    def _refresh_in_background(self) -> None:
+        if not has_app_context():
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        app = current_app._get_current_object()
+
+        def refresh():
+            try:
+                with app.app_context():
+                    self.load_snapshot()
+            except Exception as e:
+                logger.warning(f"Freshness snapshot refresh failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=refresh, name="freshness-refresh", daemon=True).start()
+
     def get_program_freshness(self, program_id: str) -> dict:
         """
         Get freshness info for a specific program.
@@ -90,22 +216,27 @@ class FreshnessService:
         Returns:
             Dict with freshness details
         """
-        config = self.DATA_SOURCES.get(program_id)
-        if not config:
+        if program_id not in self.DATA_SOURCES:
             return {"error": f"Unknown program: {program_id}"}
+        return self._program_freshness(program_id, self._get_snapshot())
+
+    def _program_freshness(self, program_id: str, snapshot: dict) -> dict:
+        """Freshness details for one program from a snapshot."""
+        config = self.DATA_SOURCES[program_id]
+        table = snapshot["tables"][config["table"]]
 
         # Get last update time
-        last_updated = self._get_last_update(config["table"])
+        last_updated = table["last_updated"]
 
         # Calculate staleness
         stale_days = self.STALE_THRESHOLDS.get(program_id, 30)
         status = self._calculate_status(last_updated, stale_days)
 
         # Get watcher status
-        watcher_status = self._get_watcher_status(config["watcher"])
+        watcher_status = dict(snapshot["watchers"][config["watcher"]])
 
         # Get record count
-        record_count = self._get_record_count(config["table"])
+        record_count = table["record_count"]
 
         return {
             "program_id": program_id,
@@ -262,6 +393,57 @@ class FreshnessService:
 _freshness_service = None
 
 
+# ============================================================================
+# v22.0: Incremental snapshot updates on commit
+# ============================================================================
+
+def _row_timestamp(obj) -> datetime:
+    """Timestamp set on the row, else now; never loads expired attributes."""
+    stamp = obj.__dict__.get("updated_at") or obj.__dict__.get("created_at") or datetime.utcnow()
+    return stamp if isinstance(stamp, datetime) else datetime.combine(stamp, datetime.min.time())
+
+
+def _source_models():
+    from app.web.db.models import tariff_tables
+    tables = {config["table"] for config in FreshnessService.DATA_SOURCES.values()}
+    return tuple(
+        model for model in vars(tariff_tables).values()
+        if isinstance(model, type) and getattr(model, "__tablename__", None) in tables
+    )
+
+
+def _record_source_change(changes, model, obj, change):
+    if _freshness_service is None:
+        return changes
+    changes = changes or {"tables": {}, "bulk": False}
+    if obj is None:
+        changes["bulk"] = True
+        return changes
+    table = changes["tables"].setdefault(model.__tablename__, {"added": 0, "deleted": 0, "last_updated": None})
+    if change == "new":
+        table["added"] += 1
+    elif change == "deleted":
+        table["deleted"] += 1
+    if change != "deleted":
+        stamp = _row_timestamp(obj)
+        if table["last_updated"] is None or stamp > table["last_updated"]:
+            table["last_updated"] = stamp
+    return changes
+
+
+def _apply_source_changes(changes: dict) -> None:
+    service = _freshness_service
+    if service is None:
+        return
+    if changes["tables"]:
+        service.record_changes(changes["tables"])
+    if changes["bulk"]:
+        service.invalidate()
+
+
+register_model_invalidation(_source_models, _apply_source_changes, record=_record_source_change)
+
+
 def get_freshness_service() -> FreshnessService:
     """Get the singleton FreshnessService instance."""
     global _freshness_service
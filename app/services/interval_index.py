@@ -0,0 +1,107 @@
+"""
+Temporal Interval Index
+
+v22.0: Per-key index that resolves "row as of date D" with one binary search.
+
+The temporal rate tables (Section 301, Section 232, IEEPA) answer every
+lookup with "rows for this key active on D, ordered by precedence, first".
+Activity only changes on an effective_start or effective_end date, so the
+winner is constant between consecutive boundary dates. The index computes
+the winner for every segment once, at build time, with the same precedence
+function the query applies; a lookup is then a bisect over the key's
+boundary dates.
+
+Usage:
+    index = TemporalIntervalIndex(
+        rows, key_func=lambda r: r.hts_8digit, pick=latest_start_first,
+    )
+    rate = index.get("85444290", date(2025, 6, 1))
+"""
+
+from bisect import bisect_right
+from datetime import date
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+
+def latest_start_first(rows: Sequence, start_attr: str = "effective_start"):
+    """Most recent start date wins; ties keep load (id) order."""
+    best = None
+    for row in rows:
+        if best is None or getattr(row, start_attr) > getattr(best, start_attr):
+            best = row
+    return best
+
+
+class TemporalIntervalIndex:
+    """
+    Immutable key -> (boundary dates, segment winners) index.
+
+    Args:
+        rows: Rows in load (id) order
+        key_func: Row -> index key
+        pick: Active rows (load order, never empty) -> winning row; this is
+              where the table's precedence rules live
+        start_attr / end_attr: Validity interval [start, end); a NULL start
+              is treated as always started, a NULL end as open-ended
+    """
+
+    def __init__(
+        self,
+        rows: Iterable,
+        key_func: Callable[[Any], Hashable],
+        pick: Callable[[Sequence], Any] = latest_start_first,
+        start_attr: str = "effective_start",
+        end_attr: str = "effective_end",
+    ):
+        self._start_attr = start_attr
+        self._end_attr = end_attr
+
+        grouped: Dict[Hashable, List] = {}
+        for row in rows:
+            grouped.setdefault(key_func(row), []).append(row)
+
+        self._segments: Dict[Hashable, Tuple[Tuple[date, ...], Tuple[Any, ...]]] = {
+            key: self._build_segments(key_rows, pick) for key, key_rows in grouped.items()
+        }
+
+    def _build_segments(self, rows: List, pick) -> Tuple[Tuple[date, ...], Tuple[Any, ...]]:
+        boundaries = set()
+        for row in rows:
+            start = getattr(row, self._start_attr)
+            end = getattr(row, self._end_attr)
+            boundaries.add(start if start is not None else date.min)
+            if end is not None:
+                boundaries.add(end)
+
+        ordered = sorted(boundaries)
+        winners = []
+        for boundary in ordered:
+            active = [row for row in rows if self._is_active(row, boundary)]
+            winners.append(pick(active) if active else None)
+        return tuple(ordered), tuple(winners)
+
+    def _is_active(self, row, as_of_date: date) -> bool:
+        start = getattr(row, self._start_attr)
+        if start is not None and start > as_of_date:
+            return False
+        end = getattr(row, self._end_attr)
+        return end is None or end > as_of_date
+
+    def get(self, key: Hashable, as_of_date: date) -> Optional[Any]:
+        """Winning row for key on as_of_date, or None."""
+        segments = self._segments.get(key)
+        if segments is None:
+            return None
+        boundaries, winners = segments
+        position = bisect_right(boundaries, as_of_date) - 1
+        return winners[position] if position >= 0 else None
+
+    def keys(self):
+        """Indexed keys."""
+        return self._segments.keys()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._segments
+
+    def __len__(self) -> int:
+        return len(self._segments)
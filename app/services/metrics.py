@@ -0,0 +1,203 @@
+"""
+In-Process Metrics
+
+v22.0: Histograms and counters kept in process memory and exported in the
+Prometheus text format by /admin/metrics.
+
+Each worker process keeps its own registry; Prometheus scrapes and sums
+per-process series (or scrape each worker). Label sets are small and fixed
+(node, tool, graph names), so series are created on first observation.
+
+Usage:
+    from app.services.metrics import get_metrics_registry
+
+    registry = get_metrics_registry()
+    registry.histogram("stacking_tool_sql_statements", "SQL statements per calculation",
+                       buckets=COUNT_BUCKETS).observe(3, tool="check_program_inclusion")
+    text = registry.render()
+
+    # Graph node / tool latency (graph_node_duration_seconds{graph,node})
+    observe_node("stacking", "initialize", 0.012)
+"""
+
+import bisect
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds (1 ms .. 10 s)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Buckets for small per-calculation counts (statements, calls)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic counter per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set (Prometheus semantics)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[LabelKey, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, **labels) -> Optional[dict]:
+        """{"count", "sum", "buckets": {le: cumulative count}} for one label set."""
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            if series is None:
+                return None
+            counts, total, count = list(series[0]), series[1], series[2]
+        cumulative, running = {}, 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            cumulative[bound] = running
+        return {"count": count, "sum": total, "buckets": cumulative}
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            running = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                running += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {running}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics; histogram()/counter() return the existing metric if registered."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, *args)
+        if not isinstance(metric, cls):
+            raise ValueError(f"Metric '{name}' is already registered as a {metric.kind}")
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, buckets)
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._get_or_create(Counter, name, help_text)
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        blocks = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            lines = metric.render()
+            if lines:
+                blocks.append("\n".join([f"# HELP {name} {metric.help}", f"# TYPE {name} {metric.kind}"] + lines))
+        return "\n\n".join(blocks) + ("\n" if blocks else "")
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """Get the process-wide metrics registry."""
+    return _registry
+
+
+# ============================================================================
+# Graph node and tool latency
+# ============================================================================
+
+
+def observe_node(graph: str, node: str, seconds: float, error: bool = False) -> None:
+    """Record one graph node run (latency histogram, error counter)."""
+    registry = get_metrics_registry()
+    registry.histogram(
+        "graph_node_duration_seconds", "Graph node latency", LATENCY_BUCKETS
+    ).observe(seconds, graph=graph, node=node)
+    if error:
+        registry.counter(
+            "graph_node_errors_total", "Graph node runs that raised"
+        ).inc(graph=graph, node=node)
+
+
+def observe_tool(graph: str, tool: str, seconds: float, error: bool = False) -> None:
+    """Record one tool call (latency histogram, error counter)."""
+    registry = get_metrics_registry()
+    registry.histogram(
+        "graph_tool_duration_seconds", "Tool call latency", LATENCY_BUCKETS
+    ).observe(seconds, graph=graph, tool=tool)
+    if error:
+        registry.counter(
+            "graph_tool_errors_total", "Tool calls that raised or returned an error"
+        ).inc(graph=graph, tool=tool)
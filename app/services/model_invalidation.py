@@ -0,0 +1,207 @@
+"""
+Model Invalidation
+
+v22.0: Shared commit hooks and versioned singletons for the in-process
+structures built from tariff tables (rule snapshot, exclusion matcher,
+program rate resolver, applicability matrix, country resolver,
+semiconductor predicate engine, freshness snapshot).
+
+Each service registers the models it is built from and a commit callback.
+One set of ORM session listeners serves every registration:
+- after_flush: each new, dirty or deleted instance is routed by its class to
+  the registrations watching it
+- do_orm_execute: bulk UPDATE/DELETE through the ORM is routed by the
+  statement's mapper class
+- after_commit: registrations with recorded changes get their callback
+- after_rollback: recorded changes are discarded
+
+VersionedSingleton holds one process-wide instance, rebuilt when the tariff
+data version or the database engine changed (a bump in another process, a
+test app) or after invalidate().
+
+Usage:
+    from app.services.model_invalidation import VersionedSingleton, register_model_invalidation
+
+    _matcher = VersionedSingleton(_build_matcher)
+    register_model_invalidation(_claim_models, lambda changes: _matcher.invalidate())
+
+    matcher = _matcher.get()        # inside an app context
+"""
+
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+_CHANGES_KEY = "model_invalidation_changes"
+
+
+def _mark_changed(changes, model, obj, change):
+    return True
+
+
+class ModelInvalidation:
+    """One service's interest in committed changes to a set of models."""
+
+    def __init__(self, models: Callable[[], Tuple[type, ...]], on_commit: Callable[[Any], None],
+                 record: Optional[Callable] = None):
+        self._models = models
+        self._watched: Optional[Tuple[type, ...]] = None
+        self.on_commit = on_commit
+        self.record = record or _mark_changed
+
+    @property
+    def watched(self) -> Tuple[type, ...]:
+        """The watched model classes (resolved on first use)."""
+        if self._watched is None:
+            self._watched = tuple(self._models())
+        return self._watched
+
+
+_registrations: List[ModelInvalidation] = []
+_by_class: Dict[type, Tuple[ModelInvalidation, ...]] = {}
+_registry_lock = threading.Lock()
+
+
+def register_model_invalidation(models: Callable[[], Tuple[type, ...]], on_commit: Callable[[Any], None],
+                                record: Optional[Callable] = None) -> ModelInvalidation:
+    """
+    Call on_commit after every commit that changed rows of the given models.
+
+    Args:
+        models: Callable returning the watched model classes (subclasses
+                included). Called on first use, so services need not import
+                models at import time.
+        on_commit: Called with the changes recorded for this registration
+        record: Optional record(changes, model, obj, change) -> changes, called
+                at flush for each changed instance with change "new", "dirty"
+                or "deleted", and for bulk UPDATE/DELETE with obj=None and
+                change "bulk". Receives the value recorded so far in the
+                transaction (None at first) and returns the new value; None
+                records nothing. By default any change records True.
+
+    Returns:
+        The registration
+    """
+    registration = ModelInvalidation(models, on_commit, record)
+    with _registry_lock:
+        _registrations.append(registration)
+        _by_class.clear()
+    return registration
+
+
+def _registrations_for(cls: type) -> Tuple[ModelInvalidation, ...]:
+    registrations = _by_class.get(cls)
+    if registrations is None:
+        with _registry_lock:
+            registrations = tuple(r for r in _registrations if issubclass(cls, r.watched))
+            _by_class[cls] = registrations
+    return registrations
+
+
+def _record(session, cls: type, obj, change: str) -> None:
+    registrations = _registrations_for(cls)
+    if not registrations:
+        return
+    pending = session.info.setdefault(_CHANGES_KEY, {})
+    for registration in registrations:
+        changes = registration.record(pending.get(registration), cls, obj, change)
+        if changes is not None:
+            pending[registration] = changes
+
+
+@event.listens_for(Session, "after_flush")
+def _track_changes(session, flush_context):
+    for rows, change in ((session.new, "new"), (session.dirty, "dirty"), (session.deleted, "deleted")):
+        for obj in rows:
+            _record(session, type(obj), obj, change)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_changes(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None:
+            _record(orm_execute_state.session, mapper.class_, None, "bulk")
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_on_commit(session):
+    pending = session.info.pop(_CHANGES_KEY, None)
+    for registration, changes in (pending or {}).items():
+        try:
+            registration.on_commit(changes)
+        except Exception as e:
+            logger.warning(f"Commit invalidation callback failed: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _clear_on_rollback(session):
+    session.info.pop(_CHANGES_KEY, None)
+
+
+# ============================================================================
+# Versioned singletons
+# ============================================================================
+
+class VersionedSingleton:
+    """
+    Process-wide instance rebuilt when the tariff data version or the
+    database engine changed.
+
+    Instances expose data_version and engine_id.
+    """
+
+    def __init__(self, build: Callable[[int, int], Any],
+                 keep: Optional[Callable[[Any, int], bool]] = None):
+        """
+        Args:
+            build: build(data_version, engine_id) -> new instance
+            keep: Optional keep(instance, data_version) -> bool, asked before
+                  rebuilding an instance of the same engine whose version is
+                  behind; True keeps it (it may update its data_version)
+        """
+        self._build = build
+        self._keep = keep
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        """The instance built last, or None; never builds."""
+        return self._instance
+
+    def get(self):
+        """
+        Current instance, built on first use and rebuilt when stale.
+
+        Must be called inside an app context.
+        """
+        from app.services.result_cache import get_tariff_data_version
+        from app.web.db import db
+
+        version = get_tariff_data_version()
+        engine_id = id(db.engine)
+        instance = self._instance
+        if instance is not None and instance.data_version == version and instance.engine_id == engine_id:
+            return instance
+
+        with self._lock:
+            instance = self._instance
+            if instance is not None and instance.engine_id == engine_id:
+                if instance.data_version == version:
+                    return instance
+                if self._keep is not None and self._keep(instance, version):
+                    return instance
+            instance = self._build(version, engine_id)
+            self._instance = instance
+            return instance
+
+    def invalidate(self) -> None:
+        """Drop the instance; the next get() builds a new one."""
+        with self._lock:
+            self._instance = None
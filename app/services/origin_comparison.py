@@ -0,0 +1,180 @@
+"""
+Origin Comparison
+
+v22.0: Duty for one HTS and value from every country of origin.
+
+Sourcing teams ask "where is the landed duty on 8544.42.9090 lowest?".
+Answering it with POST /tariff/calculate means ~240 independent stacking
+runs that repeat the same HTS work every time. The comparison instead runs
+every origin on the direct stacking engine inside one shared_lookups()
+block with the rule snapshot, so:
+- HTS-dependent work (program inclusion, Section 232 materials, Annex II,
+  MFN base rate) is resolved once and reused for every country
+- Only country-dependent work (program list and country scope, country
+  groups, reciprocal schedules, deal overrides) runs per country
+- Country-dependent lookups hit the in-memory snapshot, not SQL
+
+Origins default to the ISO codes in data/census_to_iso_mapping.csv
+(rows marked SKIP, e.g. the United States, are left out).
+
+Usage:
+    from app.services.origin_comparison import compare_origins
+
+    comparison = compare_origins(
+        hts_code="8544.42.9090", product_value=10000,
+        materials={"copper": 3000}, import_date="2025-06-01",
+    )
+"""
+
+import csv
+import logging
+import uuid
+from datetime import date
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+CENSUS_ISO_MAPPING_PATH = Path(__file__).parent.parent.parent / "data" / "census_to_iso_mapping.csv"
+
+
+class OriginComparisonError(ValueError):
+    """Raised for an invalid comparison request (missing HTS, bad countries)."""
+
+
+def load_origin_countries(path: Path = CENSUS_ISO_MAPPING_PATH) -> List[dict]:
+    """
+    Countries of origin from the census-to-ISO mapping, one per ISO code.
+
+    Returns:
+        List of {"iso_alpha2", "country_name"} in file order
+    """
+    countries = []
+    seen = set()
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            iso2 = (row.get("iso_alpha2") or "").strip().upper()
+            if not iso2 or (row.get("skip") or "").strip() or iso2 in seen:
+                continue
+            seen.add(iso2)
+            countries.append({"iso_alpha2": iso2, "country_name": (row.get("country_name") or "").strip()})
+    return countries
+
+
+def _origin_result(origin: dict, result: dict) -> dict:
+    total_duty = result.get("total_duty") or {}
+    return {
+        "country": origin["iso_alpha2"],
+        "country_name": origin["country_name"],
+        "total_duty_amount": total_duty.get("total_duty_amount", 0),
+        "effective_rate": total_duty.get("effective_rate", 0),
+        "programs": [
+            item.get("program_id") for item in total_duty.get("breakdown", [])
+            if item.get("duty_amount")
+        ],
+        "entries": result.get("entries", []),
+        "breakdown": total_duty.get("breakdown", []),
+    }
+
+
+def compare_origins(
+    hts_code: str,
+    product_value: float = 10000.0,
+    materials: Optional[dict] = None,
+    import_date: Optional[str] = None,
+    product_description: Optional[str] = None,
+    countries: Optional[List[str]] = None,
+    include_stacks: bool = False,
+) -> dict:
+    """
+    Duty for one HTS/value from each country of origin, lowest first.
+
+    Args:
+        hts_code: HTS code (e.g., '8544.42.9090')
+        product_value: Declared value used for every origin
+        materials: Material values; required when the HTS has Section 232
+                   metal content (same as /tariff/calculate)
+        import_date: Import date (YYYY-MM-DD), defaults to today
+        product_description: Optional description
+        countries: Origins to compare (any alias); defaults to every ISO
+                   code in the census mapping
+        include_stacks: Include entries and duty breakdown per origin
+
+    Returns:
+        Dict with origins sorted by total duty (ties by country code) and
+        per-origin errors. If the calculation needs material values,
+        returns needs_materials=True and no origins.
+    """
+    from app.chat.graphs.stacking_rag import StackingRAG
+    from app.chat.tools.stacking_tools import shared_lookups
+
+    if not hts_code:
+        raise OriginComparisonError("HTS code is required")
+    if countries is None:
+        origins = load_origin_countries()
+    elif isinstance(countries, list) and countries and all(isinstance(c, str) and c.strip() for c in countries):
+        origins = [{"iso_alpha2": c.strip(), "country_name": c.strip()} for c in countries]
+    else:
+        raise OriginComparisonError("countries must be a non-empty list of country names or codes")
+
+    import_date = import_date or date.today().isoformat()
+    comparison_id = str(uuid.uuid4())
+    rag = StackingRAG(conversation_id=comparison_id, checkpoint=False, engine="direct")
+    description = product_description or f"Product ({hts_code})"
+
+    results: List[dict] = []
+    errors: List[dict] = []
+    with shared_lookups(rule_snapshot=True):
+        for index, origin in enumerate(origins):
+            try:
+                result = rag.calculate_stacking(
+                    hts_code=hts_code,
+                    country=origin["iso_alpha2"],
+                    product_description=description,
+                    product_value=product_value,
+                    materials=materials,
+                    import_date=import_date,
+                    thread_id=f"{comparison_id}:{index}",
+                )
+            except Exception as e:
+                errors.append({"country": origin["iso_alpha2"], "error": str(e)})
+                continue
+
+            if result.get("awaiting_user_input"):
+                # Material questions depend on the HTS only: same for every origin
+                return {
+                    "comparison_id": comparison_id,
+                    "hts_code": hts_code,
+                    "needs_materials": True,
+                    "applicable_materials": result.get("applicable_materials", []),
+                    "origins": [],
+                    "errors": [],
+                }
+
+            origin_result = _origin_result(origin, result)
+            if not include_stacks:
+                origin_result.pop("entries")
+                origin_result.pop("breakdown")
+            results.append(origin_result)
+
+    results.sort(key=lambda r: (r["total_duty_amount"], r["country"]))
+    for rank, origin_result in enumerate(results, start=1):
+        origin_result["rank"] = rank
+
+    logger.info(
+        f"Origin comparison {comparison_id}: {hts_code} across {len(origins)} origins "
+        f"({len(errors)} errors)"
+    )
+
+    return {
+        "comparison_id": comparison_id,
+        "hts_code": hts_code,
+        "product_value": product_value,
+        "materials": materials or {},
+        "import_date": import_date,
+        "needs_materials": False,
+        "origin_count": len(results),
+        "lowest": results[0] if results else None,
+        "origins": results,
+        "errors": errors,
+    }
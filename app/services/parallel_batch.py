@@ -0,0 +1,228 @@
+"""
+Parallel Batch Executor
+
+v22.0: Shard bulk stacking calculations across worker processes.
+
+The stacking tools are lookup- and CPU-bound Python, so one process
+calculates on one core. For bulk jobs (re-pricing open entries after a rule
+change, large catalogs) the executor splits the lines into contiguous
+chunks and calculates them in a process pool:
+- Each worker builds its own Flask app and loads its own read-only rule
+  snapshot once (app.services.rule_snapshot), in the pool initializer
+- A chunk is calculated exactly like calculate_entry_batch (direct engine,
+  shared_lookups, rule snapshot); chunks are sorted by HTS code first so
+  the per-HTS lookup memo is shared by as many lines as possible
+- Results are merged back in input order, so the output is identical to
+  the serial batch calculator regardless of worker count or scheduling
+
+Workers are started with the "spawn" method: the web process already runs
+threads (async calculation log writer, freshness refresher), and a forked
+child could inherit a lock held by one of them. A worker reloads its
+snapshot when the tariff data version changes (get_rule_snapshot() checks
+it), and flushes its calculation log writer after every chunk, since pool
+workers exit without running atexit handlers.
+
+Configuration:
+    STACKING_POOL_WORKERS     Worker processes (default: CPU count)
+    STACKING_POOL_CHUNK_SIZE  Lines per chunk (default: spread each batch
+                              over ~4 chunks per worker)
+
+Usage:
+    from app.services.parallel_batch import get_parallel_executor
+
+    result = get_parallel_executor().calculate(lines, country="China", import_date="2025-06-01")
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from typing import List, Optional, Tuple
+
+from app.services.entry_batch import EntryBatchCalculator, summarize_lines
+
+logger = logging.getLogger(__name__)
+
+# Chunks per worker when STACKING_POOL_CHUNK_SIZE is not set: enough to
+# balance uneven lines, few enough that per-chunk setup stays negligible
+_CHUNKS_PER_WORKER = 4
+
+
+def shard_lines(lines: List, chunk_size: int) -> List[Tuple[List[int], List]]:
+    """
+    Split lines into chunks of (input indices, lines).
+
+    Lines are grouped by HTS code before chunking so each chunk's lookup
+    memo covers few distinct codes; indices let the caller restore input
+    order.
+    """
+    def hts_key(index):
+        raw = lines[index]
+        return str(raw.get("hts_code") or "") if isinstance(raw, dict) else ""
+
+    order = sorted(range(len(lines)), key=lambda i: (hts_key(i), i))
+    chunks = []
+    for start in range(0, len(order), chunk_size):
+        indices = order[start:start + chunk_size]
+        chunks.append((indices, [lines[i] for i in indices]))
+    return chunks
+
+
+# ============================================================================
+# Worker process
+# ============================================================================
+
+def _init_worker() -> None:
+    """Pool initializer: own app and rule snapshot, loaded once."""
+    try:
+        from app.chat.tools.stacking_tools import get_flask_app
+        from app.services.rule_snapshot import get_rule_snapshot
+
+        get_rule_snapshot(get_flask_app())
+    except Exception as e:
+        # Lines still calculate; the snapshot is loaded on first use instead
+        logger.warning(f"Stacking pool worker {os.getpid()} failed to preload rules: {e}")
+
+
+def _calculate_chunk(task: tuple) -> List[dict]:
+    """Calculate one chunk in a worker; returns results in the chunk's order."""
+    indices, lines, country, import_date, batch_id = task
+    from app.chat.tools.stacking_tools import shared_lookups
+    from app.services.calculation_log_writer import get_calculation_log_writer
+
+    calculator = EntryBatchCalculator(import_date=import_date, batch_id=batch_id)
+    try:
+        with shared_lookups(rule_snapshot=True):
+            return [
+                calculator.calculate_line(index, raw, default_country=country)
+                for index, raw in zip(indices, lines)
+            ]
+    finally:
+        # Pool workers exit via os._exit, skipping the writer's atexit flush
+        get_calculation_log_writer().flush()
+
+
+# ============================================================================
+# Executor
+# ============================================================================
+
+
+class ParallelBatchExecutor:
+    """
+    Calculates batches of lines across a pool of worker processes.
+
+    The pool is started on first use and reused across batches; with
+    workers=1 lines are calculated in the calling process.
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: Optional[int] = None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+                logger.info(f"Started stacking pool with {self.workers} workers")
+            return self._pool
+
+    def _chunk_size_for(self, line_count: int) -> int:
+        if self.chunk_size:
+            return self.chunk_size
+        return max(1, -(-line_count // (self.workers * _CHUNKS_PER_WORKER)))
+
+    def calculate_lines(
+        self,
+        lines: List,
+        country: Optional[str] = None,
+        import_date: Optional[str] = None,
+        batch_id: Optional[str] = None,
+    ) -> List[dict]:
+        """Per-line results (as EntryBatchCalculator.calculate_line) in input order."""
+        import_date = import_date or date.today().isoformat()
+        batch_id = batch_id or str(uuid.uuid4())
+        if not lines:
+            return []
+
+        chunks = shard_lines(lines, self._chunk_size_for(len(lines)))
+        tasks = [(indices, chunk, country, import_date, batch_id) for indices, chunk in chunks]
+
+        if self.workers == 1:
+            chunk_results = [_calculate_chunk(task) for task in tasks]
+        else:
+            try:
+                chunk_results = list(self._get_pool().map(_calculate_chunk, tasks))
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed); start a new pool next time
+                self.shutdown()
+                raise
+
+        results: List[Optional[dict]] = [None] * len(lines)
+        for (indices, _), chunk_result in zip(chunks, chunk_results):
+            for index, result in zip(indices, chunk_result):
+                results[index] = result
+        return results
+
+    def calculate(
+        self,
+        lines: List,
+        country: Optional[str] = None,
+        import_date: Optional[str] = None,
+    ) -> dict:
+        """
+        Calculate a batch in parallel.
+
+        Returns the same shape as calculate_entry_batch, plus "workers".
+        """
+        calculator = EntryBatchCalculator(import_date=import_date)
+        results = self.calculate_lines(
+            lines, country=country, import_date=calculator.import_date, batch_id=calculator.batch_id
+        )
+
+        logger.info(
+            f"Calculated batch {calculator.batch_id}: {len(results)} lines on {self.workers} workers"
+        )
+
+        return {
+            "batch_id": calculator.batch_id,
+            "import_date": calculator.import_date,
+            "lines": results,
+            "entry_total": summarize_lines(results),
+            "data_freshness": calculator.freshness(),
+            "workers": self.workers,
+        }
+
+    def shutdown(self) -> None:
+        """Stop the worker processes; a later batch starts a new pool."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+_executor: Optional[ParallelBatchExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_parallel_executor() -> ParallelBatchExecutor:
+    """Get the process-wide parallel batch executor (pool started on first batch)."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                chunk_size = os.getenv("STACKING_POOL_CHUNK_SIZE")
+                _executor = ParallelBatchExecutor(
+                    workers=int(os.getenv("STACKING_POOL_WORKERS", "0")) or None,
+                    chunk_size=int(chunk_size) if chunk_size else None,
+                )
+    return _executor
@@ -0,0 +1,455 @@
+"""
+Portfolio Duty Exposure
+
+v22.0: Total duty exposure over a SKU catalog (HTS, country, value, metal
+content), computed column-wise with NumPy.
+
+Looping StackingRAG over a 40k-SKU catalog repeats the same program,
+inclusion and rate lookups for every SKU that shares an HTS code and
+country. For a fixed HTS, country, import date and set of metals present,
+calculate_duties is linear in the SKU's value and metal content:
+
+    duty = sum over programs of rate * basis
+    basis = product value | metal content | value - claimed metal content
+
+The engine therefore:
+1. Loads the catalog into columnar arrays (PortfolioCatalog)
+2. Groups SKUs into profiles: (HTS, country, metals present)
+3. Runs the calculator once per profile (direct engine, shared lookups,
+   rule snapshot; with USE_RATE_RESOLVER the program rates of all new
+   profiles of a country are prefetched in one vectorized call) and
+   decomposes its breakdown into a coefficient per
+   (program, basis column); the decomposition is checked against the
+   calculator's own total for that SKU
+4. Evaluates every SKU as one tensor product over [value, copper, steel,
+   aluminum] and aggregates by country, HTS chapter and program
+
+Profile coefficients are kept per import date and reused until the tariff
+data version changes, so re-running on an updated catalog only repeats
+step 4. Profiles whose breakdown cannot be decomposed linearly are
+evaluated SKU by SKU with the calculator.
+
+Metal content is in dollars. The calculator reads material amounts <= 1.0
+as percentages, so such amounts are treated as no content.
+
+Usage:
+    from app.services.portfolio_exposure import PortfolioCatalog, PortfolioExposureEngine
+
+    catalog = PortfolioCatalog.from_csv("catalog.csv")
+    exposure = PortfolioExposureEngine(import_date="2025-06-01").compute(catalog)
+"""
+
+import csv
+import logging
+import random
+import uuid
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MATERIALS = ("copper", "steel", "aluminum")
+
+# Basis columns: product value, then one content column per material
+BASIS_COLUMNS = ("value",) + MATERIALS
+
+# Allowed gap between the decomposed and calculated duty (per-line rounding)
+_ROUNDING_TOLERANCE = 0.01
+
+
+class PortfolioCatalog:
+    """
+    Columnar SKU catalog.
+
+    Attributes:
+        sku, hts_code, country: object arrays
+        value: float64 array of declared values
+        content: float64 array (n, len(MATERIALS)) of metal content in dollars
+        valid: bool array; invalid rows are reported in errors and excluded
+    """
+
+    def __init__(self, sku, hts_code, country, value, content):
+        self.sku = np.asarray(sku, dtype=object)
+        self.hts_code = np.asarray(hts_code, dtype=object)
+        self.country = np.asarray(country, dtype=object)
+        self.value = np.asarray(value, dtype=np.float64)
+        content = np.asarray(content, dtype=np.float64).reshape(len(self.value), len(MATERIALS))
+        self.content = np.where(content > 1.0, content, 0.0)
+
+        self.errors: List[dict] = []
+        self.valid = np.ones(len(self.value), dtype=bool)
+        self._validate()
+
+    def _validate(self) -> None:
+        missing = np.array([not h or not c for h, c in zip(self.hts_code, self.country)], dtype=bool)
+        bad_value = ~(self.value > 0)
+        over = self.content.sum(axis=1) > self.value
+        for mask, reason in (
+            (missing, "HTS code and country are required"),
+            (bad_value, "value must be a positive number"),
+            (over, "metal content exceeds value"),
+        ):
+            for index in np.flatnonzero(mask & self.valid):
+                self.errors.append({"sku": self.sku[index], "error": reason})
+            self.valid &= ~mask
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> "PortfolioCatalog":
+        """Build from dicts with sku, hts_code, country, value and metal columns."""
+        sku, hts_code, country, value, content = [], [], [], [], []
+        for index, record in enumerate(records):
+            sku.append(record.get("sku", index))
+            hts_code.append((record.get("hts_code") or "").strip())
+            country.append((record.get("country") or "").strip())
+            value.append(_to_float(record.get("value")))
+            content.append([_to_float(record.get(m)) for m in MATERIALS])
+        return cls(sku, hts_code, country, value, content or np.zeros((0, len(MATERIALS))))
+
+    @classmethod
+    def from_csv(cls, path: str) -> "PortfolioCatalog":
+        """CSV with header: sku,hts_code,country,value,copper,steel,aluminum."""
+        with open(path, newline="") as f:
+            return cls.from_records(csv.DictReader(f))
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+
+def _to_float(raw) -> float:
+    try:
+        return float(raw) if raw not in (None, "") else 0.0
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+class _Profile:
+    """Calculator result for one (HTS, country, metals present) group."""
+
+    __slots__ = ("coefficients", "linear", "error")
+
+    def __init__(self, coefficients: Dict[str, np.ndarray], linear: bool, error: Optional[str] = None):
+        self.coefficients = coefficients  # program_id -> coefficient per basis column
+        self.linear = linear
+        self.error = error
+
+
+def decompose_breakdown(breakdown: List[dict], basis: np.ndarray) -> Tuple[Dict[str, np.ndarray], bool]:
+    """
+    Coefficients per program over BASIS_COLUMNS from a calculate_duties
+    breakdown, and whether every line could be expressed linearly.
+
+    Each line's base_value is matched against the bases it can take for its
+    base_on (content lines may be charged on the whole slice value, e.g.
+    steel derivatives), so the coefficient follows what the calculator
+    actually charged.
+
+    Args:
+        breakdown: total_duty["breakdown"] from the calculator
+        basis: The calculated SKU's [value, copper, steel, aluminum]
+    """
+    coefficients: Dict[str, np.ndarray] = {}
+    value = basis[0]
+
+    def column(index: int) -> np.ndarray:
+        vector = np.zeros(len(BASIS_COLUMNS))
+        vector[index] = 1.0
+        return vector
+
+    def matches(vector: np.ndarray, base_value) -> bool:
+        return abs(float(vector @ basis) - float(base_value or 0)) <= _ROUNDING_TOLERANCE
+
+    lines = [item for item in breakdown if item.get("action") not in ("disclaim", "skip")]
+
+    # Content lines first: which metals were deducted from the remaining value
+    claimed = np.zeros(len(BASIS_COLUMNS))
+    selectors = {}
+    linear = True
+    for i, item in enumerate(lines):
+        base_on = (item.get("calculation") or "").rpartition(" on ")[2]
+        if base_on != "content_value":
+            continue
+        candidates = [column(0)]
+        if item.get("material") in MATERIALS:
+            candidates.insert(0, column(1 + MATERIALS.index(item["material"])))
+        selector = next((c for c in candidates if matches(c, item.get("base_value"))), None)
+        if selector is None:
+            linear = False
+            continue
+        selectors[i] = selector
+        if selector[0] == 0:
+            claimed += selector
+
+    remaining = column(0) - claimed
+    for i, item in enumerate(lines):
+        base_on = (item.get("calculation") or "").rpartition(" on ")[2]
+        rate = float(item.get("duty_rate") or 0)
+        if base_on == "content_value":
+            selector = selectors.get(i)
+            if selector is None:
+                continue
+        elif base_on in ("product_value", "remaining_value"):
+            candidates = [remaining, column(0)] if base_on == "remaining_value" else [column(0)]
+            selector = next((c for c in candidates if matches(c, item.get("base_value"))), None)
+            if selector is None:
+                linear = False
+                continue
+        else:
+            # Legacy bases: keep the calculated share of value
+            selector = column(0)
+            rate = float(item.get("duty_amount") or 0) / value if value else 0.0
+
+        program_id = item.get("program_id")
+        coefficients[program_id] = coefficients.get(program_id, np.zeros(len(BASIS_COLUMNS))) + rate * selector
+
+    return coefficients, linear
+
+
+class PortfolioExposureEngine:
+    """
+    Vectorized duty exposure over a catalog.
+
+    One engine per import date. Profile coefficients are cached and dropped
+    when the tariff data version changes.
+    """
+
+    def __init__(self, import_date: Optional[str] = None):
+        self.import_date = import_date or date.today().isoformat()
+        self.run_id = str(uuid.uuid4())
+        self._profiles: Dict[Tuple, _Profile] = {}
+        self._data_version: Optional[int] = None
+        self._rag = None
+
+    # ------------------------------------------------------------------
+    # Calculator access
+    # ------------------------------------------------------------------
+
+    def _calculate(self, hts_code: str, country: str, value: float, content: np.ndarray) -> dict:
+        from app.chat.graphs.stacking_rag import StackingRAG
+
+        if self._rag is None:
+            self._rag = StackingRAG(conversation_id=self.run_id, checkpoint=False, engine="direct")
+        materials = {m: float(c) for m, c in zip(MATERIALS, content) if c > 0}
+        return self._rag.calculate_stacking(
+            hts_code=hts_code,
+            country=country,
+            product_description=f"Product ({hts_code})",
+            product_value=float(value),
+            materials=materials,
+            import_date=self.import_date,
+        )
+
+    def _resolve_profile(self, hts_code: str, country: str, value: float, content: np.ndarray) -> _Profile:
+        try:
+            result = self._calculate(hts_code, country, value, content)
+        except Exception as e:
+            return _Profile({}, linear=False, error=str(e))
+        if result.get("awaiting_user_input"):
+            return _Profile({}, linear=False, error="calculation needs material values")
+
+        total_duty = result.get("total_duty") or {}
+        basis = np.concatenate(([value], content))
+        coefficients, linear = decompose_breakdown(total_duty.get("breakdown", []), basis)
+        predicted = sum(float(c @ basis) for c in coefficients.values())
+        if abs(predicted - float(total_duty.get("total_duty_amount") or 0)) > \
+                _ROUNDING_TOLERANCE * (len(coefficients) + 1):
+            linear = False
+        return _Profile(coefficients, linear)
+
+    def _prefetch_rates(self, catalog: PortfolioCatalog, rows: List[int]) -> None:
+        """Rate every program for the profiles about to be resolved, one call per country."""
+        from app.chat.tools.stacking_tools import prefetch_program_rates
+
+        hts_by_country: Dict[str, List[str]] = {}
+        for r in rows:
+            hts_by_country.setdefault(catalog.country[r], []).append(catalog.hts_code[r])
+        for country, hts_codes in hts_by_country.items():
+            try:
+                prefetch_program_rates(country, hts_codes, self.import_date)
+            except Exception as e:
+                logger.warning(f"Rate prefetch for {country} failed: {e}")
+
+    def _check_data_version(self) -> None:
+        from app.chat.tools.stacking_tools import get_flask_app
+        from app.services.result_cache import get_tariff_data_version
+
+        with get_flask_app().app_context():
+            version = get_tariff_data_version()
+        if version != self._data_version:
+            if self._profiles:
+                logger.info(f"Tariff data changed (v{version}); dropping portfolio profiles")
+            self._profiles.clear()
+            self._data_version = version
+
+    # ------------------------------------------------------------------
+    # Exposure
+    # ------------------------------------------------------------------
+
+    def compute(self, catalog: PortfolioCatalog) -> dict:
+        """
+        Duty exposure for every valid SKU, with aggregates.
+
+        Returns:
+            Dict with totals, by_country, by_chapter, by_program, errors and
+            the per-SKU duty array under "sku_duty" (aligned with catalog rows;
+            NaN for rows that could not be calculated)
+        """
+        from app.chat.tools.stacking_tools import shared_lookups
+
+        self._check_data_version()
+
+        n = len(catalog)
+        present = catalog.content > 0
+        mask_bits = (present * (1 << np.arange(len(MATERIALS)))).sum(axis=1)
+        keys = np.array(
+            [f"{h}|{c}|{m}" for h, c, m in zip(catalog.hts_code, catalog.country, mask_bits)],
+            dtype=object,
+        )
+        valid_index = np.flatnonzero(catalog.valid)
+        profile_keys, first, inverse = np.unique(keys[valid_index], return_index=True, return_inverse=True)
+
+        basis = np.column_stack((catalog.value, catalog.content))
+        sku_duty = np.full(n, np.nan)
+        errors = list(catalog.errors)
+        calculator_skus = 0
+
+        with shared_lookups(rule_snapshot=True):
+            self._prefetch_rates(catalog, [
+                rep for key, rep in zip(profile_keys, valid_index[first])
+                if (key, self.import_date) not in self._profiles
+            ])
+            profiles = []
+            for key, rep in zip(profile_keys, valid_index[first]):
+                profile = self._profiles.get((key, self.import_date))
+                if profile is None:
+                    profile = self._resolve_profile(
+                        catalog.hts_code[rep], catalog.country[rep],
+                        catalog.value[rep], catalog.content[rep],
+                    )
+                    self._profiles[(key, self.import_date)] = profile
+                profiles.append(profile)
+
+            program_ids = sorted({pid for p in profiles for pid in p.coefficients})
+            program_col = {pid: k for k, pid in enumerate(program_ids)}
+
+            # (profiles, programs, basis columns)
+            coefficients = np.zeros((len(profiles), len(program_ids), len(BASIS_COLUMNS)))
+            for p, profile in enumerate(profiles):
+                for pid, coef in profile.coefficients.items():
+                    coefficients[p, program_col[pid]] = coef
+
+            linear = np.array([p.linear for p in profiles], dtype=bool)
+            vector_rows = valid_index[linear[inverse]]
+            program_duty = np.zeros((n, len(program_ids)))
+            program_duty[vector_rows] = np.einsum(
+                "nkb,nb->nk", coefficients[inverse[linear[inverse]]], basis[vector_rows]
+            )
+            sku_duty[vector_rows] = program_duty[vector_rows].sum(axis=1)
+
+            # Profiles that could not be decomposed: calculator per SKU
+            fallback_by_program: Dict[str, float] = {}
+            for p in np.flatnonzero(~linear):
+                rows = valid_index[inverse == p]
+                if profiles[p].error:
+                    errors.extend({"sku": catalog.sku[r], "error": profiles[p].error} for r in rows)
+                    continue
+                for r in rows:
+                    calculator_skus += 1
+                    try:
+                        result = self._calculate(
+                            catalog.hts_code[r], catalog.country[r], catalog.value[r], catalog.content[r]
+                        )
+                    except Exception as e:
+                        errors.append({"sku": catalog.sku[r], "error": str(e)})
+                        continue
+                    for item in (result.get("total_duty") or {}).get("breakdown", []):
+                        if item.get("action") not in ("disclaim", "skip"):
+                            pid = item.get("program_id")
+                            fallback_by_program[pid] = fallback_by_program.get(pid, 0.0) + item.get("duty_amount", 0)
+                    sku_duty[r] = (result.get("total_duty") or {}).get("total_duty_amount", 0)
+
+        calculated = ~np.isnan(sku_duty)
+        logger.info(
+            f"Portfolio exposure {self.run_id}: {int(calculated.sum())}/{n} SKUs, "
+            f"{len(profiles)} profiles, {calculator_skus} SKUs via calculator"
+        )
+
+        return {
+            "run_id": self.run_id,
+            "import_date": self.import_date,
+            "data_version": self._data_version,
+            "sku_count": n,
+            "calculated_skus": int(calculated.sum()),
+            "profiles": len(profiles),
+            "calculator_skus": calculator_skus,
+            "total_value": round(float(catalog.value[calculated].sum()), 2),
+            "total_duty_amount": round(float(sku_duty[calculated].sum()), 2),
+            "effective_rate": _rate(sku_duty[calculated].sum(), catalog.value[calculated].sum()),
+            "by_country": _aggregate(catalog.country[calculated], catalog.value[calculated],
+                                     sku_duty[calculated]),
+            "by_chapter": _aggregate(
+                np.array([h.replace(".", "")[:2] for h in catalog.hts_code[calculated]], dtype=object),
+                catalog.value[calculated], sku_duty[calculated],
+            ),
+            "by_program": {
+                pid: round(float(program_duty[calculated, program_col[pid]].sum()
+                                 if pid in program_col else 0.0) + fallback_by_program.get(pid, 0.0), 2)
+                for pid in sorted(set(program_col) | set(fallback_by_program))
+            },
+            "errors": errors,
+            "sku_duty": sku_duty,
+        }
+
+
+def _rate(duty: float, value: float) -> float:
+    return round(float(duty) / float(value), 4) if value > 0 else 0
+
+
+def _aggregate(groups: np.ndarray, value: np.ndarray, duty: np.ndarray) -> dict:
+    """Sum value and duty per group label."""
+    if len(groups) == 0:
+        return {}
+    labels, inverse = np.unique(groups, return_inverse=True)
+    value_sum = np.bincount(inverse, weights=value, minlength=len(labels))
+    duty_sum = np.bincount(inverse, weights=duty, minlength=len(labels))
+    return {
+        str(label): {
+            "total_value": round(float(v), 2),
+            "total_duty_amount": round(float(d), 2),
+            "effective_rate": _rate(d, v),
+        }
+        for label, v, d in zip(labels, value_sum, duty_sum)
+    }
+
+
+def sample_parity(engine: PortfolioExposureEngine, catalog: PortfolioCatalog, exposure: dict,
+                  sample_size: int = 25, seed: int = 0) -> List[dict]:
+    """
+    Compare engine duty with StackingRAG on a random sample of SKUs.
+
+    Returns:
+        Mismatches (empty when every sampled SKU agrees to the cent)
+    """
+    from app.chat.tools.stacking_tools import shared_lookups
+
+    sku_duty = exposure["sku_duty"]
+    candidates = [int(i) for i in np.flatnonzero(~np.isnan(sku_duty))]
+    sample = random.Random(seed).sample(candidates, min(sample_size, len(candidates)))
+
+    mismatches = []
+    with shared_lookups(rule_snapshot=True):
+        for r in sample:
+            result = engine._calculate(
+                catalog.hts_code[r], catalog.country[r], catalog.value[r], catalog.content[r]
+            )
+            expected = (result.get("total_duty") or {}).get("total_duty_amount", 0)
+            # Per-line rounding in calculate_duties: allow a cent per program
+            tolerance = _ROUNDING_TOLERANCE * (len(exposure["by_program"]) + 1)
+            if abs(expected - sku_duty[r]) > tolerance:
+                mismatches.append({
+                    "sku": catalog.sku[r],
+                    "engine": round(float(sku_duty[r]), 2),
+                    "calculator": expected,
+                })
+    return mismatches
@@ -0,0 +1,119 @@
+"""
+HTS Prefix Trie
+
+v22.0: In-memory longest-prefix-match index for the HTS prefix tables.
+
+Annex II exclusions, IEEPA Reciprocal product exclusions and deal overrides,
+and MFN base rates are all keyed by an HTS prefix (4, 6, 8 or 10 digits) and
+resolved by trying each prefix length from longest to shortest. Against the
+database that is one query per length (two for MFN, which stores dotted and
+undotted codes). The trie answers the same question in a single walk over
+the code's digits.
+
+Each node holds the rows stored under that exact prefix together with their
+validity interval [start, end). A node matches a date when one of its rows
+is active on that date; the deepest matching node wins.
+
+The tries are built by TariffRuleSnapshot from its frozen rows, so they are
+rebuilt whenever the snapshot is (see invalidate_rule_snapshot()).
+
+Usage:
+    trie = HtsPrefixTrie()
+    trie.insert("8471", row, row.effective_start, row.effective_end)
+    match = trie.longest_match("8471300100", date(2025, 6, 1))
+    if match:
+        prefix, row = match
+"""
+
+from datetime import date
+from typing import Any, List, Optional, Tuple
+
+# Prefix lengths the HTS lookups consider, longest first
+HTS_PREFIX_LENGTHS = (10, 8, 6, 4)
+
+
+class _TrieNode:
+    __slots__ = ("children", "entries")
+
+    def __init__(self):
+        self.children = {}
+        # (rank, start, end, row), ordered by rank then insertion order
+        self.entries: List[Tuple[int, Optional[date], Optional[date], Any]] = []
+
+
+class HtsPrefixTrie:
+    """
+    Digit trie with temporal validity intervals on each node.
+
+    Rows are inserted under their digits-only prefix. Within a node, rows are
+    tried by rank (lower first), then insertion order, and the first row
+    active on the query date is the node's match.
+    """
+
+    def __init__(self, lengths: Tuple[int, ...] = HTS_PREFIX_LENGTHS):
+        self.lengths = frozenset(lengths)
+        self.max_length = max(lengths)
+        self._root = _TrieNode()
+        self.size = 0
+
+    def insert(self, digits: str, row: Any, start: Optional[date],
+               end: Optional[date], rank: int = 0) -> None:
+        """
+        Store a row under a digits-only prefix.
+
+        Args:
+            digits: HTS prefix without dots (e.g. '85444290')
+            row: Row returned by longest_match()
+            start: First active date (None = always started)
+            end: First inactive date (None = open-ended)
+            rank: Precedence among rows under the same prefix (lower first)
+        """
+        node = self._root
+        for ch in digits:
+            child = node.children.get(ch)
+            if child is None:
+                child = node.children[ch] = _TrieNode()
+            node = child
+        node.entries.append((rank, start, end, row))
+        node.entries.sort(key=lambda entry: entry[0])
+        self.size += 1
+
+    def longest_match(self, digits: str, as_of_date: date,
+                      partial: bool = False) -> Optional[Tuple[str, Any]]:
+        """
+        Longest prefix of digits with a row active on as_of_date.
+
+        Only depths in self.lengths are considered. With partial=True a code
+        shorter than the longest length may also match at its own length,
+        mirroring lookups that slice hts[:length] without checking len(hts).
+
+        Returns:
+            (matched_prefix, row), or None
+        """
+        best = None
+        node = self._root
+        for depth, ch in enumerate(digits[:self.max_length], start=1):
+            node = node.children.get(ch)
+            if node is None:
+                break
+            if not node.entries:
+                continue
+            if depth not in self.lengths and not (partial and depth == len(digits)):
+                continue
+            row = self._active_entry(node, as_of_date)
+            if row is not None:
+                best = (digits[:depth], row)
+        return best
+
+    @staticmethod
+    def _active_entry(node: _TrieNode, as_of_date: date):
+        for _, start, end, row in node.entries:
+            if start is not None and start > as_of_date:
+                continue
+            if end is not None and end <= as_of_date:
+                continue
+            return row
+        return None
+
+    def __len__(self) -> int:
+        return self.size
@@ -0,0 +1,407 @@
+"""
+Compiled Rate Formulas
+
+v22.0: ProgramRate formulas parsed once into evaluator closures.
+
+get_rate_for_program() queries program_rates (or reads the rule snapshot)
+for every program on every calculation and dispatches formula rates through
+an if/else on the formula name. With USE_RATE_RESOLVER=true (default false)
+it uses this module instead, and formulas are compiled once:
+- A formula is either a named formula ('15pct_minus_mfn') or an arithmetic
+  expression over the operand `mfn` (MFN Column 1 base rate, decimal):
+  numbers, percentages ("15%"), + - * /, parentheses, min() and max()
+- The expression is parsed with the `ast` module and turned into nested
+  closures; constant subexpressions are folded at compile time
+- The same closure evaluates a scalar MFN rate or a numpy array of them,
+  so bulk callers rate a whole HTS column in one call (get_rates_for_program(),
+  used by stacking_tools.prefetch_program_rates() for entry batches and
+  portfolio exposure)
+
+ProgramRateResolver indexes program_rates per (program, country group) with
+a TemporalIntervalIndex, so each validity window carries its resolved rule
+(fixed rate, compiled formula, NULL rate or unknown formula) and a lookup is
+a bisect. The MFN operand is bound through a caller-supplied lookup, e.g.
+get_mfn_base_rate() (rule-snapshot trie walk, memoized per calculation).
+
+Rebuilt when rates change, like the exclusion claim matcher:
+- Commits that change ProgramRate or ProgramCode rows through the ORM
+- Tariff data version bumps from other processes
+- A different database engine (e.g. a test app)
+
+Usage:
+    from app.services.rate_formula import compile_formula, get_program_rate_resolver
+
+    formula = compile_formula("max(0, 15% - mfn)")
+    formula(mfn=0.026)                     # 0.124
+    formula(mfn=np.array([0.0, 0.2]))      # array([0.15, 0.  ])
+
+    rate, source = get_program_rate_resolver().evaluate(
+        "ieepa_reciprocal", "EU", "8544.42.9090", date(2025, 9, 1), mfn_lookup)
+"""
+
+import ast
+import logging
+import re
+from datetime import date
+from functools import lru_cache, reduce
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.interval_index import TemporalIntervalIndex, latest_start_first
+from app.services.model_invalidation import VersionedSingleton, register_model_invalidation
+
+logger = logging.getLogger(__name__)
+
+
+class FormulaError(ValueError):
+    """Formula text that cannot be compiled."""
+
+
+# Named formulas stored in program_rates.rate_formula, with the rate_source
+# template get_rate_for_program() has always reported for them
+NAMED_FORMULAS: Dict[str, Tuple[str, str]] = {
+    "15pct_minus_mfn": (
+        "max(0.0, 15% - mfn)",
+        "EU 15% ceiling: 15% - {mfn_pct:.1f}% MFN = {rate_pct:.1f}%",
+    ),
+}
+
+OPERANDS = frozenset({"mfn"})
+
+_PERCENT = re.compile(r"(\d+(?:\.\d+)?|\.\d+)\s*%")
+
+_BINARY = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+}
+
+
+def _maximum(*values):
+    if any(isinstance(v, np.ndarray) for v in values):
+        return reduce(np.maximum, values)
+    return max(values)
+
+
+def _minimum(*values):
+    if any(isinstance(v, np.ndarray) for v in values):
+        return reduce(np.minimum, values)
+    return min(values)
+
+
+_FUNCTIONS = {"max": _maximum, "min": _minimum}
+
+
+class CompiledFormula:
+    """
+    Evaluator for one rate formula.
+
+    Call with operands as keywords (scalar floats or numpy arrays); returns a
+    float, or an array of the operands' shape.
+    """
+
+    def __init__(self, formula: str, expression: str, evaluate: Callable[[Dict], object],
+                 operands: frozenset, source_template: Optional[str] = None):
+        self.formula = formula
+        self.expression = expression
+        self.operands = operands
+        self._evaluate = evaluate
+        self._source_template = source_template
+
+    def __call__(self, **operands):
+        missing = self.operands - operands.keys()
+        if missing:
+            raise TypeError(f"formula {self.formula!r} needs operands {sorted(missing)}")
+        value = self._evaluate(operands)
+        if isinstance(value, np.ndarray):
+            return value.astype(float, copy=False)
+        if any(isinstance(v, np.ndarray) for v in operands.values()):
+            shape = np.broadcast(*(np.asarray(v) for v in operands.values())).shape
+            return np.full(shape, float(value))
+        return float(value)
+
+    def describe(self, rate: float, mfn: float = 0.0) -> str:
+        """rate_source text for one evaluation."""
+        if self._source_template is not None:
+            return self._source_template.format(mfn_pct=mfn * 100, rate_pct=rate * 100)
+        if "mfn" in self.operands:
+            return f"formula {self.expression}: {mfn*100:.1f}% MFN = {rate*100:.1f}%"
+        return f"formula {self.expression} = {rate*100:.1f}%"
+
+    def __repr__(self) -> str:
+        return f"CompiledFormula({self.formula!r})"
+
+
+def _compile_node(node, operands: set):
+    """
+    AST node -> (closure over an operand dict, constant value or None).
+
+    Subtrees without operands are evaluated here and returned as constants.
+    """
+    if isinstance(node, ast.Expression):
+        return _compile_node(node.body, operands)
+
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise FormulaError(f"unsupported constant {node.value!r}")
+        value = node.value
+        return (lambda env: value), value
+
+    if isinstance(node, ast.Name):
+        if node.id not in OPERANDS:
+            raise FormulaError(f"unknown operand {node.id!r}")
+        operands.add(node.id)
+        name = node.id
+        return (lambda env: env[name]), None
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        inner, constant = _compile_node(node.operand, operands)
+        if isinstance(node.op, ast.UAdd):
+            return inner, constant
+        if constant is not None:
+            value = -constant
+            return (lambda env: value), value
+        return (lambda env: -inner(env)), None
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+        op = _BINARY[type(node.op)]
+        left, left_constant = _compile_node(node.left, operands)
+        right, right_constant = _compile_node(node.right, operands)
+        if left_constant is not None and right_constant is not None:
+            try:
+                value = op(left_constant, right_constant)
+            except ZeroDivisionError as e:
+                raise FormulaError("division by zero") from e
+            return (lambda env: value), value
+        if left_constant is not None:
+            return (lambda env: op(left_constant, right(env))), None
+        if right_constant is not None:
+            return (lambda env: op(left(env), right_constant)), None
+        return (lambda env: op(left(env), right(env))), None
+
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in _FUNCTIONS:
+            raise FormulaError("only min() and max() may be called")
+        if node.keywords or len(node.args) < 2:
+            raise FormulaError(f"{node.func.id}() takes two or more positional arguments")
+        function = _FUNCTIONS[node.func.id]
+        compiled = [_compile_node(arg, operands) for arg in node.args]
+        if all(constant is not None for _, constant in compiled):
+            value = function(*(constant for _, constant in compiled))
+            return (lambda env: value), value
+        args = tuple(closure for closure, _ in compiled)
+        return (lambda env: function(*(arg(env) for arg in args))), None
+
+    raise FormulaError(f"unsupported syntax {type(node).__name__}")
+
+
+@lru_cache(maxsize=256)
+def compile_formula(formula: str) -> CompiledFormula:
+    """
+    Compile a named formula or an expression. Cached per formula text.
+
+    Raises:
+        FormulaError: Unknown name, disallowed syntax or bad arithmetic
+    """
+    text = (formula or "").strip()
+    expression, template = NAMED_FORMULAS.get(text, (text, None))
+    if not expression:
+        raise FormulaError("empty formula")
+
+    try:
+        tree = ast.parse(_PERCENT.sub(r"(\1/100)", expression), mode="eval")
+    except SyntaxError as e:
+        raise FormulaError(f"cannot parse {formula!r}") from e
+
+    operands: set = set()
+    evaluate, _ = _compile_node(tree, operands)
+    return CompiledFormula(text, expression, evaluate, frozenset(operands), template)
+
+
+# ============================================================================
+# Program rate resolution
+# ============================================================================
+
+class RateRule:
+    """Resolved program_rates row for one (program, group, validity window)."""
+
+    __slots__ = ("kind", "rate", "group_id", "formula", "formula_text")
+
+    def __init__(self, row):
+        self.group_id = row.group_id
+        self.rate = None
+        self.formula = None
+        self.formula_text = row.rate_formula
+        if row.rate_type == "formula":
+            try:
+                self.formula = compile_formula(row.rate_formula)
+                self.kind = "formula"
+            except FormulaError as e:
+                logger.warning(f"program_rates {row.program_id}/{row.group_id}: {e}")
+                self.kind = "unknown_formula"
+        elif row.rate is not None:
+            self.kind = "fixed"
+            self.rate = float(row.rate)
+        else:
+            self.kind = "null"
+
+    def constant(self) -> Optional[Tuple[float, str]]:
+        """(rate, rate_source) when the rule does not depend on the HTS code."""
+        if self.kind == "fixed":
+            return self.rate, f"fixed_rate_{self.group_id}"
+        if self.kind == "null":
+            return 0.0, "rate_is_null"
+        if self.kind == "unknown_formula":
+            return 0.0, f"unknown_formula:{self.formula_text}"
+        if not self.formula.operands:
+            rate = self.formula()
+            return rate, self.formula.describe(rate)
+        return None
+
+
+class ProgramRateResolver:
+    """
+    program_rates index per (program_id, group_id), with the ProgramCode
+    fallback rate per program.
+    """
+
+    def __init__(self, program_rates: Iterable, program_codes: Iterable,
+                 data_version: int = 0, engine_id: Optional[int] = None):
+        """
+        Args:
+            program_rates: ProgramRate rows (any objects with its columns), id order
+            program_codes: ProgramCode rows, id order
+            data_version: Tariff data version the rows were read at
+            engine_id: id() of the engine they were read from
+        """
+        self.data_version = data_version
+        self.engine_id = engine_id
+        self._index = TemporalIntervalIndex(
+            program_rates,
+            key_func=lambda r: (r.program_id, r.group_id),
+            pick=lambda rows: RateRule(latest_start_first(rows, "effective_date")),
+            start_attr="effective_date",
+            end_attr="expiration_date",
+        )
+
+        # Old behaviour: the first code row of a program with an 'apply' row
+        first_code: Dict[str, object] = {}
+        applies = set()
+        for code in program_codes:
+            first_code.setdefault(code.program_id, code)
+            if code.action == "apply":
+                applies.add(code.program_id)
+        self._legacy: Dict[str, float] = {
+            program_id: float(code.duty_rate)
+            for program_id, code in first_code.items()
+            if program_id in applies and code.duty_rate
+        }
+
+    @classmethod
+    def load(cls, data_version: int = 0) -> "ProgramRateResolver":
+        """Build from program_rates and program_codes. Must be called inside an app context."""
+        from app.services.rule_snapshot import freeze_rows
+        from app.web.db import db
+        from app.web.db.models.tariff_tables import ProgramCode, ProgramRate
+
+        return cls(
+            freeze_rows(ProgramRate, ProgramRate.query.order_by(ProgramRate.id).all()),
+            freeze_rows(ProgramCode, ProgramCode.query.order_by(ProgramCode.id).all()),
+            data_version=data_version,
+            engine_id=id(db.engine),
+        )
+
+    def rule(self, program_id: str, group_id: str, check_date: date) -> Optional[RateRule]:
+        """Rule for the group on check_date, else the 'default' group's, else None."""
+        for try_group in (group_id, "default"):
+            rule = self._index.get((program_id, try_group), check_date)
+            if rule is not None:
+                return rule
+        return None
+
+    def program_ids(self) -> List[str]:
+        """Programs with program_rates rows, sorted."""
+        return sorted({program_id for program_id, _ in self._index.keys()})
+
+    def _fallback(self, program_id: str) -> Tuple[float, str]:
+        rate = self._legacy.get(program_id)
+        if rate is not None:
+            return rate, "legacy_program_code"
+        return 0.0, "no_rate_found"
+
+    def evaluate(self, program_id: str, group_id: str, hts_code: str, check_date: date,
+                 mfn_lookup: Callable[[str], float]) -> Tuple[float, str]:
+        """
+        (rate, rate_source) for one HTS code, as get_rate_for_program() returns it.
+
+        Args:
+            mfn_lookup: HTS code -> MFN base rate on check_date; only called
+                        for formulas that use the mfn operand
+        """
+        rule = self.rule(program_id, group_id, check_date)
+        if rule is None:
+            return self._fallback(program_id)
+        constant = rule.constant()
+        if constant is not None:
+            return constant
+        mfn = mfn_lookup(hts_code)
+        rate = rule.formula(mfn=mfn)
+        return rate, rule.formula.describe(rate, mfn)
+
+    def evaluate_many(self, program_id: str, group_id: str, hts_codes, check_date: date,
+                      mfn_lookup: Callable[[str], float]) -> Tuple[np.ndarray, List[str]]:
+        """
+        Vectorized evaluate() over many HTS codes.
+
+        The MFN lookup runs once per distinct code and the formula once over
+        the whole array.
+
+        Returns:
+            (rates array aligned with hts_codes, rate_source per code)
+        """
+        codes = list(hts_codes)
+        rule = self.rule(program_id, group_id, check_date)
+        constant = self._fallback(program_id) if rule is None else rule.constant()
+        if constant is not None:
+            rate, source = constant
+            return np.full(len(codes), rate, dtype=float), [source] * len(codes)
+
+        distinct = list(dict.fromkeys(codes))
+        position = {code: i for i, code in enumerate(distinct)}
+        distinct_mfn = np.fromiter((mfn_lookup(code) for code in distinct), dtype=float,
+                                   count=len(distinct))
+        mfn = distinct_mfn[[position[code] for code in codes]] if codes else distinct_mfn
+        rates = rule.formula(mfn=mfn)
+        sources = [rule.formula.describe(rate, m) for rate, m in zip(rates.tolist(), mfn.tolist())]
+        return rates, sources
+
+
+def _build_resolver(data_version: int, engine_id: int) -> ProgramRateResolver:
+    resolver = ProgramRateResolver.load(data_version=data_version)
+    logger.info(f"Built program rate resolver (data v{data_version})")
+    return resolver
+
+
+def _rate_models():
+    from app.web.db.models.tariff_tables import ProgramCode, ProgramRate
+    return ProgramRate, ProgramCode
+
+
+_resolver = VersionedSingleton(_build_resolver)
+register_model_invalidation(_rate_models, lambda changes: invalidate_program_rate_resolver())
+
+
+def get_program_rate_resolver() -> ProgramRateResolver:
+    """
+    Current program rate resolver, rebuilt if rates changed since it was built.
+
+    Must be called inside an app context.
+    """
+    return _resolver.get()
+
+
+def invalidate_program_rate_resolver() -> None:
+    """Drop the resolver; the next lookup rebuilds it."""
+    _resolver.invalidate()
@@ -0,0 +1,263 @@
+"""
+Stacking Result Cache
+
+v22.0: In-process cache of complete stacking results, keyed by the
+calculation replay key plus the tariff data version.
+
+Identical calculations (same HTS, country, date, materials, value,
+description and quantity) dominate /tariff/calculate traffic. The replay key
+from compute_replay_key() already identifies the inputs; adding the tariff
+data version makes every cached result unreachable as soon as a writer
+commits rule rows.
+
+Data version:
+- Persisted in the tariff_data_version table (single row) so a bump from any
+  process (pipeline worker, populate_tariff_tables, admin commit) is seen by
+  every web process.
+- Writers call bump_tariff_data_version() after committing rule rows
+  (write_gate, commit_engine and the populate_* / ingest_* scripts). The
+  bump also drops the in-memory rule snapshot.
+- Readers check the persisted version at most every
+  RESULT_CACHE_VERSION_POLL_SECONDS (default 5; 0 = every lookup), so a cache
+  hit does not wait on the database. Bumps made in this process are visible
+  immediately regardless of the poll interval; bumps from other processes
+  within one poll interval.
+
+Enabled for StackingRAG with USE_RESULT_CACHE=true. Results awaiting
+material input are never cached. A cache hit skips the graph entirely, so no
+new TariffCalculationLog row is written for it.
+
+Usage:
+    from app.services.result_cache import get_result_cache, bump_tariff_data_version
+
+    cache = get_result_cache()
+    result = cache.get(key)
+"""
+
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================================
+# Tariff data version
+# ============================================================================
+
+_version_lock = threading.Lock()
+_local_version = 0          # Last version seen or written by this process
+_version_checked_at = 0.0   # time.monotonic() of the last persisted read
+_local_bumps = set()        # Versions bumped here directly on top of the last version seen
+
+
+def _poll_seconds() -> float:
+    return float(os.getenv("RESULT_CACHE_VERSION_POLL_SECONDS", "5"))
+
+
+def _read_persisted_version() -> Optional[int]:
+    """Read the persisted version (None if the table is unavailable)."""
+    from app.web.db import db
+    from app.web.db.models.tariff_tables import TariffDataVersion
+    try:
+        row = db.session.get(TariffDataVersion, 1)
+    except Exception as e:
+        logger.debug(f"tariff_data_version unavailable: {e}")
+        db.session.rollback()
+        return None
+    return row.version if row else 0
+
+
+def get_tariff_data_version() -> int:
+    """
+    Current tariff data version.
+
+    Must be called inside an app context. Falls back to the in-process
+    counter when the version table cannot be read.
+    """
+    global _local_version, _version_checked_at
+    now = time.monotonic()
+    if _version_checked_at and now - _version_checked_at < _poll_seconds():
+        return _local_version
+
+    persisted = _read_persisted_version()
+    with _version_lock:
+        if persisted is not None and persisted > _local_version:
+            _local_version = persisted
+        _version_checked_at = now
+        return _local_version
+
+
+def bump_tariff_data_version(updated_by: str = None) -> int:
+    """
+    Increment the tariff data version after rule rows were committed.
+
+    Must be called inside an app context, after the writer's commit. Also
+    invalidates the rule snapshot. Never raises: a failed bump is logged and
+    the in-process version still advances.
+
+    Args:
+        updated_by: Writer name for the version row (e.g. "commit_engine")
+
+    Returns:
+        The new version
+    """
+    global _local_version, _version_checked_at
+    from app.web.db import db
+    from app.web.db.models.tariff_tables import TariffDataVersion
+    from app.services.rule_snapshot import invalidate_rule_snapshot
+
+    new_version = None
+    contiguous = False
+    try:
+        row = db.session.get(TariffDataVersion, 1, with_for_update=True)
+        if row is None:
+            row = TariffDataVersion(id=1, version=0)
+            db.session.add(row)
+        contiguous = (row.version or 0) == _local_version
+        row.version = max(row.version or 0, _local_version) + 1
+        row.updated_by = updated_by
+        db.session.commit()
+        new_version = row.version
+    except Exception as e:
+        logger.warning(f"Could not persist tariff data version bump: {e}")
+        db.session.rollback()
+
+    with _version_lock:
+        if new_version is None or contiguous:
+            _local_bumps.add(new_version if new_version is not None else _local_version + 1)
+        _local_version = new_version if new_version is not None else _local_version + 1
+        _version_checked_at = time.monotonic()
+        version = _local_version
+
+    invalidate_rule_snapshot()
+    logger.info(f"Tariff data version bumped to v{version} by {updated_by or 'unknown'}")
+    return version
+
+
+def bumped_locally(since_version: int, version: int) -> bool:
+    """
+    True when every version after since_version up to version was bumped
+    by this process with no other writer's bump in between.
+
+    In-process caches that already applied this process's committed changes
+    can then keep their contents across the version change.
+    """
+    with _version_lock:
+        return all(v in _local_bumps for v in range(since_version + 1, version + 1))
+
+
+# ============================================================================
+# Result cache
+# ============================================================================
+
+# Environment flags that change calculation output for identical inputs
+_RESULT_FLAGS = ("USE_IEEPA_V2_ENGINE", "USE_DB_ENERGY_CHECK")
+
+
+def result_cache_key(
+    hts_code: str,
+    country: str,
+    import_date: str,
+    product_value: float,
+    product_description: str,
+    materials: Optional[Dict[str, Any]],
+    quantity=None,
+    quantity_uom=None,
+    data_version: int = 0,
+) -> Tuple:
+    """
+    Cache key for a stacking calculation.
+
+    The replay key covers HTS, country, date and materials; the remaining
+    inputs that change the output are appended, then the data version.
+    """
+    from app.chat.tools.stacking_tools import compute_replay_key
+
+    replay_key = compute_replay_key(hts_code, country, import_date, materials=materials)
+    flags = tuple(os.getenv(name, "false").lower() for name in _RESULT_FLAGS)
+    return (
+        replay_key,
+        materials is None,
+        product_value,
+        product_description,
+        quantity,
+        quantity_uom,
+        flags,
+        data_version,
+    )
+
+
+class StackingResultCache:
+    """
+    Bounded LRU of complete stacking results.
+
+    Results are deep-copied on the way in and out, so callers can mutate
+    what they get back.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple) -> Optional[dict]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(result)
+
+    def put(self, key: Tuple, result: dict) -> None:
+        if result.get("awaiting_user_input"):
+            return
+        stored = copy.deepcopy(result)
+        with self._lock:
+            self._entries[key] = stored
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Summary for admin/debug endpoints."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "data_version": _local_version,
+            }
+
+
+_result_cache: Optional[StackingResultCache] = None
+_result_cache_lock = threading.Lock()
+
+
+def result_cache_enabled() -> bool:
+    return os.getenv("USE_RESULT_CACHE", "false").lower() == "true"
+
+
+def get_result_cache() -> StackingResultCache:
+    """Get the process-wide result cache (created on first use)."""
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = StackingResultCache(
+                    max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+                )
+    return _result_cache
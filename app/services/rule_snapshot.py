@@ -0,0 +1,554 @@
+"""
+Tariff Rule Snapshot
+
+v22.0: Immutable, versioned in-memory copy of the tariff rule tables used by
+the stacking tools.
+
+The stacking graph calls the same handful of lookups for every calculation
+(programs for a country, 301/232/IEEPA rate as of a date, Chapter 99 output
+codes, duty rules, MFN base rates, country groups). Each of those is a small
+indexed SELECT, but a single calculation issues dozens of them. The snapshot
+loads every rule table once, freezes the rows into namedtuples and indexes
+them by program_id, HTS prefix (prefix_trie) and effective date
+(interval_index) so the hot path runs without touching the database.
+
+Rows keep the ORM attribute names, so tool code written against
+``Model.query...first()`` can use snapshot rows unchanged.
+
+Usage:
+    from app.services.rule_snapshot import get_rule_snapshot
+
+    snapshot = get_rule_snapshot()
+    rate = snapshot.section_301_rate_as_of("85444290", date(2025, 6, 1))
+
+Enabled for the stacking tools with USE_RULE_SNAPSHOT=true. Writers call
+invalidate_rule_snapshot() after changing rule tables (directly or through
+app.services.result_cache.bump_tariff_data_version()); the next reader
+loads a fresh snapshot with a higher version. Readers also reload when the
+persisted tariff data version moved (a bump in another process) or the
+database engine changed.
+"""
+
+import logging
+import threading
+from collections import namedtuple
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import inspect as sa_inspect
+
+from app.services.interval_index import TemporalIntervalIndex, latest_start_first
+from app.services.model_invalidation import VersionedSingleton
+from app.services.prefix_trie import HtsPrefixTrie
+
+logger = logging.getLogger(__name__)
+
+
+def _is_active(start: Optional[date], end: Optional[date], as_of_date: date) -> bool:
+    """Closed-open temporal check: start <= date < end (NULL end = open)."""
+    if start is not None and start > as_of_date:
+        return False
+    return end is None or end > as_of_date
+
+
+def _pick_section_301(active: List):
+    """Section301Rate.get_rate_as_of precedence over rows active on a date."""
+    for archived in (False, True):
+        tier = [r for r in active if bool(r.is_archived) == archived]
+        if tier:
+            excludes = [r for r in tier if r.role == "exclude"]
+            return latest_start_first(excludes or tier)
+    return None
+
+
+def _dotted_hts(digits: str) -> str:
+    """Dotted form used by get_mfn_base_rate: '8544.42.9090', '8544.42', '8544'."""
+    if len(digits) > 6:
+        return f"{digits[:4]}.{digits[4:6]}.{digits[6:]}"
+    if len(digits) > 4:
+        return f"{digits[:4]}.{digits[4:]}"
+    return digits
+
+
+def _latest_first(rows, start_attr: str = "effective_start") -> List:
+    """Sort rows by start date DESC, keeping id order for ties."""
+    return sorted(rows, key=lambda r: getattr(r, start_attr), reverse=True)
+
+
+class TariffRuleSnapshot:
+    """
+    Frozen view of the tariff rule tables at a point in time.
+
+    Every lookup method mirrors one of the queries issued by the stacking
+    tools, including its precedence rules, and returns a row namedtuple
+    (or None). The snapshot never changes after load(); a new snapshot is
+    built when the underlying data changes.
+    """
+
+    # Models (from app.web.db.models.tariff_tables) captured in a snapshot
+    TABLES = (
+        "TariffProgram",
+        "Section301Rate",
+        "Section232Rate",
+        "Section232Material",
+        "IeepaRate",
+        "ProgramCode",
+        "DutyRule",
+        "IeepaAnnexIIExclusion",
+        "HtsBaseRate",
+        "CountryGroup",
+        "CountryGroupMember",
+        "ProgramRate",
+        "CountryAlias",
+        "ProgramCountryScope",
+        "IeepaReciprocalRateSchedule",
+        "IeepaReciprocalProductExclusions",
+        "IeepaReciprocalExceptionRules",
+        "IeepaReciprocalDealOverrides",
+    )
+
+    def __init__(self, version: int, rows: Dict[str, Tuple],
+                 data_version: Optional[int] = None, engine_id: Optional[int] = None):
+        self.version = version
+        # Tariff data version and id() of the engine the rows were read at
+        self.data_version = data_version
+        self.engine_id = engine_id
+        self.loaded_at = datetime.utcnow()
+        self.row_counts = {name: len(table_rows) for name, table_rows in rows.items()}
+
+        # Tariff programs
+        self._programs = rows.get("TariffProgram", ())
+        self._programs_by_id = self._group(self._programs, lambda r: r.program_id)
+
+        # Section 301 temporal rates: hts_8digit -> interval index
+        self._s301_rates = TemporalIntervalIndex(
+            rows.get("Section301Rate", ()), lambda r: r.hts_8digit, pick=_pick_section_301
+        )
+
+        # Section 232 temporal rates: (hts_8digit, material, country) -> interval index
+        self._s232_rates = TemporalIntervalIndex(
+            rows.get("Section232Rate", ()),
+            lambda r: (r.hts_8digit, r.material_type, r.country_code),
+        )
+
+        # Section 232 static materials: hts_8digit -> rows
+        self._s232_materials = self._group(rows.get("Section232Material", ()), lambda r: r.hts_8digit)
+
+        # IEEPA temporal rates: by program, by program/country, and by
+        # program/country/variant (variant-filtered lookups)
+        ieepa_rows = rows.get("IeepaRate", ())
+        self._ieepa_latest = TemporalIntervalIndex(ieepa_rows, lambda r: r.program_type)
+        self._ieepa_rates = TemporalIntervalIndex(
+            ieepa_rows, lambda r: (r.program_type, r.country_code)
+        )
+        self._ieepa_variant_rates = TemporalIntervalIndex(
+            ieepa_rows, lambda r: (r.program_type, r.country_code, r.variant)
+        )
+
+        # Output codes and duty rules: program_id -> rows
+        self._program_codes = self._group(rows.get("ProgramCode", ()), lambda r: r.program_id)
+        self._duty_rules = self._group(rows.get("DutyRule", ()), lambda r: r.program_id)
+
+        # Annex II (legacy v4.0 table): exact hts_code prefix -> rows
+        self._annex_ii = self._group(rows.get("IeepaAnnexIIExclusion", ()), lambda r: r.hts_code)
+
+        # MFN base rates: stored hts_code string (dotted or not) -> rows
+        self._base_rates = self._group(rows.get("HtsBaseRate", ()), lambda r: r.hts_code)
+
+        # Country groups and members
+        self._group_ids = {r.id: r.group_id for r in rows.get("CountryGroup", ())}
+        self._members_by_country = self._group(
+            rows.get("CountryGroupMember", ()), lambda r: r.country_code
+        )
+        self._members_by_group = self._group(
+            rows.get("CountryGroupMember", ()), lambda r: r.group_id
+        )
+        self._program_rates = self._group(
+            rows.get("ProgramRate", ()), lambda r: (r.program_id, r.group_id)
+        )
+        self._aliases = self._group(rows.get("CountryAlias", ()), lambda r: r.alias_norm)
+        self._country_scopes = self._group(
+            rows.get("ProgramCountryScope", ()), lambda r: r.program_id
+        )
+
+        # IEEPA Reciprocal V2 tables (v21.0)
+        self._rate_schedules = self._group(
+            rows.get("IeepaReciprocalRateSchedule", ()), lambda r: r.country_code
+        )
+        self._exception_rules = tuple(
+            sorted(rows.get("IeepaReciprocalExceptionRules", ()), key=lambda r: r.priority)
+        )
+
+        # Longest-prefix tries over the HTS prefix tables (product exclusions,
+        # deal overrides per country, Annex II, MFN base rates)
+        self._annex_ii_trie = self._build_annex_ii_trie(self._annex_ii)
+        self._base_rate_trie = self._build_base_rate_trie(rows.get("HtsBaseRate", ()))
+        self._product_exclusion_trie = self._build_lpm_trie(
+            rows.get("IeepaReciprocalProductExclusions", ())
+        )
+        self._deal_override_tries = {
+            country: self._build_lpm_trie(country_rows)
+            for country, country_rows in self._group(
+                rows.get("IeepaReciprocalDealOverrides", ()), lambda r: r.country_code
+            ).items()
+        }
+
+    @staticmethod
+    def _group(rows, key_func) -> Dict:
+        """Group rows by key, preserving load (id) order within each key."""
+        grouped: Dict = {}
+        for row in rows:
+            grouped.setdefault(key_func(row), []).append(row)
+        return {key: tuple(values) for key, values in grouped.items()}
+
+    @staticmethod
+    def _build_annex_ii_trie(annex_ii: Dict) -> HtsPrefixTrie:
+        """Only the first row per stored prefix counts (filter_by().first())."""
+        trie = HtsPrefixTrie()
+        for prefix, matches in annex_ii.items():
+            if prefix and prefix.isdigit():
+                row = matches[0]
+                trie.insert(prefix, row, row.effective_date, row.expiration_date)
+        return trie
+
+    @staticmethod
+    def _build_base_rate_trie(rows) -> HtsPrefixTrie:
+        """Dotted codes rank before undotted ones under the same digits."""
+        trie = HtsPrefixTrie()
+        for row in rows:
+            code = row.hts_code or ""
+            digits = code.replace(".", "")
+            if not digits.isdigit():
+                continue
+            if code == digits:
+                rank = 1
+            elif code == _dotted_hts(digits):
+                rank = 0
+            else:
+                continue  # Neither form get_mfn_base_rate queries
+            trie.insert(digits, row, row.effective_date, row.expiration_date, rank=rank)
+        return trie
+
+    @staticmethod
+    def _build_lpm_trie(rows) -> HtsPrefixTrie:
+        """V2 LPM tables: a row only matches at its declared prefix_len."""
+        trie = HtsPrefixTrie()
+        for row in rows:
+            if row.hts_prefix and len(row.hts_prefix) == row.prefix_len:
+                trie.insert(row.hts_prefix, row, row.effective_start, row.effective_end)
+        return trie
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def load(cls, version: int, data_version: Optional[int] = None) -> "TariffRuleSnapshot":
+        """
+        Read every rule table into frozen rows.
+
+        Must be called inside a Flask app context. A table that cannot be
+        read (e.g., not yet migrated) is logged and treated as empty.
+        """
+        from app.web.db import db
+        from app.web.db.models import tariff_tables
+
+        rows = {}
+        for name in cls.TABLES:
+            model = getattr(tariff_tables, name)
+            try:
+                rows[name] = freeze_rows(model, model.query.order_by(model.id).all())
+            except Exception as e:
+                logger.warning(f"Rule snapshot: could not load {name}: {e}")
+                db.session.rollback()
+                rows[name] = ()
+        return cls(version, rows, data_version=data_version, engine_id=id(db.engine))
+
+    # ------------------------------------------------------------------
+    # Tariff programs
+    # ------------------------------------------------------------------
+
+    def program(self, program_id: str):
+        """First TariffProgram row for program_id (any country)."""
+        matches = self._programs_by_id.get(program_id)
+        return matches[0] if matches else None
+
+    def programs_for_country(self, country_iso: str, as_of_date: date) -> List:
+        """Programs for a country or 'ALL', active on date, by filing_sequence."""
+        active = [
+            p for p in self._programs
+            if (p.country == country_iso or p.country == "ALL")
+            and _is_active(p.effective_date, p.expiration_date, as_of_date)
+        ]
+        return sorted(active, key=lambda p: p.filing_sequence)
+
+    # ------------------------------------------------------------------
+    # Temporal rate tables
+    # ------------------------------------------------------------------
+
+    def section_301_rate_as_of(self, hts_8digit: str, as_of_date: date):
+        """
+        Mirror of Section301Rate.get_rate_as_of.
+
+        Active datasets before archived ones; within a tier, role='exclude'
+        before 'impose', then most recent effective_start.
+        """
+        return self._s301_rates.get(hts_8digit, as_of_date)
+
+    def section_232_rate_as_of(self, hts_8digit: str, material: str,
+                               country_code: Optional[str], as_of_date: date):
+        """Mirror of Section232Rate.get_rate_as_of (country row, then global)."""
+        return (self._s232_rates.get((hts_8digit, material, country_code), as_of_date)
+                or self._s232_rates.get((hts_8digit, material, None), as_of_date))
+
+    def ieepa_rate_as_of(self, program_type: str, country_code: Optional[str],
+                         as_of_date: date, variant: Optional[str] = None):
+        """Mirror of IeepaRate.get_rate_as_of."""
+        if variant:
+            return self._ieepa_variant_rates.get((program_type, country_code, variant), as_of_date)
+        return self._ieepa_rates.get((program_type, country_code), as_of_date)
+
+    def latest_ieepa_rate(self, program_type: str, as_of_date: date):
+        """Most recent active IEEPA rate for a program type, any country."""
+        return self._ieepa_latest.get(program_type, as_of_date)
+
+    # ------------------------------------------------------------------
+    # Section 232 materials
+    # ------------------------------------------------------------------
+
+    def section_232_materials(self, hts_8digit: str) -> Tuple:
+        """All Section232Material rows for an HTS8 (load order)."""
+        return self._s232_materials.get(hts_8digit, ())
+
+    def section_232_material(self, hts_8digit: str, material: str):
+        """Section232Material row for an HTS8/material pair."""
+        for row in self._s232_materials.get(hts_8digit, ()):
+            if row.material == material:
+                return row
+        return None
+
+    # ------------------------------------------------------------------
+    # Output codes and duty rules
+    # ------------------------------------------------------------------
+
+    def program_code(self, program_id: str, action: Optional[str] = None,
+                     variant: Optional[str] = None, slice_type: Optional[str] = None,
+                     match_variant: bool = True):
+        """
+        First ProgramCode row matching the given filters.
+
+        With match_variant=True a None variant matches only NULL variants
+        (get_program_output semantics); with match_variant=False variant is
+        ignored. slice_type=None matches any slice.
+        """
+        for row in self._program_codes.get(program_id, ()):
+            if action is not None and row.action != action:
+                continue
+            if match_variant and row.variant != variant:
+                continue
+            if slice_type is not None and row.slice_type != slice_type:
+                continue
+            return row
+        return None
+
+    def duty_rule(self, program_id: str):
+        """First DutyRule row for a program."""
+        matches = self._duty_rules.get(program_id)
+        return matches[0] if matches else None
+
+    # ------------------------------------------------------------------
+    # Annex II / MFN
+    # ------------------------------------------------------------------
+
+    def annex_ii_exclusion(self, hts_prefix: str, as_of_date: date):
+        """
+        First IeepaAnnexIIExclusion row stored under this exact prefix, if
+        that row is active on the date (check_annex_ii_exclusion semantics).
+        """
+        matches = self._annex_ii.get(hts_prefix)
+        if not matches:
+            return None
+        row = matches[0]
+        if row.effective_date and as_of_date < row.effective_date:
+            return None
+        if row.expiration_date and as_of_date >= row.expiration_date:
+            return None
+        return row
+
+    def hts_base_rate(self, hts_code: str, as_of_date: date):
+        """First HtsBaseRate row stored under this exact code, active on date."""
+        for row in self._base_rates.get(hts_code, ()):
+            if _is_active(row.effective_date, row.expiration_date, as_of_date):
+                return row
+        return None
+
+    def annex_ii_longest_match(self, hts_digits: str, as_of_date: date):
+        """
+        Longest-prefix Annex II match as (matched_prefix, row), or None.
+
+        Same result as calling annex_ii_exclusion() for hts[:10], [:8], [:6]
+        and [:4] in turn, in one trie walk.
+        """
+        return self._annex_ii_trie.longest_match(hts_digits, as_of_date, partial=True)
+
+    def mfn_base_rate(self, hts_digits: str, as_of_date: date):
+        """
+        Longest-prefix HtsBaseRate row active on date (get_mfn_base_rate
+        semantics: dotted code before undotted at each length).
+        """
+        match = self._base_rate_trie.longest_match(hts_digits, as_of_date, partial=True)
+        return match[1] if match else None
+
+    # ------------------------------------------------------------------
+    # Countries and groups
+    # ------------------------------------------------------------------
+
+    def country_alias(self, alias_norm: str):
+        """CountryAlias row for a normalized (lowercase, trimmed) alias."""
+        matches = self._aliases.get(alias_norm)
+        return matches[0] if matches else None
+
+    def country_group_member(self, country_code: str, as_of_date: date):
+        """First active CountryGroupMember row for an exact country_code."""
+        for row in self._members_by_country.get(country_code, ()):
+            if _is_active(row.effective_date, row.expiration_date, as_of_date):
+                return row
+        return None
+
+    def is_group_member(self, group_id: str, country_iso2: str, as_of_date: date) -> bool:
+        """Case-insensitive membership check (ilike semantics)."""
+        target = country_iso2.lower()
+        return any(
+            (row.country_code or "").lower() == target
+            and _is_active(row.effective_date, row.expiration_date, as_of_date)
+            for row in self._members_by_group.get(group_id, ())
+        )
+
+    def group_id_for(self, country_group_pk: int) -> Optional[str]:
+        """Resolve a CountryGroup primary key to its group_id."""
+        return self._group_ids.get(country_group_pk)
+
+    def program_rate(self, program_id: str, group_id: str, as_of_date: date):
+        """Most recent active ProgramRate for a program/group."""
+        candidates = [
+            r for r in self._program_rates.get((program_id, group_id), ())
+            if _is_active(r.effective_date, r.expiration_date, as_of_date)
+        ]
+        return _latest_first(candidates, "effective_date")[0] if candidates else None
+
+    def country_scopes(self, program_id: str, as_of_date: date) -> List:
+        """Active ProgramCountryScope rows for a program."""
+        return [
+            r for r in self._country_scopes.get(program_id, ())
+            if _is_active(r.effective_date, r.expiration_date, as_of_date)
+        ]
+
+    # ------------------------------------------------------------------
+    # IEEPA Reciprocal V2 (v21.0)
+    # ------------------------------------------------------------------
+
+    def exception_rules_ordered(self, as_of_date: date) -> List:
+        """Mirror of IeepaReciprocalExceptionRules.get_active_rules_ordered."""
+        return [
+            r for r in self._exception_rules
+            if _is_active(r.effective_start, r.effective_end, as_of_date)
+        ]
+
+    def reciprocal_product_exclusion(self, hts_digits: str, as_of_date: date):
+        """Mirror of IeepaReciprocalProductExclusions.find_longest_match."""
+        match = self._product_exclusion_trie.longest_match(hts_digits, as_of_date)
+        return match[1] if match else None
+
+    def deal_override(self, country_code: str, hts_digits: str, as_of_date: date):
+        """Mirror of IeepaReciprocalDealOverrides.find_deal_override."""
+        trie = self._deal_override_tries.get(country_code)
+        if trie is None:
+            return None
+        match = trie.longest_match(hts_digits, as_of_date)
+        return match[1] if match else None
+
+    def rate_schedule(self, country_code: Optional[str], as_of_date: date):
+        """Mirror of _get_country_schedule: latest dataset_tag, then latest id."""
+        candidates = [
+            r for r in self._rate_schedules.get(country_code, ())
+            if _is_active(r.effective_start, r.effective_end, as_of_date)
+        ]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda r: (r.dataset_tag or "", r.id))
+
+    def as_dict(self) -> dict:
+        """Summary for admin/debug endpoints."""
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at.isoformat(),
+            "row_counts": dict(self.row_counts),
+        }
+
+
+# ============================================================================
+# Row freezing
+# ============================================================================
+
+_ROW_TYPES: Dict[str, type] = {}
+
+
+def freeze_rows(model, instances) -> Tuple:
+    """
+    Convert ORM instances into immutable namedtuples with the same
+    attribute names as the model's mapped columns.
+    """
+    row_type = _ROW_TYPES.get(model.__name__)
+    if row_type is None:
+        fields = [attr.key for attr in sa_inspect(model).column_attrs]
+        row_type = namedtuple(f"{model.__name__}Row", fields)
+        _ROW_TYPES[model.__name__] = row_type
+    fields = row_type._fields
+    return tuple(row_type(*(getattr(obj, f) for f in fields)) for obj in instances)
+
+
+# ============================================================================
+# Singleton access
+# ============================================================================
+
+_snapshot_version = 0
+_snapshot_version_lock = threading.Lock()
+
+
+def _load_snapshot(data_version: int, engine_id: int) -> TariffRuleSnapshot:
+    global _snapshot_version
+    with _snapshot_version_lock:
+        _snapshot_version += 1
+        version = _snapshot_version
+    snapshot = TariffRuleSnapshot.load(version, data_version=data_version)
+    logger.info(
+        f"Loaded tariff rule snapshot v{snapshot.version} at data v{data_version} "
+        f"({sum(snapshot.row_counts.values())} rows)"
+    )
+    return snapshot
+
+
+_snapshot = VersionedSingleton(_load_snapshot)
+
+
+def get_rule_snapshot(app=None) -> TariffRuleSnapshot:
+    """
+    Get the current rule snapshot, loading it on first use and reloading it
+    when the tariff data version or the database engine changed (e.g. after
+    another process committed rule changes).
+
+    Args:
+        app: Optional Flask app to push a context for loading when it is not
+             already the current app. When omitted the caller must already be
+             inside an app context.
+    """
+    if app is not None and not (has_app_context() and current_app._get_current_object() is app):
+        with app.app_context():
+            return _snapshot.get()
+    return _snapshot.get()
+
+
+def invalidate_rule_snapshot() -> None:
+    """Drop the current snapshot; the next reader loads a new version."""
+    _snapshot.invalidate()
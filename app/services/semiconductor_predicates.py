@@ -0,0 +1,275 @@
+"""
+Compiled Semiconductor Predicates
+
+v22.0: Section 232 semiconductor predicates compiled once into an
+HTS-prefix-indexed decision structure per program and validity window.
+
+evaluate_semiconductor_predicates() used to query section_232_predicates on
+every call, then filter the rows through matches_hts() (re-splitting each
+hts_scope string) and evaluate() one by one. The predicates are now
+compiled once:
+- Rows are indexed per program with a TemporalIntervalIndex, so each
+  validity window carries the PredicateSet of rows active in it and a
+  lookup is a bisect
+- A PredicateSet indexes its rows by hts_scope prefix; the predicates for
+  an HTS code are found with one dict probe per distinct prefix length and
+  turned into a PredicatePlan (groups in row order, thresholds as floats),
+  memoized per HTS code
+- A plan evaluates a technical_attributes dict in one pass over its
+  groups (AND within a group, OR between groups, first passing group wins)
+
+Rebuilt when predicates change, like the program rate resolver:
+- Commits that change Section232Predicate rows through the ORM
+- Tariff data version bumps from other processes
+- A different database engine (e.g. a test app)
+
+Usage:
+    from app.services.semiconductor_predicates import get_semiconductor_predicate_engine
+
+    engine = get_semiconductor_predicate_engine()
+    result = engine.evaluate("84713001", {"transistor_processing_power": 15000,
+                                          "dram_bandwidth": 4800}, date(2026, 2, 1))
+"""
+
+import logging
+import threading
+from datetime import date
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from app.services.interval_index import TemporalIntervalIndex
+from app.services.model_invalidation import VersionedSingleton, register_model_invalidation
+
+logger = logging.getLogger(__name__)
+
+SEMICONDUCTOR_PROGRAM = "section_232_semiconductor"
+
+# Bound on memoized per-HTS plans in one PredicateSet
+_PLAN_CACHE_SIZE = 8192
+
+
+class CompiledPredicate:
+    """One section_232_predicates row with its thresholds as floats."""
+
+    __slots__ = ("group", "attribute", "low", "high", "shown_min", "shown_max",
+                 "claim_heading_if_true", "rate_if_true", "heading_if_false", "rate_if_false")
+
+    def __init__(self, row):
+        self.group = row.predicate_group
+        self.attribute = row.attribute_name
+        self.low = float(row.threshold_min) if row.threshold_min is not None else None
+        self.high = float(row.threshold_max) if row.threshold_max is not None else None
+        # Thresholds as the per-predicate details have always reported them
+        self.shown_min = float(row.threshold_min) if row.threshold_min else None
+        self.shown_max = float(row.threshold_max) if row.threshold_max else None
+        self.claim_heading_if_true = row.claim_heading_if_true
+        self.rate_if_true = float(row.rate_if_true)
+        self.heading_if_false = row.heading_if_false
+        self.rate_if_false = float(row.rate_if_false)
+
+    def passes(self, value: float) -> bool:
+        """Strict bounds, as Section232Predicate.evaluate(): low < value < high."""
+        if self.low is not None and value <= self.low:
+            return False
+        if self.high is not None and value >= self.high:
+            return False
+        return True
+
+
+
+def _scope_prefixes(hts_scope: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """hts_scope prefixes, or None when the predicate applies to every code."""
+    if not hts_scope or hts_scope == "ALL":
+        return None
+    prefixes = tuple(p.strip() for p in hts_scope.split(","))
+    # An empty prefix (e.g. a trailing comma) matches every code
+    return None if "" in prefixes else prefixes
+
+
+class PredicatePlan:
+    """The predicates applicable to one HTS code, grouped in row order."""
+
+    __slots__ = ("groups", "first")
+
+    def __init__(self, predicates: Sequence[CompiledPredicate]):
+        groups: Dict[str, List[CompiledPredicate]] = {}
+        for predicate in predicates:
+            groups.setdefault(predicate.group, []).append(predicate)
+        self.groups: Tuple[Tuple[str, Tuple[CompiledPredicate, ...]], ...] = tuple(
+            (name, tuple(members)) for name, members in groups.items()
+        )
+        self.first = predicates[0]
+
+    def evaluate(self, technical_attributes: Mapping) -> dict:
+        """
+        Evaluate one product's attributes.
+
+        Returns the evaluate_semiconductor_predicates() result: details cover
+        each group up to and including the first one that passed.
+        """
+        details = []
+        for group_name, predicates in self.groups:
+            group_passed = True
+            for predicate in predicates:
+                value = technical_attributes.get(predicate.attribute)
+                if value is None:
+                    group_passed = False
+                    details.append({
+                        "group": group_name,
+                        "attribute": predicate.attribute,
+                        "supplied_value": None,
+                        "threshold_min": predicate.shown_min,
+                        "threshold_max": predicate.shown_max,
+                        "passed": False,
+                        "reason": "attribute not supplied"
+                    })
+                else:
+                    value = float(value)
+                    passed = predicate.passes(value)
+                    group_passed = group_passed and passed
+                    details.append({
+                        "group": group_name,
+                        "attribute": predicate.attribute,
+                        "supplied_value": value,
+                        "threshold_min": predicate.shown_min,
+                        "threshold_max": predicate.shown_max,
+                        "passed": passed,
+                    })
+
+            if group_passed:
+                return {
+                    "predicate_evaluated": True,
+                    "predicate_passed": True,
+                    "claim_heading": predicates[0].claim_heading_if_true,
+                    "duty_rate": predicates[0].rate_if_true,
+                    "matched_group": group_name,
+                    "details": details,
+                }
+
+        return {
+            "predicate_evaluated": True,
+            "predicate_passed": False,
+            "claim_heading": self.first.heading_if_false,
+            "duty_rate": self.first.rate_if_false,
+            "matched_group": None,
+            "details": details,
+        }
+
+
+class PredicateSet:
+    """Predicates of one program active in one validity window, indexed by HTS prefix."""
+
+    def __init__(self, rows: Sequence):
+        """
+        Args:
+            rows: Section232Predicate rows active in the window, in id order
+        """
+        self.predicates = tuple(CompiledPredicate(row) for row in rows)
+        self._unscoped: List[int] = []
+        self._by_prefix: Dict[str, List[int]] = {}
+        for position, row in enumerate(rows):
+            prefixes = _scope_prefixes(row.hts_scope)
+            if prefixes is None:
+                self._unscoped.append(position)
+                continue
+            for prefix in dict.fromkeys(prefixes):
+                self._by_prefix.setdefault(prefix, []).append(position)
+        self._lengths = sorted({len(prefix) for prefix in self._by_prefix})
+        self._plans: Dict[str, Optional[PredicatePlan]] = {}
+        self._plans_lock = threading.Lock()
+
+    def plan(self, hts_8digit: str) -> Optional[PredicatePlan]:
+        """Plan for an HTS code, or None when no predicate's scope covers it."""
+        plan = self._plans.get(hts_8digit, False)
+        if plan is not False:
+            return plan
+
+        positions = set(self._unscoped)
+        for length in self._lengths:
+            if length > len(hts_8digit):
+                break
+            positions.update(self._by_prefix.get(hts_8digit[:length], ()))
+        plan = PredicatePlan([self.predicates[p] for p in sorted(positions)]) if positions else None
+
+        with self._plans_lock:
+            if len(self._plans) >= _PLAN_CACHE_SIZE:
+                self._plans.clear()
+            self._plans[hts_8digit] = plan
+        return plan
+
+
+class SemiconductorPredicateEngine:
+    """Compiled section_232_predicates, per program and validity window."""
+
+    def __init__(self, predicates: Iterable, data_version: int = 0, engine_id: Optional[int] = None):
+        """
+        Args:
+            predicates: Section232Predicate rows (any objects with its columns), id order
+            data_version: Tariff data version the rows were read at
+            engine_id: id() of the engine they were read from
+        """
+        self.data_version = data_version
+        self.engine_id = engine_id
+        self._index = TemporalIntervalIndex(
+            predicates,
+            key_func=lambda r: r.program_id,
+            pick=PredicateSet,
+            start_attr="effective_start",
+            end_attr="effective_end",
+        )
+
+    @classmethod
+    def load(cls, data_version: int = 0) -> "SemiconductorPredicateEngine":
+        """Build from section_232_predicates. Must be called inside an app context."""
+        from app.services.rule_snapshot import freeze_rows
+        from app.web.db import db
+        from app.web.db.models.tariff_tables import Section232Predicate
+
+        return cls(
+            freeze_rows(Section232Predicate, Section232Predicate.query.order_by(Section232Predicate.id).all()),
+            data_version=data_version,
+            engine_id=id(db.engine),
+        )
+
+    def predicate_set(self, as_of_date: date, program_id: str = SEMICONDUCTOR_PROGRAM) -> Optional[PredicateSet]:
+        """Predicates of the program active on as_of_date, or None."""
+        return self._index.get(program_id, as_of_date)
+
+    def evaluate(self, hts_8digit: str, technical_attributes: Mapping, as_of_date: date,
+                 program_id: str = SEMICONDUCTOR_PROGRAM) -> dict:
+        """Evaluate one product, as evaluate_semiconductor_predicates() returns it."""
+        predicate_set = self.predicate_set(as_of_date, program_id)
+        if predicate_set is None:
+            return {"predicate_evaluated": False, "reason": "No active predicates found"}
+        plan = predicate_set.plan(hts_8digit)
+        if plan is None:
+            return {"predicate_evaluated": False, "reason": f"No predicates match HTS {hts_8digit}"}
+        return plan.evaluate(technical_attributes)
+
+
+def _build_engine(data_version: int, engine_id: int) -> SemiconductorPredicateEngine:
+    engine = SemiconductorPredicateEngine.load(data_version=data_version)
+    logger.info(f"Built semiconductor predicate engine (data v{data_version})")
+    return engine
+
+
+def _predicate_models():
+    from app.web.db.models.tariff_tables import Section232Predicate
+    return (Section232Predicate,)
+
+
+_engine = VersionedSingleton(_build_engine)
+register_model_invalidation(_predicate_models, lambda changes: invalidate_semiconductor_predicate_engine())
+
+
+def get_semiconductor_predicate_engine() -> SemiconductorPredicateEngine:
+    """
+    Current predicate engine, rebuilt if predicates changed since it was built.
+
+    Must be called inside an app context.
+    """
+    return _engine.get()
+
+
+def invalidate_semiconductor_predicate_engine() -> None:
+    """Drop the engine; the next lookup rebuilds it."""
+    _engine.invalidate()
@@ -0,0 +1,161 @@
+"""
+Pending Session Store
+
+v22.0: Shared, bounded store for calculations awaiting material input.
+
+When the stacking graph asks for material values, POST /tariff/calculate
+returns a session_id and the follow-up request resumes the calculation.
+Keeping StackingRAG objects in a module-level dict broke that under several
+gunicorn workers (the follow-up lands on another worker and misses) and grew
+without bound when users never answered. This store instead keeps:
+- Compact state only: the calculation inputs from
+  StackingRAG.detach_pending_state() (JSON), not graph objects
+- One SQLite file shared by every worker process on the host
+  (PENDING_SESSION_DB_PATH, default pending_sessions.db in the Flask
+  instance folder, independent of the working directory)
+- TTL eviction (PENDING_SESSION_TTL_SECONDS, default 3600) and a size cap
+  (PENDING_SESSION_MAX_ENTRIES, default 10000; oldest sessions go first)
+
+pop() removes the session atomically, so exactly one request resumes it.
+
+Usage:
+    from app.services.session_store import get_pending_session_store
+
+    store = get_pending_session_store()
+    store.put(session_id, {"engine": "graph", "state": rag.detach_pending_state()})
+    pending = store.pop(session_id)  # None if unknown, expired or evicted
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from flask import current_app, has_app_context
+
+# Flask's default instance folder for the app package: <project root>/instance
+_DEFAULT_INSTANCE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "instance"
+)
+
+
+class PendingSessionStore:
+    """
+    SQLite-backed session_id -> JSON payload map with TTL and size cap.
+
+    Each call opens its own connection, so one instance is safe to share
+    between threads and the file between processes.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: float = 3600, max_entries: int = 10000):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending_sessions ("
+                " session_id TEXT PRIMARY KEY,"
+                " payload TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_pending_sessions_created_at"
+                " ON pending_sessions (created_at)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: transactions are explicit (BEGIN IMMEDIATE)
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def put(self, session_id: str, payload: dict) -> None:
+        """Store a session, evicting expired sessions and the oldest over the cap."""
+        now = time.time()
+        data = json.dumps(payload, default=str)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM pending_sessions WHERE created_at <= ?", (now - self.ttl_seconds,))
+            conn.execute(
+                "INSERT OR REPLACE INTO pending_sessions (session_id, payload, created_at) VALUES (?, ?, ?)",
+                (session_id, data, now),
+            )
+            conn.execute(
+                "DELETE FROM pending_sessions WHERE session_id IN ("
+                " SELECT session_id FROM pending_sessions ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def pop(self, session_id: str) -> Optional[dict]:
+        """Remove and return a session's payload (None if unknown or expired)."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT payload, created_at FROM pending_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM pending_sessions WHERE session_id = ?", (session_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        if row is None or row[1] <= time.time() - self.ttl_seconds:
+            return None
+        return json.loads(row[0])
+
+    def __len__(self) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM pending_sessions WHERE created_at > ?",
+                (time.time() - self.ttl_seconds,),
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def clear(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM pending_sessions")
+        finally:
+            conn.close()
+
+
+_session_store: Optional[PendingSessionStore] = None
+_session_store_lock = threading.Lock()
+
+
+def _default_db_path() -> str:
+    instance_path = current_app.instance_path if has_app_context() else _DEFAULT_INSTANCE_PATH
+    return os.path.join(instance_path, "pending_sessions.db")
+
+
+def get_pending_session_store() -> PendingSessionStore:
+    """Get the process-wide pending session store (created on first use)."""
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                _session_store = PendingSessionStore(
+                    db_path=os.getenv("PENDING_SESSION_DB_PATH") or _default_db_path(),
+                    ttl_seconds=float(os.getenv("PENDING_SESSION_TTL_SECONDS", "3600")),
+                    max_entries=int(os.getenv("PENDING_SESSION_MAX_ENTRIES", "10000")),
+                )
+    return _session_store
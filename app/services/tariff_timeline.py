@@ -0,0 +1,276 @@
+"""
+Tariff Timeline
+
+v22.0: Duty for one HTS/country across a date range, as piecewise-constant
+segments.
+
+"What was the duty on 8544.42.9090 from China every day of 2024-2026?"
+only changes on dates where some temporal rule row starts or ends. The
+timeline collects those change points from the rule tables, runs the
+stacking calculation once per distinct interval (direct engine, shared
+lookups, rule snapshot) and merges neighbouring intervals whose stacks and
+duties turn out identical. Work is O(change points), not O(days).
+
+Change points come from:
+- TariffProgram (program effective/expiration dates)
+- Section301Rate, Section232Rate (by HTS8)
+- IeepaRate, IeepaReciprocalRateSchedule (by country, plus global rows)
+- IeepaAnnexIIExclusion, IeepaReciprocalProductExclusions,
+  IeepaReciprocalDealOverrides, HtsBaseRate (by HTS prefix)
+- IeepaReciprocalExceptionRules, ProgramSuppression
+- CountryGroupMember (by country), ProgramRate (by the country's groups and
+  'default'), ProgramCountryScope (by country or the country's groups)
+- Section232Predicate (all rows; hts_scope is a prefix list)
+
+Over-collecting a boundary only costs one extra evaluation (the segments
+are merged again); missing one would hide a change, so filters err on the
+side of including rows.
+
+Usage:
+    from app.services.tariff_timeline import calculate_tariff_timeline
+
+    timeline = calculate_tariff_timeline(
+        hts_code="8544.42.9090", country="China",
+        start_date=date(2024, 1, 1), end_date=date(2026, 12, 31),
+        materials={"copper": 3000},
+    )
+"""
+
+import json
+import logging
+import uuid
+from datetime import date, timedelta
+from typing import List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class TimelineError(ValueError):
+    """Raised for an invalid timeline request (bad range, missing fields)."""
+
+
+def _hts_prefixes(hts_clean: str) -> List[str]:
+    return [hts_clean[:length] for length in (10, 8, 6, 4)]
+
+
+def _dotted_prefixes(hts_clean: str) -> List[str]:
+    """Dotted HTS forms stored in hts_base_rates ('8544.42.9090', '8544.42', ...)."""
+    forms = []
+    for prefix in _hts_prefixes(hts_clean):
+        if len(prefix) > 6:
+            forms.append(f"{prefix[:4]}.{prefix[4:6]}.{prefix[6:]}")
+        elif len(prefix) > 4:
+            forms.append(f"{prefix[:4]}.{prefix[4:]}")
+    return forms
+
+
+def collect_change_points(hts_code: str, country: str) -> Set[date]:
+    """
+    Dates on which any rule row relevant to the HTS/country starts or ends.
+
+    End dates are exclusive (first inactive day), so both kinds of date are
+    the first day of a new interval. Must be called inside an app context.
+    """
+    from sqlalchemy import func
+
+    from app.chat.tools.stacking_tools import normalize_country
+    from app.web.db.models import tariff_tables as t
+
+    hts_clean = hts_code.replace(".", "")
+    hts_8digit = hts_clean[:8]
+    prefixes = _hts_prefixes(hts_clean)
+
+    country_info = normalize_country(country)
+    iso2 = country_info.get("iso_alpha2")
+    country_codes = {c for c in (iso2, country_info.get("iso_alpha3")) if c}
+
+    # (model, start column, end column, filters)
+    sources = [
+        (t.TariffProgram, "effective_date", "expiration_date", []),
+        (t.Section301Rate, "effective_start", "effective_end",
+         [t.Section301Rate.hts_8digit == hts_8digit]),
+        (t.Section232Rate, "effective_start", "effective_end",
+         [t.Section232Rate.hts_8digit == hts_8digit]),
+        (t.IeepaAnnexIIExclusion, "effective_date", "expiration_date",
+         [t.IeepaAnnexIIExclusion.hts_code.in_(prefixes)]),
+        (t.IeepaReciprocalProductExclusions, "effective_start", "effective_end",
+         [t.IeepaReciprocalProductExclusions.hts_prefix.in_(prefixes)]),
+        (t.IeepaReciprocalExceptionRules, "effective_start", "effective_end", []),
+        (t.HtsBaseRate, "effective_date", "expiration_date",
+         [t.HtsBaseRate.hts_code.in_(prefixes + _dotted_prefixes(hts_clean))]),
+        (t.ProgramSuppression, "effective_date", "expiration_date", []),
+        (t.Section232Predicate, "effective_start", "effective_end", []),
+    ]
+    if country_codes:
+        # country_code in country_group_members may be a code or a name
+        member_codes = {
+            c.lower() for c in country_codes | {country_info.get("canonical_name"), country} if c
+        }
+        group_ids = {"default"} | {
+            group_id for (group_id,) in t.CountryGroupMember.query.with_entities(
+                t.CountryGroupMember.group_id
+            ).filter(func.lower(t.CountryGroupMember.country_code).in_(member_codes)).distinct()
+        }
+        group_pks = [
+            pk for (pk,) in t.CountryGroup.query.with_entities(t.CountryGroup.id).filter(
+                t.CountryGroup.group_id.in_(group_ids)
+            )
+        ]
+        sources += [
+            (t.IeepaRate, "effective_start", "effective_end",
+             [(t.IeepaRate.country_code.in_(country_codes)) | (t.IeepaRate.country_code.is_(None))]),
+            (t.IeepaReciprocalRateSchedule, "effective_start", "effective_end",
+             [(t.IeepaReciprocalRateSchedule.country_code.in_(country_codes))
+              | (t.IeepaReciprocalRateSchedule.country_code.is_(None))]),
+            (t.IeepaReciprocalDealOverrides, "effective_start", "effective_end",
+             [t.IeepaReciprocalDealOverrides.country_code.in_(country_codes),
+              t.IeepaReciprocalDealOverrides.hts_prefix.in_(prefixes)]),
+            (t.CountryGroupMember, "effective_date", "expiration_date",
+             [func.lower(t.CountryGroupMember.country_code).in_(member_codes)]),
+            (t.ProgramRate, "effective_date", "expiration_date",
+             [t.ProgramRate.group_id.in_(group_ids)]),
+            (t.ProgramCountryScope, "effective_date", "expiration_date",
+             [(t.ProgramCountryScope.iso_alpha2.in_(country_codes))
+              | (t.ProgramCountryScope.country_group_id.in_(group_pks))]),
+        ]
+    else:
+        # Unknown country: every country's rows may apply
+        sources += [
+            (t.IeepaRate, "effective_start", "effective_end", []),
+            (t.IeepaReciprocalRateSchedule, "effective_start", "effective_end", []),
+            (t.IeepaReciprocalDealOverrides, "effective_start", "effective_end",
+             [t.IeepaReciprocalDealOverrides.hts_prefix.in_(prefixes)]),
+            (t.CountryGroupMember, "effective_date", "expiration_date", []),
+            (t.ProgramRate, "effective_date", "expiration_date", []),
+            (t.ProgramCountryScope, "effective_date", "expiration_date", []),
+        ]
+
+    points: Set[date] = set()
+    for model, start_attr, end_attr, filters in sources:
+        start_col = getattr(model, start_attr)
+        end_col = getattr(model, end_attr)
+        for start, end in model.query.with_entities(start_col, end_col).filter(*filters).all():
+            if start is not None:
+                points.add(start)
+            if end is not None:
+                points.add(end)
+    return points
+
+
+def _stack_signature(result: dict) -> str:
+    """Everything that defines the duty outcome, minus per-date metadata."""
+    total_duty = result.get("total_duty") or {}
+    return json.dumps({
+        "entries": result.get("entries", []),
+        "total_duty_amount": total_duty.get("total_duty_amount"),
+        "breakdown": [
+            {key: item.get(key) for key in
+             ("program_id", "chapter_99_code", "action", "duty_rate", "duty_amount", "base_value")}
+            for item in total_duty.get("breakdown", [])
+        ],
+    }, sort_keys=True, default=str)
+
+
+def _segment(start: date, end: date, result: dict) -> dict:
+    total_duty = result.get("total_duty") or {}
+    return {
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "days": (end - start).days + 1,
+        "total_duty_amount": total_duty.get("total_duty_amount", 0),
+        "effective_rate": total_duty.get("effective_rate", 0),
+        "entries": result.get("entries", []),
+        "breakdown": total_duty.get("breakdown", []),
+    }
+
+
+def calculate_tariff_timeline(
+    hts_code: str,
+    country: str,
+    start_date: date,
+    end_date: date,
+    product_value: float = 10000.0,
+    product_description: Optional[str] = None,
+    materials: Optional[dict] = None,
+) -> dict:
+    """
+    Duty for one HTS/country on every day of [start_date, end_date].
+
+    Args:
+        hts_code: HTS code (e.g., '8544.42.9090')
+        country: Country of origin (any alias)
+        start_date / end_date: Inclusive date range
+        product_value: Declared value used for every date
+        product_description: Optional description
+        materials: Material values; required when the HTS has Section 232
+                   metal content (same as /tariff/calculate)
+
+    Returns:
+        Dict with piecewise-constant segments (inclusive end_date) and the
+        number of intervals evaluated. If the calculation needs material
+        values, returns needs_materials=True and no segments.
+    """
+    from app.chat.graphs.stacking_rag import StackingRAG
+    from app.chat.tools.stacking_tools import get_flask_app, shared_lookups
+
+    if not hts_code or not country:
+        raise TimelineError("HTS code and country are required")
+    if end_date < start_date:
+        raise TimelineError("end_date must not be before start_date")
+
+    with get_flask_app().app_context():
+        points = collect_change_points(hts_code, country)
+
+    starts = [start_date] + sorted(p for p in points if start_date < p <= end_date)
+    ends = [next_start - timedelta(days=1) for next_start in starts[1:]] + [end_date]
+
+    timeline_id = str(uuid.uuid4())
+    rag = StackingRAG(conversation_id=timeline_id, checkpoint=False, engine="direct")
+    description = product_description or f"Product ({hts_code})"
+
+    segments: List[dict] = []
+    last_signature = None
+    with shared_lookups(rule_snapshot=True):
+        for index, (start, end) in enumerate(zip(starts, ends)):
+            result = rag.calculate_stacking(
+                hts_code=hts_code,
+                country=country,
+                product_description=description,
+                product_value=product_value,
+                materials=materials,
+                import_date=start.isoformat(),
+                thread_id=f"{timeline_id}:{index}",
+            )
+            if result.get("awaiting_user_input"):
+                return {
+                    "timeline_id": timeline_id,
+                    "needs_materials": True,
+                    "applicable_materials": result.get("applicable_materials", []),
+                    "segments": [],
+                }
+
+            signature = _stack_signature(result)
+            if segments and signature == last_signature:
+                segments[-1]["end_date"] = end.isoformat()
+                segments[-1]["days"] += (end - start).days + 1
+            else:
+                segments.append(_segment(start, end, result))
+            last_signature = signature
+
+    logger.info(
+        f"Tariff timeline {timeline_id}: {hts_code}/{country} "
+        f"{start_date}..{end_date}, {len(starts)} intervals -> {len(segments)} segments"
+    )
+
+    return {
+        "timeline_id": timeline_id,
+        "hts_code": hts_code,
+        "country": country,
+        "product_value": product_value,
+        "materials": materials or {},
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "needs_materials": False,
+        "intervals_evaluated": len(starts),
+        "segments": segments,
+    }
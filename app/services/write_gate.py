@@ -209,6 +209,7 @@ class WriteGate:
             Tuple of (rows_inserted, table_name)
         """
         from app.web.db import db
+        from app.services.result_cache import bump_tariff_data_version
         from app.web.db.models.tariff_tables import (
             Section301Rate,
             Section232Rate,
@@ -323,6 +324,8 @@ class WriteGate:
 
         if rows_inserted > 0:
             db.session.commit()
+            # v22.0: Invalidate cached results and the rule snapshot
+            bump_tariff_data_version("write_gate")
 
         return rows_inserted, table_name
 
@@ -537,6 +537,10 @@ class TariffCalculationLog(db.Model):
 
     Separate from TariffAuditLog (which tracks data changes like INSERT/UPDATE).
     This tracks calculations for PSC/audit defense per V2 design Section 8.
+
+    v22.0: Rows are written by app.services.calculation_log_writer. A repeat
+    of an identical calculation (same replay_key) increments hit_count and
+    last_calculated_at on the first row instead of adding one.
     """
     __tablename__ = "tariff_calculation_log"
 
@@ -566,6 +570,26 @@ class TariffCalculationLog(db.Model):
     calculated_by = db.Column(db.String(100), default='stacking_engine')
     engine_version = db.Column(db.String(20), nullable=True)
 
+    # v22.0: Repeat calculations collapsed onto this row
+    hit_count = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    last_calculated_at = db.Column(db.DateTime, nullable=True)
+
+
+class TariffDataVersion(db.Model):
+    """
+    v22.0: Monotonic version of the tariff rule data (single row, id=1).
+
+    Bumped by every writer of rule rows (CommitEngine, WriteGate and the
+    populate_* / ingest_* scripts). Cached calculation results are keyed by this
+    version, so a bump from any process invalidates them.
+    """
+    __tablename__ = "tariff_data_version"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_by = db.Column(db.String(100), nullable=True)
+
 
 class IeepaRate(BaseModel):
     """
@@ -697,7 +697,13 @@ def metrics():
     Prometheus-style metrics endpoint.
 
     Returns key metrics in a format suitable for monitoring systems.
+
+    v22.0: Also exports the in-process histograms and counters
+    (app.services.metrics), e.g. SQL statements per stacking tool.
     """
+    from app.services.metrics import get_metrics_registry
+
+    process_metrics = get_metrics_registry().render()
     try:
         from datetime import timedelta
 
@@ -773,11 +779,13 @@ pipeline_runs_total{{status="failed"}} {failed_runs_today}
 # TYPE pipeline_last_run_seconds_ago gauge
 pipeline_last_run_seconds_ago {last_run_seconds_ago if last_run_seconds_ago is not None else -1}
 """
+        if process_metrics:
+            metrics_text += "\n" + process_metrics
 
         return metrics_text, 200, {'Content-Type': 'text/plain; charset=utf-8'}
 
     except Exception as e:
-        return f"# Error: {e}\n", 500, {'Content-Type': 'text/plain; charset=utf-8'}
+        return f"# Error: {e}\n" + process_metrics, 500, {'Content-Type': 'text/plain; charset=utf-8'}
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -5,16 +5,21 @@ Clean form-based UI for tariff calculation.
 
 import uuid
 from datetime import date
-from flask import Blueprint, request, jsonify, render_template_string
+from flask import (
+    Blueprint, Response, current_app, request, jsonify, render_template_string, stream_with_context
+)
 from app.chat.graphs.stacking_rag import StackingRAG
 from app.services.freshness import get_freshness_service
+from app.services.calculation_profile import profile_calculation
+from app.services.entry_batch import calculate_entry_batch, read_ndjson_lines, stream_entry_batch
+from app.services.parallel_batch import get_parallel_executor
+from app.services.tariff_timeline import TimelineError, calculate_tariff_timeline
+from app.services.origin_comparison import OriginComparisonError, compare_origins
+from app.services.session_store import get_pending_session_store
 from app.models.section301 import ExclusionClaim
 
 bp = Blueprint("tariff", __name__)
 
-# Store active sessions
-_sessions = {}
-
 
 @bp.route("/", methods=["GET"])
 def calculator_page():
@@ -24,7 +29,24 @@ def calculator_page():
 
 @bp.route("/tariff/calculate", methods=["POST"])
 def calculate_tariff():
-    """Calculate tariff stacking."""
+    """
+    Calculate tariff stacking.
+
+    v22.0: With "debug": true the response carries a "debug" block with the
+    calculation's SQL statement count and time per graph node and tool.
+    """
+    with profile_calculation() as profile:
+        response = _calculate_tariff()
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and data.get("debug") is True and isinstance(response, Response) and response.is_json:
+        body = response.get_json()
+        body["debug"] = profile.as_dict()
+        response.set_data(current_app.json.dumps(body))
+    return response
+
+
+def _calculate_tariff():
+    """Body of calculate_tariff, run inside the request's calculation profile."""
     try:
         data = request.json or {}
 
@@ -34,19 +56,27 @@ def calculate_tariff():
         product_description = data.get("product_description", "").strip() or f"Product ({hts_code})"
         materials = data.get("materials")
         session_id = data.get("session_id")
+        # v22.0: One-shot mode skips checkpointing; callers resubmit with materials
+        checkpoint = data.get("checkpoint", True) is not False
+        # v22.0: "direct" runs the same nodes without LangGraph
+        engine = data.get("engine") or "graph"
 
         if not hts_code or not country:
             return jsonify({"success": False, "error": "HTS code and country are required"}), 400
+        if engine not in StackingRAG.ENGINES:
+            return jsonify({"success": False, "error": f"Unknown engine '{engine}'"}), 400
 
         # Continue with materials if session exists
-        if session_id and session_id in _sessions:
-            rag = _sessions[session_id]
-            result = rag.continue_with_materials(materials or {})
-            del _sessions[session_id]
+        # v22.0: Pending sessions live in the shared store, so the follow-up
+        # may land on any worker process
+        pending = get_pending_session_store().pop(session_id) if session_id else None
+        if pending is not None:
+            rag = StackingRAG(conversation_id=session_id, checkpoint=False, engine=pending["engine"])
+            result = rag.continue_with_materials(materials or {}, pending_state=pending["state"])
         else:
             # New calculation
             session_id = str(uuid.uuid4())
-            rag = StackingRAG(conversation_id=session_id)
+            rag = StackingRAG(conversation_id=session_id, checkpoint=checkpoint, engine=engine)
 
             result = rag.calculate_stacking(
                 hts_code=hts_code,
@@ -58,11 +88,14 @@ def calculate_tariff():
 
             # Check if we need materials
             if result.get("awaiting_user_input"):
-                _sessions[session_id] = rag
+                if checkpoint:
+                    get_pending_session_store().put(
+                        session_id, {"engine": engine, "state": rag.detach_pending_state()}
+                    )
                 applicable_materials = result.get("applicable_materials", [])
                 return jsonify({
                     "success": True,
-                    "session_id": session_id,
+                    "session_id": session_id if checkpoint else None,
                     "needs_materials": True,
                     "applicable_materials": applicable_materials,  # Only show these in the UI
                     "message": f"This HTS code may contain Section 232 metals ({', '.join(applicable_materials)}). Please enter the material values.",
@@ -122,6 +155,178 @@ def calculate_tariff():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def _wants_stream(data: dict) -> bool:
+    """v22.0: Stream when asked in the body, by Accept, or by sending NDJSON."""
+    if request.mimetype == NDJSON_MIMETYPE or data.get("stream") is True:
+        return True
+    # JSON first, so "*/*" keeps the buffered response
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def _ndjson_response(records):
+    """
+    v22.0: Stream records as NDJSON, one per line.
+
+    The generator is pulled by the WSGI server as it writes, so each record
+    is produced only after the previous one was handed to the client.
+    """
+    def generate():
+        for record in records:
+            yield current_app.json.dumps(record) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=NDJSON_MIMETYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@bp.route("/tariff/calculate/batch", methods=["POST"])
+def calculate_tariff_batch():
+    """
+    v22.0: Calculate tariff stacking for a multi-line entry.
+
+    Body: {"import_date": "YYYY-MM-DD", "country": "China",
+           "lines": [{"hts_code": ..., "product_value": ..., "materials": ...}, ...]}
+
+    Shared lookups (country, programs, duty rules, freshness, exclusion
+    candidates) are resolved once per entry. Returns per-line results and
+    an entry-level total; a failing line does not fail the batch.
+
+    Streaming mode (NDJSON response, one record per line as soon as it is
+    calculated, then a summary record) is used when the body has
+    "stream": true, the client Accepts application/x-ndjson, or the body
+    itself is NDJSON (Content-Type application/x-ndjson, one line object
+    per row, country/import_date as query parameters; read lazily).
+
+    With "parallel": true (buffered mode only) the lines are sharded across
+    the stacking process pool (app.services.parallel_batch); results are
+    identical and in input order.
+    """
+    try:
+        if request.mimetype == NDJSON_MIMETYPE:
+            data = request.args.to_dict()
+            lines = read_ndjson_lines(request.stream)
+        else:
+            data = request.json or {}
+            lines = data.get("lines")
+            if not isinstance(lines, list) or not lines:
+                return jsonify({"success": False, "error": "lines must be a non-empty list"}), 400
+
+        import_date = (data.get("import_date") or "").strip() or None
+        if import_date:
+            try:
+                date.fromisoformat(import_date)
+            except ValueError:
+                return jsonify({"success": False, "error": "import_date must be YYYY-MM-DD"}), 400
+
+        country = (data.get("country") or "").strip() or None
+        if _wants_stream(data):
+            return _ndjson_response(stream_entry_batch(lines, country=country, import_date=import_date))
+
+        if data.get("parallel") is True:
+            result = get_parallel_executor().calculate(lines, country=country, import_date=import_date)
+        else:
+            result = calculate_entry_batch(lines, country=country, import_date=import_date)
+
+        return jsonify({"success": True, **result})
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@bp.route("/tariff/timeline", methods=["POST"])
+def tariff_timeline():
+    """
+    v22.0: Duty for one HTS/country across a date range.
+
+    Body: {"hts_code": "8544.42.9090", "country": "China",
+           "start_date": "2024-01-01", "end_date": "2026-12-31",
+           "product_value": 10000, "materials": {"copper": 3000}}
+
+    Returns piecewise-constant segments (inclusive end_date). The stack is
+    evaluated once per interval between rule change points, not per day.
+    """
+    try:
+        data = request.json or {}
+
+        hts_code = (data.get("hts_code") or "").strip()
+        country = (data.get("country") or "").strip()
+        if not hts_code or not country:
+            return jsonify({"success": False, "error": "HTS code and country are required"}), 400
+
+        try:
+            start_date = date.fromisoformat((data.get("start_date") or "").strip())
+            end_date = date.fromisoformat((data.get("end_date") or "").strip())
+        except ValueError:
+            return jsonify({"success": False, "error": "start_date and end_date must be YYYY-MM-DD"}), 400
+
+        result = calculate_tariff_timeline(
+            hts_code=hts_code,
+            country=country,
+            start_date=start_date,
+            end_date=end_date,
+            product_value=float(data.get("product_value") or 10000),
+            product_description=(data.get("product_description") or "").strip() or None,
+            materials=data.get("materials"),
+        )
+
+        return jsonify({"success": True, **result})
+
+    except TimelineError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@bp.route("/tariff/compare-origins", methods=["POST"])
+def tariff_compare_origins():
+    """
+    v22.0: Duty for one HTS/value from every country of origin.
+
+    Body: {"hts_code": "8544.42.9090", "product_value": 10000,
+           "materials": {"copper": 3000}, "import_date": "2025-06-01",
+           "countries": ["CN", "VN"], "include_stacks": false}
+
+    countries defaults to every ISO code in the census mapping. Origins are
+    returned lowest duty first. HTS-dependent lookups are resolved once;
+    only country-dependent rules are evaluated per origin.
+    """
+    try:
+        data = request.json or {}
+
+        hts_code = (data.get("hts_code") or "").strip()
+        if not hts_code:
+            return jsonify({"success": False, "error": "HTS code is required"}), 400
+
+        import_date = (data.get("import_date") or "").strip() or None
+        if import_date:
+            try:
+                date.fromisoformat(import_date)
+            except ValueError:
+                return jsonify({"success": False, "error": "import_date must be YYYY-MM-DD"}), 400
+
+        result = compare_origins(
+            hts_code=hts_code,
+            product_value=float(data.get("product_value") or 10000),
+            materials=data.get("materials"),
+            import_date=import_date,
+            product_description=(data.get("product_description") or "").strip() or None,
+            countries=data.get("countries"),
+            include_stacks=bool(data.get("include_stacks")),
+        )
+
+        return jsonify({"success": True, **result})
+
+    except OriginComparisonError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 @bp.route("/tariff/freshness", methods=["GET"])
 def get_freshness():
     """Get data freshness information for all sources."""
@@ -25,6 +25,7 @@ from app.models import (
     CandidateChangeRecord,
 )
 from app.workers.extraction_worker import CandidateChange
+from app.services.result_cache import bump_tariff_data_version
 
 logger = logging.getLogger(__name__)
 
@@ -67,11 +68,11 @@ class CommitEngine:
 
         try:
             if program == "section_301":
-                return self._commit_301(candidate, evidence, doc, job, run_id)
+                outcome = self._commit_301(candidate, evidence, doc, job, run_id)
             elif program in ("section_232_steel", "section_232_aluminum", "section_232_copper"):
-                return self._commit_232(candidate, evidence, doc, job, run_id, program)
+                outcome = self._commit_232(candidate, evidence, doc, job, run_id, program)
             elif program in ("ieepa_fentanyl", "ieepa_reciprocal"):
-                return self._commit_ieepa(candidate, evidence, doc, job, run_id, program)
+                outcome = self._commit_ieepa(candidate, evidence, doc, job, run_id, program)
             else:
                 logger.warning(f"Unknown program for candidate: {program}")
                 return False, None, f"Unknown program: {program}"
@@ -81,6 +82,11 @@ class CommitEngine:
             db.session.rollback()
             return False, None, str(e)
 
+        # v22.0: Invalidate cached results and the rule snapshot
+        if outcome[0]:
+            bump_tariff_data_version("commit_engine")
+        return outcome
+
     def _detect_program(self, candidate: CandidateChange) -> str:
         """Detect the tariff program from the candidate data."""
         ch99 = candidate.new_chapter_99_code or ""
@@ -0,0 +1,32 @@
+"""Add hit_count and last_calculated_at to tariff_calculation_log
+
+Revision ID: c3d4e5f6g7h8
+Revises: b2c3d4e5f6g7
+Create Date: 2026-10-16
+
+v22.0: The calculation log writer collapses repeats of an identical
+calculation (same replay_key) into the first row:
+- hit_count: number of times the calculation ran (1 for existing rows)
+- last_calculated_at: time of the most recent repeat
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d4e5f6g7h8'
+down_revision = 'b2c3d4e5f6g7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tariff_calculation_log', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('hit_count', sa.Integer(), nullable=False, server_default='1'))
+        batch_op.add_column(sa.Column('last_calculated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('tariff_calculation_log', schema=None) as batch_op:
+        batch_op.drop_column('last_calculated_at')
+        batch_op.drop_column('hit_count')
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+v22.0: Stacking Engine Benchmark
+
+Replays the stacking regression scenarios plus a synthetic HTS/country mix
+through StackingRAG.calculate_stacking (graph and direct engines) and
+POST /tariff/calculate, and reports per target:
+- p50 / p95 / p99 latency and throughput
+- SQL statements per calculation (SQLAlchemy cursor events)
+- Peak Python memory over one pass (tracemalloc, traced separately from
+  the timed passes) and process max RSS
+
+Scenarios are harvested from tests/test_stacking_automated.py and
+tests/test_stacking_v7_phoebe.py by running each test function against a
+recording StackingRAG that captures the calculate_stacking arguments, so
+new regression cases are benchmarked without being copied here.
+(tests/trade_scenarios.py holds chat queries without HTS/country inputs
+and is exercised by test_trade_eval.py, not by this benchmark.)
+
+Results are written as a JSON baseline; --compare checks a run against an
+earlier baseline and exits 1 when a metric regressed beyond --threshold.
+Feature flags that change the cost profile (USE_RULE_SNAPSHOT,
+USE_RESULT_CACHE, USE_APPLICABILITY_MATRIX, USE_RATE_RESOLVER) are recorded
+in the baseline.
+
+Usage:
+    python scripts/benchmark_stacking.py                        # All targets
+    python scripts/benchmark_stacking.py --runs 5 --synthetic 200
+    python scripts/benchmark_stacking.py --targets direct http --label v22.0
+    python scripts/benchmark_stacking.py --compare benchmarks/stacking/v21.json
+    python scripts/benchmark_stacking.py --url http://localhost:5000   # Live server
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+
+SCENARIO_MODULES = [
+    'tests/test_stacking_automated.py',
+    'tests/test_stacking_v7_phoebe.py',
+]
+
+# Synthetic mix: HTS codes with their in-scope 232 metals, and origins
+SYNTHETIC_HTS = [
+    ('8544.42.9090', ('copper', 'aluminum')),
+    ('8544.42.2000', ('copper',)),
+    ('9403.99.9045', ('steel', 'aluminum')),
+    ('7318.15.2095', ('steel',)),
+    ('7616.99.5190', ('aluminum',)),
+    ('8539.50.0000', ()),
+    ('3818.00.0000', ()),
+    ('2934.99.9050', ()),
+    ('2709.00.2090', ()),
+]
+SYNTHETIC_COUNTRIES = ['China', 'Germany', 'Japan', 'Vietnam', 'Mexico', 'Canada', 'UK', 'India']
+
+FEATURE_FLAGS = ('USE_RULE_SNAPSHOT', 'USE_RESULT_CACHE', 'USE_APPLICABILITY_MATRIX', 'USE_RATE_RESOLVER')
+
+TARGETS = ('graph', 'direct', 'http')
+
+# Metrics compared against a baseline (higher is worse)
+COMPARED_METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'sql_per_calc', 'peak_memory_kb')
+
+
+# ============================================================================
+# Scenarios
+# ============================================================================
+
+class _Harvested(Exception):
+    """Stops a test function once its calculate_stacking call was recorded."""
+
+
+def harvest_scenarios() -> list:
+    """calculate_stacking kwargs of every test function in SCENARIO_MODULES."""
+    scenarios = []
+    for relative in SCENARIO_MODULES:
+        path = project_root / relative
+        spec = importlib.util.spec_from_file_location(f"_bench_{path.stem}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        recorded = []
+
+        class RecordingStackingRAG:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def calculate_stacking(self, **kwargs):
+                recorded.append(kwargs)
+                raise _Harvested()
+
+        module.StackingRAG = RecordingStackingRAG
+        for name in sorted(n for n in dir(module) if n.startswith('test_')):
+            before = len(recorded)
+            try:
+                getattr(module, name)()
+            except _Harvested:
+                pass
+            except Exception as e:
+                print(f"  skipped {path.stem}.{name}: {e}", file=sys.stderr)
+            for kwargs in recorded[before:]:
+                scenarios.append({'name': f"{path.stem}.{name}", **kwargs})
+    return scenarios
+
+
+def synthetic_scenarios(count: int, seed: int = 22) -> list:
+    """Deterministic mix of HTS codes, origins, values and metal content."""
+    rng = random.Random(seed)
+    scenarios = []
+    for i in range(count):
+        hts_code, metals = rng.choice(SYNTHETIC_HTS)
+        value = round(rng.uniform(50, 50000), 2)
+        materials = {}
+        for metal in metals:
+            if rng.random() < 0.7:
+                materials[metal] = round(value * rng.uniform(0.05, 0.4), 2)
+        scenarios.append({
+            'name': f"synthetic.{i}",
+            'hts_code': hts_code,
+            'country': rng.choice(SYNTHETIC_COUNTRIES),
+            'product_description': f"Product ({hts_code})",
+            'product_value': value,
+            # Empty dict rather than None: never stop to ask for materials
+            'materials': materials,
+        })
+    return scenarios
+
+
+# ============================================================================
+# Measurement
+# ============================================================================
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+class SqlCounter:
+    """Counts statements executed on the app's engine while attached."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def make_runner(target: str, app, url: str = None):
+    """Callable(scenario, run_idx) that performs one calculation for the target."""
+    if target in ('graph', 'direct'):
+        from app.chat.graphs.stacking_rag import StackingRAG
+
+        def run(scenario, run_idx):
+            rag = StackingRAG(conversation_id=f"bench-{target}-{run_idx}", checkpoint=False, engine=target)
+            kwargs = {k: v for k, v in scenario.items() if k != 'name'}
+            return rag.calculate_stacking(**kwargs)
+        return run
+
+    def body(scenario):
+        return {
+            'hts_code': scenario['hts_code'],
+            'country': scenario['country'],
+            'product_description': scenario.get('product_description') or '',
+            'product_value': scenario.get('product_value'),
+            'materials': scenario.get('materials'),
+            'checkpoint': False,
+        }
+
+    if url:
+        def run(scenario, run_idx):
+            request = urllib.request.Request(
+                f"{url.rstrip('/')}/tariff/calculate",
+                data=json.dumps(body(scenario)).encode(),
+                headers={'Content-Type': 'application/json'},
+            )
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read())
+        return run
+
+    client = app.test_client()
+
+    def run(scenario, run_idx):
+        return client.post('/tariff/calculate', json=body(scenario)).get_json()
+    return run
+
+
+def benchmark_target(target: str, scenarios: list, runs: int, app, url: str = None) -> dict:
+    """Run every scenario `runs` times against one target and summarize."""
+    from app.web.db import db
+
+    run = make_runner(target, app, url)
+    measure_sql = url is None
+
+    # Warm-up: graph compile, rule snapshot, first-touch lookups
+    run(scenarios[0], -1)
+
+    latencies, sql_counts, errors = [], [], 0
+    start = time.perf_counter()
+    for run_idx in range(runs):
+        for scenario in scenarios:
+            counter = SqlCounter(db.engine) if measure_sql else None
+            t0 = time.perf_counter()
+            try:
+                if counter is not None:
+                    with counter:
+                        result = run(scenario, run_idx)
+                else:
+                    result = run(scenario, run_idx)
+                if isinstance(result, dict) and result.get('success') is False:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if counter is not None:
+                sql_counts.append(counter.count)
+    elapsed = time.perf_counter() - start
+
+    # Memory is traced on a separate pass: tracing slows every allocation
+    tracemalloc.start()
+    for scenario in scenarios:
+        try:
+            run(scenario, runs)
+        except Exception:
+            pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'calculations': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'throughput_per_s': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'sql_per_calc': round(sum(sql_counts) / len(sql_counts), 2) if sql_counts else None,
+        'sql_max': max(sql_counts) if sql_counts else None,
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+# ============================================================================
+# Baselines
+# ============================================================================
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=project_root, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return None
+
+
+def compare_baselines(baseline: dict, current: dict, threshold: float) -> list:
+    """Regressions as (target, metric, baseline value, current value)."""
+    regressions = []
+    for target, metrics in current['targets'].items():
+        previous = baseline.get('targets', {}).get(target)
+        if not previous:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = previous.get(metric), metrics.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + threshold) and new - old > 1e-9:
+                regressions.append((target, metric, old, new))
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"\n{'Target':8} {'calcs':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'calc/s':>8} {'SQL/calc':>9} {'peak KB':>9} {'errors':>7}")
+    for target, m in report['targets'].items():
+        sql = f"{m['sql_per_calc']:9.2f}" if m['sql_per_calc'] is not None else f"{'-':>9}"
+        print(f"{target:8} {m['calculations']:6d} {m['p50_ms']:8.2f} {m['p95_ms']:8.2f} "
+              f"{m['p99_ms']:8.2f} {m['throughput_per_s'] or 0:8.1f} {sql} "
+              f"{m['peak_memory_kb']:9.1f} {m['errors']:7d}")
+    print(f"\nProcess max RSS: {report['max_rss_kb']:,} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the stacking engine')
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=list(TARGETS))
+    parser.add_argument('--runs', type=int, default=3, help='Passes over the scenario set per target')
+    parser.add_argument('--synthetic', type=int, default=100, help='Synthetic scenarios to add')
+    parser.add_argument('--no-regression-cases', action='store_true',
+                        help='Skip scenarios harvested from the stacking tests')
+    parser.add_argument('--url', help='Benchmark a running server instead of the in-process app (http only)')
+    parser.add_argument('--label', help='Baseline label (default: git commit)')
+    parser.add_argument('--output', help='Baseline path (default: benchmarks/stacking/<label>.json)')
+    parser.add_argument('--compare', help='Earlier baseline JSON to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed relative increase before a metric counts as regressed')
+    args = parser.parse_args()
+
+    from app.chat.tools.stacking_tools import get_flask_app
+
+    scenarios = [] if args.no_regression_cases else harvest_scenarios()
+    regression_count = len(scenarios)
+    scenarios += synthetic_scenarios(args.synthetic)
+    if not scenarios:
+        parser.error('no scenarios to run')
+    print(f"Scenarios: {regression_count} regression + {args.synthetic} synthetic", file=sys.stderr)
+
+    targets = ['http'] if args.url else args.targets
+    app = get_flask_app()
+    results = {}
+    with app.app_context():
+        for target in targets:
+            print(f"Benchmarking {target}...", file=sys.stderr)
+            results[target] = benchmark_target(target, scenarios, args.runs, app, args.url)
+
+    label = args.label or git_commit() or datetime.now().strftime('%Y%m%d-%H%M%S')
+    report = {
+        'label': label,
+        'git_commit': git_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'runs': args.runs,
+            'regression_scenarios': regression_count,
+            'synthetic_scenarios': args.synthetic,
+            'url': args.url,
+            'flags': {flag: os.getenv(flag, 'false') for flag in FEATURE_FLAGS},
+        },
+        'targets': results,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    print_report(report)
+
+    output = Path(args.output) if args.output else project_root / 'benchmarks' / 'stacking' / f"{label}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nBaseline written to {output}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare_baselines(baseline, report, args.threshold)
+        print(f"\nCompared with {baseline.get('label')} (threshold {args.threshold:.0%}):")
+        for target, metric, old, new in regressions:
+            print(f"  REGRESSION {target} {metric}: {old} -> {new}")
+        if not regressions:
+            print("  no regressions")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
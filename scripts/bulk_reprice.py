@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+v22.0: Bulk Re-pricing Script
+
+Calculates tariff stacking for a file of entry lines across a process pool
+(app.services.parallel_batch), e.g. to re-price open entries after a rule
+change. Results are written in input order, one JSON record per line
+(NDJSON), followed by a summary record.
+
+Input: NDJSON (one line object per row) or a JSON list of line objects,
+with hts_code, product_value and optional country, materials,
+product_description, quantity, quantity_uom, line_id.
+
+Usage:
+    python scripts/bulk_reprice.py open_entries.ndjson --country China
+    python scripts/bulk_reprice.py lines.json --import-date 2025-06-01 --workers 8
+    python scripts/bulk_reprice.py lines.ndjson --output repriced.ndjson --chunk-size 50
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+
+def load_lines(path: str) -> list:
+    """JSON list, or NDJSON with one object per non-blank row."""
+    text = Path(path).read_text()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(row) for row in text.splitlines() if row.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-price entry lines across a process pool')
+    parser.add_argument('lines', help='NDJSON or JSON list of entry lines')
+    parser.add_argument('--country', help='Default country of origin for lines that omit it')
+    parser.add_argument('--import-date', help='Import date (YYYY-MM-DD), defaults to today')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    parser.add_argument('--chunk-size', type=int, help='Lines per worker task')
+    parser.add_argument('--output', help='Write NDJSON results here (default: stdout)')
+    args = parser.parse_args()
+
+    from app.services.parallel_batch import ParallelBatchExecutor
+
+    lines = load_lines(args.lines)
+    executor = ParallelBatchExecutor(workers=args.workers, chunk_size=args.chunk_size)
+
+    start = time.perf_counter()
+    try:
+        result = executor.calculate(lines, country=args.country, import_date=args.import_date)
+    finally:
+        executor.shutdown()
+    elapsed = time.perf_counter() - start
+
+    totals = result["entry_total"]
+    print(f"Lines:       {totals['calculated_lines']}/{totals['line_count']} calculated "
+          f"({totals['error_lines']} errors, {totals['needs_materials_lines']} need materials)",
+          file=sys.stderr)
+    print(f"Total duty:  ${totals['total_duty_amount']:,.2f} on ${totals['total_value']:,.2f}",
+          file=sys.stderr)
+    print(f"Elapsed:     {elapsed:.2f}s on {result['workers']} workers "
+          f"({len(lines) / elapsed if elapsed else 0:.1f} lines/s)", file=sys.stderr)
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for line in result["lines"]:
+            out.write(json.dumps({"type": "line", **line}, default=str) + "\n")
+        summary = {k: v for k, v in result.items() if k != "lines"}
+        out.write(json.dumps({"type": "summary", **summary}, default=str) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    sys.exit(1 if totals["error_lines"] else 0)
+
+
+if __name__ == "__main__":
+    main()
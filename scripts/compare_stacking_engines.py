@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+v22.0: Stacking Engine Comparison Script
+
+Runs the LangGraph engine and the direct engine (run_stacking_direct) on the
+same inputs, checks that the results are identical, and reports per-engine
+latency so the LangGraph overhead can be measured.
+
+Usage:
+    python scripts/compare_stacking_engines.py                # Default cases
+    python scripts/compare_stacking_engines.py --runs 50      # More samples
+    python scripts/compare_stacking_engines.py --no-checkpoint
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+
+COMPARE_CASES = [
+    {'hts_code': '8544.42.9090', 'country': 'China', 'materials': {'copper': 3000.0}},
+    {'hts_code': '7318.15.2095', 'country': 'Germany', 'materials': {'steel': 2000.0}},
+    {'hts_code': '7616.99.5190', 'country': 'Japan', 'materials': {'aluminum': 1000.0}},
+    {'hts_code': '3818.00.0000', 'country': 'China', 'materials': {}},
+    {'hts_code': '2709.00.2090', 'country': 'Canada', 'materials': {}},
+]
+
+
+def run_case(engine: str, case: dict, checkpoint: bool, run_idx: int):
+    """Run one calculation and return (result, elapsed_ms)."""
+    from app.chat.graphs.stacking_rag import StackingRAG
+
+    rag = StackingRAG(
+        conversation_id=f"compare-{engine}-{run_idx}",
+        checkpoint=checkpoint,
+        engine=engine,
+    )
+    start = time.perf_counter()
+    result = rag.calculate_stacking(
+        hts_code=case['hts_code'],
+        country=case['country'],
+        product_description=f"Product ({case['hts_code']})",
+        product_value=10000.0,
+        materials=case['materials'],
+        import_date="2025-06-01",
+    )
+    return result, (time.perf_counter() - start) * 1000
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare LangGraph vs direct stacking engines'
+    )
+    parser.add_argument('--runs', type=int, default=20, help='Runs per case per engine')
+    parser.add_argument('--no-checkpoint', action='store_true',
+                        help='Compare against the one-shot (no checkpoint) graph')
+    args = parser.parse_args()
+
+    from app.chat.tools.stacking_tools import get_flask_app
+
+    checkpoint = not args.no_checkpoint
+    timings = {"graph": [], "direct": []}
+    mismatches = 0
+
+    with get_flask_app().app_context():
+        # Warm up both engines (graph compile, rule snapshot, lookups)
+        for engine in timings:
+            run_case(engine, COMPARE_CASES[0], checkpoint, -1)
+
+        for case in COMPARE_CASES:
+            for run_idx in range(args.runs):
+                graph_result, graph_ms = run_case("graph", case, checkpoint, run_idx)
+                direct_result, direct_ms = run_case("direct", case, checkpoint, run_idx)
+                timings["graph"].append(graph_ms)
+                timings["direct"].append(direct_ms)
+
+                if run_idx == 0:
+                    same = (json.dumps(graph_result, sort_keys=True, default=str)
+                            == json.dumps(direct_result, sort_keys=True, default=str))
+                    status = "MATCH" if same else "MISMATCH"
+                    mismatches += 0 if same else 1
+                    print(f"  {status:8} {case['hts_code']} / {case['country']}")
+
+    print()
+    print(f"{'Engine':8} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+    for engine, samples in timings.items():
+        print(f"{engine:8} {percentile(samples, 50):8.2f} {percentile(samples, 95):8.2f} "
+              f"{statistics.mean(samples):8.2f}")
+
+    overhead = statistics.median(timings["graph"]) - statistics.median(timings["direct"])
+    print(f"\nLangGraph overhead (p50): {overhead:.2f} ms per calculation")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
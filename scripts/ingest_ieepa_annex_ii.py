@@ -30,6 +30,7 @@ project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 # Flask app context needed for database access
+from app.services.result_cache import bump_tariff_data_version
 from app.web import create_app
 from app.web.db import db
 from app.web.db.models.tariff_tables import IeepaAnnexIIExclusion, IeepaReciprocalProductExclusions
@@ -228,6 +229,8 @@ def upsert_exclusions(parsed_rows: list, dry_run: bool = False) -> dict:
 
     if not dry_run:
         db.session.commit()
+        # v22.0: Invalidate cached rates and rule snapshots in every process
+        bump_tariff_data_version("ingest_ieepa_annex_ii")
 
     return stats
 
@@ -279,6 +282,8 @@ def upsert_v2_exclusions(parsed_rows: list, dry_run: bool = False) -> dict:
 
     if not dry_run:
         db.session.commit()
+        # v22.0: Invalidate cached rates and rule snapshots in every process
+        bump_tariff_data_version("ingest_ieepa_annex_ii")
 
     return stats
 
@@ -33,6 +33,7 @@ from decimal import Decimal
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
+from app.services.result_cache import bump_tariff_data_version
 from app.web import create_app
 from app.web.db import db
 from app.web.db.models.tariff_tables import IeepaReciprocalRateSchedule
@@ -516,6 +517,8 @@ def ingest_rates(dry_run: bool = False) -> dict:
 
     if not dry_run:
         db.session.commit()
+        # v22.0: Invalidate cached rates and rule snapshots in every process
+        bump_tariff_data_version("ingest_ieepa_reciprocal_rates")
 
     return stats
 
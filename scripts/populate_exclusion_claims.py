@@ -392,6 +392,11 @@ def populate_db(exclusions: list, reset: bool = False):
 
         flask_db.session.commit()
         print(f"  DB: {inserted} inserted, {updated} updated, {skipped} unchanged")
+
+        # v22.0: Rebuild exclusion matchers in every process
+        from app.services.result_cache import bump_tariff_data_version
+        version = bump_tariff_data_version("populate_exclusion_claims")
+        print(f"  Tariff data version: v{version}")
         total = ExclusionClaim.query.count()
         print(f"  Total exclusion claims in DB: {total}")
 
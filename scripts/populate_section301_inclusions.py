@@ -458,6 +458,11 @@ def populate_db(inclusions: list, reset: bool = False):
 
         print(f"  DB: {inserted} inserted, {skipped} skipped (already exist)")
 
+        # v22.0: Invalidate cached rates and rule snapshots in every process
+        from app.services.result_cache import bump_tariff_data_version
+        version = bump_tariff_data_version("populate_section301_inclusions")
+        print(f"  Tariff data version: v{version}")
+
         # Count by list
         for list_name in sorted(LIST_EFFECTIVE_DATES.keys()):
             count = Section301Rate.query.filter_by(list_name=list_name).count()
@@ -113,6 +113,7 @@ from app.web.db.models.tariff_tables import (
     IeepaRate,
     Section301Rate,
 )
+from app.services.result_cache import bump_tariff_data_version
 
 # =============================================================================
 # v19.0: CSV-driven configuration loaders
@@ -2082,6 +2083,11 @@ def main():
     # Verify data
     verify_data(app)
 
+    # v22.0: Invalidate cached calculation results in every process
+    with app.app_context():
+        version = bump_tariff_data_version("populate_tariff_tables")
+    print(f"Tariff data version: v{version}")
+
     print("\n=== Done! ===")
 
 
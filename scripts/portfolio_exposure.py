@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+v22.0: Portfolio Duty Exposure Script
+
+Computes total duty exposure for a SKU catalog with the vectorized
+portfolio engine (app.services.portfolio_exposure), checks a random sample
+of SKUs against StackingRAG, and writes the aggregates as JSON.
+
+Catalog CSV header: sku,hts_code,country,value,copper,steel,aluminum
+(metal content in dollars; blank = none).
+
+Usage:
+    python scripts/portfolio_exposure.py catalog.csv
+    python scripts/portfolio_exposure.py catalog.csv --import-date 2025-06-01
+    python scripts/portfolio_exposure.py catalog.csv --output exposure.json --sample 100
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute duty exposure for a SKU catalog')
+    parser.add_argument('catalog', help='Catalog CSV path')
+    parser.add_argument('--import-date', help='Import date (YYYY-MM-DD), defaults to today')
+    parser.add_argument('--sample', type=int, default=25,
+                        help='SKUs to check against StackingRAG (0 = skip)')
+    parser.add_argument('--output', help='Write the exposure JSON here (default: stdout)')
+    args = parser.parse_args()
+
+    from app.services.portfolio_exposure import (
+        PortfolioCatalog, PortfolioExposureEngine, sample_parity
+    )
+
+    catalog = PortfolioCatalog.from_csv(args.catalog)
+    engine = PortfolioExposureEngine(import_date=args.import_date)
+
+    start = time.perf_counter()
+    exposure = engine.compute(catalog)
+    elapsed = time.perf_counter() - start
+
+    print(f"SKUs:        {exposure['calculated_skus']}/{exposure['sku_count']} calculated "
+          f"({len(exposure['errors'])} errors)", file=sys.stderr)
+    print(f"Profiles:    {exposure['profiles']} "
+          f"({exposure['calculator_skus']} SKUs via calculator)", file=sys.stderr)
+    print(f"Total duty:  ${exposure['total_duty_amount']:,.2f} "
+          f"on ${exposure['total_value']:,.2f} ({exposure['effective_rate'] * 100:.2f}%)",
+          file=sys.stderr)
+    print(f"Elapsed:     {elapsed:.2f}s", file=sys.stderr)
+
+    mismatches = []
+    if args.sample:
+        mismatches = sample_parity(engine, catalog, exposure, sample_size=args.sample)
+        print(f"Parity:      {args.sample - len(mismatches)}/{args.sample} sampled SKUs match",
+              file=sys.stderr)
+        for mismatch in mismatches:
+            print(f"  MISMATCH {mismatch}", file=sys.stderr)
+
+    exposure.pop("sku_duty")
+    exposure["parity_mismatches"] = mismatches
+    payload = json.dumps(exposure, indent=2, default=str)
+    if args.output:
+        Path(args.output).write_text(payload)
+    else:
+        print(payload)
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
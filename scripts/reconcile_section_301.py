@@ -15,6 +15,7 @@ import sys
 import argparse
 import sqlite3
 import logging
+from datetime import datetime
 from typing import Set, Tuple, Dict, List, Any
 
 from sqlalchemy import create_engine, text
@@ -176,11 +177,32 @@ def insert_rows_to_sqlite(sqlite_conn, rows: List[Dict], dry_run: bool = False)
                 logger.warning(f"  Skipping duplicate: {row['hts_8digit']} - {e}")
 
     if not dry_run:
+        if inserted:
+            bump_data_version(sqlite_conn)
         sqlite_conn.commit()
 
     return inserted
 
 
+def bump_data_version(sqlite_conn) -> None:
+    """
+    v22.0: Bump tariff_data_version in the same transaction as the inserted rows.
+
+    Running web processes key cached results and rule snapshots by this
+    version (see app.services.result_cache), so they reload the new rates.
+    """
+    try:
+        sqlite_conn.execute(
+            "INSERT INTO tariff_data_version (id, version, updated_at, updated_by) "
+            "VALUES (1, 1, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET version = version + 1, "
+            "updated_at = excluded.updated_at, updated_by = excluded.updated_by",
+            (datetime.utcnow().isoformat(sep=' '), 'reconcile_section_301'),
+        )
+    except sqlite3.OperationalError as e:
+        logger.warning(f"  Could not bump tariff data version: {e}")
+
+
 def reconcile(dry_run: bool = False):
     """Main reconciliation function."""
     logger.info("=" * 60)
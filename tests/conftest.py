@@ -68,6 +68,54 @@ def db_session(app):
         yield db.session
 
 
+@pytest.fixture
+def memory_app(monkeypatch):
+    """
+    Bare Flask app on an empty in-memory database with the tariff tables,
+    and a fresh tariff data version.
+
+    Lighter than app (no create_app()). Tests reset the in-process rule
+    caches they exercise themselves.
+    """
+    import importlib
+    from flask import Flask
+    from app.services import result_cache
+    from app.web.db import db
+
+    importlib.import_module("app.web.db.models.tariff_tables")  # Register the tables
+    monkeypatch.setattr(result_cache, "_local_version", 0)
+    monkeypatch.setattr(result_cache, "_version_checked_at", 0.0)
+    monkeypatch.setattr(result_cache, "_local_bumps", set())
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['TESTING'] = True
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.drop_all()
+
+
+@pytest.fixture
+def populated_app():
+    """Flask app on the populated tariff database (skips when empty)."""
+    from app.chat.tools import stacking_tools
+    from app.web.db.models.tariff_tables import TariffProgram
+
+    app = stacking_tools.get_flask_app()
+    with app.app_context():
+        try:
+            populated = TariffProgram.query.count() > 0
+        except Exception:
+            populated = False
+    if not populated:
+        pytest.skip("Populated tariff database not available")
+    return app
+
+
 # ============================================================================
 # User and Auth Fixtures
 # ============================================================================
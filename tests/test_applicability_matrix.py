@@ -0,0 +1,217 @@
+"""
+v22.0: Tests for the program applicability matrix.
+
+Interval and invalidation behaviour runs on an in-memory SQLite app; parity
+of the stacking tools with and without the matrix runs on the populated
+database.
+"""
+
+from datetime import date
+
+import pytest
+
+from app.web.db import db
+from app.services import applicability_matrix
+from app.services.applicability_matrix import ApplicabilityMatrix, validity_interval
+
+
+@pytest.fixture(autouse=True)
+def fresh_matrix():
+    """Start every test without a cached matrix."""
+    applicability_matrix.invalidate_applicability_matrix()
+
+
+def add_program(program_id="section_301", country="CN", check_type="hts_lookup",
+                inclusion_table="section_301_inclusions", effective_date=date(2018, 7, 6)):
+    from app.web.db.models.tariff_tables import TariffProgram
+
+    db.session.add(TariffProgram(
+        program_id=program_id, program_name=program_id, country=country, check_type=check_type,
+        inclusion_table=inclusion_table, filing_sequence=1, effective_date=effective_date,
+    ))
+    db.session.commit()
+
+
+def add_301_rate(hts_8digit, start, end=None):
+    from app.web.db.models.tariff_tables import Section301Rate
+
+    db.session.add(Section301Rate(
+        hts_8digit=hts_8digit, chapter_99_code="9903.88.03", duty_rate=0.25,
+        effective_start=start, effective_end=end,
+    ))
+    db.session.commit()
+
+
+class Loader:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+class TestValidityInterval:
+
+    def test_surrounding_boundaries(self):
+        bounds = [date(2024, 1, 1), date(2025, 1, 1), None, date(2026, 1, 1)]
+        assert validity_interval(bounds, date(2025, 6, 1)) == (date(2025, 1, 1), date(2026, 1, 1))
+        assert validity_interval(bounds, date(2025, 1, 1)) == (date(2025, 1, 1), date(2026, 1, 1))
+        assert validity_interval(bounds, date(2023, 1, 1)) == (date.min, date(2024, 1, 1))
+        assert validity_interval([], date(2023, 1, 1)) == (date.min, None)
+
+
+class TestApplicabilityMatrix:
+
+    def test_hit_within_interval_miss_across_boundary(self, memory_app):
+        add_program()
+        add_301_rate("85444290", date(2018, 7, 6), date(2025, 1, 1))
+        add_301_rate("85444290", date(2025, 1, 1))
+        matrix = ApplicabilityMatrix()
+        key = ("8544429090", "section_301")
+
+        loader = Loader({"included": True, "duty_rate": 0.25})
+        assert matrix.materialize("inclusion", key, date(2024, 3, 1), loader)["included"]
+        matrix.materialize("inclusion", key, date(2019, 1, 1), loader)
+        assert loader.calls == 1
+
+        matrix.materialize("inclusion", key, date(2025, 1, 1), loader)
+        assert loader.calls == 2
+        assert (matrix.hits, matrix.misses) == (1, 2)
+
+    def test_returned_values_are_copies(self, memory_app):
+        matrix = ApplicabilityMatrix()
+        value = matrix.materialize("programs", "CN", date(2025, 1, 1), Loader([{"program_id": "x"}]))
+        value.append({"program_id": "y"})
+        assert matrix.get("programs", "CN", date(2025, 1, 1)) == [{"program_id": "x"}]
+
+    def test_applicability_joins_answers(self, memory_app):
+        add_program()
+        add_program("ieepa_fentanyl", check_type="always", inclusion_table=None)
+        matrix = ApplicabilityMatrix()
+        on = date(2025, 6, 1)
+        matrix.put("programs", "CN", date(2025, 1, 1), None,
+                   [{"program_id": "section_301"}, {"program_id": "ieepa_fentanyl"}])
+        matrix.put("inclusion", ("8544429090", "section_301"), date.min, date(2026, 1, 1), {"included": True})
+        matrix.put("scope", ("ieepa_fentanyl", "CN"), date(2025, 3, 4), None, {"in_scope": True})
+
+        row = matrix.applicability("8544429090", "CN", on)
+        assert row["valid_from"] == date(2025, 3, 4)
+        assert row["valid_to"] == date(2026, 1, 1)
+        assert row["inclusions"] == {"section_301": {"included": True}}
+        assert row["scopes"] == {"ieepa_fentanyl": {"in_scope": True}}
+        assert matrix.applicability("8544429090", "MX", on) is None
+
+
+class TestIncrementalInvalidation:
+
+    def populate(self, matrix):
+        on = date(2025, 6, 1)
+        for hts10 in ("8544429090", "7308905000"):
+            matrix.materialize("inclusion", (hts10, "section_301"), on, Loader({"included": False}))
+        matrix.materialize("inclusion", ("8544429090", "ieepa_fentanyl"), on, Loader({"included": True}))
+        matrix.materialize("scope", ("ieepa_fentanyl", "CN"), on, Loader({"in_scope": True}))
+        matrix.materialize("programs", "CN", on, Loader([]))
+
+    def test_rate_commit_drops_only_its_hts8(self, memory_app):
+        from app.services.applicability_matrix import get_applicability_matrix
+
+        add_program()
+        matrix = get_applicability_matrix()
+        self.populate(matrix)
+
+        add_301_rate("85444290", date(2025, 1, 1))
+        assert get_applicability_matrix() is matrix
+        # Every entry under the HTS8 goes, other HTS and other kinds stay
+        assert matrix.stats()["entries"] == {"programs": 1, "inclusion": 1, "scope": 1}
+        assert matrix.get("inclusion", ("7308905000", "section_301"), date(2025, 6, 1)) is not None
+
+    def test_ieepa_and_scope_commits(self, memory_app):
+        from app.web.db.models.tariff_tables import CountryGroupMember, IeepaRate
+        from app.services.applicability_matrix import get_applicability_matrix
+
+        matrix = get_applicability_matrix()
+        self.populate(matrix)
+
+        db.session.add(IeepaRate(program_type="fentanyl", country_code="CN", chapter_99_code="9903.01.24",
+                                 duty_rate=0.10, effective_start=date(2025, 11, 10)))
+        db.session.add(CountryGroupMember(country_code="CN", group_id="FENTANYL",
+                                          effective_date=date(2025, 2, 4)))
+        db.session.commit()
+        assert matrix.stats()["entries"] == {"programs": 1, "inclusion": 2, "scope": 0}
+
+    def test_program_commit_drops_everything(self, memory_app):
+        from app.services.applicability_matrix import get_applicability_matrix
+
+        matrix = get_applicability_matrix()
+        self.populate(matrix)
+        add_program("section_232_steel", inclusion_table="section_232_materials")
+        assert matrix.stats()["entries"] == {"programs": 0, "inclusion": 0, "scope": 0}
+
+    def test_rollback_drops_nothing(self, memory_app):
+        from app.web.db.models.tariff_tables import Section301Rate
+        from app.services.applicability_matrix import get_applicability_matrix
+
+        matrix = get_applicability_matrix()
+        self.populate(matrix)
+        db.session.add(Section301Rate(hts_8digit="85444290", chapter_99_code="9903.88.03",
+                                      duty_rate=0.25, effective_start=date(2025, 1, 1)))
+        db.session.flush()
+        db.session.rollback()
+        assert matrix.stats()["entries"]["inclusion"] == 3
+
+
+class TestDataVersion:
+
+    def test_local_bump_keeps_matrix(self, memory_app):
+        from app.services.applicability_matrix import get_applicability_matrix
+        from app.services.result_cache import bump_tariff_data_version
+
+        matrix = get_applicability_matrix()
+        bump_tariff_data_version("test")
+        assert get_applicability_matrix() is matrix
+        assert matrix.data_version == 1
+
+    def test_foreign_bump_resets_matrix(self, memory_app, monkeypatch):
+        from app.web.db.models.tariff_tables import TariffDataVersion
+        from app.services.applicability_matrix import get_applicability_matrix
+
+        monkeypatch.setenv("RESULT_CACHE_VERSION_POLL_SECONDS", "0")
+        matrix = get_applicability_matrix()
+        db.session.add(TariffDataVersion(id=1, version=5, updated_by="other_process"))
+        db.session.commit()
+        assert get_applicability_matrix() is not matrix
+
+
+class TestStackingToolsParity:
+
+    CASES = [
+        ("8544.42.9090", "China", "2026-01-15"),
+        ("7308.90.6000", "Germany", "2025-06-01"),
+        ("8471.30.0100", "CN", None),
+        ("9403.20.0080", "Vietnam", "2025-12-01"),
+    ]
+
+    def test_matrix_matches_live_logic(self, populated_app, monkeypatch):
+        from app.chat.tools import stacking_tools as st
+
+        def answers():
+            out = []
+            for hts, country, when in self.CASES:
+                programs = st.get_applicable_programs_data(country, hts, when)
+                out.append(programs)
+                for program in programs.get("programs", []):
+                    out.append(st.check_program_inclusion_data(program["program_id"], hts, when))
+                iso = st.normalize_country(country)["iso_alpha2"]
+                out.append(st.check_program_country_scope(
+                    "ieepa_fentanyl", iso, date.fromisoformat(when) if when else None))
+            return out
+
+        live = answers()
+        monkeypatch.setenv("USE_APPLICABILITY_MATRIX", "true")
+        applicability_matrix.invalidate_applicability_matrix()
+        assert answers() == live   # misses, materialized
+        assert answers() == live   # hits
+        with populated_app.app_context():
+            assert applicability_matrix.get_applicability_matrix().hits > 0
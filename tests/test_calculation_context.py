@@ -0,0 +1,85 @@
+"""
+v22.0: Tests for the per-calculation context of the stacking tools.
+
+A calculation pushes one app context and resolves each memoized lookup once,
+however many slices and programs ask for it.
+"""
+
+from collections import Counter
+
+import pytest
+
+from app.chat.tools import stacking_tools
+from app.chat.tools.stacking_tools import calculation_context, tool_app_context
+
+
+@pytest.fixture
+def pushes(monkeypatch):
+    """Count app contexts pushed on the stacking tools' Flask app."""
+    app = stacking_tools.get_flask_app()
+    original = app.app_context
+    counter = Counter()
+
+    def counting_app_context():
+        counter["pushes"] += 1
+        return original()
+
+    monkeypatch.setattr(app, "app_context", counting_app_context)
+    return counter
+
+
+class TestCalculationContext:
+
+    def test_tools_reuse_the_calculation_app_context(self, pushes):
+        with calculation_context() as calculation:
+            assert pushes["pushes"] == 1
+            with tool_app_context():
+                with tool_app_context():
+                    assert stacking_tools.get_models() is calculation.models
+            assert pushes["pushes"] == 1
+
+        with tool_app_context():
+            pass
+        assert pushes["pushes"] == 2
+
+    def test_nested_blocks_share_state(self):
+        with calculation_context() as outer:
+            with calculation_context() as inner:
+                assert inner is outer
+            stacking_tools.shared_lookup("k", 1, lambda: "value")
+            assert outer.memo[("k", 1)] == "value"
+        assert getattr(stacking_tools._batch_lookups, "calculation", None) is None
+        assert stacking_tools.get_models() is not outer.models
+
+    def test_enclosing_batch_memo_is_reused(self):
+        with stacking_tools.shared_lookups() as batch_memo:
+            with calculation_context() as calculation:
+                assert calculation.memo is batch_memo
+
+
+class TestCalculationLookups:
+
+    def test_one_app_context_and_inclusion_per_key(self, populated_app, pushes, monkeypatch):
+        from app.chat.graphs.stacking_rag import StackingRAG
+
+        calls = Counter()
+        original = stacking_tools._check_program_inclusion_uncached
+
+        def counting(program_id, hts_code, as_of_date=None, technical_attributes=None):
+            calls[(program_id, hts_code, as_of_date)] += 1
+            return original(program_id, hts_code, as_of_date, technical_attributes)
+
+        monkeypatch.setattr(stacking_tools, "_check_program_inclusion_uncached", counting)
+        result = StackingRAG(conversation_id="context-run", engine="direct").calculate_stacking(
+            hts_code="8544.42.9090",
+            country="China",
+            product_description="USB-C cable",
+            product_value=10000.0,
+            materials={"copper": 3000.0, "aluminum": 1000.0},
+            import_date="2025-06-01",
+        )
+
+        assert len(result["entries"]) > 1
+        assert calls and max(calls.values()) == 1
+        # The calculation's own context plus the calculation log write
+        assert pushes["pushes"] <= 2
@@ -0,0 +1,117 @@
+"""
+v22.0: Tests for the batched calculation log writer.
+
+Runs on an in-memory SQLite app; INSERT statements issued by the writer are
+counted to check batching.
+"""
+
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import event
+
+from app.web.db import db
+from app.services.calculation_log_writer import CalculationLogWriter, collapse_records
+
+
+@pytest.fixture
+def inserts(memory_app):
+    issued = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("INSERT"):
+            issued.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    yield issued
+    event.remove(db.engine, "before_cursor_execute", record)
+
+
+def log_record(replay_key, duty=25.0):
+    return {
+        "hts_code": "8544429090",
+        "country_of_origin": "China",
+        "as_of_date": date(2026, 1, 15),
+        "product_value": 10000.0,
+        "replay_key": replay_key,
+        "calculation_result": {"total_duty_percent": duty},
+        "total_duty_rate": duty,
+        "engine_version": "v11.0",
+    }
+
+
+def logged():
+    from app.web.db.models.tariff_tables import TariffCalculationLog
+
+    db.session.expire_all()
+    return {row.replay_key: row for row in TariffCalculationLog.query.all()}
+
+
+class TestCollapseRecords:
+
+    def test_repeats_summed_on_first_record(self):
+        rows = collapse_records([
+            {"replay_key": "a", "calculated_at": datetime(2026, 1, 1), "n": 1},
+            {"replay_key": "b", "calculated_at": datetime(2026, 1, 2), "n": 2},
+            {"replay_key": "a", "calculated_at": datetime(2026, 1, 3), "n": 3},
+        ])
+        assert [(r["replay_key"], r["n"], r["hit_count"]) for r in rows] == [("a", 1, 2), ("b", 2, 1)]
+        assert rows[0]["last_calculated_at"] == datetime(2026, 1, 3)
+
+
+class TestCalculationLogWriter:
+
+    def test_synchronous_upsert_counts_hits(self, memory_app):
+        writer = CalculationLogWriter(app=memory_app)
+        writer.submit(log_record("k1"))
+        writer.submit(log_record("k1"))
+        writer.submit(log_record("k2"))
+
+        rows = logged()
+        assert rows["k1"].hit_count == 2
+        assert rows["k1"].last_calculated_at >= rows["k1"].calculated_at
+        assert rows["k2"].hit_count == 1
+
+    def test_asynchronous_batches_into_one_insert(self, memory_app, inserts):
+        writer = CalculationLogWriter(app=memory_app, asynchronous=True, batch_size=100, flush_seconds=60)
+        writer._ensure_thread = lambda: None  # drain only through flush()
+        for i in range(50):
+            writer.submit(log_record(f"k{i % 10}"))
+        assert writer.pending() == 50 and logged() == {}
+
+        writer.flush()
+        assert len(inserts) == 1
+        rows = logged()
+        assert len(rows) == 10
+        assert all(row.hit_count == 5 for row in rows.values())
+
+    def test_close_flushes_background_queue(self, memory_app):
+        writer = CalculationLogWriter(app=memory_app, asynchronous=True, flush_seconds=0.05)
+        for i in range(20):
+            writer.submit(log_record(f"k{i}"))
+        writer.close()
+
+        assert writer.pending() == 0
+        assert len(logged()) == 20
+        assert writer.records_written == 20
+
+    def test_full_queue_writes_synchronously(self, memory_app):
+        writer = CalculationLogWriter(app=memory_app, asynchronous=True, max_queue=2)
+        writer._ensure_thread = lambda: None
+        for i in range(5):
+            writer.submit(log_record(f"k{i}"))
+
+        assert writer.pending() == 2
+        assert len(logged()) == 3
+        writer.flush()
+        assert len(logged()) == 5
+
+    def test_submitted_result_is_snapshotted(self, memory_app):
+        writer = CalculationLogWriter(app=memory_app, asynchronous=True)
+        writer._ensure_thread = lambda: None
+        record = log_record("k1")
+        writer.submit(record)
+        record["calculation_result"]["total_duty_percent"] = 99.0
+        writer.flush()
+
+        assert logged()["k1"].calculation_result == {"total_duty_percent": 25.0}
@@ -0,0 +1,97 @@
+"""
+v22.0: Tests for per-node and per-tool SQL attribution.
+
+Uses a plain in-memory SQLite engine; the hooks listen on every Engine.
+"""
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from app.services import calculation_profile
+from app.services.calculation_profile import (
+    UNSCOPED, active_profile, profile_calculation, profiled_node, profiled_tool
+)
+from app.services.metrics import MetricsRegistry
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(calculation_profile, "get_metrics_registry", lambda: registry)
+    return registry
+
+
+@pytest.fixture
+def engine():
+    return create_engine("sqlite://")
+
+
+def _run(engine, statements):
+    with engine.connect() as conn:
+        for _ in range(statements):
+            conn.execute(text("SELECT 1"))
+
+
+class TestCalculationProfile:
+
+    def test_sql_attributed_to_innermost_tool_and_node(self, engine, registry):
+        @profiled_tool("check_program_inclusion")
+        def inclusion():
+            _run(engine, 2)
+
+        @profiled_tool("get_applicable_programs")
+        def programs():
+            _run(engine, 1)
+            inclusion()
+
+        @profiled_node("initialize")
+        def initialize_node():
+            programs()
+            inclusion()
+
+        with profile_calculation() as profile:
+            initialize_node()
+            _run(engine, 1)
+
+        debug = profile.as_dict()
+        assert debug["sql_statements"] == 6
+        assert debug["tools"]["check_program_inclusion"]["calls"] == 2
+        assert debug["tools"]["check_program_inclusion"]["sql_statements"] == 4
+        assert debug["tools"]["get_applicable_programs"]["sql_statements"] == 1
+        assert debug["tools"][UNSCOPED]["sql_statements"] == 1
+        assert debug["nodes"]["initialize"]["sql_statements"] == 5
+        assert list(debug["tools"])[0] == "check_program_inclusion"
+
+        tool_sql = registry.get("stacking_tool_sql_statements")
+        assert tool_sql.snapshot(tool="check_program_inclusion")["sum"] == 4
+        assert registry.get("stacking_tool_calls").snapshot(tool="check_program_inclusion")["sum"] == 2
+        assert registry.get("stacking_calculation_sql_statements").snapshot()["count"] == 1
+
+    def test_nested_profiles_share_one_calculation(self, engine, registry):
+        with profile_calculation() as outer:
+            with profile_calculation() as inner:
+                _run(engine, 1)
+            assert inner is outer
+        assert active_profile() is None
+        assert registry.get("stacking_calculation_sql_statements").snapshot()["count"] == 1
+
+    def test_no_profile_outside_block(self, engine, registry):
+        calls = []
+
+        @profiled_tool("normalize_country")
+        def normalize():
+            calls.append(1)
+            _run(engine, 1)
+            return "CN"
+
+        assert normalize() == "CN" and calls == [1]
+        assert registry.get("stacking_calculation_sql_statements") is None
+
+    def test_failed_statement_does_not_leak_timing(self, engine, registry):
+        with profile_calculation() as profile:
+            with engine.connect() as conn:
+                with pytest.raises(Exception):
+                    conn.execute(text("SELECT * FROM missing_table"))
+                conn.execute(text("SELECT 1"))
+                assert not conn.info.get("_profile_start")
+        assert profile.sql_count == 1
@@ -0,0 +1,173 @@
+"""
+v22.0: Tests for the preloaded country resolver.
+
+Lookups run on a resolver built from plain rows; loading and invalidation
+run on an in-memory SQLite app.
+"""
+
+from collections import namedtuple
+from datetime import date
+
+import pytest
+
+from app.services import country_resolver
+from app.services.country_resolver import (
+    CENSUS_ISO_MAPPING_PATH,
+    CountryResolver,
+    load_census_countries,
+    normalize_key,
+)
+
+Alias = namedtuple("Alias", "alias_norm iso_alpha2 iso_alpha3 canonical_name")
+Member = namedtuple("Member", "group_id country_code effective_date expiration_date")
+
+ALIASES = [
+    Alias("germany", "DE", "DEU", "Germany"),
+    Alias("deutschland", "DE", "DEU", "Germany"),
+    Alias("de", "DE", "DEU", "Germany"),
+    Alias("macau", "MO", "MAC", "Macau"),
+    Alias("united kingdom", "GB", "GBR", "United Kingdom"),
+]
+FALLBACK = {"china": "CN", "prc": "CN", "vietnam": "VN", "uk": "GB"}
+CENSUS = [("AT", "Austria"), ("AU", "Australia"), ("CN", "China"), ("FR", "France"), ("KR", "Korea, South")]
+MEMBERS = [
+    Member("EU", "Germany", date(2020, 1, 1), None),
+    Member("EU", "FR", date(2020, 1, 1), None),
+    Member("EU", "GB", date(2020, 1, 1), date(2021, 1, 1)),
+    Member("UK", "GB", date(2021, 1, 1), None),
+    Member("CN", "CN", date(2018, 1, 1), None),
+    Member("EU", "Atlantis", date(2020, 1, 1), None),
+]
+
+
+@pytest.fixture
+def resolver():
+    return CountryResolver(aliases=ALIASES, fallback_map=FALLBACK, census_countries=CENSUS, members=MEMBERS)
+
+
+class TestResolve:
+
+    def test_alias_takes_precedence(self, resolver):
+        resolution = resolver.resolve("  Deutschland ")
+        assert (resolution.iso_alpha2, resolution.iso_alpha3) == ("DE", "DEU")
+        assert resolution.canonical_name == "Germany"
+        assert resolution.matched_by == "alias"
+
+    def test_fallback_echoes_input_name(self, resolver):
+        resolution = resolver.resolve("PRC")
+        assert resolution.iso_alpha2 == "CN"
+        assert resolution.canonical_name == "PRC"
+        assert resolution.matched_by == "fallback"
+
+    def test_census_names_and_iso_codes(self, resolver):
+        assert resolver.resolve("Austria").matched_by == "census"
+        assert resolver.resolve("korea south").iso_alpha2 == "KR"
+        resolution = resolver.resolve("fr")
+        assert (resolution.iso_alpha2, resolution.canonical_name, resolution.matched_by) == ("FR", "France", "iso")
+
+    def test_fuzzy_match_misspelling(self, resolver):
+        resolution = resolver.resolve("Germnay")
+        assert resolution.iso_alpha2 == "DE"
+        assert resolution.matched_by == "fuzzy"
+        assert resolver.resolve("Vietnma").iso_alpha2 == "VN"
+
+    def test_fuzzy_match_rejects_distant_and_short_inputs(self, resolver):
+        assert resolver.resolve("Narnia") is None
+        assert resolver.resolve("XX") is None
+        assert resolver.resolve("Germnay", fuzzy=False) is None
+
+    def test_fuzzy_match_rejects_ambiguous_names(self, resolver):
+        # Equally close to Austria and Australia
+        assert resolver.fuzzy_match("Austrlia") is None
+        assert resolver.fuzzy_match("Austr") is None
+
+    def test_memberships_returned_with_resolution(self, resolver):
+        resolution = resolver.resolve("GB")
+        assert resolution.groups(date(2020, 6, 1)) == ["EU"]
+        assert resolution.groups(date(2025, 6, 1)) == ["UK"]
+
+
+class TestNormalize:
+
+    def test_result_shape_matches_normalize_country(self, resolver):
+        assert resolver.normalize("Macau") == {
+            "iso_alpha2": "MO",
+            "iso_alpha3": "MAC",
+            "canonical_name": "Macau",
+            "original_input": "Macau",
+            "normalized": True,
+            "matched_by": "alias",
+        }
+
+    def test_unknown_input_passes_through(self, resolver):
+        result = resolver.normalize("ZZ")
+        assert result["iso_alpha2"] == "ZZ"
+        assert result["normalized"] is False
+        assert resolver.normalize("Narnia")["iso_alpha2"] is None
+
+
+class TestGroups:
+
+    def test_exact_country_code_row(self, resolver):
+        assert resolver.country_group("Germany", date(2025, 1, 1)) == "EU"
+        assert resolver.country_group("CN", date(2025, 1, 1)) == "CN"
+
+    def test_names_and_codes_resolve_to_same_group(self, resolver):
+        for country in ("DE", "Deutschland", "germany"):
+            assert resolver.country_group(country, date(2025, 1, 1)) == "EU"
+        assert resolver.country_group("France", date(2025, 1, 1)) == "EU"
+
+    def test_time_bounded_membership(self, resolver):
+        assert resolver.country_group("United Kingdom", date(2020, 6, 1)) == "EU"
+        assert resolver.country_group("UK", date(2021, 1, 1)) == "UK"
+        assert resolver.country_group("China", date(2017, 1, 1)) == "default"
+        assert resolver.country_group("Vietnam", date(2025, 1, 1)) == "default"
+
+    def test_is_group_member(self, resolver):
+        assert resolver.is_group_member("EU", "de", date(2025, 1, 1))
+        assert resolver.is_group_member("EU", "GB", date(2020, 6, 1))
+        assert not resolver.is_group_member("EU", "GB", date(2021, 1, 1))
+        assert not resolver.is_group_member("EU", "CN", date(2025, 1, 1))
+
+    def test_unresolved_member_code_matched_verbatim(self, resolver):
+        assert resolver.is_group_member("EU", "Atlantis", date(2025, 1, 1))
+
+
+def test_normalize_key():
+    assert normalize_key("  South   Korea ") == "south korea"
+
+
+def test_load_census_countries_skips_flagged_rows():
+    rows = load_census_countries(CENSUS_ISO_MAPPING_PATH)
+    codes = {iso2 for iso2, _ in rows}
+    assert "CA" in codes and "MX" in codes
+    assert all(iso2 for iso2, _ in rows)
+    assert ("", "United States of America") not in rows
+
+
+class TestInvalidation:
+
+    @pytest.fixture(autouse=True)
+    def fresh_resolver(self):
+        """Start every test without a cached resolver."""
+        country_resolver.invalidate_country_resolver()
+
+    def test_commit_rebuilds_resolver(self, memory_app):
+        from app.services.country_resolver import get_country_resolver
+        from app.web.db import db
+        from app.web.db.models.tariff_tables import CountryAlias, CountryGroupMember
+
+        resolver = get_country_resolver()
+        assert get_country_resolver() is resolver
+        assert resolver.country_group("Germany", date(2025, 1, 1)) == "default"
+
+        db.session.add(CountryGroupMember(country_code="DE", group_id="EU", effective_date=date(2020, 1, 1)))
+        db.session.commit()
+        rebuilt = get_country_resolver()
+        assert rebuilt is not resolver
+        assert rebuilt.country_group("Germany", date(2025, 1, 1)) == "EU"
+
+        db.session.add(CountryAlias(alias_raw="Allemagne", alias_norm="allemagne", iso_alpha2="DE",
+                                    iso_alpha3="DEU", canonical_name="Germany"))
+        db.session.commit()
+        assert get_country_resolver().resolve("Allemagne").matched_by == "alias"
@@ -0,0 +1,252 @@
+"""
+v22.0: Tests for the multi-line entry batch calculator.
+
+Covers line validation, entry totals, batch-scoped shared lookups, the
+streaming (NDJSON) form, and parity between POST /tariff/calculate/batch
+and per-line StackingRAG runs on the populated database.
+"""
+
+import json
+
+import pytest
+
+from app.services import entry_batch
+from app.services.entry_batch import (
+    BatchLineError, _parse_line, read_ndjson_lines, stream_entry_batch, summarize_lines
+)
+
+
+class TestLineParsing:
+    """Validation and entry-level defaults."""
+
+    def test_entry_country_is_default(self):
+        line = _parse_line({"hts_code": "8544.42.9090", "product_value": 500}, 0, "China")
+        assert line["country"] == "China"
+        assert line["product_value"] == 500.0
+        assert line["product_description"] == "Product (8544.42.9090)"
+        assert line["line_id"] == 0
+
+    def test_line_country_overrides_default(self):
+        line = _parse_line({"hts_code": "7318.15.2095", "country": "Germany", "line_id": "A1"}, 3, "China")
+        assert line["country"] == "Germany"
+        assert line["line_id"] == "A1"
+
+    @pytest.mark.parametrize("raw", [
+        {"product_value": 100},
+        {"hts_code": "8544.42.9090"},
+        {"hts_code": "8544.42.9090", "country": "China", "product_value": "abc"},
+        "8544.42.9090",
+    ])
+    def test_invalid_lines_raise(self, raw):
+        with pytest.raises(BatchLineError):
+            _parse_line(raw, 0, None)
+
+
+class TestEntryTotals:
+    """summarize_lines aggregates only calculated lines."""
+
+    def test_totals_skip_errors_and_pending_materials(self):
+        lines = [
+            {"success": True, "product_value": 1000.0, "total_duty": {
+                "total_duty_amount": 350.0,
+                "breakdown": [
+                    {"program_id": "section_301", "action": "apply", "duty_amount": 250.0},
+                    {"program_id": "ieepa_fentanyl", "action": "apply", "duty_amount": 100.0},
+                    {"program_id": "section_232_copper", "action": "disclaim", "duty_amount": 0.0},
+                ],
+            }},
+            {"success": True, "product_value": 3000.0, "total_duty": {
+                "total_duty_amount": 750.0,
+                "breakdown": [{"program_id": "section_301", "action": "apply", "duty_amount": 750.0}],
+            }},
+            {"success": True, "needs_materials": True, "product_value": 5000.0, "total_duty": None},
+            {"success": False, "error": "bad line"},
+        ]
+        totals = summarize_lines(lines)
+
+        assert totals["line_count"] == 4
+        assert totals["calculated_lines"] == 2
+        assert totals["needs_materials_lines"] == 1
+        assert totals["error_lines"] == 1
+        assert totals["total_value"] == 4000.0
+        assert totals["total_duty_amount"] == 1100.0
+        assert totals["effective_rate"] == 0.275
+        assert totals["by_program"] == {"section_301": 1000.0, "ieepa_fentanyl": 100.0}
+
+
+class TestStreamEntryBatch:
+    """stream_entry_batch() calculates lazily and ends with a summary."""
+
+    @pytest.fixture
+    def calculated(self, monkeypatch):
+        """Replace the stacking run with a fixed 25% duty per line."""
+        calls = []
+
+        def calculate_line(self, index, raw, default_country=None):
+            calls.append(index)
+            if not raw.get("hts_code"):
+                return {"line": index, "line_id": index, "success": False, "error": "missing"}
+            return {"line": index, "line_id": index, "success": True, "needs_materials": False,
+                    "product_value": 100.0, "total_duty": {"total_duty_amount": 25.0, "breakdown": []}}
+
+        monkeypatch.setattr(entry_batch.EntryBatchCalculator, "calculate_line", calculate_line)
+        monkeypatch.setattr(entry_batch.EntryBatchCalculator, "freshness", lambda self: {})
+        monkeypatch.setattr(entry_batch, "_data_version", lambda: 7)
+        return calls
+
+    def test_lines_are_pulled_one_record_at_a_time(self, calculated):
+        pulled = []
+
+        def lines():
+            for i in range(1000):
+                pulled.append(i)
+                yield {"hts_code": "8544.42.9090"}
+
+        stream = stream_entry_batch(lines(), country="China")
+        first = next(stream)
+        assert first["type"] == "line" and first["line"] == 0
+        assert pulled == [0] and calculated == [0]
+        next(stream)
+        assert pulled == [0, 1]
+        stream.close()
+
+    def test_summary_totals_and_capped_errors(self, calculated, monkeypatch):
+        monkeypatch.setattr(entry_batch, "MAX_SUMMARY_ERRORS", 2)
+        lines = [{"hts_code": "8544.42.9090"}, {}, {}, {}, BatchLineError("bad json")]
+        records = list(stream_entry_batch(lines, country="China"))
+
+        assert [r["type"] for r in records] == ["line"] * 5 + ["summary"]
+        assert records[4]["error"] == "bad json"
+        summary = records[-1]
+        assert summary["success"] is True and summary["data_version"] == 7
+        assert summary["entry_total"] == summarize_lines(records[:-1])
+        assert summary["entry_total"]["error_lines"] == 4
+        assert [e["line"] for e in summary["errors"]] == [1, 2]
+
+    def test_broken_input_still_ends_with_summary(self, calculated):
+        def lines():
+            yield {"hts_code": "8544.42.9090"}
+            raise OSError("client went away")
+
+        records = list(stream_entry_batch(lines(), country="China"))
+        assert records[-1]["success"] is False
+        assert records[-1]["error"] == "client went away"
+        assert records[-1]["entry_total"]["calculated_lines"] == 1
+
+    def test_read_ndjson_lines(self):
+        body = [b'{"hts_code": "8544.42.9090"}\n', b"\n", b"{bad\n", b'{"hts_code": "7318.15.2095"}']
+        decoded = list(read_ndjson_lines(body))
+        assert decoded[0] == {"hts_code": "8544.42.9090"}
+        assert isinstance(decoded[1], BatchLineError) and "line 3" in str(decoded[1])
+        assert decoded[2] == {"hts_code": "7318.15.2095"}
+
+
+class TestSharedLookups:
+    """shared_lookups() memoizes only inside the block."""
+
+    def test_loader_called_once_inside_block(self):
+        from app.chat.tools.stacking_tools import shared_lookup, shared_lookups
+
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return "value"
+
+        with shared_lookups():
+            assert shared_lookup("kind", "key", loader) == "value"
+            assert shared_lookup("kind", "key", loader) == "value"
+        assert len(calls) == 1
+
+        shared_lookup("kind", "key", loader)
+        shared_lookup("kind", "key", loader)
+        assert len(calls) == 3
+
+    def test_rule_snapshot_flag_is_scoped(self, monkeypatch):
+        from app.chat.tools import stacking_tools
+
+        monkeypatch.setenv("USE_RULE_SNAPSHOT", "false")
+        monkeypatch.setattr(stacking_tools, "get_flask_app", lambda: None)
+        monkeypatch.setattr(
+            "app.services.rule_snapshot.get_rule_snapshot", lambda app=None: "snapshot"
+        )
+
+        assert stacking_tools.get_active_rule_snapshot() is None
+        with stacking_tools.shared_lookups(rule_snapshot=True):
+            assert stacking_tools.get_active_rule_snapshot() == "snapshot"
+        assert stacking_tools.get_active_rule_snapshot() is None
+
+
+class TestBatchEndpoint:
+    """POST /tariff/calculate/batch."""
+
+    def test_rejects_empty_lines(self, populated_app):
+        response = populated_app.test_client().post("/tariff/calculate/batch", json={"lines": []})
+        assert response.status_code == 400
+
+    def test_rejects_bad_import_date(self, populated_app):
+        response = populated_app.test_client().post("/tariff/calculate/batch", json={
+            "import_date": "06/01/2025",
+            "lines": [{"hts_code": "8544.42.9090", "country": "China"}],
+        })
+        assert response.status_code == 400
+
+    def test_lines_match_single_calculations(self, populated_app):
+        from app.chat.graphs.stacking_rag import StackingRAG
+
+        lines = [
+            {"hts_code": "8544.42.9090", "product_value": 10000, "materials": {"copper": 3000}},
+            {"hts_code": "7318.15.2095", "product_value": 5000, "materials": {"steel": 2000}},
+            {"hts_code": "3818.00.0000", "product_value": 2500, "materials": {}},
+            {"product_value": 100},
+        ]
+        response = populated_app.test_client().post("/tariff/calculate/batch", json={
+            "country": "China", "import_date": "2025-06-01", "lines": lines,
+        })
+        data = response.get_json()
+
+        assert data["success"] is True
+        assert [l["line"] for l in data["lines"]] == [0, 1, 2, 3]
+        assert data["lines"][3]["success"] is False
+        assert data["entry_total"]["calculated_lines"] == 3
+        assert data["entry_total"]["error_lines"] == 1
+
+        expected_total = 0.0
+        for line, result in zip(lines[:3], data["lines"][:3]):
+            single = StackingRAG(conversation_id=f"single-{line['hts_code']}").calculate_stacking(
+                hts_code=line["hts_code"],
+                country="China",
+                product_description=f"Product ({line['hts_code']})",
+                product_value=line["product_value"],
+                materials=line["materials"],
+                import_date="2025-06-01",
+            )
+            assert result["total_duty"]["total_duty_amount"] == single["total_duty"]["total_duty_amount"]
+            assert result["entries"] == single["entries"]
+            expected_total += single["total_duty"]["total_duty_amount"]
+
+        assert data["entry_total"]["total_duty_amount"] == round(expected_total, 2)
+
+    def test_streamed_records_match_buffered_response(self, populated_app):
+        lines = [
+            {"hts_code": "8544.42.9090", "product_value": 10000, "materials": {"copper": 3000}},
+            {"hts_code": "3818.00.0000", "product_value": 2500, "materials": {}},
+            {"product_value": 100},
+        ]
+        client = populated_app.test_client()
+        body = {"country": "China", "import_date": "2025-06-01", "lines": lines}
+        buffered = client.post("/tariff/calculate/batch", json=body).get_json()
+
+        response = client.post("/tariff/calculate/batch", json=body,
+                               headers={"Accept": "application/x-ndjson"})
+        assert response.mimetype == "application/x-ndjson"
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [{k: v for k, v in r.items() if k != "type"} for r in records[:-1]] == buffered["lines"]
+        assert records[-1]["type"] == "summary"
+        assert records[-1]["entry_total"] == buffered["entry_total"]
+
+        ndjson = "\n".join(json.dumps(line) for line in lines)
+        response = client.post("/tariff/calculate/batch?country=China&import_date=2025-06-01",
+                               data=ndjson, content_type="application/x-ndjson")
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert records[-1]["entry_total"] == buffered["entry_total"]
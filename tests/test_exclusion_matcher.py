@@ -0,0 +1,96 @@
+"""
+v22.0: Tests for the precomputed exclusion claim matcher.
+
+The matcher must return exactly what the old full-table scan in
+ExclusionClaim.find_exclusion_candidates() returned: HTS10 exact matches
+if any, otherwise HTS8 prefix matches, both limited to active claims.
+"""
+
+import random
+from datetime import date, timedelta
+
+from app.services.exclusion_matcher import ExclusionClaimMatcher
+
+
+def claim(claim_id, hts10=None, hts8=None, start=date(2025, 1, 1), end=None):
+    constraints = {}
+    if hts10 is not None:
+        constraints["hts10_exact"] = hts10
+    if hts8 is not None:
+        constraints["hts8_prefix"] = hts8
+    return (claim_id, constraints, start, end)
+
+
+def scan(claims, hts_code, entry_date):
+    """The pre-index matching loop, kept as the reference."""
+    hts_normalized = hts_code.replace(".", "").strip()
+    hts8 = hts_normalized[:8]
+    exact, fallback = [], []
+    for claim_id, constraints, start, end in claims:
+        if not (start <= entry_date and (end is None or entry_date < end)):
+            continue
+        if not constraints:
+            continue
+        if "hts10_exact" in constraints and hts_normalized in constraints["hts10_exact"]:
+            exact.append(claim_id)
+            continue
+        if "hts8_prefix" in constraints:
+            prefixes = constraints["hts8_prefix"]
+            if isinstance(prefixes, str):
+                prefixes = [prefixes]
+            if hts8 in prefixes or any(hts8.startswith(p) for p in prefixes):
+                fallback.append(claim_id)
+    return exact if exact else fallback
+
+
+class TestExclusionClaimMatcher:
+
+    def test_hts10_exact_wins_over_prefix(self):
+        matcher = ExclusionClaimMatcher([
+            claim("a", hts10=["9025198020"], hts8=["90251980"]),
+            claim("b", hts10=["9025198040"], hts8=["90251980"]),
+            claim("c", hts8=["90251980"]),
+        ])
+        assert matcher.match_ids("9025.19.8020", date(2025, 6, 1)) == ["a"]
+        assert matcher.match_ids("9025.19.8060", date(2025, 6, 1)) == ["a", "b", "c"]
+
+    def test_short_prefixes_and_dedup(self):
+        matcher = ExclusionClaimMatcher([
+            claim("a", hts8=["8536", "853690"]),
+            claim("b", hts8="85369040"),
+        ])
+        assert matcher.match_ids("8536904000", date(2025, 6, 1)) == ["a", "b"]
+        assert matcher.match_ids("8537100000", date(2025, 6, 1)) == []
+
+    def test_end_exclusive_window(self):
+        matcher = ExclusionClaimMatcher([
+            claim("a", hts10=["8536904000"], start=date(2025, 11, 30), end=date(2026, 11, 11)),
+            claim("b", hts8=["85369040"]),
+        ])
+        assert matcher.match_ids("8536904000", date(2026, 11, 10)) == ["a"]
+        # Expired exact match no longer shadows the prefix match
+        assert matcher.match_ids("8536904000", date(2026, 11, 11)) == ["b"]
+
+    def test_matches_linear_scan(self):
+        rng = random.Random(7)
+        codes = [f"{rng.randint(8400, 8410)}{rng.randint(0, 99):02d}{rng.randint(0, 9999):04d}"
+                 for _ in range(40)]
+        claims = []
+        for i in range(300):
+            code = rng.choice(codes)
+            start = date(2025, 1, 1) + timedelta(days=rng.randint(0, 365))
+            end = start + timedelta(days=rng.randint(1, 365)) if rng.random() < 0.7 else None
+            claims.append(claim(
+                f"c{i}",
+                hts10=[code] if rng.random() < 0.5 else None,
+                hts8=[code[:rng.choice((4, 6, 8))]] if rng.random() < 0.7 else None,
+                start=start, end=end,
+            ))
+        matcher = ExclusionClaimMatcher(claims)
+
+        for _ in range(500):
+            code = rng.choice(codes)
+            if rng.random() < 0.3:
+                code = code[:8] + f"{rng.randint(0, 99):02d}"
+            entry_date = date(2025, 1, 1) + timedelta(days=rng.randint(0, 800))
+            assert matcher.match_ids(code, entry_date) == scan(claims, code, entry_date)
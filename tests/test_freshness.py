@@ -0,0 +1,96 @@
+"""
+v22.0: Tests for the cached freshness snapshot.
+
+Runs on an in-memory SQLite app; SQL issued by the service is counted to
+check that reads are served from memory.
+"""
+
+import time
+from datetime import date
+
+import pytest
+from sqlalchemy import event, text
+
+from app.web.db import db
+from app.services import freshness
+from app.services.freshness import FreshnessService
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """Freshness service registered as the singleton (receives commit updates)."""
+    service = FreshnessService(refresh_seconds=300)
+    monkeypatch.setattr(freshness, "_freshness_service", service)
+    return service
+
+
+@pytest.fixture
+def statements(memory_app):
+    issued = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        issued.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    yield issued
+    event.remove(db.engine, "before_cursor_execute", record)
+
+
+def add_rate(hts_8digit="85444290"):
+    from app.web.db.models.tariff_tables import Section301Rate
+
+    db.session.add(Section301Rate(
+        hts_8digit=hts_8digit, chapter_99_code="9903.88.03", duty_rate=0.25,
+        effective_start=date(2024, 9, 27),
+    ))
+    db.session.commit()
+
+
+class TestFreshnessSnapshot:
+
+    def test_reads_served_from_memory(self, memory_app, service, statements):
+        first = service.get_all_freshness()
+        assert statements
+        assert first["section_301"]["record_count"] == 0
+
+        statements.clear()
+        second = service.get_all_freshness()
+        assert statements == []
+        assert second == first
+
+    def test_commit_updates_snapshot_incrementally(self, memory_app, service, statements):
+        service.get_all_freshness()
+        add_rate()
+        add_rate("85444210")
+
+        statements.clear()
+        result = service.get_program_freshness("section_301")
+        assert not any("COUNT" in s.upper() or "MAX(" in s.upper() for s in statements)
+        assert result["record_count"] == 2
+        assert result["status"] == "current"
+
+    def test_old_snapshot_refreshed_in_background(self, memory_app, service):
+        service.get_all_freshness()
+        db.session.execute(text(
+            "INSERT INTO section_301_rates (hts_8digit, chapter_99_code, duty_rate, effective_start, role)"
+            " VALUES ('85444290', '9903.88.03', 0.25, '2024-09-27', 'impose')"
+        ))
+        db.session.commit()
+        service._loaded_at -= 301
+
+        # Old snapshot is served immediately; the reload happens off-request
+        assert service.get_program_freshness("section_301")["record_count"] == 0
+        deadline = time.monotonic() + 10
+        while service._refreshing and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert service.get_program_freshness("section_301")["record_count"] == 1
+
+    def test_zero_refresh_reloads_every_call(self, memory_app, statements):
+        service = FreshnessService(refresh_seconds=0)
+        service.get_all_freshness()
+        statements.clear()
+        service.get_all_freshness()
+        assert statements
+
+    def test_unknown_program(self, memory_app, service):
+        assert "error" in service.get_program_freshness("nope")
@@ -0,0 +1,97 @@
+"""
+v22.0: Tests for the temporal interval index behind the snapshot's
+as-of rate lookups.
+
+Rows are plain namedtuples; every indexed lookup is compared with a linear
+scan that applies the same precedence to the rows active on the date.
+"""
+
+import random
+from collections import namedtuple
+from datetime import date, timedelta
+
+from app.services.interval_index import TemporalIntervalIndex, latest_start_first
+
+Rate = namedtuple("Rate", "id key effective_start effective_end role is_archived")
+
+
+def rate(id, start, end=None, key="85444290", role="impose", is_archived=False):
+    return Rate(id, key, start, end, role, is_archived)
+
+
+def pick_301(active):
+    for archived in (False, True):
+        tier = [r for r in active if bool(r.is_archived) == archived]
+        if tier:
+            excludes = [r for r in tier if r.role == "exclude"]
+            return latest_start_first(excludes or tier)
+    return None
+
+
+def scan(rows, key, as_of_date, pick):
+    active = [
+        r for r in rows
+        if r.key == key
+        and (r.effective_start is None or r.effective_start <= as_of_date)
+        and (r.effective_end is None or r.effective_end > as_of_date)
+    ]
+    return pick(active) if active else None
+
+
+class TestTemporalIntervalIndex:
+
+    def test_latest_start_wins(self):
+        rows = [rate(1, date(2018, 7, 6)), rate(2, date(2024, 9, 27))]
+        index = TemporalIntervalIndex(rows, lambda r: r.key)
+        assert index.get("85444290", date(2020, 1, 1)).id == 1
+        assert index.get("85444290", date(2024, 9, 27)).id == 2
+        assert index.get("85444290", date(2018, 7, 5)) is None
+        assert index.get("99999999", date(2025, 1, 1)) is None
+
+    def test_end_date_is_exclusive(self):
+        rows = [rate(1, date(2018, 1, 1)), rate(2, date(2024, 1, 1), end=date(2025, 1, 1))]
+        index = TemporalIntervalIndex(rows, lambda r: r.key)
+        assert index.get("85444290", date(2024, 12, 31)).id == 2
+        assert index.get("85444290", date(2025, 1, 1)).id == 1
+
+    def test_ties_keep_load_order(self):
+        rows = [rate(1, date(2024, 1, 1)), rate(2, date(2024, 1, 1))]
+        index = TemporalIntervalIndex(rows, lambda r: r.key)
+        assert index.get("85444290", date(2025, 1, 1)).id == 1
+
+    def test_exclude_before_impose_and_active_before_archived(self):
+        rows = [
+            rate(1, date(2024, 1, 1)),
+            rate(2, date(2018, 1, 1), end=date(2025, 6, 1), role="exclude"),
+            rate(3, date(2025, 1, 1), role="exclude", is_archived=True),
+        ]
+        index = TemporalIntervalIndex(rows, lambda r: r.key, pick=pick_301)
+        assert index.get("85444290", date(2025, 3, 1)).id == 2
+        assert index.get("85444290", date(2025, 6, 1)).id == 1
+        assert index.get("85444290", date(2023, 1, 1)).id == 2
+
+    def test_archived_fallback(self):
+        rows = [rate(1, date(2018, 1, 1), end=date(2024, 1, 1)),
+                rate(2, date(2018, 1, 1), is_archived=True)]
+        index = TemporalIntervalIndex(rows, lambda r: r.key, pick=pick_301)
+        assert index.get("85444290", date(2023, 1, 1)).id == 1
+        assert index.get("85444290", date(2025, 1, 1)).id == 2
+
+    def test_matches_linear_scan(self):
+        rng = random.Random(22)
+        base = date(2018, 1, 1)
+        rows = []
+        for i in range(300):
+            start = base + timedelta(days=rng.randrange(0, 2500))
+            end = start + timedelta(days=rng.randrange(1, 900)) if rng.random() < 0.6 else None
+            rows.append(rate(
+                i, start, end,
+                key=rng.choice(["A", "B", "C"]),
+                role=rng.choice(["impose", "exclude", None]),
+                is_archived=rng.choice([False, True, None]),
+            ))
+        index = TemporalIntervalIndex(rows, lambda r: r.key, pick=pick_301)
+        for offset in range(-30, 3500, 7):
+            day = base + timedelta(days=offset)
+            for key in ("A", "B", "C"):
+                assert index.get(key, day) == scan(rows, key, day, pick_301)
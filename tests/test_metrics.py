@@ -0,0 +1,87 @@
+"""
+v22.0: Tests for the in-process metrics registry, its Prometheus export,
+and graph node / tool latency recording.
+"""
+
+import pytest
+
+from app.services import metrics
+from app.services.metrics import MetricsRegistry
+
+
+class TestHistogram:
+
+    def test_cumulative_buckets_per_label_set(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("calc_seconds", "Calculation time", buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, node="initialize")
+        histogram.observe(0.2, node="calculate")
+
+        snapshot = histogram.snapshot(node="initialize")
+        assert snapshot["count"] == 4
+        assert snapshot["sum"] == pytest.approx(3.65)
+        assert snapshot["buckets"] == {0.1: 2, 1.0: 3, float("inf"): 4}
+        assert histogram.snapshot(node="calculate")["count"] == 1
+        assert histogram.snapshot(node="generate") is None
+
+    def test_render_prometheus_text(self):
+        registry = MetricsRegistry()
+        registry.histogram("calc_seconds", "Calculation time", buckets=(0.1, 1.0)).observe(0.5, node="plan")
+        registry.counter("calc_errors_total", "Failed calculations").inc(node='say "hi"')
+
+        text = registry.render()
+        assert "# TYPE calc_seconds histogram" in text
+        assert 'calc_seconds_bucket{node="plan",le="0.1"} 0' in text
+        assert 'calc_seconds_bucket{node="plan",le="1"} 1' in text
+        assert 'calc_seconds_bucket{node="plan",le="+Inf"} 1' in text
+        assert 'calc_seconds_count{node="plan"} 1' in text
+        assert 'calc_errors_total{node="say \\"hi\\""} 1' in text
+
+    def test_same_name_returns_same_metric(self):
+        registry = MetricsRegistry()
+        assert registry.counter("hits_total", "Hits") is registry.counter("hits_total", "Hits")
+        with pytest.raises(ValueError):
+            registry.histogram("hits_total", "Hits")
+
+    def test_empty_registry_renders_nothing(self):
+        assert MetricsRegistry().render() == ""
+
+
+class TestGraphLatency:
+
+    @pytest.fixture
+    def registry(self, monkeypatch):
+        registry = MetricsRegistry()
+        monkeypatch.setattr(metrics, "_registry", registry)
+        return registry
+
+    def test_timed_node_records_latency_and_errors(self, registry):
+        from app.chat.logging_utils import timed_node
+
+        @timed_node("initialize", graph="stacking", log=False)
+        def initialize_node(state):
+            return {"programs": []}
+
+        @timed_node("retrieve", graph="conversational", log=False)
+        def retrieve_documents_node(state, config):
+            raise RuntimeError("vector store down")
+
+        assert initialize_node({}) == {"programs": []}
+        with pytest.raises(RuntimeError):
+            retrieve_documents_node({}, {"configurable": {}})
+
+        durations = registry.get("graph_node_duration_seconds")
+        assert durations.snapshot(graph="stacking", node="initialize")["count"] == 1
+        assert durations.snapshot(graph="conversational", node="retrieve")["count"] == 1
+        errors = registry.get("graph_node_errors_total")
+        assert errors.value(graph="conversational", node="retrieve") == 1
+        assert errors.value(graph="stacking", node="initialize") == 0
+
+    def test_observe_tool(self, registry):
+        metrics.observe_tool("stacking", "check_program_inclusion", 0.004)
+        metrics.observe_tool("agentic", "search_documents", 0.2, error=True)
+
+        text = registry.render()
+        assert 'graph_tool_duration_seconds_count{graph="stacking",tool="check_program_inclusion"} 1' in text
+        assert 'graph_tool_errors_total{graph="agentic",tool="search_documents"} 1' in text
@@ -0,0 +1,102 @@
+"""
+v22.0: Tests for the shared commit hooks and versioned singletons.
+
+Runs on an in-memory SQLite app.
+"""
+
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+from app.web.db import db
+from app.services import model_invalidation, result_cache
+from app.services.model_invalidation import VersionedSingleton, register_model_invalidation
+
+
+@pytest.fixture
+def commits(monkeypatch):
+    """Changes passed to a registration watching CountryAlias."""
+    from app.web.db.models.tariff_tables import CountryAlias
+
+    monkeypatch.setattr(model_invalidation, "_registrations", list(model_invalidation._registrations))
+    monkeypatch.setattr(model_invalidation, "_by_class", {})
+    received = []
+
+    def record(changes, model, obj, change):
+        return (changes or []) + [(model.__name__, change)]
+
+    register_model_invalidation(lambda: (CountryAlias,), received.append, record=record)
+    return received
+
+
+def add_alias(alias_norm="deutschland"):
+    from app.web.db.models.tariff_tables import CountryAlias
+
+    alias = CountryAlias(alias_raw=alias_norm, alias_norm=alias_norm, iso_alpha2="DE",
+                         iso_alpha3="DEU", canonical_name="Germany")
+    db.session.add(alias)
+    db.session.commit()
+    return alias
+
+
+class TestRegisterModelInvalidation:
+
+    def test_commit_reports_recorded_changes(self, memory_app, commits):
+        alias = add_alias()
+        alias.canonical_name = "Federal Republic of Germany"
+        db.session.commit()
+        assert commits == [[("CountryAlias", "new")], [("CountryAlias", "dirty")]]
+
+    def test_unwatched_models_and_rollback_report_nothing(self, memory_app, commits):
+        from app.web.db.models.tariff_tables import CountryAlias, CountryGroupMember
+
+        db.session.add(CountryGroupMember(country_code="DE", group_id="EU", effective_date=date(2020, 1, 1)))
+        db.session.commit()
+
+        db.session.add(CountryAlias(alias_raw="x", alias_norm="x", iso_alpha2="DE", canonical_name="Germany"))
+        db.session.flush()
+        db.session.rollback()
+        assert commits == []
+
+    def test_bulk_delete(self, memory_app, commits):
+        from app.web.db.models.tariff_tables import CountryAlias
+
+        add_alias()
+        CountryAlias.query.delete()
+        db.session.commit()
+        assert commits[-1] == [("CountryAlias", "bulk")]
+
+
+class TestVersionedSingleton:
+
+    def build(self, version, engine_id):
+        return SimpleNamespace(data_version=version, engine_id=engine_id)
+
+    def test_rebuilds_on_version_change_and_invalidate(self, memory_app):
+        singleton = VersionedSingleton(self.build)
+        first = singleton.get()
+        assert singleton.get() is first
+
+        result_cache.bump_tariff_data_version("test")
+        second = singleton.get()
+        assert second is not first
+        assert second.data_version == first.data_version + 1
+
+        singleton.invalidate()
+        assert singleton.current is None
+        assert singleton.get() is not second
+
+    def test_keep_skips_rebuild(self, memory_app):
+        kept = []
+
+        def keep(instance, version):
+            kept.append(version)
+            instance.data_version = version
+            return True
+
+        singleton = VersionedSingleton(self.build, keep=keep)
+        first = singleton.get()
+        result_cache.bump_tariff_data_version("test")
+        assert singleton.get() is first
+        assert kept == [first.data_version]
@@ -0,0 +1,88 @@
+"""
+v22.0: Tests for the origin comparison (one HTS across every country).
+
+Country loading runs on the census mapping file; parity with per-country
+calculations and the shared HTS lookups run on the populated database.
+"""
+
+import pytest
+
+from app.services.origin_comparison import OriginComparisonError, compare_origins, load_origin_countries
+
+
+class TestOriginCountries:
+
+    def test_census_mapping_skips_us_and_blanks(self):
+        countries = load_origin_countries()
+        codes = [c["iso_alpha2"] for c in countries]
+        assert len(codes) > 200
+        assert len(codes) == len(set(codes))
+        assert "US" not in codes
+        assert {"CN", "VN", "MX", "DE"} <= set(codes)
+
+    def test_invalid_countries_rejected(self):
+        with pytest.raises(OriginComparisonError):
+            compare_origins("8544.42.9090", countries=[])
+        with pytest.raises(OriginComparisonError):
+            compare_origins("", countries=["CN"])
+
+
+class TestCompareOrigins:
+    """Comparison on the populated database."""
+
+    COUNTRIES = ["CN", "VN", "DE", "MX", "JP"]
+
+    def test_matches_single_calculations(self, populated_app):
+        from app.chat.graphs.stacking_rag import StackingRAG
+
+        comparison = compare_origins(
+            "8544.42.9090", product_value=10000, materials={"copper": 3000},
+            import_date="2025-06-01", countries=self.COUNTRIES,
+        )
+        assert comparison["errors"] == []
+        assert [o["rank"] for o in comparison["origins"]] == [1, 2, 3, 4, 5]
+        amounts = [o["total_duty_amount"] for o in comparison["origins"]]
+        assert amounts == sorted(amounts)
+        assert comparison["lowest"]["total_duty_amount"] == amounts[0]
+
+        for origin in comparison["origins"]:
+            single = StackingRAG(conversation_id=f"origin-{origin['country']}").calculate_stacking(
+                hts_code="8544.42.9090",
+                country=origin["country"],
+                product_description="Product (8544.42.9090)",
+                product_value=10000,
+                materials={"copper": 3000},
+                import_date="2025-06-01",
+            )
+            assert single["total_duty"]["total_duty_amount"] == origin["total_duty_amount"]
+
+    def test_hts_lookups_resolved_once(self, populated_app, monkeypatch):
+        from app.chat.tools import stacking_tools
+
+        calls = []
+        uncached = stacking_tools._check_annex_ii_exclusion_uncached
+
+        def counting(hts_code, import_date=None):
+            calls.append((hts_code, import_date))
+            return uncached(hts_code, import_date)
+
+        monkeypatch.setattr(stacking_tools, "_check_annex_ii_exclusion_uncached", counting)
+        compare_origins(
+            "8544.42.9090", materials={"copper": 3000},
+            import_date="2025-06-01", countries=self.COUNTRIES,
+        )
+        # Once per distinct (HTS, date) argument, not once per country
+        assert calls and len(calls) == len(set(calls))
+
+    def test_endpoint(self, populated_app):
+        client = populated_app.test_client()
+        assert client.post("/tariff/compare-origins", json={"product_value": 100}).status_code == 400
+
+        response = client.post("/tariff/compare-origins", json={
+            "hts_code": "8544.42.9090", "materials": {"copper": 3000},
+            "import_date": "2025-06-01", "countries": ["CN", "VN"], "include_stacks": True,
+        })
+        data = response.get_json()
+        assert data["success"] is True
+        assert {o["country"] for o in data["origins"]} == {"CN", "VN"}
+        assert all(o["breakdown"] for o in data["origins"])
@@ -0,0 +1,102 @@
+"""
+v22.0: Tests for the process-pool batch executor.
+
+Sharding and in-order merging use a stand-in chunk calculator (also across
+real worker processes). Parity with the serial batch calculator runs on the
+populated database.
+"""
+
+import pytest
+
+from app.services import parallel_batch
+from app.services.parallel_batch import ParallelBatchExecutor, shard_lines
+
+
+def fake_calculate_chunk(task):
+    """Module-level so worker processes can unpickle it."""
+    indices, lines, country, import_date, batch_id = task
+    return [
+        {"line": index, "line_id": index, "hts_code": raw["hts_code"], "country": country}
+        for index, raw in zip(indices, lines)
+    ]
+
+
+def no_init():
+    """Stand-in pool initializer (picklable for spawned workers)."""
+
+
+def _lines(n):
+    codes = ["8544.42.9090", "7318.15.2095", "3818.00.0000"]
+    return [{"hts_code": codes[i % 3], "product_value": 100} for i in range(n)]
+
+
+class TestShardLines:
+
+    def test_groups_by_hts_and_covers_every_line(self):
+        lines = _lines(10)
+        chunks = shard_lines(lines, chunk_size=4)
+
+        assert [len(indices) for indices, _ in chunks] == [4, 4, 2]
+        flat = [i for indices, _ in chunks for i in indices]
+        assert sorted(flat) == list(range(10))
+        hts = [lines[i]["hts_code"] for i in flat]
+        assert hts == sorted(hts)
+        for indices, chunk in chunks:
+            assert chunk == [lines[i] for i in indices]
+
+    def test_non_dict_lines_are_kept(self):
+        chunks = shard_lines(["bad", {"hts_code": "8544.42.9090"}], chunk_size=10)
+        assert chunks[0][1] == ["bad", {"hts_code": "8544.42.9090"}]
+
+
+class TestParallelBatchExecutor:
+
+    @pytest.fixture(autouse=True)
+    def fake_chunks(self, monkeypatch):
+        monkeypatch.setattr(parallel_batch, "_calculate_chunk", fake_calculate_chunk)
+        monkeypatch.setattr(parallel_batch, "_init_worker", no_init)
+
+    def test_results_in_input_order_in_process(self):
+        lines = _lines(25)
+        results = ParallelBatchExecutor(workers=1, chunk_size=4).calculate_lines(lines, country="CN")
+        assert [r["line"] for r in results] == list(range(25))
+        assert [r["hts_code"] for r in results] == [l["hts_code"] for l in lines]
+
+    def test_results_in_input_order_across_processes(self):
+        lines = _lines(50)
+        executor = ParallelBatchExecutor(workers=2, chunk_size=3)
+        try:
+            results = executor.calculate_lines(lines, country="CN")
+        finally:
+            executor.shutdown()
+        assert [r["line"] for r in results] == list(range(50))
+        assert all(r["country"] == "CN" for r in results)
+
+    def test_default_chunk_size_spreads_over_workers(self):
+        assert ParallelBatchExecutor(workers=4)._chunk_size_for(100) == 7
+        assert ParallelBatchExecutor(workers=4)._chunk_size_for(3) == 1
+
+    def test_empty_batch(self):
+        assert ParallelBatchExecutor(workers=2).calculate_lines([]) == []
+
+
+class TestParallelParity:
+
+    def test_matches_serial_batch(self, populated_app):
+        from app.services.entry_batch import calculate_entry_batch
+
+        lines = [
+            {"hts_code": "8544.42.9090", "product_value": 10000, "materials": {"copper": 3000}},
+            {"hts_code": "3818.00.0000", "product_value": 2500, "materials": {}},
+            {"product_value": 100},
+            {"hts_code": "8544.42.9090", "product_value": 500, "materials": {"copper": 100}},
+        ]
+        serial = calculate_entry_batch(lines, country="China", import_date="2025-06-01")
+        executor = ParallelBatchExecutor(workers=2, chunk_size=1)
+        try:
+            parallel = executor.calculate(lines, country="China", import_date="2025-06-01")
+        finally:
+            executor.shutdown()
+
+        assert parallel["lines"] == serial["lines"]
+        assert parallel["entry_total"] == serial["entry_total"]
@@ -0,0 +1,124 @@
+"""
+v22.0: Tests for the vectorized portfolio duty-exposure engine.
+
+Catalog loading and breakdown decomposition are pure NumPy. Parity with
+StackingRAG runs on the populated database.
+"""
+
+import math
+
+import numpy as np
+
+from app.services.portfolio_exposure import (
+    PortfolioCatalog,
+    PortfolioExposureEngine,
+    decompose_breakdown,
+    sample_parity,
+)
+
+
+class TestPortfolioCatalog:
+
+    def test_columns_and_validation(self):
+        catalog = PortfolioCatalog.from_records([
+            {"sku": "A", "hts_code": "8544.42.9090", "country": "China", "value": "10000", "copper": "3000"},
+            {"sku": "B", "hts_code": "", "country": "China", "value": 100},
+            {"sku": "C", "hts_code": "7318.15.2095", "country": "Germany", "value": 100, "steel": 500},
+            {"sku": "D", "hts_code": "7318.15.2095", "country": "Germany", "value": "abc"},
+        ])
+        assert len(catalog) == 4
+        assert catalog.content[0].tolist() == [3000.0, 0.0, 0.0]
+        assert catalog.valid.tolist() == [True, False, False, False]
+        assert {e["sku"] for e in catalog.errors} == {"B", "C", "D"}
+
+    def test_sub_dollar_content_ignored(self):
+        catalog = PortfolioCatalog.from_records([
+            {"sku": "A", "hts_code": "8544.42.9090", "country": "China", "value": 100, "copper": 0.3},
+        ])
+        assert catalog.content[0, 0] == 0.0
+
+
+class TestDecomposeBreakdown:
+
+    def test_remaining_value_subtracts_claimed_content(self):
+        breakdown = [
+            {"program_id": "section_301", "action": "apply", "duty_rate": 0.25,
+             "duty_amount": 2500.0, "calculation": "additive on product_value", "base_value": 10000.0},
+            {"program_id": "section_232_copper", "action": "claim", "duty_rate": 0.50, "material": "copper",
+             "duty_amount": 1500.0, "calculation": "on_portion on content_value", "base_value": 3000.0},
+            {"program_id": "ieepa_reciprocal", "action": "paid", "duty_rate": 0.10,
+             "duty_amount": 700.0, "calculation": "additive on remaining_value", "base_value": 7000.0},
+            {"program_id": "section_232_steel", "action": "disclaim", "duty_rate": 0.50,
+             "duty_amount": 0.0, "calculation": "additive on content_value"},
+        ]
+        basis = np.array([10000.0, 3000.0, 0.0, 0.0])
+        coefficients, linear = decompose_breakdown(breakdown, basis)
+
+        assert linear is True
+        assert set(coefficients) == {"section_301", "section_232_copper", "ieepa_reciprocal"}
+        assert coefficients["ieepa_reciprocal"].tolist() == [0.10, -0.10, 0.0, 0.0]
+        total = sum(c @ basis for c in coefficients.values())
+        assert math.isclose(total, 4700.0)
+
+        # Same profile, different SKU: no calculator call needed
+        other = np.array([2000.0, 500.0, 0.0, 0.0])
+        assert math.isclose(sum(c @ other for c in coefficients.values()), 500 + 250 + 150)
+
+    def test_fallback_content_uses_full_value(self):
+        breakdown = [
+            {"program_id": "section_232_steel", "action": "claim", "duty_rate": 0.50, "material": "steel",
+             "duty_amount": 5000.0, "calculation": "on_portion on content_value", "base_value": 10000.0},
+        ]
+        coefficients, linear = decompose_breakdown(breakdown, np.array([10000.0, 0.0, 0.0, 0.0]))
+        assert linear is True
+        assert coefficients["section_232_steel"].tolist() == [0.50, 0.0, 0.0, 0.0]
+
+    def test_full_slice_content_line_not_deducted(self):
+        # Steel derivative: 232 charged on the whole value, nothing left for reciprocal
+        breakdown = [
+            {"program_id": "section_232_steel", "action": "claim", "duty_rate": 0.50, "material": "steel",
+             "duty_amount": 5000.0, "calculation": "on_portion on content_value", "base_value": 10000.0},
+            {"program_id": "section_301", "action": "apply", "duty_rate": 0.25,
+             "duty_amount": 2500.0, "calculation": "additive on product_value", "base_value": 10000.0},
+        ]
+        coefficients, linear = decompose_breakdown(breakdown, np.array([10000.0, 0.0, 3000.0, 0.0]))
+        assert linear is True
+        assert coefficients["section_232_steel"].tolist() == [0.50, 0.0, 0.0, 0.0]
+
+    def test_unexplained_base_is_not_linear(self):
+        breakdown = [
+            {"program_id": "section_232_copper", "action": "claim", "duty_rate": 0.50, "material": "copper",
+             "duty_amount": 600.0, "calculation": "on_portion on content_value", "base_value": 1200.0},
+        ]
+        _, linear = decompose_breakdown(breakdown, np.array([10000.0, 3000.0, 0.0, 0.0]))
+        assert linear is False
+
+
+class TestPortfolioParity:
+    """Engine duty agrees with StackingRAG on a sample of SKUs."""
+
+    def test_sampled_skus_match_calculator(self, populated_app):
+        records = []
+        for i, (hts, country, copper, steel) in enumerate([
+            ("8544.42.9090", "China", 3000, 0),
+            ("8544.42.9090", "China", 1200, 0),
+            ("8544.42.9090", "Germany", 2000, 0),
+            ("7318.15.2095", "China", 0, 2000),
+            ("7318.15.2095", "China", 0, 4500),
+            ("3818.00.0000", "China", 0, 0),
+            ("3818.00.0000", "Vietnam", 0, 0),
+        ]):
+            records.append({"sku": f"SKU{i}", "hts_code": hts, "country": country,
+                            "value": 10000 - 500 * i, "copper": copper, "steel": steel})
+        catalog = PortfolioCatalog.from_records(records)
+
+        engine = PortfolioExposureEngine(import_date="2025-06-01")
+        exposure = engine.compute(catalog)
+
+        assert exposure["calculated_skus"] == len(records)
+        assert exposure["profiles"] < len(records)
+        assert sample_parity(engine, catalog, exposure, sample_size=len(records)) == []
+        assert math.isclose(
+            sum(a["total_duty_amount"] for a in exposure["by_country"].values()),
+            exposure["total_duty_amount"], abs_tol=0.05,
+        )
@@ -0,0 +1,129 @@
+"""
+v22.0: Tests for the HTS longest-prefix trie and the snapshot lookups built
+on it.
+
+Snapshot rows are built from transient model instances and frozen with
+freeze_rows(), so these tests never write to the database. Each lookup is
+checked against the prefix-by-prefix query it replaces.
+"""
+
+from collections import namedtuple
+from datetime import date
+
+from app.services.prefix_trie import HtsPrefixTrie
+from app.services.rule_snapshot import TariffRuleSnapshot, freeze_rows
+from app.web.db.models.tariff_tables import (
+    HtsBaseRate,
+    IeepaAnnexIIExclusion,
+    IeepaReciprocalDealOverrides,
+    IeepaReciprocalProductExclusions,
+)
+
+Row = namedtuple("Row", "name")
+OPEN_END = date(9999, 12, 31)
+
+
+def make_snapshot(**tables):
+    """Build a snapshot from {ModelName: [instances]}."""
+    models = {
+        "HtsBaseRate": HtsBaseRate,
+        "IeepaAnnexIIExclusion": IeepaAnnexIIExclusion,
+        "IeepaReciprocalDealOverrides": IeepaReciprocalDealOverrides,
+        "IeepaReciprocalProductExclusions": IeepaReciprocalProductExclusions,
+    }
+    rows = {name: freeze_rows(models[name], instances) for name, instances in tables.items()}
+    return TariffRuleSnapshot(1, rows)
+
+
+class TestHtsPrefixTrie:
+
+    def test_longest_prefix_wins(self):
+        trie = HtsPrefixTrie()
+        trie.insert("8471", Row("4"), date(2025, 1, 1), None)
+        trie.insert("847130", Row("6"), date(2025, 1, 1), None)
+        assert trie.longest_match("8471300100", date(2025, 6, 1)) == ("847130", Row("6"))
+        assert trie.longest_match("8471500100", date(2025, 6, 1)) == ("8471", Row("4"))
+        assert trie.longest_match("8544429090", date(2025, 6, 1)) is None
+
+    def test_inactive_longer_prefix_falls_back(self):
+        trie = HtsPrefixTrie()
+        trie.insert("8471", Row("4"), date(2025, 1, 1), None)
+        trie.insert("847130", Row("6"), date(2025, 1, 1), date(2025, 6, 1))
+        assert trie.longest_match("8471300100", date(2025, 5, 31))[1] == Row("6")
+        assert trie.longest_match("8471300100", date(2025, 6, 1))[1] == Row("4")
+        assert trie.longest_match("8471300100", date(2024, 12, 31)) is None
+
+    def test_first_active_row_by_rank(self):
+        trie = HtsPrefixTrie()
+        trie.insert("8471", Row("undotted"), date(2025, 1, 1), None, rank=1)
+        trie.insert("8471", Row("dotted"), date(2025, 1, 1), None, rank=0)
+        assert trie.longest_match("84713001", date(2025, 6, 1))[1] == Row("dotted")
+
+    def test_only_configured_lengths_match(self):
+        trie = HtsPrefixTrie()
+        trie.insert("84713", Row("5"), None, None)
+        trie.insert("847", Row("3"), None, None)
+        assert trie.longest_match("8471300100", date(2025, 6, 1)) is None
+
+    def test_partial_matches_short_code_at_its_length(self):
+        trie = HtsPrefixTrie()
+        trie.insert("84713", Row("5"), None, None)
+        assert trie.longest_match("84713", date(2025, 6, 1)) is None
+        assert trie.longest_match("84713", date(2025, 6, 1), partial=True) == ("84713", Row("5"))
+
+
+class TestSnapshotPrefixLookups:
+
+    def test_mfn_dotted_before_undotted(self):
+        snapshot = make_snapshot(HtsBaseRate=[
+            HtsBaseRate(hts_code="85444290", column1_rate=0.01, effective_date=date(2020, 1, 1)),
+            HtsBaseRate(hts_code="8544.42.90", column1_rate=0.02, effective_date=date(2020, 1, 1)),
+            HtsBaseRate(hts_code="8544", column1_rate=0.05, effective_date=date(2020, 1, 1)),
+        ])
+        assert snapshot.mfn_base_rate("8544429090", date(2025, 6, 1)).column1_rate == 0.02
+        assert snapshot.mfn_base_rate("8544110000", date(2025, 6, 1)).column1_rate == 0.05
+        assert snapshot.mfn_base_rate("9401000000", date(2025, 6, 1)) is None
+
+    def test_mfn_expired_row_skipped(self):
+        snapshot = make_snapshot(HtsBaseRate=[
+            HtsBaseRate(hts_code="8544.42.9090", column1_rate=0.03,
+                        effective_date=date(2020, 1, 1), expiration_date=date(2025, 1, 1)),
+            HtsBaseRate(hts_code="8544.42", column1_rate=0.026, effective_date=date(2020, 1, 1)),
+        ])
+        assert snapshot.mfn_base_rate("8544429090", date(2024, 6, 1)).column1_rate == 0.03
+        assert snapshot.mfn_base_rate("8544429090", date(2025, 6, 1)).column1_rate == 0.026
+
+    def test_annex_ii_only_first_row_per_prefix(self):
+        snapshot = make_snapshot(IeepaAnnexIIExclusion=[
+            IeepaAnnexIIExclusion(hts_code="2709", category="energy",
+                                  effective_date=date(2025, 4, 5),
+                                  expiration_date=date(2025, 11, 14)),
+            IeepaAnnexIIExclusion(hts_code="2709", category="energy",
+                                  effective_date=date(2025, 11, 14)),
+        ])
+        assert snapshot.annex_ii_longest_match("2709002090", date(2025, 6, 1))[0] == "2709"
+        # The DB query takes .first() and then checks is_active()
+        assert snapshot.annex_ii_longest_match("2709002090", date(2025, 12, 1)) is None
+
+    def test_product_exclusion_respects_prefix_len(self):
+        snapshot = make_snapshot(IeepaReciprocalProductExclusions=[
+            IeepaReciprocalProductExclusions(hts_prefix="8471", prefix_len=4, category="A",
+                                             effective_start=date(2025, 4, 5),
+                                             effective_end=OPEN_END, dataset_tag="t"),
+            IeepaReciprocalProductExclusions(hts_prefix="8473", prefix_len=6, category="B",
+                                             effective_start=date(2025, 4, 5),
+                                             effective_end=OPEN_END, dataset_tag="t"),
+        ])
+        assert snapshot.reciprocal_product_exclusion("8471300100", date(2025, 6, 1)).category == "A"
+        assert snapshot.reciprocal_product_exclusion("8473300100", date(2025, 6, 1)) is None
+        assert snapshot.reciprocal_product_exclusion("8471300100", date(2025, 4, 4)) is None
+
+    def test_deal_override_scoped_by_country(self):
+        snapshot = make_snapshot(IeepaReciprocalDealOverrides=[
+            IeepaReciprocalDealOverrides(country_code="IN", hts_prefix="620342", prefix_len=6,
+                                         override_rate=18.0, deal_name="India interim",
+                                         effective_start=date(2025, 8, 1),
+                                         effective_end=OPEN_END, dataset_tag="t"),
+        ])
+        assert snapshot.deal_override("IN", "6203424011", date(2025, 9, 1)).override_rate == 18.0
+        assert snapshot.deal_override("VN", "6203424011", date(2025, 9, 1)) is None
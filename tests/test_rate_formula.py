@@ -0,0 +1,177 @@
+"""
+v22.0: Tests for compiled ProgramRate formulas and the program rate resolver.
+
+Compilation runs without a database; resolution and invalidation run on an
+in-memory SQLite app.
+"""
+
+from datetime import date
+
+import numpy as np
+import pytest
+
+from app.web.db import db
+from app.services import rate_formula
+from app.services.rate_formula import FormulaError, ProgramRateResolver, compile_formula
+
+
+@pytest.fixture(autouse=True)
+def fresh_resolver():
+    """Start every test without a cached resolver."""
+    rate_formula.invalidate_program_rate_resolver()
+
+
+def add_rate(program_id, group_id, rate=None, formula=None, effective=date(2025, 1, 1), expires=None):
+    from app.web.db.models.tariff_tables import ProgramRate
+
+    db.session.add(ProgramRate(
+        program_id=program_id, group_id=group_id, rate=rate,
+        rate_type="formula" if formula else "fixed", rate_formula=formula,
+        effective_date=effective, expiration_date=expires,
+    ))
+    db.session.commit()
+
+
+MFN = {"8544429090": 0.026, "0101300000": 0.068, "7308906000": 0.20}
+
+
+def mfn_lookup(hts_code):
+    return MFN.get(hts_code.replace(".", ""), 0.0)
+
+
+class TestCompileFormula:
+
+    def test_named_eu_ceiling_matches_original_arithmetic(self):
+        formula = compile_formula("15pct_minus_mfn")
+        for mfn in (0.0, 0.026, 0.068, 0.15, 0.2):
+            assert formula(mfn=mfn) == max(0.0, 0.15 - mfn)
+        assert formula.describe(0.124, 0.026) == "EU 15% ceiling: 15% - 2.6% MFN = 12.4%"
+
+    def test_expressions_and_vectors(self):
+        formula = compile_formula("min(max(0, 15% - mfn), 10%) + 0.5 * 2%")
+        assert formula.operands == {"mfn"}
+        mfn = np.array([0.0, 0.026, 0.2])
+        np.testing.assert_allclose(formula(mfn=mfn), [0.11, 0.11, 0.01])
+        assert formula(mfn=0.1) == pytest.approx(0.06)
+        assert compile_formula("2 * 5%")(mfn=np.zeros(3)).tolist() == [0.1, 0.1, 0.1]
+
+    def test_compiled_once(self):
+        assert compile_formula("max(0, 15% - mfn)") is compile_formula("max(0, 15% - mfn)")
+
+    @pytest.mark.parametrize("text", [
+        "", "unknown_formula_name", "__import__('os')", "mfn ** 2",
+        "max(mfn)", "abs(mfn)", "1 / 0", "mfn.real", "duty_rate - mfn",
+    ])
+    def test_rejected(self, text):
+        with pytest.raises(FormulaError):
+            compile_formula(text)
+
+
+class TestProgramRateResolver:
+
+    def test_group_default_and_windows(self, memory_app):
+        add_rate("ieepa_reciprocal", "default", rate=0.10, effective=date(2025, 4, 5))
+        add_rate("ieepa_reciprocal", "EU", formula="15pct_minus_mfn", effective=date(2025, 8, 7))
+        add_rate("ieepa_reciprocal", "UK", rate=None, effective=date(2025, 4, 5))
+        add_rate("ieepa_reciprocal", "JP", formula="mystery", effective=date(2025, 4, 5))
+        resolver = ProgramRateResolver.load()
+
+        def rate(group, on, hts="8544.42.9090"):
+            return resolver.evaluate("ieepa_reciprocal", group, hts, on, mfn_lookup)
+
+        assert rate("EU", date(2025, 6, 1)) == (0.10, "fixed_rate_default")
+        assert rate("EU", date(2025, 9, 1))[0] == max(0.0, 0.15 - 0.026)
+        assert rate("EU", date(2025, 9, 1), "7308.90.6000") == (0.0, "EU 15% ceiling: 15% - 20.0% MFN = 0.0%")
+        assert rate("UK", date(2025, 9, 1)) == (0.0, "rate_is_null")
+        assert rate("JP", date(2025, 9, 1)) == (0.0, "unknown_formula:mystery")
+        assert rate("EU", date(2025, 1, 1)) == (0.0, "no_rate_found")
+
+    def test_legacy_program_code_fallback(self, memory_app):
+        from app.web.db.models.tariff_tables import ProgramCode
+
+        db.session.add(ProgramCode(program_id="section_232_steel", action="claim",
+                                   chapter_99_code="9903.81.91", duty_rate=0.5))
+        db.session.add(ProgramCode(program_id="section_232_steel", action="apply",
+                                   chapter_99_code="9903.81.91", duty_rate=0.25))
+        db.session.commit()
+        resolver = ProgramRateResolver.load()
+        assert resolver.evaluate("section_232_steel", "EU", "7308.90.6000", date(2025, 9, 1),
+                                 mfn_lookup) == (0.5, "legacy_program_code")
+
+    def test_evaluate_many_matches_scalar(self, memory_app):
+        add_rate("ieepa_reciprocal", "EU", formula="15pct_minus_mfn", effective=date(2025, 8, 7))
+        resolver = ProgramRateResolver.load()
+        codes = ["8544.42.9090", "0101.30.0000", "7308.90.6000", "8544.42.9090", "9999.99.9999"]
+        lookups = []
+
+        def counting_lookup(hts_code):
+            lookups.append(hts_code)
+            return mfn_lookup(hts_code)
+
+        rates, sources = resolver.evaluate_many("ieepa_reciprocal", "EU", codes, date(2025, 9, 1),
+                                                counting_lookup)
+        expected = [resolver.evaluate("ieepa_reciprocal", "EU", code, date(2025, 9, 1), mfn_lookup)
+                    for code in codes]
+        assert list(zip(rates.tolist(), sources)) == expected
+        assert len(lookups) == 4
+
+        rates, sources = resolver.evaluate_many("ieepa_reciprocal", "CN", codes, date(2025, 9, 1),
+                                                counting_lookup)
+        assert rates.tolist() == [0.0] * 5 and set(sources) == {"no_rate_found"}
+
+
+class TestInvalidation:
+
+    def test_commit_rebuilds_resolver(self, memory_app):
+        from app.services.rate_formula import get_program_rate_resolver
+
+        add_rate("ieepa_reciprocal", "default", rate=0.10)
+        resolver = get_program_rate_resolver()
+        assert get_program_rate_resolver() is resolver
+
+        add_rate("ieepa_reciprocal", "EU", formula="max(0, 15% - mfn)")
+        rebuilt = get_program_rate_resolver()
+        assert rebuilt is not resolver
+        assert rebuilt.evaluate("ieepa_reciprocal", "EU", "8544.42.9090", date(2025, 9, 1),
+                                mfn_lookup)[1] == "formula max(0, 15% - mfn): 2.6% MFN = 12.4%"
+
+
+class TestStackingTools:
+
+    @pytest.fixture(autouse=True)
+    def tools_app(self, memory_app, monkeypatch):
+        """Run the stacking tools on the in-memory app."""
+        from app.chat.tools import stacking_tools
+
+        monkeypatch.setattr(stacking_tools, "_flask_app", memory_app)
+
+    def test_resolver_is_opt_in(self, memory_app, monkeypatch):
+        from app.chat.tools.stacking_tools import get_rate_for_program
+
+        monkeypatch.delenv("USE_RATE_RESOLVER", raising=False)
+        add_rate("ieepa_reciprocal", "default", formula="15pct_minus_mfn")
+        assert get_rate_for_program("ieepa_reciprocal", "Germany", "8544.42.9090",
+                                    date(2025, 9, 1)) == (0.15, "EU 15% ceiling: 15% - 0.0% MFN = 15.0%")
+        assert rate_formula._resolver.current is None
+
+        monkeypatch.setenv("USE_RATE_RESOLVER", "true")
+        assert get_rate_for_program("ieepa_reciprocal", "Germany", "8544.42.9090",
+                                    date(2025, 9, 1)) == (0.15, "EU 15% ceiling: 15% - 0.0% MFN = 15.0%")
+        assert rate_formula._resolver.current is not None
+
+    def test_prefetch_primes_per_code_lookups(self, memory_app, monkeypatch):
+        from app.chat.tools.stacking_tools import get_rate_for_program, prefetch_program_rates, shared_lookups
+
+        monkeypatch.setenv("USE_RATE_RESOLVER", "true")
+        add_rate("ieepa_reciprocal", "default", formula="max(0, 15% - mfn)")
+        add_rate("section_232_steel", "default", rate=0.5)
+        codes = ["8544.42.9090", "7308.90.6000"]
+        with shared_lookups():
+            prefetch_program_rates("Germany", codes, "2025-09-01")
+            monkeypatch.setattr(ProgramRateResolver, "evaluate",
+                                lambda *args, **kwargs: pytest.fail("rate was not prefetched"))
+            for code in codes:
+                assert get_rate_for_program("section_232_steel", "Germany", code,
+                                            date(2025, 9, 1)) == (0.5, "fixed_rate_default")
+                assert get_rate_for_program("ieepa_reciprocal", "Germany", code,
+                                            date(2025, 9, 1))[0] == 0.15
@@ -0,0 +1,125 @@
+"""
+v22.0: Tests for the stacking result cache and tariff data version.
+
+The cache and key are pure Python. Version polling is tested with the
+persisted read replaced, so these tests never write to the database.
+"""
+
+import pytest
+
+from app.services import result_cache
+from app.services.result_cache import StackingResultCache, result_cache_key
+
+
+def key(**overrides):
+    kwargs = dict(
+        hts_code="8544.42.9090",
+        country="China",
+        import_date="2025-06-01",
+        product_value=10000.0,
+        product_description="USB-C cable",
+        materials={"copper": 3000.0},
+        quantity=None,
+        quantity_uom="PCS",
+        data_version=1,
+    )
+    kwargs.update(overrides)
+    return result_cache_key(**kwargs)
+
+
+class TestResultCacheKey:
+
+    def test_identical_inputs_same_key(self):
+        assert key() == key()
+
+    def test_materials_order_does_not_matter(self):
+        a = key(materials={"copper": 3000.0, "steel": 1000.0})
+        b = key(materials={"steel": 1000.0, "copper": 3000.0})
+        assert a == b
+
+    @pytest.mark.parametrize("field,value", [
+        ("hts_code", "8544.42.2000"),
+        ("country", "Germany"),
+        ("import_date", "2025-07-01"),
+        ("product_value", 12000.0),
+        ("product_description", "Copper wire"),
+        ("materials", {"copper": 2000.0}),
+        ("quantity", 10),
+        ("data_version", 2),
+    ])
+    def test_each_input_changes_key(self, field, value):
+        assert key(**{field: value}) != key()
+
+    def test_unknown_and_empty_materials_differ(self):
+        assert key(materials=None) != key(materials={})
+
+    def test_engine_flag_changes_key(self, monkeypatch):
+        before = key()
+        monkeypatch.setenv("USE_IEEPA_V2_ENGINE", "true")
+        assert key() != before
+
+
+class TestStackingResultCache:
+
+    def test_miss_then_hit(self):
+        cache = StackingResultCache()
+        assert cache.get(("k",)) is None
+        cache.put(("k",), {"total_duty": {"total_duty_amount": 2500.0}})
+        assert cache.get(("k",)) == {"total_duty": {"total_duty_amount": 2500.0}}
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_results_awaiting_input_not_cached(self):
+        cache = StackingResultCache()
+        cache.put(("k",), {"awaiting_user_input": True})
+        assert cache.get(("k",)) is None
+
+    def test_returned_result_is_a_copy(self):
+        cache = StackingResultCache()
+        cache.put(("k",), {"entries": [{"stack": []}]})
+        cache.get(("k",))["entries"].append("mutated")
+        assert cache.get(("k",)) == {"entries": [{"stack": []}]}
+
+    def test_least_recently_used_evicted(self):
+        cache = StackingResultCache(max_entries=2)
+        cache.put(("a",), {"n": 1})
+        cache.put(("b",), {"n": 2})
+        cache.get(("a",))
+        cache.put(("c",), {"n": 3})
+        assert cache.get(("b",)) is None
+        assert cache.get(("a",)) == {"n": 1}
+        assert cache.get(("c",)) == {"n": 3}
+
+
+class TestTariffDataVersion:
+
+    @pytest.fixture(autouse=True)
+    def reset_version(self, monkeypatch):
+        monkeypatch.setattr(result_cache, "_local_version", 0)
+        monkeypatch.setattr(result_cache, "_version_checked_at", 0.0)
+
+    def test_picks_up_bump_from_another_process(self, monkeypatch):
+        monkeypatch.setenv("RESULT_CACHE_VERSION_POLL_SECONDS", "0")
+        persisted = {"version": 3}
+        monkeypatch.setattr(result_cache, "_read_persisted_version", lambda: persisted["version"])
+        assert result_cache.get_tariff_data_version() == 3
+        persisted["version"] = 4
+        assert result_cache.get_tariff_data_version() == 4
+
+    def test_never_goes_backwards(self, monkeypatch):
+        monkeypatch.setattr(result_cache, "_local_version", 7)
+        monkeypatch.setattr(result_cache, "_read_persisted_version", lambda: 5)
+        assert result_cache.get_tariff_data_version() == 7
+
+    def test_unreadable_table_uses_local_counter(self, monkeypatch):
+        monkeypatch.setattr(result_cache, "_local_version", 2)
+        monkeypatch.setattr(result_cache, "_read_persisted_version", lambda: None)
+        assert result_cache.get_tariff_data_version() == 2
+
+    def test_poll_interval_skips_reads(self, monkeypatch):
+        reads = []
+        monkeypatch.setenv("RESULT_CACHE_VERSION_POLL_SECONDS", "60")
+        monkeypatch.setattr(result_cache, "_read_persisted_version", lambda: reads.append(1) or 1)
+        result_cache.get_tariff_data_version()
+        result_cache.get_tariff_data_version()
+        assert len(reads) == 1
@@ -0,0 +1,261 @@
+"""
+v22.0: Tests for the in-memory tariff rule snapshot.
+
+Rows are built from transient model instances and frozen with freeze_rows(),
+so these tests never write to the database. Each lookup is checked against
+the precedence rules of the query it replaces.
+"""
+
+from datetime import date
+
+import pytest
+
+from app.services import rule_snapshot
+from app.services.rule_snapshot import TariffRuleSnapshot, freeze_rows
+from app.web.db.models.tariff_tables import (
+    IeepaAnnexIIExclusion,
+    IeepaRate,
+    ProgramCode,
+    Section232Rate,
+    Section301Rate,
+    TariffProgram,
+)
+
+
+def make_snapshot(**tables):
+    """Build a snapshot from {ModelName: [instances]}."""
+    models = {
+        "TariffProgram": TariffProgram,
+        "Section301Rate": Section301Rate,
+        "Section232Rate": Section232Rate,
+        "IeepaRate": IeepaRate,
+        "ProgramCode": ProgramCode,
+        "IeepaAnnexIIExclusion": IeepaAnnexIIExclusion,
+    }
+    rows = {name: freeze_rows(models[name], instances) for name, instances in tables.items()}
+    return TariffRuleSnapshot(1, rows)
+
+
+def s301(rate, start, end=None, role="impose", is_archived=False, hts="85444290"):
+    return Section301Rate(
+        hts_8digit=hts, chapter_99_code="9903.88.03", duty_rate=rate,
+        effective_start=start, effective_end=end, role=role, is_archived=is_archived,
+    )
+
+
+class TestSection301Lookup:
+    """Mirror of Section301Rate.get_rate_as_of."""
+
+    def test_latest_effective_start_wins(self):
+        snapshot = make_snapshot(Section301Rate=[
+            s301(0.25, date(2018, 7, 6)),
+            s301(0.50, date(2024, 9, 27)),
+        ])
+        assert snapshot.section_301_rate_as_of("85444290", date(2025, 1, 1)).duty_rate == 0.50
+        assert snapshot.section_301_rate_as_of("85444290", date(2020, 1, 1)).duty_rate == 0.25
+
+    def test_exclude_before_impose(self):
+        snapshot = make_snapshot(Section301Rate=[
+            s301(0.25, date(2024, 1, 1)),
+            s301(0.0, date(2018, 1, 1), role="exclude"),
+        ])
+        assert snapshot.section_301_rate_as_of("85444290", date(2025, 1, 1)).role == "exclude"
+
+    def test_archived_only_used_as_fallback(self):
+        snapshot = make_snapshot(Section301Rate=[
+            s301(0.10, date(2024, 1, 1), is_archived=True),
+            s301(0.25, date(2018, 1, 1)),
+        ])
+        assert snapshot.section_301_rate_as_of("85444290", date(2025, 1, 1)).duty_rate == 0.25
+
+        archived_only = make_snapshot(Section301Rate=[
+            s301(0.10, date(2024, 1, 1), is_archived=True),
+        ])
+        assert archived_only.section_301_rate_as_of("85444290", date(2025, 1, 1)).duty_rate == 0.10
+
+    def test_end_date_is_exclusive(self):
+        snapshot = make_snapshot(Section301Rate=[
+            s301(0.25, date(2018, 1, 1), end=date(2025, 1, 1)),
+        ])
+        assert snapshot.section_301_rate_as_of("85444290", date(2024, 12, 31)) is not None
+        assert snapshot.section_301_rate_as_of("85444290", date(2025, 1, 1)) is None
+
+
+class TestSection232AndIeepaLookup:
+    """Country-specific rows, variants and global fallback."""
+
+    def test_232_country_row_before_global(self):
+        snapshot = make_snapshot(Section232Rate=[
+            Section232Rate(hts_8digit="73181500", material_type="steel",
+                           chapter_99_claim="9903.81.89", chapter_99_disclaim="9903.81.90",
+                           duty_rate=0.50, country_code=None, effective_start=date(2025, 6, 4)),
+            Section232Rate(hts_8digit="73181500", material_type="steel",
+                           chapter_99_claim="9903.81.89", chapter_99_disclaim="9903.81.90",
+                           duty_rate=0.25, country_code="GB", effective_start=date(2025, 6, 4)),
+        ])
+        as_of = date(2025, 7, 1)
+        assert snapshot.section_232_rate_as_of("73181500", "steel", "GB", as_of).duty_rate == 0.25
+        assert snapshot.section_232_rate_as_of("73181500", "steel", "CN", as_of).duty_rate == 0.50
+        assert snapshot.section_232_rate_as_of("73181500", "copper", "CN", as_of) is None
+
+    def test_ieepa_variant_filter(self):
+        snapshot = make_snapshot(IeepaRate=[
+            IeepaRate(program_type="reciprocal", country_code="CN", chapter_99_code="9903.01.25",
+                      duty_rate=0.10, variant="taxable", effective_start=date(2025, 4, 9)),
+            IeepaRate(program_type="reciprocal", country_code="CN", chapter_99_code="9903.01.32",
+                      duty_rate=0.0, variant="annex_ii_exempt", effective_start=date(2025, 4, 9)),
+        ])
+        as_of = date(2025, 6, 1)
+        row = snapshot.ieepa_rate_as_of("reciprocal", "CN", as_of, variant="annex_ii_exempt")
+        assert row.chapter_99_code == "9903.01.32"
+        assert snapshot.ieepa_rate_as_of("reciprocal", "DE", as_of) is None
+
+
+class TestProgramLookups:
+    """Programs, output codes and Annex II."""
+
+    def test_programs_for_country_sorted_and_active(self):
+        snapshot = make_snapshot(TariffProgram=[
+            TariffProgram(program_id="section_232_steel", program_name="232 Steel", country="ALL",
+                          check_type="hts_lookup", condition_handler="none", filing_sequence=3,
+                          effective_date=date(2018, 3, 23)),
+            TariffProgram(program_id="section_301", program_name="301", country="China",
+                          check_type="hts_lookup", condition_handler="none", filing_sequence=1,
+                          effective_date=date(2018, 7, 6)),
+            TariffProgram(program_id="expired", program_name="Old", country="China",
+                          check_type="always", condition_handler="none", filing_sequence=0,
+                          effective_date=date(2018, 1, 1), expiration_date=date(2019, 1, 1)),
+        ])
+        programs = snapshot.programs_for_country("China", date(2025, 1, 1))
+        assert [p.program_id for p in programs] == ["section_301", "section_232_steel"]
+
+    def test_program_code_variant_semantics(self):
+        snapshot = make_snapshot(ProgramCode=[
+            ProgramCode(program_id="ieepa_reciprocal", action="apply", variant="taxable",
+                        slice_type="all", chapter_99_code="9903.01.25", duty_rate=0.10),
+            ProgramCode(program_id="ieepa_reciprocal", action="apply", variant=None,
+                        slice_type="all", chapter_99_code="9903.01.99", duty_rate=0.10),
+        ])
+        assert snapshot.program_code("ieepa_reciprocal", "apply").chapter_99_code == "9903.01.99"
+        assert snapshot.program_code(
+            "ieepa_reciprocal", "apply", variant="taxable"
+        ).chapter_99_code == "9903.01.25"
+        assert snapshot.program_code(
+            "ieepa_reciprocal", "apply", match_variant=False
+        ).chapter_99_code == "9903.01.25"
+        assert snapshot.program_code("ieepa_reciprocal", "disclaim") is None
+
+    def test_inactive_annex_ii_row_ignored(self):
+        snapshot = make_snapshot(IeepaAnnexIIExclusion=[
+            IeepaAnnexIIExclusion(hts_code="2709", category="energy",
+                                  effective_date=date(2025, 4, 5),
+                                  expiration_date=date(2025, 11, 14)),
+        ])
+        assert snapshot.annex_ii_exclusion("2709", date(2025, 6, 1)) is not None
+        assert snapshot.annex_ii_exclusion("2709", date(2025, 11, 14)) is None
+        assert snapshot.annex_ii_exclusion("2709", date(2025, 4, 4)) is None
+
+    def test_rows_are_immutable(self):
+        snapshot = make_snapshot(Section301Rate=[s301(0.25, date(2018, 7, 6))])
+        row = snapshot.section_301_rate_as_of("85444290", date(2025, 1, 1))
+        with pytest.raises(AttributeError):
+            row.duty_rate = 0.0
+        assert snapshot.row_counts == {"Section301Rate": 1}
+
+
+class TestRuleSnapshotSingleton:
+    """get_rule_snapshot / invalidate_rule_snapshot versioning."""
+
+    @pytest.fixture(autouse=True)
+    def fresh_snapshot(self):
+        """Start every test without a cached snapshot."""
+        rule_snapshot.invalidate_rule_snapshot()
+
+    def test_invalidate_bumps_version(self, memory_app):
+        first = rule_snapshot.get_rule_snapshot()
+        assert rule_snapshot.get_rule_snapshot() is first
+
+        rule_snapshot.invalidate_rule_snapshot()
+        second = rule_snapshot.get_rule_snapshot()
+        assert second is not first
+        assert second.version == first.version + 1
+
+    def test_reloads_after_version_bump_in_another_process(self, memory_app, monkeypatch):
+        from sqlalchemy.orm import Session
+        from app.web.db import db
+        from app.web.db.models.tariff_tables import TariffDataVersion, TariffProgram
+
+        monkeypatch.setenv("RESULT_CACHE_VERSION_POLL_SECONDS", "0")
+        first = rule_snapshot.get_rule_snapshot()
+        assert first.data_version == 0
+        assert first.program("section_301") is None
+
+        # Another process commits a rule change and bumps the persisted version
+        with Session(db.engine) as other:
+            other.add(TariffProgram(
+                program_id="section_301", program_name="Section 301", country="China",
+                check_type="hts_lookup", condition_handler="none",
+                inclusion_table="section_301_inclusions", filing_sequence=1,
+                calculation_sequence=1, effective_date=date(2018, 7, 6),
+            ))
+            other.add(TariffDataVersion(id=1, version=1, updated_by="other_process"))
+            other.commit()
+
+        reloaded = rule_snapshot.get_rule_snapshot()
+        assert reloaded is not first
+        assert reloaded.data_version == 1
+        assert reloaded.program("section_301") is not None
+        assert rule_snapshot.get_rule_snapshot() is reloaded
+
+
+class TestSnapshotToolParity:
+    """Tool outputs with USE_RULE_SNAPSHOT match the SQL path on the populated DB."""
+
+    CASES = [
+        ("8544.42.9090", "China", date(2025, 6, 1)),
+        ("7318.15.2095", "Germany", date(2025, 7, 1)),
+        ("2709.00.2090", "Canada", date(2025, 5, 1)),
+    ]
+
+    @pytest.fixture
+    def tools(self, populated_app):
+        from app.chat.tools import stacking_tools
+        from app.services.rule_snapshot import invalidate_rule_snapshot
+
+        invalidate_rule_snapshot()
+        yield stacking_tools
+        invalidate_rule_snapshot()
+
+    @pytest.mark.parametrize("hts_code,country,as_of", CASES)
+    def test_programs_and_inclusion_match(self, tools, monkeypatch, hts_code, country, as_of):
+        def run():
+            programs = tools.get_applicable_programs.invoke({
+                "country": country, "hts_code": hts_code, "import_date": as_of.isoformat(),
+            })
+            inclusion = tools.check_program_inclusion.invoke({
+                "program_id": "section_301", "hts_code": hts_code,
+                "as_of_date": as_of.isoformat(),
+            })
+            return programs, inclusion
+
+        monkeypatch.setenv("USE_RULE_SNAPSHOT", "false")
+        expected = run()
+        monkeypatch.setenv("USE_RULE_SNAPSHOT", "true")
+        assert run() == expected
+
+    def test_calculation_resolves_snapshot_once(self, tools, monkeypatch):
+        from app.services import result_cache
+
+        reads = []
+        real_version = result_cache.get_tariff_data_version
+        monkeypatch.setattr(result_cache, "get_tariff_data_version",
+                            lambda: reads.append(1) or real_version())
+        monkeypatch.setenv("USE_RULE_SNAPSHOT", "true")
+
+        with tools.calculation_context():
+            snapshot = tools.get_active_rule_snapshot()
+            tools.get_applicable_programs.invoke({
+                "country": "China", "hts_code": "8544.42.9090", "import_date": "2025-06-01",
+            })
+            assert tools.get_active_rule_snapshot() is snapshot
+        assert len(reads) == 1
@@ -0,0 +1,136 @@
+"""
+v22.0: Tests for the compiled Section 232 semiconductor predicate engine.
+
+Results are checked against the row-by-row evaluation through
+Section232Predicate.matches_hts() / evaluate() on an in-memory SQLite app.
+"""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from app.web.db import db
+from app.services import semiconductor_predicates
+from app.services.semiconductor_predicates import SemiconductorPredicateEngine
+
+TPP = "transistor_processing_power"
+DRAM = "dram_bandwidth"
+
+
+@pytest.fixture(autouse=True)
+def fresh_engine():
+    """Start every test without a cached engine."""
+    semiconductor_predicates.invalidate_semiconductor_predicate_engine()
+
+
+def add_predicate(group, attribute, low, high, scope="8471,8473", start=date(2026, 1, 15), end=None,
+                  program_id="section_232_semiconductor"):
+    from app.web.db.models.tariff_tables import Section232Predicate
+
+    db.session.add(Section232Predicate(
+        program_id=program_id, hts_scope=scope, predicate_group=group, attribute_name=attribute,
+        threshold_min=Decimal(str(low)) if low is not None else None,
+        threshold_max=Decimal(str(high)) if high is not None else None,
+        claim_heading_if_true="9903.79.01", rate_if_true=Decimal("0.25"),
+        heading_if_false="9903.79.02", rate_if_false=Decimal("0"),
+        effective_start=start, effective_end=end,
+    ))
+    db.session.commit()
+
+
+@pytest.fixture
+def csms_predicates(memory_app):
+    """The two CSMS #67400472 ranges, plus a 2027 tightening of range 1."""
+    add_predicate("range_1", TPP, 14000, 17500)
+    add_predicate("range_1", DRAM, 4500, 5000)
+    add_predicate("range_2", TPP, 20800, 21100)
+    add_predicate("range_2", DRAM, 5800, 6200)
+    add_predicate("range_3", TPP, 30000, None, scope="847130", start=date(2027, 1, 1))
+
+
+def reference_evaluate(hts_8digit, attributes, check_date):
+    """The original per-row evaluation, for comparison."""
+    from app.web.db.models.tariff_tables import Section232Predicate
+
+    rows = [p for p in Section232Predicate.query.order_by(Section232Predicate.id)
+            if p.program_id == "section_232_semiconductor" and p.is_active(check_date)]
+    if not rows:
+        return {"predicate_evaluated": False, "reason": "No active predicates found"}
+    matching = [p for p in rows if p.matches_hts(hts_8digit)]
+    if not matching:
+        return {"predicate_evaluated": False, "reason": f"No predicates match HTS {hts_8digit}"}
+    groups = {}
+    for p in matching:
+        groups.setdefault(p.predicate_group, []).append(p)
+    for name, preds in groups.items():
+        if all(attributes.get(p.attribute_name) is not None and p.evaluate(float(attributes[p.attribute_name]))
+               for p in preds):
+            return {"predicate_passed": True, "claim_heading": preds[0].claim_heading_if_true,
+                    "duty_rate": float(preds[0].rate_if_true), "matched_group": name}
+    return {"predicate_passed": False, "claim_heading": matching[0].heading_if_false,
+            "duty_rate": float(matching[0].rate_if_false), "matched_group": None}
+
+
+PRODUCTS = [
+    ("84713001", {TPP: 15000, DRAM: 4800}),     # range 1
+    ("84733011", {TPP: 21000, DRAM: 6000}),     # range 2
+    ("84713001", {TPP: 15000, DRAM: 6000}),     # mixed ranges -> fails
+    ("84713001", {TPP: 14000, DRAM: 4800}),     # on the bound (strict) -> fails
+    ("84713001", {TPP: 15000}),                 # DRAM not supplied -> fails
+    ("84713001", {TPP: 35000, DRAM: 1}),        # range 3 (2027 only)
+    ("85423100", {TPP: 15000, DRAM: 4800}),     # out of scope
+]
+
+
+class TestEvaluate:
+
+    @pytest.mark.parametrize("check_date", [date(2026, 2, 1), date(2027, 6, 1)])
+    def test_matches_row_by_row_evaluation(self, csms_predicates, check_date):
+        engine = SemiconductorPredicateEngine.load()
+        for hts, attributes in PRODUCTS:
+            result = engine.evaluate(hts, attributes, check_date)
+            expected = reference_evaluate(hts, attributes, check_date)
+            assert {k: result[k] for k in expected} == expected, (hts, attributes)
+
+    def test_details_and_reasons(self, csms_predicates):
+        engine = SemiconductorPredicateEngine.load()
+
+        result = engine.evaluate("84713001", {TPP: "15000", DRAM: 4800}, date(2026, 2, 1))
+        assert result["matched_group"] == "range_1"
+        assert result["details"] == [
+            {"group": "range_1", "attribute": TPP, "supplied_value": 15000.0,
+             "threshold_min": 14000.0, "threshold_max": 17500.0, "passed": True},
+            {"group": "range_1", "attribute": DRAM, "supplied_value": 4800.0,
+             "threshold_min": 4500.0, "threshold_max": 5000.0, "passed": True},
+        ]
+
+        failed = engine.evaluate("84713001", {TPP: 15000}, date(2026, 2, 1))
+        assert failed["claim_heading"] == "9903.79.02"
+        assert failed["details"][1]["reason"] == "attribute not supplied"
+        assert len(failed["details"]) == 4
+
+        assert engine.evaluate("84713001", {}, date(2025, 1, 1)) == {
+            "predicate_evaluated": False, "reason": "No active predicates found"}
+        assert engine.evaluate("85423100", {}, date(2026, 2, 1))["reason"] == \
+            "No predicates match HTS 85423100"
+
+    def test_unscoped_predicates_apply_to_every_code(self, memory_app):
+        add_predicate("default", TPP, 100, None, scope="ALL")
+        engine = SemiconductorPredicateEngine.load()
+        assert engine.evaluate("85423100", {TPP: 150}, date(2026, 2, 1))["predicate_passed"]
+
+
+class TestInvalidation:
+
+    def test_commit_rebuilds_engine(self, csms_predicates):
+        from app.services.semiconductor_predicates import get_semiconductor_predicate_engine
+
+        engine = get_semiconductor_predicate_engine()
+        assert get_semiconductor_predicate_engine() is engine
+        assert engine.evaluate("85423100", {TPP: 15000}, date(2026, 2, 1))["predicate_evaluated"] is False
+
+        add_predicate("range_x", TPP, 100, None, scope="8542")
+        rebuilt = get_semiconductor_predicate_engine()
+        assert rebuilt is not engine
+        assert rebuilt.evaluate("85423100", {TPP: 15000}, date(2026, 2, 1))["predicate_passed"]
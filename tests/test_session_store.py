@@ -0,0 +1,136 @@
+"""
+v22.0: Tests for the shared pending-session store.
+
+Store behaviour (TTL, size cap, single resume, sharing between instances)
+runs on a temporary SQLite file; the /tariff/calculate materials round
+trip runs on the populated database.
+"""
+
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from app.services import session_store
+from app.services.session_store import PendingSessionStore
+
+
+@pytest.fixture
+def store_path(tmp_path, monkeypatch):
+    """Fresh store file for get_pending_session_store()."""
+    path = str(tmp_path / "sessions" / "pending.db")
+    monkeypatch.setenv("PENDING_SESSION_DB_PATH", path)
+    monkeypatch.setattr(session_store, "_session_store", None)
+    return path
+
+
+def _put_from_other_process(path, session_id):
+    PendingSessionStore(path).put(session_id, {"engine": "direct", "state": {"hts_code": "8544.42.9090"}})
+
+
+class TestPendingSessionStore:
+
+    def test_pop_returns_once(self, store_path):
+        store = PendingSessionStore(store_path)
+        store.put("s1", {"engine": "graph", "state": {"hts_code": "8544.42.9090"}})
+        assert len(store) == 1
+        assert store.pop("s1") == {"engine": "graph", "state": {"hts_code": "8544.42.9090"}}
+        assert store.pop("s1") is None
+        assert store.pop("unknown") is None
+
+    def test_expired_sessions_evicted(self, store_path, monkeypatch):
+        store = PendingSessionStore(store_path, ttl_seconds=60)
+        clock = [1000.0]
+        monkeypatch.setattr(session_store.time, "time", lambda: clock[0])
+        store.put("old", {"state": {}})
+        clock[0] += 61
+        assert store.pop("old") is None
+
+        store.put("stale", {"state": {}})
+        clock[0] += 61
+        store.put("fresh", {"state": {}})
+        assert len(store) == 1
+
+    def test_size_cap_drops_oldest(self, store_path, monkeypatch):
+        store = PendingSessionStore(store_path, max_entries=3)
+        clock = [1000.0]
+        monkeypatch.setattr(session_store.time, "time", lambda: clock[0])
+        for i in range(5):
+            clock[0] += 1
+            store.put(f"s{i}", {"state": {"i": i}})
+        assert len(store) == 3
+        assert store.pop("s0") is None and store.pop("s1") is None
+        assert store.pop("s4") == {"state": {"i": 4}}
+
+    def test_shared_across_processes(self, store_path):
+        PendingSessionStore(store_path)
+        process = multiprocessing.get_context("spawn").Process(
+            target=_put_from_other_process, args=(store_path, "from-worker-2")
+        )
+        process.start()
+        process.join(30)
+        assert process.exitcode == 0
+        assert PendingSessionStore(store_path).pop("from-worker-2")["engine"] == "direct"
+
+    def test_default_path_in_instance_folder(self, tmp_path, monkeypatch):
+        from flask import Flask
+
+        monkeypatch.delenv("PENDING_SESSION_DB_PATH", raising=False)
+        monkeypatch.setattr(session_store, "_session_store", None)
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        assert session_store._DEFAULT_INSTANCE_PATH == os.path.join(project_root, "instance")
+
+        monkeypatch.setattr(session_store, "_DEFAULT_INSTANCE_PATH", str(tmp_path / "default"))
+        monkeypatch.chdir(tmp_path)
+        assert session_store.get_pending_session_store().db_path == \
+            str(tmp_path / "default" / "pending_sessions.db")
+
+        monkeypatch.setattr(session_store, "_session_store", None)
+        app = Flask(__name__, instance_path=str(tmp_path / "instance"))
+        with app.app_context():
+            store = session_store.get_pending_session_store()
+        assert store.db_path == str(tmp_path / "instance" / "pending_sessions.db")
+
+
+class TestMaterialsRoundTrip:
+    """Session created on one worker resumes on another."""
+
+    @pytest.mark.parametrize("engine", ["graph", "direct"])
+    def test_resume_from_another_worker(self, populated_app, store_path, engine):
+        from app.chat.graphs.stacking_rag import StackingRAG
+
+        client = populated_app.test_client()
+        first = client.post("/tariff/calculate", json={
+            "hts_code": "8544.42.9090", "country": "China",
+            "product_value": 10000, "engine": engine,
+        }).get_json()
+        assert first["needs_materials"] is True
+        session_id = first["session_id"]
+
+        stored = PendingSessionStore(store_path).pop(session_id)
+        assert stored["engine"] == engine
+        assert json.loads(json.dumps(stored)) == stored
+        assert set(stored["state"]) == {
+            "hts_code", "country", "product_description", "product_value",
+            "import_date", "quantity", "quantity_uom",
+        }
+
+        # Another worker: its own store instance on the shared file
+        PendingSessionStore(store_path).put(session_id, stored)
+        session_store._session_store = None
+        second = client.post("/tariff/calculate", json={
+            "hts_code": "8544.42.9090", "country": "China", "product_value": 10000,
+            "session_id": session_id, "materials": {"copper": 3000},
+        }).get_json()
+        assert second["success"] is True
+        assert second["needs_materials"] is False
+
+        direct = StackingRAG(conversation_id="round-trip").calculate_stacking(
+            hts_code="8544.42.9090", country="China",
+            product_description="Product (8544.42.9090)",
+            product_value=10000, materials={"copper": 3000},
+        )
+        assert second["entries"] == direct["entries"]
+        assert second["total_duty"]["total_duty_amount"] == direct["total_duty"]["total_duty_amount"]
+        assert len(PendingSessionStore(store_path)) == 0
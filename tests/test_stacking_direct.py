@@ -0,0 +1,75 @@
+"""
+v22.0: Tests for the direct (no LangGraph) stacking engine.
+
+run_stacking_direct() must produce exactly the same result as the compiled
+graph for every flow: full calculation, awaiting materials, and resuming
+with continue_with_materials().
+"""
+
+import json
+
+import pytest
+
+from app.chat.graphs.stacking_rag import StackingRAG
+
+
+def dumps(result):
+    return json.dumps(result, sort_keys=True, default=str)
+
+
+class TestEngineSelection:
+
+    def test_unknown_engine_rejected(self):
+        with pytest.raises(ValueError):
+            StackingRAG(conversation_id="bad-engine", engine="fast")
+
+    def test_direct_continue_without_pending_state(self):
+        rag = StackingRAG(conversation_id="direct-nothing-pending", engine="direct")
+        with pytest.raises(ValueError):
+            rag.continue_with_materials({"copper": 100.0})
+
+
+class TestDirectMatchesGraph:
+
+    CASES = [
+        ("8544.42.9090", "China", {"copper": 3000.0}),
+        ("7318.15.2095", "Germany", {"steel": 2000.0}),
+        ("3818.00.0000", "China", {}),
+        ("2709.00.2090", "Canada", {}),
+        ("7616.99.5190", "Japan", {"aluminum": 1000.0}),
+    ]
+
+    @pytest.mark.parametrize("hts_code,country,materials", CASES)
+    def test_identical_results(self, populated_app, hts_code, country, materials):
+        kwargs = dict(
+            hts_code=hts_code,
+            country=country,
+            product_description=f"Product ({hts_code})",
+            product_value=10000.0,
+            materials=materials,
+            import_date="2025-06-01",
+        )
+        graph_result = StackingRAG(conversation_id="graph-run").calculate_stacking(**kwargs)
+        direct_result = StackingRAG(conversation_id="direct-run", engine="direct").calculate_stacking(**kwargs)
+        assert dumps(direct_result) == dumps(graph_result)
+
+    def test_identical_materials_round_trip(self, populated_app):
+        kwargs = dict(
+            hts_code="8544.42.9090",
+            country="China",
+            product_description="USB-C cable",
+            product_value=10000.0,
+            import_date="2025-06-01",
+        )
+        graph_rag = StackingRAG(conversation_id="graph-pending")
+        direct_rag = StackingRAG(conversation_id="direct-pending", engine="direct")
+
+        graph_pending = graph_rag.calculate_stacking(**kwargs)
+        direct_pending = direct_rag.calculate_stacking(**kwargs)
+        assert direct_pending["awaiting_user_input"] is True
+        assert dumps(direct_pending) == dumps(graph_pending)
+
+        graph_final = graph_rag.continue_with_materials({"copper": 3000.0})
+        direct_final = direct_rag.continue_with_materials({"copper": 3000.0})
+        assert direct_final["entries"]
+        assert dumps(direct_final) == dumps(graph_final)
@@ -0,0 +1,106 @@
+"""
+v22.0: Tests for the process-wide compiled stacking graph.
+
+StackingRAG reuses one compiled graph per checkpoint mode; per-request
+isolation comes only from thread_id. One-shot (checkpoint=False) runs skip
+checkpointing and cannot resume.
+"""
+
+import pytest
+from langgraph.checkpoint.memory import MemorySaver
+
+from app.chat.graphs.stacking_rag import StackingRAG, get_stacking_graph
+
+
+class TestCompiledGraphReuse:
+    """Graphs are compiled once per process and mode."""
+
+    def test_same_graph_across_instances(self):
+        first = StackingRAG(conversation_id="reuse-a")
+        second = StackingRAG(conversation_id="reuse-b")
+        assert first.graph is second.graph
+        assert first.graph is get_stacking_graph()
+        assert first.config != second.config
+
+    def test_one_shot_graph_has_no_checkpointer(self):
+        rag = StackingRAG(conversation_id="one-shot", checkpoint=False)
+        assert rag.graph is get_stacking_graph(checkpoint=False)
+        assert rag.graph is not get_stacking_graph(checkpoint=True)
+        assert rag.graph.checkpointer is None
+
+    def test_custom_checkpointer_gets_dedicated_graph(self):
+        saver = MemorySaver()
+        rag = StackingRAG(conversation_id="custom", checkpointer=saver)
+        assert rag.graph is not get_stacking_graph()
+        assert rag.graph.checkpointer is saver
+
+    def test_one_shot_cannot_continue(self):
+        rag = StackingRAG(conversation_id="one-shot-continue", checkpoint=False)
+        with pytest.raises(ValueError):
+            rag.continue_with_materials({"copper": 100.0})
+
+
+class TestThreadIsolation:
+    """Shared graph runs are isolated by thread_id."""
+
+    def test_results_match_between_modes(self, populated_app):
+        kwargs = dict(
+            hts_code="8544.42.9090",
+            country="China",
+            product_description="USB-C cable",
+            product_value=10000.0,
+            materials={"copper": 3000.0},
+            import_date="2025-06-01",
+        )
+        checkpointed = StackingRAG(conversation_id="mode-a").calculate_stacking(**kwargs)
+        one_shot = StackingRAG(conversation_id="mode-b", checkpoint=False).calculate_stacking(**kwargs)
+        assert checkpointed == one_shot
+
+    def test_finished_threads_released_pending_threads_kept(self, populated_app):
+        graph = get_stacking_graph()
+        rag = StackingRAG(conversation_id="pending-thread")
+        pending = rag.calculate_stacking(
+            hts_code="8544.42.9090",
+            country="China",
+            product_description="USB-C cable",
+            product_value=10000.0,
+            import_date="2025-06-01",
+        )
+        assert pending["awaiting_user_input"] is True
+        assert graph.get_state(rag.config).values
+
+        other = StackingRAG(conversation_id="other-thread").calculate_stacking(
+            hts_code="3818.00.0000",
+            country="China",
+            product_description="Wafers",
+            product_value=1000.0,
+            materials={},
+            import_date="2025-06-01",
+        )
+        assert other["awaiting_user_input"] is False
+        assert graph.get_state({"configurable": {"thread_id": "other-thread"}}).values == {}
+
+        # The pending thread is unaffected by the other run and can resume
+        assert graph.get_state(rag.config).values["hts_code"] == "8544.42.9090"
+        resumed = rag.continue_with_materials({"copper": 3000.0})
+        assert resumed["entries"]
+        assert graph.get_state(rag.config).values == {}
+
+    def test_failed_thread_released(self, populated_app, monkeypatch):
+        from app.chat.graphs import stacking_rag
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("calculation failed")
+
+        monkeypatch.setattr(stacking_rag, "calculate_duties_data", fail)
+        rag = StackingRAG(conversation_id="failed-thread")
+        with pytest.raises(RuntimeError):
+            rag.calculate_stacking(
+                hts_code="8544.42.9090",
+                country="China",
+                product_description="USB-C cable",
+                product_value=10000.0,
+                materials={"copper": 3000.0},
+                import_date="2025-06-01",
+            )
+        assert get_stacking_graph().get_state(rag.config).values == {}
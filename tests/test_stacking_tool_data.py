@@ -0,0 +1,112 @@
+"""
+v22.0: Tests for the dict-native stacking tool APIs.
+
+The graph nodes call the *_data functions directly; the @tool wrappers only
+parse JSON arguments and serialize the same dicts. Each wrapper must return
+exactly json.dumps() of its *_data result.
+"""
+
+import json
+
+from app.chat.tools.stacking_tools import (
+    calculate_duties,
+    calculate_duties_data,
+    check_annex_ii_exclusion,
+    check_annex_ii_exclusion_data,
+    check_material_composition,
+    check_program_inclusion,
+    check_program_inclusion_data,
+    ensure_materials,
+    ensure_materials_data,
+    get_applicable_programs,
+    get_applicable_programs_data,
+    get_program_output,
+    get_program_output_data,
+    plan_entry_slices,
+    plan_entry_slices_data,
+    build_entry_stack,
+)
+
+
+class TestWrapperJsonErrors:
+    """Invalid JSON is rejected at the @tool boundary, before any lookup."""
+
+    def test_material_composition_invalid_json(self):
+        result = json.loads(check_material_composition.invoke({
+            "hts_code": "8544.42.9090",
+            "materials": "{not json",
+        }))
+        assert result["error"] == "Invalid materials JSON format"
+
+    def test_plan_entry_slices_invalid_json(self):
+        result = json.loads(plan_entry_slices.invoke({
+            "hts_code": "8544.42.9090",
+            "product_value": 10000.0,
+            "materials": "{not json",
+            "applicable_programs": "[]",
+        }))
+        assert result["error"].startswith("Invalid JSON")
+
+    def test_build_entry_stack_invalid_json(self):
+        result = json.loads(build_entry_stack.invoke({
+            "hts_code": "8544.42.9090",
+            "country": "China",
+            "slice_type": "full",
+            "applicable_programs": "[not json",
+        }))
+        assert result["error"].startswith("Invalid JSON")
+
+
+class TestWrapperMatchesData:
+    """Wrapper output == json.dumps(data output) for the calculator's tools."""
+
+    def test_get_applicable_programs(self, populated_app):
+        args = {"country": "China", "hts_code": "8544.42.9090", "import_date": "2025-06-01"}
+        assert get_applicable_programs.invoke(args) == json.dumps(get_applicable_programs_data(**args))
+
+    def test_check_program_inclusion(self, populated_app):
+        args = {"program_id": "section_301", "hts_code": "8544.42.9090", "as_of_date": "2025-06-01"}
+        assert check_program_inclusion.invoke(args) == json.dumps(check_program_inclusion_data(**args))
+
+    def test_get_program_output(self, populated_app):
+        args = {"program_id": "ieepa_fentanyl", "action": "apply", "variant": None, "slice_type": "all"}
+        assert get_program_output.invoke(args) == json.dumps(get_program_output_data(**args))
+
+    def test_check_annex_ii_exclusion(self, populated_app):
+        args = {"hts_code": "2709.00.2090", "import_date": "2025-06-01"}
+        assert check_annex_ii_exclusion.invoke(args) == json.dumps(check_annex_ii_exclusion_data(**args))
+
+    def test_ensure_materials_empty_dict_is_explicit_no_claim(self, populated_app):
+        wrapped = json.loads(ensure_materials.invoke({
+            "hts_code": "8544.42.9090",
+            "product_description": "USB-C cable",
+            "known_materials": "{}",
+        }))
+        data = ensure_materials_data("8544.42.9090", "USB-C cable", {})
+        assert data == wrapped
+        assert data["materials_needed"] is False
+
+    def test_plan_entry_slices(self, populated_app):
+        materials = {"copper": 3000.0}
+        programs = ["section_301", "section_232_copper", "ieepa_reciprocal"]
+        wrapped = plan_entry_slices.invoke({
+            "hts_code": "8544.42.9090",
+            "product_value": 10000.0,
+            "materials": json.dumps(materials),
+            "applicable_programs": json.dumps(programs),
+        })
+        assert wrapped == json.dumps(plan_entry_slices_data("8544.42.9090", 10000.0, materials, programs))
+
+    def test_calculate_duties(self, populated_app):
+        lines = [
+            {"program_id": "section_301", "chapter_99_code": "9903.88.03", "action": "apply",
+             "duty_rate": 0.25, "line_value": 10000.0},
+        ]
+        kwargs = {"product_value": 10000.0, "country": "China", "hts_code": "8544.42.9090",
+                  "import_date": "2025-06-01"}
+        wrapped = json.loads(calculate_duties.invoke({
+            "filing_lines": json.dumps(lines), "materials": json.dumps({}), **kwargs
+        }))
+        data = calculate_duties_data(filing_lines=lines, materials={}, **kwargs)
+        assert data["breakdown"] == wrapped["breakdown"]
+        assert data["total_duty_amount"] == wrapped["total_duty_amount"]
@@ -0,0 +1,169 @@
+"""
+v22.0: Tests for the tariff timeline (duty across a date range).
+
+Segment building is tested with the change points and the calculator
+replaced; parity with per-date calculations runs on the populated database.
+"""
+
+import contextlib
+from datetime import date
+
+import pytest
+
+from app.services import tariff_timeline
+from app.services.tariff_timeline import TimelineError, _stack_signature, calculate_tariff_timeline
+
+
+def duty(amount, rates_as_of="2025-01-01"):
+    return {
+        "entries": [{"slice_type": "full", "stack": [{"chapter_99_code": "9903.88.03"}]}],
+        "total_duty": {
+            "total_duty_amount": amount,
+            "effective_rate": amount / 10000,
+            "breakdown": [{"program_id": "section_301", "duty_amount": amount}],
+            "rate_sources": {"rates_as_of": rates_as_of},
+        },
+    }
+
+
+class FakeRAG:
+    """Duty changes on 2025-03-01 only; records evaluated dates."""
+
+    calls = []
+
+    def __init__(self, **kwargs):
+        pass
+
+    def calculate_stacking(self, import_date, **kwargs):
+        FakeRAG.calls.append(import_date)
+        return duty(2500.0 if import_date < "2025-03-01" else 5000.0, rates_as_of=import_date)
+
+
+@pytest.fixture
+def fake_calculator(monkeypatch):
+    from app.chat.graphs import stacking_rag
+    from app.chat.tools import stacking_tools
+
+    class FakeApp:
+        def app_context(self):
+            return contextlib.nullcontext()
+
+    FakeRAG.calls = []
+    monkeypatch.setattr(stacking_rag, "StackingRAG", FakeRAG)
+    monkeypatch.setattr(stacking_tools, "get_flask_app", lambda: FakeApp())
+    monkeypatch.setattr(tariff_timeline, "collect_change_points", lambda hts, country: {
+        date(2024, 6, 1),   # Before the range: ignored
+        date(2025, 2, 1),   # No duty change: merged away
+        date(2025, 3, 1),
+        date(2026, 1, 1),   # After the range: ignored
+    })
+    return FakeRAG
+
+
+class TestTimelineSegments:
+
+    def test_one_evaluation_per_interval_and_merge(self, fake_calculator):
+        result = calculate_tariff_timeline(
+            "8544.42.9090", "China", date(2025, 1, 1), date(2025, 12, 31), materials={},
+        )
+        assert fake_calculator.calls == ["2025-01-01", "2025-02-01", "2025-03-01"]
+        assert result["intervals_evaluated"] == 3
+        assert [(s["start_date"], s["end_date"], s["total_duty_amount"]) for s in result["segments"]] == [
+            ("2025-01-01", "2025-02-28", 2500.0),
+            ("2025-03-01", "2025-12-31", 5000.0),
+        ]
+        assert sum(s["days"] for s in result["segments"]) == 365
+
+    def test_reversed_range_rejected(self):
+        with pytest.raises(TimelineError):
+            calculate_tariff_timeline("8544.42.9090", "China", date(2025, 2, 1), date(2025, 1, 1))
+
+    def test_signature_ignores_rates_as_of(self):
+        assert _stack_signature(duty(2500.0, "2025-01-01")) == _stack_signature(duty(2500.0, "2025-02-01"))
+        assert _stack_signature(duty(2500.0)) != _stack_signature(duty(5000.0))
+
+
+class TestChangePoints:
+    """collect_change_points() on an in-memory SQLite app."""
+
+    @pytest.fixture
+    def rules_app(self, memory_app, monkeypatch):
+        """memory_app, also used by the stacking tools."""
+        from app.chat.tools import stacking_tools
+
+        monkeypatch.setattr(stacking_tools, "get_flask_app", lambda: memory_app)
+        return memory_app
+
+    def test_mid_range_program_rate_change_adds_interval(self, rules_app, monkeypatch):
+        from app.chat.graphs import stacking_rag
+        from app.web.db import db
+        from app.web.db.models.tariff_tables import CountryGroup, CountryGroupMember, ProgramRate
+
+        db.session.add_all([
+            CountryGroup(group_id="EU", effective_date=date(2020, 1, 1)),
+            CountryGroupMember(country_code="DE", group_id="EU", effective_date=date(2020, 1, 1)),
+            ProgramRate(program_id="ieepa_reciprocal", group_id="EU", rate_type="formula",
+                        rate_formula="15pct_minus_mfn", effective_date=date(2025, 1, 1),
+                        expiration_date=date(2025, 8, 7)),
+            ProgramRate(program_id="ieepa_reciprocal", group_id="EU", rate=0.10,
+                        effective_date=date(2025, 8, 7)),
+            # Another group's rate change does not split the German timeline
+            ProgramRate(program_id="ieepa_reciprocal", group_id="UK", rate=0.10,
+                        effective_date=date(2025, 5, 1)),
+        ])
+        db.session.commit()
+
+        points = tariff_timeline.collect_change_points("8544.42.9090", "Germany")
+        assert date(2025, 8, 7) in points
+        assert date(2025, 5, 1) not in points
+
+        class RateChangeRAG(FakeRAG):
+            def calculate_stacking(self, import_date, **kwargs):
+                FakeRAG.calls.append(import_date)
+                return duty(1240.0 if import_date < "2025-08-07" else 1000.0, rates_as_of=import_date)
+
+        FakeRAG.calls = []
+        monkeypatch.setattr(stacking_rag, "StackingRAG", RateChangeRAG)
+        result = calculate_tariff_timeline(
+            "8544.42.9090", "Germany", date(2025, 6, 1), date(2025, 12, 31), materials={},
+        )
+        assert [(s["start_date"], s["end_date"]) for s in result["segments"]] == [
+            ("2025-06-01", "2025-08-06"),
+            ("2025-08-07", "2025-12-31"),
+        ]
+
+
+class TestTimelineEndpoint:
+    """POST /tariff/timeline on the populated database."""
+
+    def test_rejects_bad_dates(self, populated_app):
+        response = populated_app.test_client().post("/tariff/timeline", json={
+            "hts_code": "8544.42.9090", "country": "China",
+            "start_date": "01/01/2025", "end_date": "2025-12-31",
+        })
+        assert response.status_code == 400
+
+    def test_segments_match_single_calculations(self, populated_app):
+        from app.chat.graphs.stacking_rag import StackingRAG
+
+        response = populated_app.test_client().post("/tariff/timeline", json={
+            "hts_code": "8544.42.9090", "country": "China",
+            "start_date": "2025-01-01", "end_date": "2025-12-31",
+            "product_value": 10000, "materials": {"copper": 3000},
+        })
+        data = response.get_json()
+        assert data["success"] is True
+        assert data["segments"][0]["start_date"] == "2025-01-01"
+        assert data["segments"][-1]["end_date"] == "2025-12-31"
+
+        for segment in data["segments"]:
+            for day in (segment["start_date"], segment["end_date"]):
+                single = StackingRAG(conversation_id=f"timeline-{day}").calculate_stacking(
+                    hts_code="8544.42.9090",
+                    country="China",
+                    product_description="Product (8544.42.9090)",
+                    product_value=10000,
+                    materials={"copper": 3000},
+                    import_date=day,
+                )
+                assert single["total_duty"]["total_duty_amount"] == segment["total_duty_amount"]